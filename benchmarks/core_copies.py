@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: core_copies.py
+# @Date: 2019-07-10-14-25
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+
+import time
+
+import gym
+import numpy as np
+
+from trajopt.ilqr import iLQR
+from trajopt.gps import MBGPS
+from trajopt.bspilqr import BSPiLQR
+
+from trajopt.ilqr import core as ilqr_core
+from trajopt.gps import core as gps_core
+from trajopt.bspilqr import core as bspilqr_core
+
+
+def copies_per_call(core, call, nb_calls=10):
+    core.reset_copied_bytes()
+
+    _start = time.perf_counter()
+    for _ in range(nb_calls):
+        call()
+    _time = (time.perf_counter() - _start) / nb_calls
+
+    return core.copied_bytes() / nb_calls, _time
+
+
+if __name__ == '__main__':
+
+    nb_steps = 1000
+
+    np.random.seed(1337)
+    env = gym.make('Pendulum-TO-v0')
+    env._max_episode_steps = nb_steps
+
+    ilqr = iLQR(env, nb_steps=nb_steps, activation=range(900, 1000))
+    ilqr.run(nb_iter=1)
+
+    _bytes, _time = copies_per_call(ilqr_core, ilqr.backward_pass)
+    print('{:<32} copied: {:10.0f} bytes/call  time: {:8.4f}s'.format('ilqr backward_pass', _bytes, _time))
+
+    # c-ordered inputs as they were passed before
+    _args = [np.ascontiguousarray(_arg) for _arg in ilqr.cost.params + ilqr.dyn.params]
+    _call = lambda: ilqr_core.backward_pass(*_args, ilqr.lmbda, ilqr.reg,
+                                            ilqr.nb_xdim, ilqr.nb_udim, ilqr.nb_steps,
+                                            *ilqr.work.params)
+    _bytes, _time = copies_per_call(ilqr_core, _call)
+    print('{:<32} copied: {:10.0f} bytes/call  time: {:8.4f}s'.format('ilqr backward_pass (c-order)', _bytes, _time))
+
+    np.random.seed(1337)
+    env = gym.make('LQR-TO-v0')
+    env._max_episode_steps = nb_steps
+
+    gps = MBGPS(env, nb_steps=nb_steps, kl_bound=1., init_ctl_sigma=1., activation=range(900, 1000))
+    gps.run(nb_iter=1)
+
+    # augment_cost, backward_pass, forward_pass, quad_expectation and kl_divergence
+    _bytes, _time = copies_per_call(gps_core, lambda: gps.dual(np.array([-1.e3])))
+    print('{:<32} copied: {:10.0f} bytes/call  time: {:8.4f}s'.format('gps dual', _bytes, _time))
+
+    np.random.seed(1337)
+    env = gym.make('LightDark-TO-v0')
+    env._max_episode_steps = nb_steps
+
+    bspilqr = BSPiLQR(env, nb_steps=nb_steps, activation=range(900, 1000))
+    bspilqr.run(nb_iter=1)
+
+    _bytes, _time = copies_per_call(bspilqr_core, bspilqr.backward_pass)
+    print('{:<32} copied: {:10.0f} bytes/call  time: {:8.4f}s'.format('bspilqr backward_pass', _bytes, _time))
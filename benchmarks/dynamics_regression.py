@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: dynamics_regression.py
+# @Date: 2019-07-19-14-20
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+
+import time
+
+import numpy as np
+
+from trajopt.gps.objects import LearnedLinearGaussianDynamics
+
+
+def random_data(nb_xdim, nb_udim, nb_steps, nb_episodes, seed=1337):
+    _random = np.random.RandomState(seed)
+
+    A = np.eye(nb_xdim) + 0.01 * _random.randn(nb_xdim, nb_xdim)
+    B = 0.1 * _random.randn(nb_xdim, nb_udim)
+
+    x = _random.randn(nb_xdim, nb_steps, nb_episodes)
+    u = _random.randn(nb_udim, nb_steps, nb_episodes)
+    xn = np.einsum('kh,htn->ktn', A, x) + np.einsum('kh,htn->ktn', B, u)\
+         + 0.01 * _random.randn(nb_xdim, nb_steps, nb_episodes)
+
+    return {'x': x, 'u': u, 'xn': xn}
+
+
+def mimo_learn(dyn, data):
+    # per-step fits of the previous implementation
+    from mimo import distributions
+    _hypparams = dict(M=np.zeros((dyn.nb_xdim, dyn.nb_xdim + dyn.nb_udim + 1)),
+                      V=1.e6 * np.eye(dyn.nb_xdim + dyn.nb_udim + 1),
+                      affine=True,
+                      psi=np.eye(dyn.nb_xdim), nu=dyn.nb_xdim + 2)
+    _prior = distributions.MatrixNormalInverseWishart(**_hypparams)
+
+    for t in range(dyn.nb_steps):
+        _data = np.hstack((data['x'][:, t, :].T, data['u'][:, t, :].T, data['xn'][:, t, :].T))
+        _model = distributions.BayesianLinearGaussian(_prior).MAP(_data)
+        dyn.A[..., t] = _model.A[:, :dyn.nb_xdim]
+
+
+def loop_learn(dyn, data):
+    # per-step map fits in numpy, the same estimate as learn
+    _V_inv = 1.e-6 * np.eye(dyn.nb_xdim + dyn.nb_udim + 1)
+    for t in range(dyn.nb_steps):
+        _z = np.vstack((data['x'][:, t, :], data['u'][:, t, :], np.ones((1, data['x'].shape[-1]))))
+        _y = data['xn'][:, t, :]
+        _A = np.linalg.solve(_z @ _z.T + _V_inv, _z @ _y.T).T
+        _psi = np.eye(dyn.nb_xdim) + _y @ _y.T - _A @ _z @ _y.T
+        dyn.A[..., t] = _A[:, :dyn.nb_xdim]
+        dyn.sigma[..., t] = _psi / (dyn.nb_xdim + 2 + _y.shape[-1] + dyn.nb_xdim + 1)
+
+
+def timeit(call, nb_calls=5):
+    call()
+    _start = time.perf_counter()
+    for _ in range(nb_calls):
+        call()
+    return (time.perf_counter() - _start) / nb_calls
+
+
+if __name__ == '__main__':
+
+    nb_xdim, nb_udim, nb_steps = 4, 1, 150
+
+    try:
+        import mimo  # noqa
+        _paths = ['vectorized', 'loop', 'mimo']
+    except ImportError:
+        _paths = ['vectorized', 'loop']
+
+    print('{:>8}'.format('episodes') + ''.join('{:>12}'.format(_p) for _p in _paths))
+
+    for nb_episodes in [10, 100, 1000]:
+        data = random_data(nb_xdim, nb_udim, nb_steps, nb_episodes)
+        dyn = LearnedLinearGaussianDynamics(nb_xdim, nb_udim, nb_steps)
+
+        _time = [timeit(lambda: dyn.learn(data, pointwise=True)),
+                 timeit(lambda: loop_learn(dyn, data))]
+        if 'mimo' in _paths:
+            _time.append(timeit(lambda: mimo_learn(dyn, data), nb_calls=1))
+
+        print('{:>8d}'.format(nb_episodes) + ''.join('{:>11.4f}s'.format(_t) for _t in _time))
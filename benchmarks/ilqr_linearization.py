@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: ilqr_linearization.py
+# @Date: 2019-07-08-10-12
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+
+import time
+
+import gym
+import numpy as np
+
+from trajopt.ilqr import iLQR
+from trajopt.ilqr.objects import AnalyticalLinearDynamics
+
+
+def iteration_time(env, nb_steps, activation, batched, nb_iter=5):
+    np.random.seed(1337)
+    alg = iLQR(env, nb_steps=nb_steps, activation=activation)
+
+    # per-step linearization as before
+    if not batched:
+        alg.dyn = AnalyticalLinearDynamics(alg.env_init, alg.env_dyn,
+                                           alg.nb_xdim, alg.nb_udim, alg.nb_steps)
+
+    # time the linearization and a whole iteration
+    _lin, _iter = [], []
+    alg.run(nb_iter=0)
+    for _ in range(nb_iter):
+        _start = time.perf_counter()
+        alg.dyn.taylor_expansion(alg.xref, alg.uref)
+        _lin.append(time.perf_counter() - _start)
+
+        _start = time.perf_counter()
+        alg.run(nb_iter=1)
+        _iter.append(time.perf_counter() - _start)
+
+    return np.mean(_lin), np.mean(_iter)
+
+
+if __name__ == '__main__':
+
+    for env_id in ['Cartpole-TO-v0', 'DoubleCartpole-TO-v0']:
+        env = gym.make(env_id)
+        env._max_episode_steps = 700
+
+        for batched in [False, True]:
+            _lin, _iter = iteration_time(env, 700, range(600, 700), batched)
+            print('{:<24} {:<10} linearize: {:8.4f}s  iteration: {:8.4f}s'.format(
+                  env_id, 'batched' if batched else 'per-step', _lin, _iter))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: mfgps_prior.py
+# @Date: 2019-07-20-15-30
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+
+import numpy as np
+
+import gym
+import trajopt  # noqa
+
+from trajopt.gps import MFGPS
+
+
+def rollouts_to_target(env_id, target, dynamics, nb_episodes,
+                       nb_steps=60, nb_iter=20, seed=1337):
+    env = gym.make(env_id).unwrapped
+    env.seed(seed)
+    np.random.seed(seed)
+
+    alg = MFGPS(env, nb_steps=nb_steps, kl_bound=1., init_ctl_sigma=1.,
+                dynamics=dynamics, forget=0.8, sampler='vectorized')
+    _trace = alg.run(nb_episodes=nb_episodes, nb_iter=nb_iter)
+
+    # returns after every iteration, each preceded by
+    # one batch of samples and the initial batch
+    _returns = np.array(_trace[2::2])
+    _hit = np.flatnonzero(_returns < target)
+    return nb_episodes * (_hit[0] + 2) if len(_hit) > 0 else None
+
+
+if __name__ == '__main__':
+
+    _envs = [('Pendulum-TO-v0', 10.), ('LQR-TO-v0', 5.e8)]
+    _paths = [('pointwise', 25), ('pointwise', 5), ('incremental', 5),
+              ('gmm', 5), ('gmm', 2)]
+
+    print('{:>16}'.format('') + ''.join('{:>16}'.format('{}/{}'.format(*_p)) for _p in _paths))
+
+    for env_id, target in _envs:
+        _rollouts = [rollouts_to_target(env_id, target, _dyn, _nb) for _dyn, _nb in _paths]
+        print('{:>16}'.format(env_id) + ''.join('{:>16}'.format(str(_r) if _r is not None else '-')
+                                                for _r in _rollouts))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: parallel_scan.py
+# @Date: 2019-07-12-09-40
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+
+import os
+import time
+
+import numpy as np
+
+from trajopt.ilqr import core as ilqr_core
+
+
+def random_lqr(nb_xdim, nb_udim, nb_steps, seed=1337):
+    _random = np.random.RandomState(seed)
+    _zeros = lambda *shape: np.zeros(shape, order='F')
+
+    Cxx, cx = _zeros(nb_xdim, nb_xdim, nb_steps + 1), _zeros(nb_xdim, nb_steps + 1)
+    Cuu, cu = _zeros(nb_udim, nb_udim, nb_steps + 1), _zeros(nb_udim, nb_steps + 1)
+    Cxu = _zeros(nb_xdim, nb_udim, nb_steps + 1)
+    for t in range(nb_steps + 1):
+        _M = _random.randn(nb_xdim + nb_udim, nb_xdim + nb_udim)
+        _H = _M @ _M.T + 0.1 * np.eye(nb_xdim + nb_udim)
+        Cxx[..., t], Cuu[..., t] = _H[:nb_xdim, :nb_xdim], _H[nb_xdim:, nb_xdim:]
+        Cxu[..., t] = _H[:nb_xdim, nb_xdim:]
+        cx[..., t], cu[..., t] = _random.randn(nb_xdim), _random.randn(nb_udim)
+
+    A, B = _zeros(nb_xdim, nb_xdim, nb_steps), _zeros(nb_xdim, nb_udim, nb_steps)
+    for t in range(nb_steps):
+        A[..., t] = np.eye(nb_xdim) + 0.01 * _random.randn(nb_xdim, nb_xdim)
+        B[..., t] = 0.1 * _random.randn(nb_xdim, nb_udim)
+
+    return Cxx, cx, Cuu, cu, Cxu, A, B
+
+
+def workspace(nb_xdim, nb_udim, nb_steps):
+    _zeros = lambda *shape: np.zeros(shape, order='F')
+    return [_zeros(nb_xdim, nb_xdim, nb_steps), _zeros(nb_udim, nb_xdim, nb_steps),
+            _zeros(nb_udim, nb_udim, nb_steps), _zeros(nb_xdim, nb_steps), _zeros(nb_udim, nb_steps),
+            _zeros(nb_xdim, nb_xdim, nb_steps + 1), _zeros(nb_xdim, nb_steps + 1), _zeros(2),
+            _zeros(nb_udim, nb_xdim, nb_steps), _zeros(nb_udim, nb_steps)]
+
+
+def timeit(call, nb_calls=5):
+    call()
+    _start = time.perf_counter()
+    for _ in range(nb_calls):
+        call()
+    return (time.perf_counter() - _start) / nb_calls
+
+
+if __name__ == '__main__':
+
+    nb_xdim, nb_udim = 4, 1
+
+    # the scan solves the unregularized problem
+    lmbda, reg = 0., 1
+
+    _threads = sorted({1, 2, 4, os.cpu_count()})
+    print('{:>8} {:>12}'.format('steps', 'sequential') +
+          ''.join('{:>12}'.format('scan/{}'.format(_n)) for _n in _threads) + '{:>12}'.format('max err'))
+
+    for nb_steps in [100, 1000, 10000, 100000]:
+        _args = random_lqr(nb_xdim, nb_udim, nb_steps)
+        _dims = (nb_xdim, nb_udim, nb_steps)
+
+        _seq = workspace(nb_xdim, nb_udim, nb_steps)
+        _time = [timeit(lambda: ilqr_core.backward_pass(*_args, lmbda, reg, *_dims, *_seq))]
+
+        _par = workspace(nb_xdim, nb_udim, nb_steps)
+        for _n in _threads:
+            _time.append(timeit(lambda: ilqr_core.parallel_backward_pass(*_args, *_dims, *_par, _n)))
+
+        # gains of both kernels
+        _err = max(np.max(np.abs(_seq[-2] - _par[-2])), np.max(np.abs(_seq[-1] - _par[-1])))
+
+        print('{:>8d}'.format(nb_steps) + ''.join('{:>11.4f}s'.format(_t) for _t in _time) +
+              '{:>12.1e}'.format(_err))
@@ -67,7 +67,9 @@ setup(
     long_description='',
     ext_modules=[CMakeExtension('gps', './trajopt/gps/'),
                  CMakeExtension('ilqr', './trajopt/ilqr/'),
-                 CMakeExtension('bspilqr', './trajopt/bspilqr/')],
+                 CMakeExtension('bspilqr', './trajopt/bspilqr/'),
+                 CMakeExtension('elqr', './trajopt/elqr/'),
+                 CMakeExtension('riccati', './trajopt/riccati/')],
     cmdclass=dict(build_ext=CMakeBuild),
     zip_safe=False,
 )
@@ -1,6 +1,6 @@
 import autograd.numpy as np
 import numpy.random as npr
-from trajopt import core
+from trajopt.gps import core
 
 npr.seed(1337)
 
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+import gym
+from gym import spaces
+
+import autograd.numpy as anp
+
+
+class _Pendulum(gym.Env):
+    """
+    Damped pendulum written against a given numpy module,
+    autograd.numpy or jax.numpy
+    """
+
+    def __init__(self, numpy):
+        self.np = numpy
+
+        self.dt = 0.05
+        self._g = np.array([0., 0.])
+        self._gw = np.array([1.e1, 1.e-1])
+        self._uw = np.array([1.e-3])
+
+        self.observation_space = spaces.Box(low=-np.array([2. * np.pi, 25.]),
+                                            high=np.array([2. * np.pi, 25.]), dtype=np.float64)
+        self.action_space = spaces.Box(low=-np.array([5.]), high=np.array([5.]), dtype=np.float64)
+
+    def init(self):
+        return np.array([np.pi / 2., 0.]), 1.e-4 * np.eye(2)
+
+    def dynamics(self, x, u):
+        _np = self.np
+        u = _np.clip(u, -5., 5.)
+        _acc = 9.81 * _np.sin(x[0]) + u[0] - 0.1 * x[1]
+        return _np.stack((x[0] + self.dt * x[1] + self.dt**2 * _acc,
+                          x[1] + self.dt * _acc))
+
+    def noise(self, x=None, u=None):
+        return 1.e-4 * np.eye(2)
+
+    def cost(self, x, u, a, xref):
+        _np = self.np
+        if a:
+            return (x - self._g) @ _np.diag(self._gw) @ (x - self._g) + u @ _np.diag(self._uw) @ u
+        else:
+            return u @ _np.diag(self._uw) @ u
+
+
+def test_jax_backend():
+    jnp = pytest.importorskip('jax.numpy')
+
+    from trajopt.ilqr import iLQR
+    from trajopt.riccati import Riccati
+    from trajopt.gps import MBGPS
+
+    def _solve(numpy, backend):
+        _env = _Pendulum(numpy)
+        _out = {}
+
+        for linesearch in ['serial', 'vectorized']:
+            np.random.seed(1337)
+            alg = iLQR(_env, nb_steps=20, activation=range(20), backend=backend, linesearch=linesearch)
+            _out['ilqr', linesearch] = np.array(alg.run(nb_iter=5))
+            _out['ilqr.K', linesearch] = alg.ctl.K
+
+        np.random.seed(1337)
+        alg = Riccati(_env, nb_steps=20, activation=range(20), backend=backend)
+        _out['riccati'] = np.array([alg.run()])
+        _out['riccati.K'] = alg.ctl.K
+
+        np.random.seed(1337)
+        alg = MBGPS(_env, nb_steps=20, kl_bound=1., init_ctl_sigma=1.,
+                    activation=range(20), backend=backend)
+        _out['mbgps'] = np.array(alg.run(nb_iter=3))
+        _out['mbgps.K'] = alg.ctl.K
+
+        return _out
+
+    ref = _solve(anp, 'autograd')
+    out = _solve(jnp, 'jax')
+
+    for key in ref:
+        assert np.allclose(out[key], ref[key], rtol=1.e-6, atol=1.e-8), key
+
+
+@pytest.mark.parametrize('name', ['Pendulum-TO-v0', 'LQR-TO-v0'])
+def test_jax_backend_envs(name):
+    pytest.importorskip('jax.numpy')
+
+    import trajopt
+    from trajopt.ilqr import iLQR
+    from trajopt.riccati import Riccati
+    from trajopt.gps import MBGPS
+
+    def _solve(backend):
+        _out = {}
+
+        env = gym.make(name)
+        np.random.seed(1337)
+        alg = iLQR(env, nb_steps=40, backend=backend)
+        _out['ilqr'] = np.array(alg.run(nb_iter=3))
+        _out['ilqr.K'] = alg.ctl.K
+
+        env = gym.make(name)
+        np.random.seed(1337)
+        alg = Riccati(env, nb_steps=40, backend=backend)
+        _out['riccati'] = np.array([alg.run()])
+        _out['riccati.K'] = alg.ctl.K
+
+        env = gym.make(name)
+        env.seed(1337)
+        np.random.seed(1337)
+        alg = MBGPS(env, nb_steps=40, kl_bound=1., init_ctl_sigma=1., backend=backend)
+        _out['mbgps'] = np.array(alg.run(nb_iter=2))
+        _out['mbgps.K'] = alg.ctl.K
+
+        return _out
+
+    ref = _solve('autograd')
+    out = _solve('jax')
+
+    for key in ref:
+        assert np.allclose(out[key], ref[key], rtol=1.e-6, atol=1.e-8), key
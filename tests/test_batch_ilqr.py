@@ -0,0 +1,30 @@
+import numpy as np
+
+import gym
+import trajopt  # noqa: registers the environments
+
+from trajopt.ilqr import iLQR, BatchiLQR
+
+
+def test_batch_matches_single_runs():
+    env = gym.make('Pendulum-TO-v0').unwrapped
+
+    _x0, _kff, _traces = [], [], []
+    for n in range(3):
+        np.random.seed(n)
+        alg = iLQR(env, nb_steps=30)
+
+        x0 = alg.x0 + 0.1 * n
+        alg.x0 = x0
+
+        _x0.append(x0)
+        _kff.append(np.copy(alg.ctl.kff))
+        _traces.append(alg.run(nb_iter=5))
+
+    batch = BatchiLQR(env, nb_steps=30, x0=np.stack(_x0), nb_threads=2)
+    batch.ctl.kff[...] = np.stack(_kff)
+    trace = batch.run(nb_iter=5)
+
+    assert trace.shape[1] == 3
+    for n in range(3):
+        assert np.allclose(trace[-1, n], _traces[n][-1], rtol=1e-10)
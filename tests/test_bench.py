@@ -0,0 +1,43 @@
+import json
+
+import numpy as np
+
+from trajopt import bench
+
+
+def test_bench(tmp_path):
+    _output = str(tmp_path / 'bench.json')
+    report = bench.main(['--nb-steps', '5', '--nb-iter', '1', '--output', _output])
+
+    with open(_output) as f:
+        assert json.load(f) == report
+
+    assert set(report['meta']) == {'time', 'host', 'platform', 'python', 'numpy', 'args'}
+    assert len(report['results']) == len(bench.ENVS) * len(bench.SOLVERS)
+
+    for _result in report['results']:
+        assert _result['solver'] in bench.SOLVERS and _result['env'] in bench.ENVS
+        assert _result['status'] in ('ok', 'skipped'), _result.get('error')
+
+        if _result['status'] == 'ok':
+            assert _result['setup'] >= 0. and _result['run'] >= 0.
+            assert set(_result['phases']) <= set(bench.PHASES) | {'other'}
+            for _phase in _result['phases'].values():
+                assert set(_phase) == {'time', 'calls'}
+            assert len(_result['trace']) > 0
+            assert all(np.isfinite(_result['trace']))
+
+    # every solver runs on at least one env
+    _ok = {_result['solver'] for _result in report['results'] if _result['status'] == 'ok'}
+    assert _ok == set(bench.SOLVERS)
+
+
+def test_bench_diverged(monkeypatch):
+    _make = lambda env, args: None
+    _run = lambda alg, args: [1., np.nan]
+    monkeypatch.setitem(bench.SOLVERS, 'NaN', (_make, _run, lambda env: True))
+
+    _result = bench.benchmark('NaN', 'LQR-TO-v0', bench.parse_args([]))
+    assert _result['status'] == 'diverged'
+    assert _result['trace'] == [1., None]
+    json.dumps(_result, allow_nan=False)
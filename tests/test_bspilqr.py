@@ -0,0 +1,65 @@
+import numpy as np
+
+import gym
+import trajopt  # noqa: registers the environments
+
+from trajopt.bspilqr import BSPiLQR
+from trajopt.bspilqr.objects import duplication_matrix, vech_indices
+
+
+def _alg(covariance):
+    env = gym.make('Car-TO-v0')
+    np.random.seed(1337)
+
+    alg = BSPiLQR(env, nb_steps=10, covariance=covariance)
+    alg.bref, alg.uref, _ = alg.forward_pass(alg.ctl, 1.)
+
+    alg.dyn.taylor_expansion(alg.bref, alg.uref)
+    alg.cost.taylor_expansion(alg.bref, alg.uref, alg.activation)
+    return alg
+
+
+def test_vech_expansions():
+    full, vech = _alg('full'), _alg('vech')
+
+    nb_bdim = full.nb_bdim
+    D = duplication_matrix(nb_bdim)
+    _rows, _cols = vech_indices(nb_bdim)
+    _L = _rows * nb_bdim + _cols
+
+    assert vech.dyn.Y.shape[:2] == (nb_bdim * (nb_bdim + 1) // 2, ) * 2
+
+    # rows are eliminated, columns duplicated, covariance gradients summed
+    for t in range(full.nb_steps):
+        assert np.allclose(vech.dyn.X[..., t], full.dyn.X[_L, :, t])
+        assert np.allclose(vech.dyn.Y[..., t], full.dyn.Y[_L, :, t] @ D)
+        assert np.allclose(vech.dyn.U[..., t], full.dyn.U[_L, :, t] @ D)
+        assert np.allclose(vech.dyn.V[..., t], full.dyn.V[_L, :, t])
+        assert np.allclose(vech.cost.p[..., t], D.T @ full.cost.p[..., t])
+
+
+def test_vech_backward_pass():
+    full, vech = _alg('full'), _alg('vech')
+
+    lc_full, bvalue_full, dS_full, _ = full.backward_pass()
+    lc_vech, bvalue_vech, dS_vech, _ = vech.backward_pass()
+
+    D = duplication_matrix(full.nb_bdim)
+
+    assert np.allclose(lc_full.K, lc_vech.K) and np.allclose(lc_full.kff, lc_vech.kff)
+    assert np.allclose(bvalue_full.S, bvalue_vech.S) and np.allclose(bvalue_full.s, bvalue_vech.s)
+    assert np.allclose(D.T @ bvalue_full.tau, bvalue_vech.tau)
+    assert np.allclose(dS_full, dS_vech)
+
+
+def test_analytic_ekf_jacobian():
+    for covariance in ('full', 'vech'):
+        alg = _alg(covariance)
+        dyn = alg.dyn
+
+        _mu, _u = alg.bref.mu[..., :alg.nb_steps].T, alg.uref.T
+        _sigma = np.transpose(alg.bref.sigma[..., :alg.nb_steps], (2, 0, 1))
+
+        # autodiff through the whole filter as reference
+        _z = np.hstack((_mu, dyn.cov.flatten(alg.bref.sigma[..., :alg.nb_steps]).T, _u))
+        assert np.allclose(dyn.ekf_jacobian(_mu, _sigma, _u), dyn.dekf(_z), rtol=1e-8, atol=1e-10)
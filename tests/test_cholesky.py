@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: test_cholesky.py
+# @Date: 2019-07-13-10-05
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+# The kernels factorize once by Cholesky instead of checking definiteness,
+# inverting and taking determinants separately. The references below are
+# the former explicit-inverse recursions, the outputs have to agree.
+
+import numpy as np
+import pytest
+
+from trajopt.ilqr import core as ilqr_core
+from trajopt.gps import core as gps_core
+from trajopt.bspilqr import core as bspilqr_core
+
+
+def _zeros(*shape):
+    return np.zeros(shape, order='F')
+
+
+def _random_spd(random, n, nb_steps, scale=1.):
+    _M = random.randn(n, n, nb_steps)
+    return np.asfortranarray(scale * (np.einsum('ikt,jkt->ijt', _M, _M) + 0.1 * np.eye(n)[..., None]))
+
+
+def _random_problem(nb_xdim, nb_udim, nb_steps, seed=1337):
+    random = np.random.RandomState(seed)
+
+    Cxx = _zeros(nb_xdim, nb_xdim, nb_steps + 1)
+    Cuu = _zeros(nb_udim, nb_udim, nb_steps + 1)
+    Cxu = _zeros(nb_xdim, nb_udim, nb_steps + 1)
+    for t in range(nb_steps + 1):
+        _M = random.randn(nb_xdim + nb_udim, nb_xdim + nb_udim)
+        _H = _M @ _M.T + 0.1 * np.eye(nb_xdim + nb_udim)
+        Cxx[..., t], Cuu[..., t] = _H[:nb_xdim, :nb_xdim], _H[nb_xdim:, nb_xdim:]
+        Cxu[..., t] = _H[:nb_xdim, nb_xdim:]
+
+    cx = np.asfortranarray(random.randn(nb_xdim, nb_steps + 1))
+    cu = np.asfortranarray(random.randn(nb_udim, nb_steps + 1))
+    c0 = random.randn(nb_steps + 1)
+
+    A = np.asfortranarray(np.eye(nb_xdim)[..., None] + 0.1 * random.randn(nb_xdim, nb_xdim, nb_steps))
+    B = np.asfortranarray(0.5 * random.randn(nb_xdim, nb_udim, nb_steps))
+    c = np.asfortranarray(0.1 * random.randn(nb_xdim, nb_steps))
+    sigma = _random_spd(random, nb_xdim, nb_steps, 0.01)
+
+    return Cxx, cx, Cuu, cu, Cxu, c0, A, B, c, sigma
+
+
+def _ilqr_reference(Cxx, cx, Cuu, cu, Cxu, A, B, lmbda, reg, nb_steps):
+    V, v = np.zeros_like(Cxx), np.zeros_like(cx)
+    K, kff = np.zeros_like(np.swapaxes(B, 0, 1)), np.zeros_like(cu[:, :-1])
+    dV = np.zeros((2, ))
+
+    V[..., -1], v[..., -1] = Cxx[..., -1], cx[..., -1]
+    for t in range(nb_steps - 1, -1, -1):
+        _A, _B = A[..., t], B[..., t]
+        Qxx = Cxx[..., t] + _A.T @ V[..., t + 1] @ _A
+        Quu = Cuu[..., t] + _B.T @ V[..., t + 1] @ _B
+        Qux = (Cxu[..., t] + _A.T @ V[..., t + 1] @ _B).T
+        qu = cu[..., t] + _B.T @ v[..., t + 1]
+        qx = cx[..., t] + _A.T @ v[..., t + 1]
+
+        V_reg = V[..., t + 1] + (lmbda * np.eye(V.shape[0]) if reg == 2 else 0.)
+        Qux_reg = (Cxu[..., t] + _A.T @ V_reg @ _B).T
+        Quu_reg = Cuu[..., t] + _B.T @ V_reg @ _B + (lmbda * np.eye(Quu.shape[0]) if reg == 1 else 0.)
+
+        Quu_inv = np.linalg.inv(Quu_reg)
+        K[..., t], kff[..., t] = - Quu_inv @ Qux_reg, - Quu_inv @ qu
+        _K, _kff = K[..., t], kff[..., t]
+
+        dV += np.hstack((_kff.T @ qu, 0.5 * _kff.T @ Quu @ _kff))
+        v[..., t] = qx + _K.T @ Quu @ _kff + _K.T @ qu + Qux.T @ _kff
+        V[..., t] = Qxx + _K.T @ Quu @ _K + _K.T @ Qux + Qux.T @ _K
+        V[..., t] = 0.5 * (V[..., t] + V[..., t].T)
+
+    return V, v, dV, K, kff
+
+
+def _gps_reference(Cxx, cx, Cuu, cu, Cxu, c0, A, B, c, sigma_dyn, alpha, nb_steps):
+    nb_udim = Cuu.shape[0]
+
+    V, v = np.zeros_like(Cxx), np.zeros_like(cx)
+    v0, v0_softmax = np.zeros_like(c0), np.zeros_like(c0)
+    K, kff = np.zeros_like(np.swapaxes(B, 0, 1)), np.zeros_like(cu[:, :-1])
+    sigma_ctl = np.zeros_like(Cuu[..., :-1])
+
+    V[..., -1], v[..., -1] = Cxx[..., -1], cx[..., -1]
+    v0[-1], v0_softmax[-1] = c0[-1], c0[-1]
+    for t in range(nb_steps - 1, -1, -1):
+        _A, _B, _c, _V, _v = A[..., t], B[..., t], c[..., t], V[..., t + 1], v[..., t + 1]
+        Qxx = (Cxx[..., t] + _A.T @ _V @ _A) / alpha
+        Quu = (Cuu[..., t] + _B.T @ _V @ _B) / alpha
+        Qux = (Cxu[..., t] + _A.T @ _V @ _B).T / alpha
+        qu = (cu[..., t] + 2. * _B.T @ _V @ _c + _B.T @ _v) / alpha
+        qx = (cx[..., t] + 2. * _A.T @ _V @ _c + _A.T @ _v) / alpha
+        q0_common = c0[t] + _c.T @ _V @ _c + np.trace(_V @ sigma_dyn[..., t]) + _v.T @ _c
+        q0 = (q0_common + v0[t + 1]) / alpha
+        q0_softmax = (q0_common + v0_softmax[t + 1]) / alpha
+
+        Quu_inv = np.linalg.inv(Quu)
+        K[..., t], kff[..., t] = - Quu_inv @ Qux, - 0.5 * Quu_inv @ qu
+        sigma_ctl[..., t] = - 0.5 * Quu_inv
+        sigma_ctl[..., t] = 0.5 * (sigma_ctl[..., t] + sigma_ctl[..., t].T)
+
+        V[..., t] = (Qxx + Qux.T @ K[..., t]) * alpha
+        V[..., t] = 0.5 * (V[..., t] + V[..., t].T)
+        v[..., t] = (qx + 2. * Qux.T @ kff[..., t]) * alpha
+        v0[t] = alpha * (0.5 * qu.T @ kff[..., t] + q0 - 0.5 * nb_udim)
+        v0_softmax[t] = alpha * (0.5 * qu.T @ kff[..., t] + q0_softmax
+                                 + 0.5 * (nb_udim * np.log(2. * np.pi) - np.log(np.linalg.det(- 2. * Quu))))
+
+    return V, v, v0, v0_softmax, K, kff, sigma_ctl
+
+
+@pytest.mark.parametrize('reg', [1, 2])
+def test_ilqr_backward_pass(reg):
+    nb_xdim, nb_udim, nb_steps = 4, 2, 50
+    Cxx, cx, Cuu, cu, Cxu, _, A, B, _, _ = _random_problem(nb_xdim, nb_udim, nb_steps)
+
+    _work = [_zeros(nb_xdim, nb_xdim, nb_steps), _zeros(nb_udim, nb_xdim, nb_steps),
+             _zeros(nb_udim, nb_udim, nb_steps), _zeros(nb_xdim, nb_steps), _zeros(nb_udim, nb_steps),
+             _zeros(nb_xdim, nb_xdim, nb_steps + 1), _zeros(nb_xdim, nb_steps + 1), _zeros(2),
+             _zeros(nb_udim, nb_xdim, nb_steps), _zeros(nb_udim, nb_steps)]
+
+    diverge = ilqr_core.backward_pass(Cxx, cx, Cuu, cu, Cxu, A, B, 1e-2, reg,
+                                      nb_xdim, nb_udim, nb_steps, *_work)
+    assert diverge == 0
+
+    V, v, dV, K, kff = _ilqr_reference(Cxx, cx, Cuu, cu, Cxu, A, B, 1e-2, reg, nb_steps)
+    for _out, _ref in zip([_work[5], _work[6], _work[7], _work[8], _work[9]], [V, v, dV, K, kff]):
+        assert np.allclose(_out, _ref, rtol=1e-8, atol=1e-10)
+
+
+@pytest.mark.parametrize('step', [7, 0])
+def test_ilqr_backward_pass_diverge(step):
+    nb_xdim, nb_udim, nb_steps = 2, 1, 10
+    Cxx, cx, Cuu, cu, Cxu, _, A, B, _, _ = _random_problem(nb_xdim, nb_udim, nb_steps)
+    Cuu[..., step] = - 1.e6
+
+    _work = [_zeros(nb_xdim, nb_xdim, nb_steps), _zeros(nb_udim, nb_xdim, nb_steps),
+             _zeros(nb_udim, nb_udim, nb_steps), _zeros(nb_xdim, nb_steps), _zeros(nb_udim, nb_steps),
+             _zeros(nb_xdim, nb_xdim, nb_steps + 1), _zeros(nb_xdim, nb_steps + 1), _zeros(2),
+             _zeros(nb_udim, nb_xdim, nb_steps), _zeros(nb_udim, nb_steps)]
+
+    diverge = ilqr_core.backward_pass(Cxx, cx, Cuu, cu, Cxu, A, B, 0., 1,
+                                      nb_xdim, nb_udim, nb_steps, *_work)
+    assert diverge == 1
+
+
+def test_gps_backward_pass():
+    nb_xdim, nb_udim, nb_steps = 3, 2, 50
+    Cxx, cx, Cuu, cu, Cxu, c0, A, B, c, sigma = _random_problem(nb_xdim, nb_udim, nb_steps)
+
+    alpha = -5.
+    _out = gps_core.backward_pass(Cxx, cx, Cuu, cu, Cxu, c0, A, B, c, sigma,
+                                  alpha, nb_xdim, nb_udim, nb_steps)
+    assert _out[-1] == 0
+
+    _ref = _gps_reference(Cxx, cx, Cuu, cu, Cxu, c0, A, B, c, sigma, alpha, nb_steps)
+    for _o, _r in zip(_out[7:14], _ref):
+        assert np.allclose(_o, _r, rtol=1e-8, atol=1e-10)
+
+
+def test_gps_augment_cost():
+    nb_xdim, nb_udim, nb_steps = 3, 2, 20
+    Cxx, cx, Cuu, cu, Cxu, c0, _, _, _, _ = _random_problem(nb_xdim, nb_udim, nb_steps)
+
+    random = np.random.RandomState(1)
+    K = np.asfortranarray(random.randn(nb_udim, nb_xdim, nb_steps))
+    kff = np.asfortranarray(random.randn(nb_udim, nb_steps))
+    sigma_ctl = _random_spd(random, nb_udim, nb_steps)
+
+    alpha = -2.
+    agCxx, agcx, agCuu, agcu, agCxu, agc0 = gps_core.augment_cost(Cxx, cx, Cuu, cu, Cxu, c0,
+                                                                  K, kff, sigma_ctl, alpha,
+                                                                  nb_xdim, nb_udim, nb_steps)
+
+    for t in range(nb_steps):
+        prec = np.linalg.inv(sigma_ctl[..., t])
+        _K, _kff = K[..., t], kff[..., t]
+        assert np.allclose(agCxx[..., t], Cxx[..., t] - 0.5 * alpha * _K.T @ prec @ _K)
+        assert np.allclose(agCuu[..., t], Cuu[..., t] - 0.5 * alpha * prec)
+        assert np.allclose(agCxu[..., t], Cxu[..., t] + 0.5 * alpha * _K.T @ prec)
+        assert np.allclose(agcx[..., t], cx[..., t] - alpha * _K.T @ prec @ _kff)
+        assert np.allclose(agcu[..., t], cu[..., t] + alpha * prec @ _kff)
+        assert np.allclose(agc0[t], c0[t] - 0.5 * alpha * np.log(np.linalg.det(2. * np.pi * sigma_ctl[..., t]))
+                           - 0.5 * alpha * _kff.T @ prec @ _kff)
+
+
+def test_gps_kl_divergence():
+    nb_xdim, nb_udim, nb_steps = 3, 2, 20
+    random = np.random.RandomState(1)
+
+    K, lK = [np.asfortranarray(random.randn(nb_udim, nb_xdim, nb_steps)) for _ in range(2)]
+    kff, lkff = [np.asfortranarray(random.randn(nb_udim, nb_steps)) for _ in range(2)]
+    sigma_ctl, lsigma_ctl = [_random_spd(random, nb_udim, nb_steps) for _ in range(2)]
+    mu_x = np.asfortranarray(random.randn(nb_xdim, nb_steps))
+    sigma_x = _random_spd(random, nb_xdim, nb_steps)
+
+    kl = gps_core.kl_divergence(K, kff, sigma_ctl, lK, lkff, lsigma_ctl,
+                                mu_x, sigma_x, nb_xdim, nb_udim, nb_steps)
+
+    _kl = 0.
+    for t in range(nb_steps):
+        lprec = np.linalg.inv(lsigma_ctl[..., t])
+        dK, dkff = lK[..., t] - K[..., t], - lkff[..., t] + kff[..., t]
+        _kl += 0.5 * np.log(np.linalg.det(lsigma_ctl[..., t]) / np.linalg.det(sigma_ctl[..., t])) \
+            + 0.5 * np.trace(lprec @ sigma_ctl[..., t]) - 0.5 * nb_udim \
+            + 0.5 * np.trace(dK.T @ lprec @ dK @ sigma_x[..., t]) \
+            + 0.5 * mu_x[..., t].T @ dK.T @ lprec @ dK @ mu_x[..., t] \
+            - mu_x[..., t].T @ dK.T @ lprec @ dkff + 0.5 * dkff.T @ lprec @ dkff
+
+    assert np.allclose(kl, _kl)
+
+
+def test_gps_log_determinant_overflow():
+    # det() of these covariances overflows, the log-determinant does not
+    nb_xdim, nb_udim, nb_steps = 1, 4, 2
+    Cxx, cx, Cuu, cu, Cxu, c0, _, _, _, _ = _random_problem(nb_xdim, nb_udim, nb_steps)
+
+    K = _zeros(nb_udim, nb_xdim, nb_steps)
+    kff = _zeros(nb_udim, nb_steps)
+    sigma_ctl = np.asfortranarray(np.tile(1e100 * np.eye(nb_udim)[..., None], (1, 1, nb_steps)))
+
+    agc0 = gps_core.augment_cost(Cxx, cx, Cuu, cu, Cxu, c0, K, kff, sigma_ctl, -1.,
+                                 nb_xdim, nb_udim, nb_steps)[-1]
+
+    _logdet = nb_udim * np.log(2. * np.pi * 1e100)
+    assert np.all(np.isfinite(agc0))
+    assert np.allclose(agc0[:-1], c0[:-1] + 0.5 * _logdet)
+
+
+def test_bspilqr_backward_pass():
+    nb_bdim, nb_udim, nb_steps = 3, 1, 20
+    nb_sdim = nb_bdim * nb_bdim
+    random = np.random.RandomState(1337)
+
+    Q, R = _random_spd(random, nb_bdim, nb_steps + 1), _random_spd(random, nb_udim, nb_steps + 1)
+    P = np.asfortranarray(0.1 * random.randn(nb_bdim, nb_udim, nb_steps + 1))
+    q = np.asfortranarray(random.randn(nb_bdim, nb_steps + 1))
+    r = np.asfortranarray(random.randn(nb_udim, nb_steps + 1))
+    p = np.asfortranarray(random.randn(nb_sdim, nb_steps + 1))
+
+    F = np.asfortranarray(np.eye(nb_bdim)[..., None] + 0.1 * random.randn(nb_bdim, nb_bdim, nb_steps))
+    G = np.asfortranarray(0.5 * random.randn(nb_bdim, nb_udim, nb_steps))
+    T, U = np.asfortranarray(0.1 * random.randn(nb_sdim, nb_bdim, nb_steps)), _zeros(nb_sdim, nb_sdim, nb_steps)
+    V = np.asfortranarray(0.1 * random.randn(nb_sdim, nb_udim, nb_steps))
+    X, Y, Z = [np.asfortranarray(0.1 * random.randn(nb_sdim, n, nb_steps)) for n in (nb_bdim, nb_sdim, nb_udim)]
+
+    lmbda, reg = 1e-2, 1
+    S, s, tau, dS, K, kff, diverge = bspilqr_core.backward_pass(Q, q, R, r, P, p, F, G, T, U, V, X, Y, Z,
+                                                                lmbda, reg, nb_bdim, nb_udim, nb_steps)
+    assert diverge == 0
+
+    _S, _s, _tau = Q[..., -1], q[..., -1], p[..., -1]
+    for t in range(nb_steps - 1, -1, -1):
+        _vS = _S.flatten(order='F')
+        C = Q[..., t] + F[..., t].T @ _S @ F[..., t]
+        D = R[..., t] + G[..., t].T @ _S @ G[..., t]
+        E = (P[..., t] + F[..., t].T @ _S @ G[..., t]).T
+        c = q[..., t] + F[..., t].T @ _s + T[..., t].T @ _tau + 0.5 * X[..., t].T @ _vS
+        d = r[..., t] + G[..., t].T @ _s + V[..., t].T @ _tau + 0.5 * Z[..., t].T @ _vS
+
+        Dinv = np.linalg.inv(D + lmbda * np.eye(nb_udim))
+        _K, _kff = - Dinv @ E, - Dinv @ d
+        assert np.allclose(K[..., t], _K) and np.allclose(kff[..., t], _kff)
+
+        _tau = p[..., t] + 0.5 * Y[..., t].T @ _vS
+        _s = c + _K.T @ D @ _kff + _K.T @ d + E.T @ _kff
+        _S = C + _K.T @ D @ _K + _K.T @ E + E.T @ _K
+        _S = 0.5 * (_S + _S.T)
+        assert np.allclose(S[..., t], _S) and np.allclose(s[..., t], _s)
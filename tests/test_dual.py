@@ -0,0 +1,141 @@
+import numpy as np
+
+from trajopt.gps.dual import bracketed_dual
+
+
+def _dual(kl_bound, scale):
+    # kl(alpha) = scale / alpha^2, decreasing in |alpha|
+    def dual(alpha):
+        return np.zeros((1, )), np.array([scale / alpha[0]**2 - kl_bound])
+    return dual
+
+
+def test_root():
+    alpha, nb_evals = bracketed_dual(_dual(0.1, 1.e3), np.array([-1.]), gtol=1.e-6)
+    assert np.isclose(alpha[0], - 1.e2, rtol=1.e-5)
+    assert nb_evals < 20
+
+
+def test_warm_start():
+    _, cold = bracketed_dual(_dual(0.1, 1.e3), np.array([-1.e6]), gtol=1.e-6)
+    _, warm = bracketed_dual(_dual(0.1, 1.e3), np.array([-1.01e2]), gtol=1.e-6)
+    assert warm < cold
+
+
+def test_bounds():
+    # constraint inactive on the whole domain
+    alpha, _ = bracketed_dual(_dual(1.e20, 1.), np.array([-1.]), gtol=1.e-6)
+    assert np.isclose(alpha[0], -1.e-8)
+
+    # constraint unreachable
+    alpha, _ = bracketed_dual(_dual(1.e-20, 1.), np.array([-1.]), gtol=1.e-6)
+    assert np.isclose(alpha[0], -1.e8)
+
+
+def _unfused_dual(alg, alpha):
+    from trajopt.gps.core import quad_expectation
+
+    agcost = alg.augment_cost(alpha)
+    lgc, xvalue, _, _ = alg.backward_pass(alpha, agcost)
+    xdist, _, _ = alg.forward_pass(lgc)
+
+    dual = quad_expectation(xdist.mu[..., 0], xdist.sigma[..., 0],
+                            xvalue.V[..., 0], xvalue.v[..., 0],
+                            xvalue.v0_softmax[..., 0]) + alpha * alg.kl_bound
+    grad = alg.kl_bound - alg.kldiv(lgc, xdist)
+    return dual, grad, lgc
+
+
+def test_fused_dual():
+    import gym
+    import trajopt  # noqa: registers the environments
+
+    from trajopt.gps import MBGPS
+    from trajopt.gps.core import dual_and_grad
+
+    env = gym.make('Pendulum-TO-v0').unwrapped
+    np.random.seed(1337)
+
+    for backward in ['sequential', 'parallel']:
+        alg = MBGPS(env, nb_steps=30, kl_bound=1., init_ctl_sigma=1., backward=backward)
+        alg.xdist, alg.udist, _ = alg.extended_kalman(alg.ctl)
+        alg.cost.taylor_expansion(alg.xdist.mu, alg.udist.mu, alg.activation)
+
+        for alpha in [-1.e1, -1.e3]:
+            dual, grad, lgc = _unfused_dual(alg, alpha)
+
+            _dual, _grad = alg.dual(np.array([alpha]))
+            assert np.isclose(- _dual[0], dual, rtol=1e-10)
+            assert np.isclose(- _grad[0], grad, rtol=1e-10)
+
+            _, _, _, K, kff, sigma = dual_and_grad(alpha, alg.kl_bound, *alg.cost.params,
+                                                   alg.dyn.A, alg.dyn.B, alg.dyn.c, alg.dyn.sigma,
+                                                   alg.xdist.mu[..., 0], alg.xdist.sigma[..., 0],
+                                                   alg.ctl.K, alg.ctl.kff, alg.ctl.sigma,
+                                                   alg.nb_xdim, alg.nb_udim, alg.nb_steps,
+                                                   True, backward == 'parallel', 2)
+            assert np.allclose(K, lgc.K) and np.allclose(kff, lgc.kff)
+            assert np.allclose(sigma, lgc.sigma)
+
+
+def test_diverged_dual():
+    # kl(alpha) = scale / alpha^2, undefined for |alpha| < 1
+    def dual(alpha):
+        if alpha[0] > -1.:
+            return np.array([np.inf]), np.array([np.inf])
+        return np.zeros((1, )), np.array([1.e3 / alpha[0]**2 - 0.1])
+
+    alpha, _ = bracketed_dual(dual, np.array([-1.e-2]), gtol=1.e-6)
+    assert np.isclose(alpha[0], - 1.e2, rtol=1.e-5)
+
+
+def test_nonconvex_cost():
+    import gym
+    import trajopt  # noqa: registers the environments
+
+    from trajopt.gps import MBGPS
+
+    env = gym.make('Pendulum-TO-v0').unwrapped
+    np.random.seed(1337)
+
+    alg = MBGPS(env, nb_steps=30, kl_bound=1., init_ctl_sigma=1.)
+    alg.xdist, alg.udist, _ = alg.extended_kalman(alg.ctl)
+    alg.cost.taylor_expansion(alg.xdist.mu, alg.udist.mu, alg.activation)
+
+    # concave in the state, the backward pass diverges for small |alpha|
+    alg.cost.Cxx[...] = - alg.cost.Cxx
+
+    dual, grad = alg.dual(np.array([-1.e-8]))
+    assert dual[0] == np.inf and grad[0] == np.inf
+
+    for solver in ['bracketed', 'lbfgs']:
+        alg.dual_solver = solver
+        alg.alpha = np.array([-1.])
+
+        alpha = alg.optimize_dual()
+        dual, grad = alg.dual(alpha)
+        assert np.isfinite(dual[0]) and abs(grad[0]) < 1.e-2 * alg.kl_bound
+
+
+def test_first_step_divergence():
+    import gym
+    import trajopt  # noqa: registers the environments
+
+    from trajopt.gps import MBGPS
+
+    env = gym.make('Pendulum-TO-v0').unwrapped
+    np.random.seed(1337)
+
+    for backward in ['sequential', 'parallel']:
+        alg = MBGPS(env, nb_steps=30, kl_bound=1., init_ctl_sigma=1., backward=backward)
+        alg.xdist, alg.udist, _ = alg.extended_kalman(alg.ctl)
+        alg.cost.taylor_expansion(alg.xdist.mu, alg.udist.mu, alg.activation)
+
+        # only the first step fails, which has index zero
+        alg.cost.Cuu[..., 0] = - 1.e6
+
+        dual, grad = alg.dual(np.array([-1.]))
+        assert dual[0] == np.inf and grad[0] == np.inf
+
+        _, _, _, diverge = alg.backward_pass(np.array([-1.]), alg.cost)
+        assert diverge
@@ -0,0 +1,106 @@
+import numpy as np
+
+from trajopt.elqr.core import forward_sweep, backward_sweep
+
+
+def _expansions(nb_xdim, nb_udim, nb_steps, seed=1337):
+    random = np.random.RandomState(seed)
+
+    _exp = []
+    for _ in range(nb_steps):
+        A = np.eye(nb_xdim) + 0.1 * random.randn(nb_xdim, nb_xdim)
+        B = random.randn(nb_xdim, nb_udim)
+        c = 0.1 * random.randn(nb_xdim)
+
+        _M = random.randn(nb_xdim + nb_udim, nb_xdim + nb_udim)
+        _H = _M @ _M.T + np.eye(nb_xdim + nb_udim)
+        Cxx, Cuu, Cxu = 0.5 * _H[:nb_xdim, :nb_xdim], 0.5 * _H[nb_xdim:, nb_xdim:], _H[:nb_xdim, nb_xdim:]
+
+        _exp.append((A, B, c, Cxx, Cuu, Cxu,
+                     random.randn(nb_xdim), random.randn(nb_udim), random.randn()))
+    return _exp
+
+
+def test_forward_sweep():
+    nb_xdim, nb_udim, nb_steps = 3, 2, 10
+    _exp = _expansions(nb_xdim, nb_udim, nb_steps)
+
+    Vgo = np.tile(np.eye(nb_xdim)[..., None], (1, 1, nb_steps + 1))
+    vgo = np.ones((nb_xdim, nb_steps + 1))
+
+    Vcome = np.zeros((nb_xdim, nb_xdim, nb_steps + 1))
+    Vcome[..., 0] = 1e-2 * np.eye(nb_xdim)
+    vcome, v0come = np.zeros((nb_xdim, nb_steps + 1)), np.zeros((nb_steps + 1, ))
+
+    x0 = np.ones((nb_xdim, ))
+    _states = []
+
+    def expansion(x, t):
+        _states.append(x)
+        return _exp[t]
+
+    V, v, v0, K, kff, _, _, _, x = forward_sweep(expansion, Vgo, vgo, Vcome, vcome, v0come,
+                                                 x0, nb_xdim, nb_udim, nb_steps)
+
+    # the explicit-inverse recursion of the previous python sweep
+    _V, _v, _v0, _x = Vcome[..., 0], vcome[..., 0], 0., x0
+    for t in range(nb_steps):
+        assert np.allclose(_states[t], _x)
+
+        A, B, c, Cxx, Cuu, Cxu, cx, cu, c0 = _exp[t]
+        M = Cxx + _V
+        Qxx = A.T @ M @ A
+        Quu = B.T @ M @ B + B.T @ Cxu + Cxu.T @ B + Cuu
+        Qux = B.T @ M @ A + Cxu.T @ A
+        qx = A.T @ M @ c + A.T @ (cx + _v)
+        qu = B.T @ M @ c + Cxu.T @ c + B.T @ (cx + _v) + cu
+        q0 = 0.5 * c.T @ M @ c + c.T @ (cx + _v) + c0 + _v0
+
+        Quu_inv = np.linalg.inv(Quu)
+        assert np.allclose(K[..., t], - Quu_inv @ Qux) and np.allclose(kff[..., t], - Quu_inv @ qu)
+
+        _V = Qxx - Qux.T @ Quu_inv @ Qux
+        _v = qx - Qux.T @ Quu_inv @ qu
+        _v0 = q0 - 0.5 * qu.T @ Quu_inv @ qu
+        assert np.allclose(V[..., t + 1], _V) and np.allclose(v[..., t + 1], _v)
+        assert np.allclose(v0[t + 1], _v0)
+
+        _x = - np.linalg.inv(Vgo[..., t + 1] + _V) @ (vgo[..., t + 1] + _v)
+
+    assert np.allclose(x, _x)
+    # the input state is left untouched
+    assert np.allclose(x0, 1.)
+
+
+def test_backward_sweep():
+    nb_xdim, nb_udim, nb_steps = 3, 2, 10
+    _exp = _expansions(nb_xdim, nb_udim, nb_steps)
+
+    Vgo, vgo, v0go = np.zeros((nb_xdim, nb_xdim, nb_steps + 1)), np.zeros((nb_xdim, nb_steps + 1)), np.zeros((nb_steps + 1, ))
+    Vgo[..., -1], vgo[..., -1], v0go[-1] = np.eye(nb_xdim), np.ones((nb_xdim, )), 1.
+
+    Vcome = np.tile(np.eye(nb_xdim)[..., None], (1, 1, nb_steps + 1))
+    vcome = np.ones((nb_xdim, nb_steps + 1))
+
+    V, v, v0, K, kff, _, _, _, x = backward_sweep(lambda x, t: _exp[t], Vgo, vgo, v0go, Vcome, vcome,
+                                                  np.ones((nb_xdim, )), nb_xdim, nb_udim, nb_steps)
+
+    _V, _v, _v0 = Vgo[..., -1], vgo[..., -1], v0go[-1]
+    for t in range(nb_steps - 1, -1, -1):
+        A, B, c, Cxx, Cuu, Cxu, cx, cu, c0 = _exp[t]
+        Qxx = Cxx + A.T @ _V @ A
+        Quu = Cuu + B.T @ _V @ B
+        Qux = Cxu.T + B.T @ _V @ A
+        qx = cx + A.T @ _V @ c + A.T @ _v
+        qu = cu + B.T @ _V @ c + B.T @ _v
+        q0 = c0 + _v0 + 0.5 * c.T @ _V @ c + c.T @ _v
+
+        Quu_inv = np.linalg.inv(Quu)
+        assert np.allclose(K[..., t], - Quu_inv @ Qux) and np.allclose(kff[..., t], - Quu_inv @ qu)
+
+        _V = Qxx - Qux.T @ Quu_inv @ Qux
+        _v = qx - Qux.T @ Quu_inv @ qu
+        _v0 = q0 - 0.5 * qu.T @ Quu_inv @ qu
+        assert np.allclose(V[..., t], _V) and np.allclose(v[..., t], _v) and np.allclose(v0[t], _v0)
+
+    assert np.allclose(x, - np.linalg.inv(_V + Vcome[..., 0]) @ (_v + vcome[..., 0]))
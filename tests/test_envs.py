@@ -0,0 +1,60 @@
+import numpy as np
+
+import gym
+import trajopt  # noqa: registers the environments
+
+import autograd.numpy as anp
+from autograd import jacobian
+
+
+_envs = ['LQR-TO-v0', 'Pendulum-TO-v0', 'Pendulum-TO-v2',
+         'Cartpole-TO-v0', 'DoubleCartpole-TO-v0',
+         'LightDark-TO-v0', 'Car-TO-v0',
+         'Quanser-Qube-TO-v0', 'Quanser-Cartpole-TO-v0']
+
+
+def test_dynamics_batch():
+    random = np.random.RandomState(1337)
+
+    for name in _envs:
+        env = gym.make(name).unwrapped
+        nb_xdim, nb_udim = env.init()[0].shape[0], env.action_space.shape[0]
+
+        x = env.init()[0] + 0.1 * random.randn(10, nb_xdim)
+        u = random.randn(10, nb_udim)
+
+        xn = env.dynamics_batch(x, u)
+        assert xn.shape == (10, nb_xdim)
+        assert np.allclose(xn, np.stack([env.dynamics(_x, _u) for _x, _u in zip(x, u)])), name
+
+        # rows do not interact, the jacobian of the sum holds all rows
+        _z = np.hstack((x, u))
+        _J = jacobian(lambda z: anp.sum(env.dynamics_batch(z[:, :nb_xdim], z[:, nb_xdim:]), axis=0))(_z)
+        for _n in range(10):
+            _Jn = jacobian(lambda z: env.dynamics(z[:nb_xdim], z[nb_xdim:]))(_z[_n])
+            assert np.allclose(_J[:, _n, :], _Jn), name
+
+
+def test_gaussian_step_batch():
+    random = np.random.RandomState(1337)
+
+    for name in ['LQR-TO-v0', 'Pendulum-TO-v0', 'Pendulum-TO-v1', 'Pendulum-TO-v2',
+                 'Cartpole-TO-v0', 'Cartpole-TO-v1', 'DoubleCartpole-TO-v0', 'DoubleCartpole-TO-v1']:
+        env = gym.make(name).unwrapped
+        assert env.gaussian_step, name
+
+        nb_xdim, nb_udim = env.init()[0].shape[0], env.action_space.shape[0]
+
+        x = env.init()[0] + 0.1 * random.randn(10, nb_xdim)
+        u = random.randn(10, nb_udim)
+        a = np.arange(10) % 2
+
+        sigma = env.noise_batch(x, u)
+        assert np.allclose(sigma, np.stack([env.noise(_x, _u) for _x, _u in zip(x, u)])), name
+
+        c = env.cost_batch(x, u, a)
+        assert np.allclose(c, [env.cost(_x, _u, _a, _x) for _x, _u, _a in zip(x, u, a)]), name
+
+    # reset and step do not follow the model of these envs
+    for name in ['Quanser-Qube-v0', 'Quanser-Cartpole-v0']:
+        assert not getattr(gym.make(name).unwrapped, 'gaussian_step', False), name
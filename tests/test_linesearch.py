@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import gym
+import trajopt  # noqa: registers the environments
+
+from trajopt.ilqr import iLQR
+from trajopt.bspilqr import BSPiLQR
+
+
+def _run(cls, name, linesearch, nb_steps, nb_iter):
+    env = gym.make(name).unwrapped
+    np.random.seed(1337)
+
+    alg = cls(env, nb_steps=nb_steps, linesearch=linesearch)
+    trace = alg.run(nb_iter=nb_iter)
+    return alg, trace
+
+
+def test_ilqr_linesearch():
+    serial, trace = _run(iLQR, 'Pendulum-TO-v0', 'serial', 30, 10)
+
+    for linesearch in ['vectorized', 'pool']:
+        alg, _trace = _run(iLQR, 'Pendulum-TO-v0', linesearch, 30, 10)
+
+        # same step sizes accepted, so the same iterates
+        assert np.allclose(_trace, trace)
+        assert np.allclose(alg.uref, serial.uref)
+        assert np.allclose(alg.ctl.kff, serial.ctl.kff)
+        assert alg.pool is None
+
+
+def test_bspilqr_linesearch():
+    serial, trace = _run(BSPiLQR, 'Car-TO-v0', 'serial', 20, 5)
+
+    for linesearch in ['vectorized', 'pool']:
+        alg, _trace = _run(BSPiLQR, 'Car-TO-v0', linesearch, 20, 5)
+
+        assert np.allclose(_trace, trace)
+        assert np.allclose(alg.uref, serial.uref)
+        assert alg.pool is None
+
+
+def test_pool_closed_on_error():
+    env = gym.make('Pendulum-TO-v0').unwrapped
+    alg = iLQR(env, nb_steps=10, linesearch='pool')
+
+    def _iteration(trace):
+        raise RuntimeError
+
+    alg.iteration = _iteration
+    with pytest.raises(RuntimeError):
+        alg.run(nb_iter=1)
+
+    assert alg.pool is None
@@ -0,0 +1,26 @@
+import numpy as np
+
+import gym
+import trajopt  # noqa: registers the environments
+
+from trajopt.ilqr import MPC
+
+
+def test_mpc_ticks():
+    env = gym.make('Pendulum-TO-v0').unwrapped
+    np.random.seed(1337)
+
+    mpc = MPC(env, nb_steps=20, nb_iter=2, deadline=1.)
+
+    x = env.init()[0]
+    for _ in range(5):
+        u = mpc.action(x)
+        assert u.shape == (env.action_space.shape[0], )
+        # the reference starts at the measured state
+        assert np.allclose(mpc.alg.xref[:, 0], x)
+        x = env.dynamics(x, u)
+
+    _stats = mpc.latency()
+    assert _stats['ticks'] == 5
+    assert 1 <= _stats['iterations'] <= 2
+    assert _stats['min'] <= _stats['p50'] <= _stats['max']
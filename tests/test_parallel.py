@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import gym
+import trajopt  # noqa: registers the environments
+
+from trajopt.ilqr import iLQR
+from trajopt.ilqr.objects import Workspace
+from trajopt.ilqr.core import backward_pass as ilqr_backward_pass
+from trajopt.ilqr.core import parallel_backward_pass as ilqr_parallel_backward_pass
+
+from trajopt.riccati.core import backward_pass as riccati_backward_pass
+from trajopt.riccati.core import parallel_backward_pass as riccati_parallel_backward_pass
+
+
+def _problem(nb_xdim, nb_udim, nb_steps, seed=1337):
+    random = np.random.RandomState(seed)
+
+    _M = random.randn(nb_steps + 1, nb_xdim + nb_udim, nb_xdim + nb_udim)
+    _H = _M @ np.swapaxes(_M, 1, 2) + np.eye(nb_xdim + nb_udim)
+
+    Cxx = np.asfortranarray(np.transpose(_H[:, :nb_xdim, :nb_xdim], (1, 2, 0)))
+    Cuu = np.asfortranarray(np.transpose(_H[:, nb_xdim:, nb_xdim:], (1, 2, 0)))
+    Cxu = np.asfortranarray(np.transpose(_H[:, :nb_xdim, nb_xdim:], (1, 2, 0)))
+    cx = np.asfortranarray(random.randn(nb_xdim, nb_steps + 1))
+    cu = np.asfortranarray(random.randn(nb_udim, nb_steps + 1))
+
+    A = np.asfortranarray(np.eye(nb_xdim)[..., None] + 0.3 * random.randn(nb_xdim, nb_xdim, nb_steps))
+    B = np.asfortranarray(random.randn(nb_xdim, nb_udim, nb_steps))
+    c = np.asfortranarray(0.1 * random.randn(nb_xdim, nb_steps))
+
+    return Cxx, cx, Cuu, cu, Cxu, A, B, c
+
+
+def test_ilqr_parallel_backward_pass():
+    nb_xdim, nb_udim = 3, 2
+
+    for nb_steps in [1, 2, 3, 7, 40]:
+        Cxx, cx, Cuu, cu, Cxu, A, B, _ = _problem(nb_xdim, nb_udim, nb_steps)
+
+        _args = (Cxx, cx, Cuu, cu, Cxu, A, B)
+        _dims = (nb_xdim, nb_udim, nb_steps)
+
+        # the scan solves the unregularized problem
+        seq = Workspace(nb_xdim, nb_udim, nb_steps)
+        assert ilqr_backward_pass(*_args, 0., 1, *_dims, *seq.params) == 0
+
+        for nb_threads in [1, 4, 16]:
+            par = Workspace(nb_xdim, nb_udim, nb_steps)
+            assert ilqr_parallel_backward_pass(*_args, *_dims, *par.params, nb_threads) == 0
+
+            assert np.allclose(par.ctl.K, seq.ctl.K)
+            assert np.allclose(par.ctl.kff, seq.ctl.kff)
+            assert np.allclose(par.vfunc.V, seq.vfunc.V)
+            assert np.allclose(par.vfunc.v, seq.vfunc.v)
+            assert np.allclose(par.dV, seq.dV)
+
+
+def test_ilqr_parallel():
+    env = gym.make('Pendulum-TO-v0').unwrapped
+
+    # a regularized problem cannot be solved by the scan
+    with pytest.raises(ValueError):
+        iLQR(env, nb_steps=30, backward='parallel')
+
+    _traces, _algs = [], []
+    for backward in ['sequential', 'parallel']:
+        np.random.seed(1337)
+        alg = iLQR(env, nb_steps=30, lmbda=0., backward=backward, nb_threads=4)
+        _traces.append(alg.run(nb_iter=10))
+        _algs.append(alg)
+
+    # the sequential pass takes over whenever lmbda > 0
+    assert np.allclose(_traces[0], _traces[1])
+    assert np.allclose(_algs[0].uref, _algs[1].uref)
+    assert np.allclose(_algs[0].ctl.K, _algs[1].ctl.K)
+
+
+def test_riccati_parallel_backward_pass():
+    nb_xdim, nb_udim = 3, 2
+
+    for nb_steps in [1, 2, 3, 7, 40]:
+        Cxx, cx, Cuu, cu, Cxu, A, B, c = _problem(nb_xdim, nb_udim, nb_steps)
+
+        # tol=0 sweeps all steps
+        V, v, K, kff, diverge, _ = riccati_backward_pass(Cxx, cx, Cuu, cu, Cxu, A, B, c,
+                                                         nb_xdim, nb_udim, nb_steps, 0., 100)
+        assert diverge == 0
+
+        for nb_threads in [1, 4, 16]:
+            _V, _v, _K, _kff, _diverge = riccati_parallel_backward_pass(Cxx, cx, Cuu, cu, Cxu, A, B, c,
+                                                                        nb_xdim, nb_udim, nb_steps,
+                                                                        nb_threads)
+            assert _diverge == 0
+
+            assert np.allclose(_K, K) and np.allclose(_kff, kff)
+            assert np.allclose(_V, V) and np.allclose(_v, v)
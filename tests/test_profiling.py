@@ -0,0 +1,86 @@
+import json
+
+import numpy as np
+
+import gym
+import trajopt  # noqa: registers the environments
+
+from trajopt.ilqr import iLQR
+from trajopt.gps import MBGPS
+from trajopt.profiling import Profiler
+
+
+def _load(path):
+    with open(path) as f:
+        return [json.loads(_line) for _line in f]
+
+
+def test_ilqr_profiler(tmp_path):
+    env = gym.make('Cartpole-TO-v0').unwrapped
+    np.random.seed(1337)
+
+    # min_imp=1 rejects some of the larger step sizes
+    profiler = Profiler()
+    alg = iLQR(env, nb_steps=30, min_imp=1., profiler=profiler)
+    trace = alg.run(nb_iter=5)
+
+    _phases = profiler.summary()['phases']
+    assert set(_phases) == {'dyn.taylor_expansion', 'cost.taylor_expansion',
+                            'backward_pass', 'forward_pass'}
+
+    # the initial rollout is iteration 0, every iteration expands once
+    assert profiler.iteration == 5
+    _expansions = [_r['iteration'] for _r in profiler.records if _r['phase'] == 'dyn.taylor_expansion']
+    assert _expansions == list(range(1, 6))
+    assert all('lmbda' in _r for _r in profiler.records if _r['phase'] == 'backward_pass')
+
+    # every step size tried is either accepted or rejected
+    _steps = [_r for _r in profiler.records if _r['phase'] == 'forward_pass' and _r['iteration'] > 0]
+    assert all('alpha' in _r for _r in _steps)
+    assert profiler.counts['rejected_steps'] > 0
+    assert len(_steps) == profiler.counts['rejected_steps'] + len(trace) - 1
+
+    _path = str(tmp_path / 'ilqr.jsonl')
+    profiler.dump(_path)
+
+    _lines = _load(_path)
+    assert _lines[:-1] == profiler.records
+    assert _lines[-1] == {'counts': profiler.counts}
+
+
+def test_mbgps_profiler(tmp_path):
+    env = gym.make('Pendulum-TO-v0').unwrapped
+    np.random.seed(1337)
+
+    profiler = Profiler()
+    alg = MBGPS(env, nb_steps=30, kl_bound=1., init_ctl_sigma=1., profiler=profiler)
+
+    # count the dual evaluations independently
+    _nb_duals = []
+    _dual = alg.dual
+
+    def _counted(alpha):
+        _nb_duals.append(alpha)
+        return _dual(alpha)
+
+    alg.dual = _counted
+    trace = alg.run(nb_iter=2)
+
+    _phases = profiler.summary()['phases']
+    assert set(_phases) == {'extended_kalman', 'cost.taylor_expansion', 'optimize_dual',
+                            'backward_pass', 'forward_pass'}
+    assert _phases['extended_kalman']['calls'] == 3
+
+    _iterations = [_r['iteration'] for _r in profiler.records]
+    assert _iterations[0] == 0 and set(_iterations) == {0, 1, 2}
+    assert all(_r['solver'] == alg.dual_solver for _r in profiler.records if _r['phase'] == 'optimize_dual')
+
+    assert profiler.counts['dual_evaluations'] == len(_nb_duals) > 0
+    assert profiler.counts.get('rejected_steps', 0) == 2 - (len(trace) - 1)
+
+    _path = str(tmp_path / 'mbgps.jsonl')
+    profiler.dump(_path)
+
+    _lines = _load(_path)
+    assert _lines[:-1] == profiler.records
+    assert _lines[-1] == {'counts': profiler.counts}
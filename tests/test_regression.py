@@ -0,0 +1,171 @@
+import sys
+import types
+
+import numpy as np
+
+from trajopt.gps.objects import LearnedLinearGaussianDynamics
+
+
+def _data(nb_xdim, nb_udim, nb_steps, nb_episodes, noise):
+    _random = np.random.RandomState(1337)
+
+    A = np.eye(nb_xdim) + 0.1 * _random.randn(nb_xdim, nb_xdim)
+    B = _random.randn(nb_xdim, nb_udim)
+    c = _random.randn(nb_xdim)
+
+    x = _random.randn(nb_xdim, nb_steps, nb_episodes)
+    u = _random.randn(nb_udim, nb_steps, nb_episodes)
+    xn = np.einsum('kh,htn->ktn', A, x) + np.einsum('kh,htn->ktn', B, u) + c[:, None, None]\
+         + noise * _random.randn(nb_xdim, nb_steps, nb_episodes)
+
+    return {'x': x, 'u': u, 'xn': xn}, A, B, c
+
+
+def test_pointwise_recovers_dynamics():
+    data, A, B, c = _data(3, 2, 5, 200, noise=1e-3)
+
+    dyn = LearnedLinearGaussianDynamics(3, 2, 5)
+    dyn.learn(data, pointwise=True)
+
+    for t in range(5):
+        assert np.allclose(dyn.A[..., t], A, atol=1e-3)
+        assert np.allclose(dyn.B[..., t], B, atol=1e-3)
+        assert np.allclose(dyn.c[..., t], c, atol=1e-3)
+
+
+def test_pointwise_map():
+    data, _, _, _ = _data(3, 2, 4, 20, noise=1e-1)
+    nb_episodes = 20
+
+    dyn = LearnedLinearGaussianDynamics(3, 2, 4)
+    dyn.learn(data, pointwise=True)
+
+    # per-step mode of the matrix-normal inverse-wishart posterior
+    for t in range(4):
+        _z = np.vstack((data['x'][:, t, :], data['u'][:, t, :], np.ones((1, nb_episodes))))
+        _y = data['xn'][:, t, :]
+
+        _K = _z @ _z.T + 1.e-6 * np.eye(6)
+        _A = np.linalg.solve(_K, _z @ _y.T).T
+        _psi = np.eye(3) + _y @ _y.T - _A @ _K @ _A.T
+        _sigma = _psi / (3 + 2 + nb_episodes + 3 + 1)
+
+        assert np.allclose(dyn.A[..., t], _A[:, :3])
+        assert np.allclose(dyn.B[..., t], _A[:, 3:5])
+        assert np.allclose(dyn.c[..., t], _A[:, -1])
+        assert np.allclose(dyn.sigma[..., t], _sigma)
+
+
+def test_incremental_matches_joint_fit():
+    data, _, _, _ = _data(3, 2, 4, 30, noise=1e-1)
+    _first = {k: v[..., :10] for k, v in data.items()}
+    _second = {k: v[..., 10:] for k, v in data.items()}
+
+    joint = LearnedLinearGaussianDynamics(3, 2, 4)
+    joint.learn(data, pointwise=True)
+
+    incremental = LearnedLinearGaussianDynamics(3, 2, 4)
+    incremental.update(_first)
+    incremental.update(_second)
+
+    for _a, _b in zip([joint.A, joint.B, joint.c, joint.sigma],
+                      [incremental.A, incremental.B, incremental.c, incremental.sigma]):
+        assert np.allclose(_a, _b)
+
+
+def test_forgetting():
+    data, _, _, _ = _data(3, 2, 4, 30, noise=1e-1)
+    _first = {k: v[..., :10] for k, v in data.items()}
+    _second = {k: v[..., 10:] for k, v in data.items()}
+
+    dyn = LearnedLinearGaussianDynamics(3, 2, 4, forget=0.5)
+    dyn.update(_first)
+    dyn.update(_second)
+
+    _zz = 0.5 * np.einsum('itn,jtn->tij', _first['xn'], _first['xn'])\
+          + np.einsum('itn,jtn->tij', _second['xn'], _second['xn'])
+    assert np.allclose(dyn.stats.yy, _zz)
+    assert np.allclose(dyn.stats.n, 0.5 * 10 + 20)
+
+
+def test_gmm_prior_recovers_dynamics():
+    from trajopt.gps.prior import GMMPrior
+
+    data, A, B, c = _data(3, 2, 5, 200, noise=1e-3)
+
+    np.random.seed(1337)
+    prior = GMMPrior(3, 2, nb_components=4)
+    prior.update(data)
+
+    dyn = LearnedLinearGaussianDynamics(3, 2, 5)
+    dyn.learn_with_prior(data, prior)
+
+    for t in range(5):
+        assert np.allclose(dyn.A[..., t], A, atol=1e-2)
+        assert np.allclose(dyn.B[..., t], B, atol=1e-2)
+        assert np.allclose(dyn.c[..., t], c, atol=1e-2)
+        assert np.all(np.linalg.eigvalsh(dyn.sigma[..., t]) > 0.)
+
+
+class _rARHMM:
+    # records the calls of the non-pointwise fit, sds is not needed
+    instances = []
+
+    def __init__(self, nb_states, dim_obs, dim_act):
+        _random = np.random.RandomState(1337)
+        self.observations = types.SimpleNamespace(A=_random.randn(nb_states, dim_obs, dim_obs),
+                                                  B=_random.randn(nb_states, dim_obs, dim_act),
+                                                  c=_random.randn(nb_states, dim_obs))
+        self.nb_states = nb_states
+        self.nb_init, self.em_iter, self.nb_viterbi = 0, [], 0
+        self.instances.append(self)
+
+    def initialize(self, obs, act):
+        self.nb_init += 1
+
+    def em(self, obs, act, nb_iter, prec, verbose):
+        self.em_iter.append(nb_iter)
+
+    def viterbi(self, obs, act):
+        self.nb_viterbi += 1
+        return None, [np.arange(obs[0].shape[0]) % self.nb_states]
+
+
+def test_rarhmm_warm_start(monkeypatch):
+    _module = types.ModuleType('sds.rarhmm_ls')
+    _module.rARHMM = _rARHMM
+    monkeypatch.setitem(sys.modules, 'sds', types.ModuleType('sds'))
+    monkeypatch.setitem(sys.modules, 'sds.rarhmm_ls', _module)
+    monkeypatch.setattr(_rARHMM, 'instances', [])
+
+    data, _, _, _ = _data(3, 2, 5, 10, noise=1e-1)
+
+    dyn = LearnedLinearGaussianDynamics(3, 2, 5, nb_states=2, nb_em_iter=50, nb_warm_iter=10)
+    dyn.learn(data)
+
+    rarhmm = dyn.rarhmm
+    assert rarhmm.nb_init == 1 and rarhmm.em_iter == [50]
+    assert rarhmm.nb_viterbi == 1
+
+    _z = np.arange(5) % 2
+    assert np.allclose(dyn.A, np.transpose(rarhmm.observations.A[_z], (1, 2, 0)))
+    assert np.allclose(dyn.c, rarhmm.observations.c[_z].T)
+
+    # same data and parameters, warm em and no decoding
+    dyn.learn(data)
+    assert rarhmm.nb_init == 1 and rarhmm.em_iter == [50, 10]
+    assert rarhmm.nb_viterbi == 1
+
+    # moved mean trajectory
+    _shifted = dict(data, x=data['x'] + 1.)
+    dyn.learn(_shifted)
+    assert rarhmm.nb_viterbi == 2
+
+    # moved parameters
+    rarhmm.observations.B = rarhmm.observations.B + 1.
+    dyn.learn(_shifted)
+    assert rarhmm.nb_viterbi == 3
+    assert rarhmm.em_iter == [50, 10, 10, 10]
+
+    # the model is built only once
+    assert len(_rARHMM.instances) == 1 and dyn.rarhmm is rarhmm
@@ -0,0 +1,75 @@
+import numpy as np
+
+from trajopt.riccati.core import backward_pass, infinite_horizon
+
+
+def _problem(nb_xdim, nb_udim, nb_steps, time_invariant, seed=1337):
+    random = np.random.RandomState(seed)
+    _nb = 1 if time_invariant else nb_steps + 1
+
+    _M = random.randn(_nb, nb_xdim + nb_udim, nb_xdim + nb_udim)
+    _H = _M @ np.swapaxes(_M, 1, 2) + np.eye(nb_xdim + nb_udim)
+    _H = np.broadcast_to(_H, (nb_steps + 1, ) + _H.shape[1:])
+
+    Cxx = np.asfortranarray(np.transpose(_H[:, :nb_xdim, :nb_xdim], (1, 2, 0)))
+    Cuu = np.asfortranarray(np.transpose(_H[:, nb_xdim:, nb_xdim:], (1, 2, 0)))
+    Cxu = np.asfortranarray(np.transpose(_H[:, :nb_xdim, nb_xdim:], (1, 2, 0)))
+
+    _tile = lambda X, nb: np.asfortranarray(np.broadcast_to(X[..., :1], X.shape[:-1] + (nb, ))
+                                            if time_invariant else X[..., :nb])
+
+    cx = _tile(random.randn(nb_xdim, nb_steps + 1), nb_steps + 1)
+    cu = _tile(random.randn(nb_udim, nb_steps + 1), nb_steps + 1)
+
+    A = _tile(0.5 * np.eye(nb_xdim)[..., None] + 0.3 * random.randn(nb_xdim, nb_xdim, nb_steps), nb_steps)
+    B = _tile(random.randn(nb_xdim, nb_udim, nb_steps), nb_steps)
+    c = _tile(0.1 * random.randn(nb_xdim, nb_steps), nb_steps)
+
+    return Cxx, cx, Cuu, cu, Cxu, A, B, c
+
+
+def test_backward_pass():
+    nb_xdim, nb_udim, nb_steps = 3, 2, 20
+    Cxx, cx, Cuu, cu, Cxu, A, B, c = _problem(nb_xdim, nb_udim, nb_steps, False)
+
+    V, v, K, kff, diverge, nb_sweep = backward_pass(Cxx, cx, Cuu, cu, Cxu, A, B, c,
+                                                    nb_xdim, nb_udim, nb_steps, 1e-10, 100)
+    assert diverge == 0 and nb_sweep == nb_steps
+
+    _V, _v = Cxx[..., -1], cx[..., -1]
+    for t in range(nb_steps - 1, -1, -1):
+        Qxx = Cxx[..., t] + A[..., t].T @ _V @ A[..., t]
+        Quu = Cuu[..., t] + B[..., t].T @ _V @ B[..., t]
+        Qux = Cxu[..., t].T + B[..., t].T @ _V @ A[..., t]
+        qx = cx[..., t] + A[..., t].T @ (_V @ c[..., t] + _v)
+        qu = cu[..., t] + B[..., t].T @ (_V @ c[..., t] + _v)
+
+        _K, _kff = - np.linalg.solve(Quu, Qux), - np.linalg.solve(Quu, qu)
+        assert np.allclose(K[..., t], _K) and np.allclose(kff[..., t], _kff)
+
+        _V, _v = Qxx + Qux.T @ _K, qx + Qux.T @ _kff
+        assert np.allclose(V[..., t], _V) and np.allclose(v[..., t], _v)
+
+
+def test_time_invariant_early_stop():
+    nb_xdim, nb_udim, nb_steps = 3, 2, 200
+    args = _problem(nb_xdim, nb_udim, nb_steps, True)
+
+    V, v, K, kff, _, nb_full = backward_pass(*args, nb_xdim, nb_udim, nb_steps, 0., 100)
+    _V, _v, _K, _kff, _, nb_sweep = backward_pass(*args, nb_xdim, nb_udim, nb_steps, 1e-10, 100)
+
+    assert nb_full == nb_steps and nb_sweep < nb_steps
+    assert np.allclose(K, _K, atol=1e-8) and np.allclose(kff, _kff, atol=1e-8)
+    assert np.allclose(V, _V, rtol=1e-8) and np.allclose(v, _v, rtol=1e-8)
+
+    # the infinite-horizon solution is the limit of the sweep
+    Cxx, cx, Cuu, cu, Cxu, A, B, c = [np.asfortranarray(_a[..., 0]) for _a in args]
+    Vs, vs, Ks, kffs, converged, _ = infinite_horizon(Cxx, cx, Cuu, cu, Cxu, A, B, c, 1e-12, 100)
+
+    assert converged
+    assert np.allclose(Vs, V[..., 0]) and np.allclose(vs, v[..., 0])
+    assert np.allclose(Ks, K[..., 0]) and np.allclose(kffs, kff[..., 0])
+
+    # fixed point of the riccati recursion
+    Quu, Qux = Cuu + B.T @ Vs @ B, Cxu.T + B.T @ Vs @ A
+    assert np.allclose(Vs, Cxx + A.T @ Vs @ A - Qux.T @ np.linalg.solve(Quu, Qux))
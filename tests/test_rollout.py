@@ -0,0 +1,33 @@
+import numpy as np
+
+import gym
+import trajopt  # noqa: registers the environments
+
+from trajopt.rollout import Rollout
+
+
+def test_rollout():
+    env = gym.make('Pendulum-TO-v0').unwrapped
+    random = np.random.RandomState(1337)
+
+    nb_xdim, nb_udim, nb_steps = 2, 1, 20
+    rollout = Rollout(env.dynamics, env.cost, nb_xdim, nb_udim, nb_steps)
+
+    K = 0.1 * random.randn(nb_udim, nb_xdim, nb_steps)
+    k = random.randn(nb_udim, nb_steps)
+    xref = random.randn(nb_xdim, nb_steps + 1)
+    a = np.ones((nb_steps + 1, ), dtype=np.int64)
+    x0 = env.init()[0]
+
+    state, action, cost = rollout(x0, K, k, a, xref)
+
+    # step by step, cost evaluated along the way
+    x = x0
+    for t in range(nb_steps):
+        u = k[:, t] + K[..., t] @ (x - xref[:, t])
+        assert np.allclose(state[:, t], x) and np.allclose(action[:, t], u)
+        assert np.allclose(cost[t], env.cost(x, u, a[t], x))
+        x = env.dynamics(x, u)
+
+    assert np.allclose(state[:, -1], x)
+    assert np.allclose(cost[-1], env.cost(x, np.zeros((nb_udim, )), a[-1], x))
@@ -0,0 +1,75 @@
+import numpy as np
+
+import gym
+import trajopt  # noqa: registers the environments
+
+from trajopt.gps import MBGPS
+
+
+def _alg(sampler, sigma, sigma_0, nb_steps=10):
+    env = gym.make('Pendulum-TO-v0').unwrapped
+    env._sigma, env._sigma_0 = sigma, sigma_0
+    env.seed(1337)
+    np.random.seed(1337)
+
+    alg = MBGPS(env, nb_steps=nb_steps, kl_bound=1., init_ctl_sigma=1., sampler=sampler)
+    alg.ctl.K[...] = 0.5 * np.random.randn(*alg.ctl.K.shape)
+    return alg
+
+
+def test_samplers():
+    # near deterministic, all samplers follow the mean trajectory
+    _sigma = 1.e-16 * np.eye(2)
+
+    data = _alg('serial', _sigma, _sigma).sample(4, stoch=False)
+    for sampler in ['vectorized', 'pool']:
+        _data = _alg(sampler, _sigma, _sigma).sample(4, stoch=False)
+        for key in ['x', 'u', 'xn', 'c']:
+            assert _data[key].shape == data[key].shape
+            assert np.allclose(_data[key], data[key], atol=1.e-6), (sampler, key)
+
+
+def test_sampler_noise():
+    _sigma = np.array([[1.e-2, 5.e-3], [5.e-3, 4.e-2]])
+    _sigma_0 = np.diag([4.e-2, 1.e-2])
+
+    for sampler in ['vectorized', 'pool']:
+        alg = _alg(sampler, _sigma, _sigma_0, nb_steps=5)
+        data = alg.sample(400, stoch=True)
+
+        # initial states and one step residuals of the dynamics
+        _x0 = data['x'][:, 0, :].T
+        assert np.allclose(np.cov(_x0.T), _sigma_0, rtol=0.2, atol=2.e-3), sampler
+
+        _x = np.reshape(np.transpose(data['x'], (2, 1, 0)), (-1, 2))
+        _u = np.reshape(np.transpose(data['u'], (2, 1, 0)), (-1, 1))
+        _xn = np.reshape(np.transpose(data['xn'], (2, 1, 0)), (-1, 2))
+
+        _res = _xn - alg.env.unwrapped.dynamics_batch(_x, np.clip(_u, - alg.ulim, alg.ulim))
+        assert np.allclose(np.mean(_res, axis=0), 0., atol=1.e-2), sampler
+        assert np.allclose(np.cov(_res.T), _sigma, rtol=0.15, atol=2.e-3), sampler
+
+
+def test_sampler_fallback():
+    import pytest
+
+    from trajopt.envs import Pendulum
+
+    class _Pendulum(Pendulum):
+        # e.g. a simulator or hardware behind step
+        gaussian_step = False
+
+    def _sample(sampler):
+        env = _Pendulum()
+        env.seed(1337)
+        np.random.seed(1337)
+        alg = MBGPS(env, nb_steps=10, kl_bound=1., init_ctl_sigma=1., sampler=sampler)
+        return alg, alg.sample(4)
+
+    with pytest.warns(UserWarning, match='gaussian_step'):
+        alg, data = _sample('vectorized')
+    assert alg.sampler == 'serial'
+
+    _, _data = _sample('serial')
+    for key in ['x', 'u', 'xn', 'c']:
+        assert np.array_equal(_data[key], data[key]), key
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: autodiff.py
+# @Date: 2019-07-09-09-30
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import numpy as onp
+
+import autograd.numpy as np
+from autograd import jacobian, make_vjp, value_and_grad
+from autograd.misc import flatten
+
+
+def value_grad_hessian(fun):
+    """
+    Value, gradient and hessian of a scalar function w.r.t. its
+    first (vector) argument, all extracted from a single trace
+    :param fun: fun(z, *args) -> scalar
+    :return: function(z, *args) -> (value, gradient, hessian)
+    """
+    def _grad_value(z, *args):
+        _value, _grad = value_and_grad(fun)(z, *args)
+        return np.hstack((_grad, _value))
+
+    _vjp = make_vjp(_grad_value)
+
+    def _value_grad_hessian(z, *args):
+        vjp, ans = _vjp(z, *args)
+
+        _nb_dim = z.shape[0]
+        _basis = np.eye(_nb_dim, _nb_dim + 1)
+        _hess = np.stack([vjp(_e) for _e in _basis])
+        return ans[-1], ans[:-1], _hess
+
+    return _value_grad_hessian
+
+
+def _scalar(arg):
+    # static arguments have to be hashable
+    if isinstance(arg, (onp.ndarray, onp.generic)):
+        return arg.item()
+    return arg
+
+
+class AutogradBackend:
+    """
+    Default backend, functions are traced by autograd at
+    every call and batched functions loop over the rows
+    """
+
+    name = 'autograd'
+
+    def __init__(self):
+        self.numpy = np
+        self.flatten = flatten
+
+    def jit(self, fun, static_argnums=()):
+        return fun
+
+    def jacobian(self, fun, argnum=0):
+        return jacobian(fun, argnum)
+
+    def value_grad_hessian(self, fun, static_argnums=()):
+        return value_grad_hessian(fun)
+
+    def batch(self, fun, static_argnums=()):
+        """
+        Evaluate a function on every row of a batch
+        :param fun: fun(z, *args) -> array or tuple of arrays, evaluated on a single row
+        :return: function(Z, *args) -> (nb_rows, ...), args are batched along the first axis
+        """
+        def _batch(Z, *args):
+            _res = [fun(Z[t], *[_arg[t] for _arg in args])
+                    for t in range(Z.shape[0])]
+            if isinstance(_res[0], tuple):
+                return tuple(np.stack(_r) for _r in zip(*_res))
+            return np.stack(_res)
+
+        return _batch
+
+    def batch_jacobian(self, fun, fun_batch=None, static_argnums=()):
+        """
+        Jacobians w.r.t. the first argument for every row of a batch
+        :param fun: fun(z, *args) -> array, evaluated on a single row
+        :param fun_batch: optional fun_batch(Z) -> (nb_rows, nb_out), evaluated on all rows
+        :return: function(Z, *args) -> (nb_rows, ...), args are batched along the first axis
+        """
+        if fun_batch is not None:
+            # rows do not interact, so the jacobian of the sum over
+            # all rows holds the jacobians of every row at once
+            _jac = jacobian(lambda Z: np.sum(fun_batch(Z), axis=0))
+            return lambda Z: np.transpose(_jac(Z), (1, 0, 2))
+
+        _jac = jacobian(fun)
+
+        def _batch_jacobian(Z, *args):
+            return np.stack([_jac(Z[t], *[_arg[t] for _arg in args])
+                             for t in range(Z.shape[0])])
+
+        return _batch_jacobian
+
+    def batch_value_grad_hessian(self, fun, static_argnums=()):
+        """
+        Value, gradient and hessian for every row of a batch
+        :param fun: fun(z, *args) -> scalar, evaluated on a single row
+        :return: function(Z, *args) -> (nb_rows, ), (nb_rows, d), (nb_rows, d, d)
+        """
+        _vgh = value_grad_hessian(fun)
+
+        def _batch_value_grad_hessian(Z, *args):
+            _v, _g, _H = zip(*[_vgh(Z[t], *[_arg[t] for _arg in args])
+                               for t in range(Z.shape[0])])
+            return np.stack(_v), np.stack(_g), np.stack(_H)
+
+        return _batch_value_grad_hessian
+
+    def scan(self, fun):
+        """
+        Loop of a step function over the leading axis of its inputs
+        :param fun: fun(carry, x) -> (carry, y), x and y are tuples of arrays
+        :return: function(carry, xs) -> (carry, ys), ys are stacked along the first axis
+        """
+        def _scan(carry, xs):
+            _ys = []
+            for t in range(xs[0].shape[0]):
+                carry, _y = fun(carry, tuple(_x[t] for _x in xs))
+                _ys.append(_y)
+            return carry, tuple(np.stack(_y) for _y in zip(*_ys))
+
+        return _scan
+
+
+class JaxBackend:
+    """
+    Optional backend, functions and derivatives are compiled once with
+    jax.jit and batches are vectorized with jax.vmap. All functions have
+    to be traceable by jax, i.e. written with jax.numpy. Arguments listed
+    in static_argnums are treated as compile-time constants, batches
+    are split into groups sharing the same static values
+    """
+
+    name = 'jax'
+
+    def __init__(self):
+        import jax
+        import jax.numpy as jnp
+        from jax.flatten_util import ravel_pytree
+
+        # double precision as with autograd and the c++ cores
+        jax.config.update('jax_enable_x64', True)
+
+        self.jax = jax
+        self.numpy = jnp
+        self.flatten = ravel_pytree
+
+    def jit(self, fun, static_argnums=()):
+        _fun = self.jax.jit(fun, static_argnums=static_argnums)
+
+        def _jit(*args):
+            _args = [_scalar(_arg) if i in static_argnums else _arg
+                     for i, _arg in enumerate(args)]
+            return _fun(*_args)
+
+        return _jit
+
+    def jacobian(self, fun, argnum=0):
+        return self.jit(self.jax.jacfwd(fun, argnums=argnum))
+
+    def _value_grad_hessian(self, fun):
+        def _vgh(z, *args):
+            return fun(z, *args),\
+                   self.jax.grad(fun)(z, *args),\
+                   self.jax.hessian(fun)(z, *args)
+        return _vgh
+
+    def value_grad_hessian(self, fun, static_argnums=()):
+        return self.jit(self._value_grad_hessian(fun), static_argnums)
+
+    def _batch(self, fun, static_argnums):
+        # vectorize over all non-static arguments
+        _in_axes = lambda args: tuple(None if i + 1 in static_argnums else 0
+                                      for i in range(len(args)))
+
+        def _vmapped(Z, *args):
+            return self.jax.vmap(fun, in_axes=(0, ) + _in_axes(args))(Z, *args)
+
+        _fun = self.jax.jit(_vmapped, static_argnums=static_argnums)
+
+        def _grouped(Z, *args):
+            if not static_argnums:
+                return self.jax.tree_util.tree_map(onp.asarray, _fun(Z, *args))
+
+            _keys = list(zip(*[[_scalar(_a) for _a in args[i - 1]] for i in static_argnums]))
+
+            _out = None
+            for _key in sorted(set(_keys)):
+                _idx = onp.array([t for t, _k in enumerate(_keys) if _k == _key])
+                _args = [_key[static_argnums.index(i + 1)] if i + 1 in static_argnums else _arg[_idx]
+                         for i, _arg in enumerate(args)]
+
+                _res = self.jax.tree_util.tree_leaves(_fun(Z[_idx], *_args))
+                if _out is None:
+                    _out = [onp.zeros((Z.shape[0], ) + _r.shape[1:]) for _r in _res]
+                for _o, _r in zip(_out, _res):
+                    _o[_idx] = _r
+
+            return tuple(_out) if len(_out) > 1 else _out[0]
+
+        return _grouped
+
+    def batch(self, fun, static_argnums=()):
+        return self._batch(fun, static_argnums)
+
+    def batch_jacobian(self, fun, fun_batch=None, static_argnums=()):
+        # vmap takes care of the batch, fun_batch is not needed
+        return self._batch(self.jax.jacfwd(fun), static_argnums)
+
+    def batch_value_grad_hessian(self, fun, static_argnums=()):
+        return self._batch(self._value_grad_hessian(fun), static_argnums)
+
+    def scan(self, fun):
+        # the whole loop is compiled into a single lax.scan
+        _fun = self.jax.jit(lambda carry, xs: self.jax.lax.scan(fun, carry, xs))
+
+        def _scan(carry, xs):
+            return self.jax.tree_util.tree_map(onp.asarray, _fun(carry, xs))
+
+        return _scan
+
+
+_backends = {'autograd': AutogradBackend,
+             'jax': JaxBackend}
+
+
+def get_backend(backend='autograd'):
+    """
+    :param backend: name of the backend or a backend instance
+    :return: backend instance
+    """
+    if isinstance(backend, str):
+        if backend not in _backends:
+            raise ValueError("Unknown backend '{}', choose from {}".format(backend, list(_backends)))
+        return _backends[backend]()
+    return backend
+
+
+_tracing = {}
+
+
+def backend_of(*args):
+    """
+    Backend tracing the given arguments, the jax backend for jax
+    arrays and tracers and the autograd backend otherwise. Models
+    of the environments take their numpy module and jacobians from
+    here, so the same model can be traced by either backend
+    :param args: arrays passed to a model
+    :return: backend instance
+    """
+    _name = 'autograd'
+    if any(type(_arg).__module__.startswith('jax') for _arg in args):
+        _name = 'jax'
+
+    if _name not in _tracing:
+        _tracing[_name] = _backends[_name]()
+    return _tracing[_name]
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: bench.py
+# @Date: 2019-07-14-11-20
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+"""
+Benchmark of all solvers on all registered environments.
+
+    python -m trajopt.bench --nb-steps 100 --nb-iter 5 --output bench.json
+
+Every run reports the wall time of setup and run and, within run,
+the time spent in the linearize, quadratize, backward and forward
+phases of the solver. Phase times are exclusive, time spent in a
+nested phase, e.g. a backward pass inside the GPS dual, is only
+counted once. The remainder of run is reported as other. Runs
+with a non-finite cost are reported as diverged.
+
+MFGPS fits its dynamics pointwise, the rARHMM of the default
+needs the optional sds package.
+"""
+
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import traceback
+
+import numpy
+import autograd.numpy as np
+
+import gym
+
+import trajopt  # noqa: registers the environments
+
+
+ENVS = ['LQR-TO-v0', 'Pendulum-TO-v0', 'Cartpole-TO-v0',
+        'DoubleCartpole-TO-v0', 'LightDark-TO-v0', 'Car-TO-v0',
+        'Quanser-Qube-TO-v0']
+
+# solver methods timed as each phase
+PHASES = {'linearize': ['dyn.taylor_expansion', 'idyn.taylor_expansion', 'dyn.learn', 'dyn.update'],
+          'quadratize': ['cost.taylor_expansion', 'augment_cost'],
+          'backward': ['backward_pass', 'backward_lqr'],
+          'forward': ['forward_pass', 'forward_pass_batch', 'forward_lqr', 'extended_kalman'],
+          'sample': ['sample']}
+
+
+def _belief_space(env):
+    return hasattr(env, 'observe')
+
+
+def _steppable(env):
+    # model-free solvers sample from the env, envs that only
+    # provide a model for trajectory optimization cannot be reset
+    try:
+        env.reset()
+    except NotImplementedError:
+        return False
+    return True
+
+
+def _make_ilqr(env, args):
+    from trajopt.ilqr import iLQR
+    return iLQR(env, nb_steps=args.nb_steps)
+
+
+def _make_elqr(env, args):
+    from trajopt.elqr import eLQR
+    return eLQR(env, nb_steps=args.nb_steps)
+
+
+def _make_riccati(env, args):
+    from trajopt.riccati import Riccati
+    return Riccati(env, nb_steps=args.nb_steps)
+
+
+def _make_mbgps(env, args):
+    from trajopt.gps import MBGPS
+    return MBGPS(env, nb_steps=args.nb_steps, kl_bound=args.kl_bound, init_ctl_sigma=1.)
+
+
+def _make_mfgps(env, args):
+    from trajopt.gps import MFGPS
+    return MFGPS(env, nb_steps=args.nb_steps, kl_bound=args.kl_bound, init_ctl_sigma=1.,
+                 dynamics='pointwise')
+
+
+def _make_bspilqr(env, args):
+    from trajopt.bspilqr import BSPiLQR
+    return BSPiLQR(env, nb_steps=args.nb_steps)
+
+
+# factory, run and requirements on the env of every solver
+SOLVERS = {'iLQR': (_make_ilqr, lambda alg, args: alg.run(nb_iter=args.nb_iter),
+                    lambda env: not _belief_space(env)),
+           'eLQR': (_make_elqr, lambda alg, args: alg.run(nb_iter=args.nb_iter),
+                    lambda env: not _belief_space(env) and hasattr(env, 'inverse_dynamics')),
+           'Riccati': (_make_riccati, lambda alg, args: [alg.run()],
+                       lambda env: not _belief_space(env)),
+           'MBGPS': (_make_mbgps, lambda alg, args: alg.run(nb_iter=args.nb_iter),
+                     lambda env: not _belief_space(env)),
+           'MFGPS': (_make_mfgps, lambda alg, args: alg.run(nb_episodes=args.nb_episodes, nb_iter=args.nb_iter),
+                     lambda env: not _belief_space(env) and _steppable(env)),
+           'BSPiLQR': (_make_bspilqr, lambda alg, args: alg.run(nb_iter=args.nb_iter),
+                       _belief_space)}
+
+
+class PhaseTimer:
+    """
+    Times methods of a solver instance by shadowing them with
+    timed wrappers. Nested calls are charged to the innermost phase
+    """
+
+    def __init__(self):
+        self.times, self.calls = {}, {}
+        self._stack = []
+
+    def wrap(self, obj, path, phase):
+        *_parents, _name = path.split('.')
+        for _parent in _parents:
+            obj = getattr(obj, _parent, None)
+
+        _method = getattr(obj, _name, None)
+        if not callable(_method):
+            return
+
+        self.times.setdefault(phase, 0.)
+        self.calls.setdefault(phase, 0)
+
+        def _timed(*args, **kwargs):
+            # time of nested phases is subtracted from the caller
+            self._stack.append(0.)
+            _start = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                _elapsed = time.perf_counter() - _start
+                _nested = self._stack.pop()
+                self.times[phase] += _elapsed - _nested
+                self.calls[phase] += 1
+                if self._stack:
+                    self._stack[-1] += _elapsed
+
+        setattr(obj, _name, _timed)
+
+    def report(self, total):
+        _phases = {_phase: {'time': self.times[_phase], 'calls': self.calls[_phase]}
+                   for _phase in self.times}
+        _phases['other'] = {'time': total - sum(self.times.values()), 'calls': 1}
+        return _phases
+
+
+def benchmark(solver, env_id, args):
+    _make, _run, _accepts = SOLVERS[solver]
+    _result = {'solver': solver, 'env': env_id, 'nb_steps': args.nb_steps,
+               'nb_iter': args.nb_iter, 'seed': args.seed}
+
+    try:
+        # the horizon is set by nb_steps, step the raw env
+        env = gym.make(env_id).unwrapped
+        env.seed(args.seed)
+        if not _accepts(env):
+            _result['status'] = 'skipped'
+            return _result
+
+        np.random.seed(args.seed)
+
+        _start = time.perf_counter()
+        alg = _make(env, args)
+        _result['setup'] = time.perf_counter() - _start
+
+        timer = PhaseTimer()
+        for _phase, _paths in PHASES.items():
+            for _path in _paths:
+                timer.wrap(alg, _path, _phase)
+
+        _start = time.perf_counter()
+        _trace = _run(alg, args)
+        _total = time.perf_counter() - _start
+
+        # nan and inf are not valid json, non-finite costs are null
+        _trace = numpy.ravel(_trace).astype(float)
+        _finite = numpy.isfinite(_trace)
+
+        _result.update({'status': 'ok' if numpy.all(_finite) else 'diverged',
+                        'run': _total, 'phases': timer.report(_total),
+                        'trace': [float(_cost) if _ok else None
+                                  for _cost, _ok in zip(_trace, _finite)]})
+    except Exception as e:
+        _result.update({'status': 'error', 'error': '{}: {}'.format(type(e).__name__, e),
+                        'traceback': traceback.format_exc()})
+
+    return _result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m trajopt.bench',
+                                     description='Benchmark trajopt solvers per phase.')
+    parser.add_argument('--solvers', nargs='+', default=list(SOLVERS), choices=list(SOLVERS))
+    parser.add_argument('--envs', nargs='+', default=ENVS)
+    parser.add_argument('--nb-steps', type=int, default=100)
+    parser.add_argument('--nb-iter', type=int, default=5)
+    parser.add_argument('--nb-episodes', type=int, default=10)
+    parser.add_argument('--kl-bound', type=float, default=1.)
+    parser.add_argument('--seed', type=int, default=1337)
+    parser.add_argument('--output', default='-', help="json file, '-' for stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    results = []
+    for env_id in args.envs:
+        for solver in args.solvers:
+            _result = benchmark(solver, env_id, args)
+            results.append(_result)
+
+            _status = _result['status']
+            if _status == 'ok':
+                _status = '{:.3f}s'.format(_result['run'])
+            elif _status == 'diverged':
+                _status = '{:.3f}s, diverged'.format(_result['run'])
+            print('{:<8} {:<24} {}'.format(solver, env_id, _status), file=sys.stderr)
+
+    report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'host': socket.gethostname(),
+                       'platform': platform.platform(),
+                       'python': platform.python_version(),
+                       'numpy': numpy.__version__,
+                       'args': vars(args)},
+              'results': results}
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,10 @@ from trajopt.bspilqr.objects import LinearControl
 
 from trajopt.bspilqr.core import backward_pass
 
+from trajopt.autodiff import get_backend
+from trajopt.parallel import WorkerPool
+from trajopt.profiling import NullProfiler
+
 
 class BSPiLQR:
 
@@ -22,10 +26,21 @@ class BSPiLQR:
                  lmbda=1., dlmbda=1.,
                  min_lmbda=1.e-6, max_lmbda=1.e6, mult_lmbda=1.6,
                  tolfun=1.e-8, tolgrad=1.e-6, min_imp=0., reg=1,
-                 activation=range(-1, 0)):
+                 activation=range(-1, 0),
+                 backend='autograd',
+                 linesearch='serial',
+                 covariance='full',
+                 derivatives='analytic',
+                 profiler=None):
 
         self.env = env
 
+        # phase timings and event counts, nothing recorded by default
+        self.profiler = profiler if profiler is not None else NullProfiler()
+
+        # autodiff backend, autograd or jax
+        self.backend = get_backend(backend)
+
         self.env_dyn = self.env.unwrapped.dynamics
         self.env_obs = self.env.unwrapped.observe
 
@@ -50,6 +65,19 @@ class BSPiLQR:
         self.max_lmbda = max_lmbda
         self.mult_lmbda = mult_lmbda
 
+        # line search over alphas, serial, vectorized or pool
+        self.linesearch = linesearch
+        if self.linesearch not in ('serial', 'vectorized', 'pool'):
+            raise ValueError("Unknown line search '{}', choose from "
+                             "['serial', 'vectorized', 'pool']".format(self.linesearch))
+        self.pool = None
+
+        # belief covariances in vec or symmetric vech coordinates
+        self.covariance = covariance
+        if self.covariance not in ('full', 'vech'):
+            raise ValueError("Unknown covariance '{}', choose from "
+                             "['full', 'vech']".format(self.covariance))
+
         # regularization type
         self.reg = reg
 
@@ -70,7 +98,9 @@ class BSPiLQR:
 
         self.dyn = AnalyticalLinearBeliefDynamics(self.env_init, self.env_dyn, self.env_obs,
                                                   self.env_dyn_noise, self.env_obs_noise,
-                                                  self.nb_bdim, self.nb_zdim, self.nb_udim, self.nb_steps)
+                                                  self.nb_bdim, self.nb_zdim, self.nb_udim, self.nb_steps,
+                                                  vech=self.covariance == 'vech', derivatives=derivatives,
+                                                  backend=self.backend)
 
         self.ctl = LinearControl(self.nb_bdim, self.nb_udim, self.nb_steps)
         self.ctl.kff = 1e-2 * np.random.randn(self.nb_udim, self.nb_steps)
@@ -80,7 +110,8 @@ class BSPiLQR:
         self.activation[-1] = 1.  # last step always in
         self.activation[activation] = 1.
 
-        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_bdim, self.nb_udim, self.nb_steps + 1)
+        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_bdim, self.nb_udim, self.nb_steps + 1,
+                                            vech=self.covariance == 'vech', backend=self.backend)
 
         self.last_return = - np.inf
 
@@ -99,6 +130,50 @@ class BSPiLQR:
                                         np.zeros((self.nb_udim, )), self.activation[-1])
         return belief, action, cost
 
+    def forward_pass_batch(self, ctl, alphas):
+        alphas = np.asarray(alphas)
+        _nb_alphas = len(alphas)
+
+        mu = np.zeros((_nb_alphas, self.nb_bdim, self.nb_steps + 1))
+        sigma = np.zeros((_nb_alphas, self.nb_bdim, self.nb_bdim, self.nb_steps + 1))
+        action = np.zeros((_nb_alphas, self.nb_udim, self.nb_steps))
+        cost = np.zeros((_nb_alphas, self.nb_steps + 1))
+
+        mu[..., 0], sigma[..., 0] = self.dyn.evali()
+        for t in range(self.nb_steps):
+            action[..., t] = ctl.action_batch(mu[..., t], alphas, self.bref.mu, self.uref, t)
+            cost[..., t] = self.cost.evalfb(mu[..., t], sigma[..., t], action[..., t], self.activation[t])
+            mu[..., t + 1], sigma[..., t + 1] = self.dyn.forward_batch(mu[..., t], sigma[..., t], action[..., t])
+
+        cost[..., -1] = self.cost.evalfb(mu[..., -1], sigma[..., -1],
+                                         np.zeros((_nb_alphas, self.nb_udim)), self.activation[-1])
+
+        _rollouts = []
+        for k in range(_nb_alphas):
+            belief = Gaussian(self.nb_bdim, self.nb_steps + 1)
+            belief.mu[...], belief.sigma[...] = mu[k], sigma[k]
+            _rollouts.append((belief, action[k], cost[k]))
+
+        return _rollouts
+
+    def line_search(self, ctl):
+        # rollouts for all step sizes, the serial search stays lazy
+        if self.linesearch == 'vectorized':
+            with self.profiler.phase('forward_pass', nb_alphas=len(self.alphas)):
+                return self.forward_pass_batch(ctl, self.alphas)
+        elif self.linesearch == 'pool':
+            with self.profiler.phase('forward_pass', nb_alphas=len(self.alphas)):
+                return self.pool.starmap('forward_pass', [(ctl, alpha) for alpha in self.alphas],
+                                         bref=self.bref, uref=self.uref)
+        else:
+            return self.serial_search(ctl)
+
+    def serial_search(self, ctl):
+        for alpha in self.alphas:
+            with self.profiler.phase('forward_pass', alpha=alpha):
+                _rollout = self.forward_pass(ctl, alpha)
+            yield _rollout
+
     def backward_pass(self):
         lc = LinearControl(self.nb_bdim, self.nb_udim, self.nb_steps)
         bvalue = QuadraticBeliefValue(self.nb_bdim, self.nb_steps + 1)
@@ -139,7 +214,8 @@ class BSPiLQR:
         _trace = []
         # init trajectory
         for alpha in self.alphas:
-            _belief, _action, _cost = self.forward_pass(self.ctl, alpha)
+            with self.profiler.phase('forward_pass', alpha=alpha):
+                _belief, _action, _cost = self.forward_pass(self.ctl, alpha)
             if np.all(_belief.mu < 1.e8):
                 self.bref = _belief
                 self.uref = _action
@@ -150,83 +226,101 @@ class BSPiLQR:
 
         _trace.append(self.last_return)
 
-        for _ in range(nb_iter):
-            # get linear system dynamics around ref traj.
-            self.dyn.taylor_expansion(self.bref, self.uref)
-
-            # get quadratic cost around ref traj.
-            self.cost.taylor_expansion(self.bref, self.uref, self.activation)
-
-            bvalue = None
-            lc, dvalue = None, None
-            # execute a backward pass
-            backpass_done = False
-            while not backpass_done:
-                lc, bvalue, dvalue, diverge = self.backward_pass()
-                if np.any(diverge):
-                    # increase lmbda
-                    self.dlmbda = np.maximum(self.dlmbda * self.mult_lmbda, self.mult_lmbda)
-                    self.lmbda = np.maximum(self.lmbda * self.dlmbda, self.min_lmbda)
-                    if self.lmbda > self.max_lmbda:
-                        break
+        if self.linesearch == 'pool':
+            self.pool = WorkerPool(self)
+
+        try:
+            for _ in range(nb_iter):
+                self.profiler.step()
+
+                # get linear system dynamics around ref traj.
+                with self.profiler.phase('dyn.taylor_expansion'):
+                    self.dyn.taylor_expansion(self.bref, self.uref)
+
+                # get quadratic cost around ref traj.
+                with self.profiler.phase('cost.taylor_expansion'):
+                    self.cost.taylor_expansion(self.bref, self.uref, self.activation)
+
+                bvalue = None
+                lc, dvalue = None, None
+                # execute a backward pass
+                backpass_done = False
+                while not backpass_done:
+                    with self.profiler.phase('backward_pass', lmbda=self.lmbda):
+                        lc, bvalue, dvalue, diverge = self.backward_pass()
+                    if diverge:
+                        self.profiler.count('diverged_backward_passes')
+                        # increase lmbda
+                        self.dlmbda = np.maximum(self.dlmbda * self.mult_lmbda, self.mult_lmbda)
+                        self.lmbda = np.maximum(self.lmbda * self.dlmbda, self.min_lmbda)
+                        if self.lmbda > self.max_lmbda:
+                            break
+                        else:
+                            continue
                     else:
-                        continue
-                else:
-                    backpass_done = True
+                        backpass_done = True
 
-            # terminate if gradient too small
-            _g_norm = np.mean(np.max(np.abs(lc.kff) / (np.abs(self.uref) + 1.), axis=1))
-            if _g_norm < self.tolgrad and self.lmbda < 1.e-5:
-                self.dlmbda = np.minimum(self.dlmbda / self.mult_lmbda, 1. / self.mult_lmbda)
-                self.lmbda = self.lmbda * self.dlmbda * (self.lmbda > self.min_lmbda)
-                break
+                # terminate if gradient too small
+                _g_norm = np.mean(np.max(np.abs(lc.kff) / (np.abs(self.uref) + 1.), axis=1))
+                if _g_norm < self.tolgrad and self.lmbda < 1.e-5:
+                    self.dlmbda = np.minimum(self.dlmbda / self.mult_lmbda, 1. / self.mult_lmbda)
+                    self.lmbda = self.lmbda * self.dlmbda * (self.lmbda > self.min_lmbda)
+                    break
 
-            _belief, _action = None, None
-            _return, _dreturn = None, None
-            # execute a forward pass
-            fwdpass_done = False
-            if backpass_done:
-                for alpha in self.alphas:
+                _belief, _action = None, None
+                _return, _dreturn = None, None
+                # execute a forward pass
+                fwdpass_done = False
+                if backpass_done:
                     # apply on actual system
-                    _belief, _action, _cost = self.forward_pass(ctl=lc, alpha=alpha)
+                    for alpha, (_belief, _action, _cost) in zip(self.alphas, self.line_search(lc)):
 
-                    # summed mean return
-                    _return = np.sum(_cost)
+                        # summed mean return
+                        _return = np.sum(_cost)
 
-                    # check return improvement
-                    _dreturn = self.last_return - _return
-                    _expected = - 1. * alpha * (dvalue[0] + alpha * dvalue[1])
-                    _imp = _dreturn / _expected
-                    if _imp > self.min_imp:
-                        fwdpass_done = True
-                        break
+                        # check return improvement
+                        _dreturn = self.last_return - _return
+                        _expected = - 1. * alpha * (dvalue[0] + alpha * dvalue[1])
+                        _imp = _dreturn / _expected
+                        if _imp > self.min_imp:
+                            fwdpass_done = True
+                            break
+                        else:
+                            self.profiler.count('rejected_steps')
 
-            # accept or reject
-            if fwdpass_done:
-                # decrease lmbda
-                self.dlmbda = np.minimum(self.dlmbda / self.mult_lmbda, 1. / self.mult_lmbda)
-                self.lmbda = self.lmbda * self.dlmbda * (self.lmbda > self.min_lmbda)
+                # accept or reject
+                if fwdpass_done:
+                    # decrease lmbda
+                    self.dlmbda = np.minimum(self.dlmbda / self.mult_lmbda, 1. / self.mult_lmbda)
+                    self.lmbda = self.lmbda * self.dlmbda * (self.lmbda > self.min_lmbda)
 
-                self.bref = _belief
-                self.uref = _action
-                self.last_return = _return
+                    self.bref = _belief
+                    self.uref = _action
+                    self.last_return = _return
 
-                self.vfunc = bvalue
+                    self.vfunc = bvalue
 
-                self.ctl = lc
+                    self.ctl = lc
 
-                _trace.append(self.last_return)
+                    _trace.append(self.last_return)
 
-                # terminate if reached objective tolerance
-                if _dreturn < self.tolfun:
-                    break
-            else:
-                # increase lmbda
-                self.dlmbda = np.maximum(self.dlmbda * self.mult_lmbda, self.mult_lmbda)
-                self.lmbda = np.maximum(self.lmbda * self.dlmbda, self.min_lmbda)
-                if self.lmbda > self.max_lmbda:
-                    break
+                    # terminate if reached objective tolerance
+                    if _dreturn < self.tolfun:
+                        break
                 else:
-                    continue
+                    self.profiler.count('rejected_iterations')
+
+                    # increase lmbda
+                    self.dlmbda = np.maximum(self.dlmbda * self.mult_lmbda, self.mult_lmbda)
+                    self.lmbda = np.maximum(self.lmbda * self.dlmbda, self.min_lmbda)
+                    if self.lmbda > self.max_lmbda:
+                        break
+                    else:
+                        continue
+        finally:
+            # workers are closed even if an iteration raises
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
 
         return _trace
@@ -6,8 +6,53 @@
 # @Contact: hany@robot-learning.de
 
 import autograd.numpy as np
-from autograd import jacobian, hessian
-from autograd.misc import flatten
+
+from trajopt.autodiff import get_backend
+
+
+def vech_indices(nb_dim):
+    # lower triangle by columns
+    _cols, _rows = np.triu_indices(nb_dim)
+    return _rows, _cols
+
+
+def duplication_matrix(nb_dim):
+    # vec(M) = D vech(M) of a symmetric M
+    _rows, _cols = vech_indices(nb_dim)
+
+    D = np.zeros((nb_dim * nb_dim, len(_rows)))
+    D[_rows * nb_dim + _cols, np.arange(len(_rows))] = 1.
+    D[_cols * nb_dim + _rows, np.arange(len(_rows))] = 1.
+    return D
+
+
+class Covariance:
+    """
+    Coordinates of symmetric belief covariances, all nb_dim^2 entries
+    of vec(sigma) or the nb_dim (nb_dim + 1) / 2 entries of vech(sigma).
+    Derivatives w.r.t. vech coordinates account for both halves of sigma
+    """
+
+    def __init__(self, nb_dim, vech=False):
+        self.nb_dim = nb_dim
+        self.vech = vech
+
+        self.nb_sdim = nb_dim * (nb_dim + 1) // 2 if vech else nb_dim * nb_dim
+
+        self.rows, self.cols = vech_indices(nb_dim)
+        self.D = duplication_matrix(nb_dim)
+
+    def flatten(self, sigma):
+        # sigma: (nb_dim, nb_dim, ...) -> (nb_sdim, ...)
+        if self.vech:
+            return sigma[self.rows, self.cols, ...]
+        return np.reshape(sigma, (self.nb_sdim, ) + sigma.shape[2:], order='F')
+
+    def unflatten(self, s, numpy=np):
+        # s: (nb_sdim, ) -> (nb_dim, nb_dim), traced by the numpy of a backend
+        if self.vech:
+            return numpy.reshape(numpy.dot(self.D, s), (self.nb_dim, self.nb_dim))
+        return numpy.reshape(s, (self.nb_dim, self.nb_dim))
 
 
 class Gaussian:
@@ -15,8 +60,8 @@ class Gaussian:
         self.nb_dim = nb_dim
         self.nb_steps = nb_steps
 
-        self.mu = np.zeros((self.nb_dim, self.nb_steps))
-        self.sigma = np.zeros((self.nb_dim, self.nb_dim, self.nb_steps))
+        self.mu = np.zeros((self.nb_dim, self.nb_steps), order='F')
+        self.sigma = np.zeros((self.nb_dim, self.nb_dim, self.nb_steps), order='F')
         for t in range(self.nb_steps):
             self.sigma[..., t] = np.eye(self.nb_dim)
 
@@ -34,26 +79,30 @@ class QuadraticBeliefValue:
         self.nb_bdim = nb_bdim
         self.nb_steps = nb_steps
 
-        self.S = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps))
-        self.s = np.zeros((self.nb_bdim, self.nb_steps, ))
-        self.tau = np.zeros((self.nb_bdim, self.nb_steps, ))
+        self.S = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps), order='F')
+        self.s = np.zeros((self.nb_bdim, self.nb_steps, ), order='F')
+        self.tau = np.zeros((self.nb_bdim, self.nb_steps, ), order='F')
 
 
 class QuadraticCost:
-    def __init__(self, nb_bdim, nb_udim, nb_steps):
+    def __init__(self, nb_bdim, nb_udim, nb_steps, vech=False):
         self.nb_bdim = nb_bdim
         self.nb_udim = nb_udim
 
+        # coordinates of the belief covariance
+        self.cov = Covariance(self.nb_bdim, vech)
+        self.nb_sdim = self.cov.nb_sdim
+
         self.nb_steps = nb_steps
 
-        self.Q = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps))
-        self.q = np.zeros((self.nb_bdim, self.nb_steps))
+        self.Q = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps), order='F')
+        self.q = np.zeros((self.nb_bdim, self.nb_steps), order='F')
 
-        self.R = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps))
-        self.r = np.zeros((self.nb_udim, self.nb_steps))
+        self.R = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps), order='F')
+        self.r = np.zeros((self.nb_udim, self.nb_steps), order='F')
 
-        self.P = np.zeros((self.nb_bdim, self.nb_udim, self.nb_steps))
-        self.p = np.zeros((self.nb_bdim * self.nb_bdim, self.nb_steps))
+        self.P = np.zeros((self.nb_bdim, self.nb_udim, self.nb_steps), order='F')
+        self.p = np.zeros((self.nb_sdim, self.nb_steps), order='F')
 
     @property
     def params(self):
@@ -65,71 +114,90 @@ class QuadraticCost:
 
 
 class AnalyticalQuadraticCost(QuadraticCost):
-    def __init__(self, f_cost, nb_bdim, nb_udim, nb_steps):
-        super(AnalyticalQuadraticCost, self).__init__(nb_bdim, nb_udim, nb_steps)
+    def __init__(self, f_cost, nb_bdim, nb_udim, nb_steps,
+                 vech=False, backend='autograd'):
+        super(AnalyticalQuadraticCost, self).__init__(nb_bdim, nb_udim, nb_steps, vech)
 
-        self.f = f_cost
+        self.backend = get_backend(backend)
 
-        self.fQ = hessian(self.f, 0)
-        self.fq = jacobian(self.f, 0)
+        self.f = self.backend.jit(f_cost, static_argnums=(3, ))
 
-        self.fR = hessian(self.f, 2)
-        self.fr = jacobian(self.f, 2)
+        # value, gradient and hessian w.r.t. z = [mu_b, u] of all steps
+        self.fz = self.backend.batch_value_grad_hessian(self.fmu, static_argnums=(2, ))
+        # gradient w.r.t. the coordinates of sigma_b of all steps
+        self.fp = self.backend.batch_jacobian(self.fsigma, static_argnums=(3, ))
 
-        self.fP = jacobian(jacobian(self.f, 0), 2)
-        self.fp = jacobian(self.f, 1)
+        # cost of a batch of beliefs and actions
+        self.fb = self.backend.batch(self.f, static_argnums=(3, ))
+
+    def fmu(self, z, sigma_b, a):
+        return self.f(z[:self.nb_bdim], sigma_b, z[self.nb_bdim:], a)
+
+    def fsigma(self, s, mu_b, u, a):
+        return self.f(mu_b, self.cov.unflatten(s, self.backend.numpy), u, a)
 
     def evalf(self, mu_b, sigma_b, u, a):
         return self.f(mu_b, sigma_b, u, a)
 
+    def evalfb(self, mu_b, sigma_b, u, a):
+        # mu_b: (nb_rows, nb_bdim), sigma_b: (nb_rows, nb_bdim, nb_bdim)
+        _a = np.full((mu_b.shape[0], ), a)
+        return self.fb(mu_b, sigma_b, u, _a)
+
     def taylor_expansion(self, b, u, a):
         # padd last time step of action traj.
         _u = np.hstack((u, np.zeros((self.nb_udim, 1))))
+        _sigma = np.transpose(b.sigma, (2, 0, 1))
 
-        for t in range(self.nb_steps):
-            _in = tuple([b.mu[..., t], b.sigma[..., t], _u[..., t], a[t]])
+        _z = np.vstack((b.mu, _u)).T
+        _, _g, _H = self.fz(_z, _sigma, a)
 
-            self.Q[..., t] = self.fQ(*_in)
-            self.q[..., t] = self.fq(*_in)
+        self.Q[...] = np.transpose(_H[:, :self.nb_bdim, :self.nb_bdim], (1, 2, 0))
+        self.q[...] = _g[:, :self.nb_bdim].T
 
-            self.R[..., t] = self.fR(*_in)
-            self.r[..., t] = self.fr(*_in)
+        self.R[...] = np.transpose(_H[:, self.nb_bdim:, self.nb_bdim:], (1, 2, 0))
+        self.r[...] = _g[:, self.nb_bdim:].T
 
-            self.P[..., t] = self.fP(*_in)
-            self.p[..., t] = np.reshape(self.fp(*_in),
-                                        (self.nb_bdim * self.nb_bdim), order='F')
+        self.P[...] = np.transpose(_H[:, :self.nb_bdim, self.nb_bdim:], (1, 2, 0))
+
+        _s = self.cov.flatten(b.sigma).T
+        self.p[...] = self.fp(_s, b.mu.T, _u.T, a).T
 
 
 class LinearBeliefDynamics:
-    def __init__(self, nb_bdim, nb_zdim, nb_udim, nb_steps):
+    def __init__(self, nb_bdim, nb_zdim, nb_udim, nb_steps, vech=False):
         self.nb_bdim = nb_bdim
         self.nb_zdim = nb_zdim
         self.nb_udim = nb_udim
 
+        # coordinates of the belief covariance
+        self.cov = Covariance(self.nb_bdim, vech)
+        self.nb_sdim = self.cov.nb_sdim
+
         self.nb_steps = nb_steps
 
         # Linearization of dynamics
-        self.A = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps))
-        self.H = np.zeros((self.nb_zdim, self.nb_zdim, self.nb_steps))
+        self.A = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps), order='F')
+        self.H = np.zeros((self.nb_zdim, self.nb_zdim, self.nb_steps), order='F')
 
         # EKF matrices
-        self.K = np.zeros((self.nb_bdim, self.nb_zdim, self.nb_steps))
-        self.D = np.zeros((self.nb_bdim, self.nb_zdim, self.nb_steps))
+        self.K = np.zeros((self.nb_bdim, self.nb_zdim, self.nb_steps), order='F')
+        self.D = np.zeros((self.nb_bdim, self.nb_zdim, self.nb_steps), order='F')
 
         # Linearization of belief dynamics
-        self.F = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps))
-        self.G = np.zeros((self.nb_bdim, self.nb_udim, self.nb_steps))
+        self.F = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps), order='F')
+        self.G = np.zeros((self.nb_bdim, self.nb_udim, self.nb_steps), order='F')
 
-        self.T = np.zeros((self.nb_bdim * self.nb_bdim, self.nb_bdim, self.nb_steps))
-        self.U = np.zeros((self.nb_bdim * self.nb_bdim, self.nb_bdim * self.nb_bdim, self.nb_steps))
-        self.V = np.zeros((self.nb_bdim * self.nb_bdim, self.nb_udim, self.nb_steps))
+        self.T = np.zeros((self.nb_sdim, self.nb_bdim, self.nb_steps), order='F')
+        self.U = np.zeros((self.nb_sdim, self.nb_sdim, self.nb_steps), order='F')
+        self.V = np.zeros((self.nb_sdim, self.nb_udim, self.nb_steps), order='F')
 
-        self.X = np.zeros((self.nb_bdim * self.nb_bdim, self.nb_bdim, self.nb_steps))
-        self.Y = np.zeros((self.nb_bdim * self.nb_bdim, self.nb_bdim * self.nb_bdim, self.nb_steps))
-        self.Z = np.zeros((self.nb_bdim * self.nb_bdim, self.nb_udim, self.nb_steps))
+        self.X = np.zeros((self.nb_sdim, self.nb_bdim, self.nb_steps), order='F')
+        self.Y = np.zeros((self.nb_sdim, self.nb_sdim, self.nb_steps), order='F')
+        self.Z = np.zeros((self.nb_sdim, self.nb_udim, self.nb_steps), order='F')
 
-        self.sigma_x = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps))
-        self.sigma_z = np.zeros((self.nb_zdim, self.nb_zdim, self.nb_steps))
+        self.sigma_x = np.zeros((self.nb_bdim, self.nb_bdim, self.nb_steps), order='F')
+        self.sigma_z = np.zeros((self.nb_zdim, self.nb_zdim, self.nb_steps), order='F')
 
     @property
     def params(self):
@@ -147,18 +215,53 @@ class LinearBeliefDynamics:
 class AnalyticalLinearBeliefDynamics(LinearBeliefDynamics):
     def __init__(self, f_init, f_dyn, f_obs,
                  noise_dyn, noise_obs,
-                 nb_bdim, nb_zdim, nb_udim, nb_steps):
-        super(AnalyticalLinearBeliefDynamics, self).__init__(nb_bdim, nb_zdim, nb_udim, nb_steps)
+                 nb_bdim, nb_zdim, nb_udim, nb_steps,
+                 vech=False, derivatives='analytic', backend='autograd'):
+        super(AnalyticalLinearBeliefDynamics, self).__init__(nb_bdim, nb_zdim, nb_udim, nb_steps, vech)
+
+        self.backend = get_backend(backend)
 
         self.i = f_init
-        self.f = f_dyn
-        self.h = f_obs
+        self.f = self.backend.jit(f_dyn)
+        self.h = self.backend.jit(f_obs)
 
         self.noise_dyn = noise_dyn
         self.noise_obs = noise_obs
 
-        self.dfdx = jacobian(self.f, 0)
-        self.dhdx = jacobian(self.h, 0)
+        self.dfdx = self.backend.jacobian(self.f, 0)
+        self.dhdx = self.backend.jacobian(self.h, 0)
+
+        # ekf over flat inputs z = [mu_b, s(sigma_b), u], jacobian of
+        # flat outputs [f, s(W), s(phi)] of all steps, s is vec or vech
+        _, self.unflatten = self.backend.flatten((np.zeros((self.nb_bdim, )),
+                                                  np.zeros((self.nb_sdim, )),
+                                                  np.zeros((self.nb_udim, ))))
+        self.dekf = self.backend.batch_jacobian(self.ekf_flat)
+        self.fekf = self.backend.jit(self.ekf)
+        self.fekfb = self.backend.batch(self.ekf)
+
+        # jacobian of the ekf by autodiff through the whole filter,
+        # or by the chain rule over the derivatives of the models
+        self.derivatives = derivatives
+        if self.derivatives not in ('analytic', 'autodiff'):
+            raise ValueError("Unknown derivatives '{}', choose from "
+                             "['analytic', 'autodiff']".format(self.derivatives))
+
+        # models and their derivatives w.r.t. [mu_b, u] of all steps
+        self.fAB = self.backend.batch_jacobian(self.fz)
+        self.fdA = self.backend.batch_jacobian(self.Az)
+        self.fQ = self.backend.batch(self.Qz)
+        self.fdQ = self.backend.batch_jacobian(self.Qz)
+
+        # observation models and their derivatives w.r.t. x at the next mean
+        self.fH = self.backend.batch(self.dhdx)
+        self.fdH = self.backend.batch_jacobian(self.dhdx)
+        self.fR = self.backend.batch(self.noise_obs)
+        self.fdR = self.backend.batch_jacobian(self.noise_obs)
+        self.fxn = self.backend.batch(self.fz)
+
+        # perturbations of sigma_b along its coordinates, (nb_sdim, nb_bdim, nb_bdim)
+        self.dsigma = np.stack([self.cov.unflatten(_e) for _e in np.eye(self.nb_sdim)])
 
         # # legacy
         # self.fm = lambda mu_b, sigma_b, u: self.ekf(mu_b, sigma_b, u)[0]
@@ -186,6 +289,8 @@ class AnalyticalLinearBeliefDynamics(LinearBeliefDynamics):
         return self.h(mu_b)
 
     def ekf(self, mu_b, sigma_b, u):
+        _np = self.backend.numpy
+
         # extended kalman filtering
         _A = self.dfdx(mu_b, u)
         _H = self.dhdx(self.evalf(mu_b, u))
@@ -196,7 +301,7 @@ class AnalyticalLinearBeliefDynamics(LinearBeliefDynamics):
         _D = _A @ sigma_b @ _A.T + _sigma_dyn
         _D = 0.5 * (_D + _D.T)
 
-        _K = _D @ _H.T @ np.linalg.inv(_H @ _D @ _H.T + _sigma_obs)
+        _K = _D @ _H.T @ _np.linalg.inv(_H @ _D @ _H.T + _sigma_obs)
 
         # deterministic and stochastic mean dynamics
         _f = self.evalf(mu_b, u)
@@ -208,46 +313,132 @@ class AnalyticalLinearBeliefDynamics(LinearBeliefDynamics):
 
         return _f, _W, _phi
 
+    def fz(self, z):
+        return self.f(z[:self.nb_bdim], z[self.nb_bdim:])
+
+    def Az(self, z):
+        return self.dfdx(z[:self.nb_bdim], z[self.nb_bdim:])
+
+    def Qz(self, z):
+        return self.noise_dyn(z[:self.nb_bdim], z[self.nb_bdim:])
+
+    def ekf_jacobian(self, mu_b, sigma_b, u):
+        """
+        Jacobian of the flat ekf outputs [f, s(W), s(phi)] w.r.t. the
+        flat inputs [mu_b, s(sigma_b), u] by the chain rule, every input
+        coordinate k is a direction along which D, H and the observation
+        noise move, which carry through the kalman gain to W and phi
+        :param mu_b: (nb_steps, nb_bdim)
+        :param sigma_b: (nb_steps, nb_bdim, nb_bdim)
+        :param u: (nb_steps, nb_udim)
+        :return: (nb_steps, nb_bdim + 2 * nb_sdim, nb_bdim + nb_sdim + nb_udim)
+        """
+        _nb, _ns = self.nb_bdim, self.nb_sdim
+        _z = np.hstack((mu_b, u))
+
+        _AB, _dA = self.fAB(_z), self.fdA(_z)
+        _A = _AB[..., :_nb]
+        _Q, _dQ = self.fQ(_z), self.fdQ(_z)
+
+        _xn = self.fxn(_z)
+        _H, _dHx = self.fH(_xn), self.fdH(_xn)
+        _R, _dRx = self.fR(_xn), self.fdR(_xn)
+
+        # directions of mu_b and u move the next mean by [A, B]
+        _dH = np.einsum('tabj,tjk->tabk', _dHx, _AB)
+        _dR = np.einsum('tabj,tjk->tabk', _dRx, _AB)
+
+        _dASA = np.einsum('tijk,tjl,tml->timk', _dA, sigma_b, _A)
+        _dD = _dASA + np.swapaxes(_dASA, 1, 2) + _dQ
+
+        # directions of sigma_b move D only
+        _dDs = np.einsum('tij,kjl,tml->timk', _A, self.dsigma, _A)
+
+        # all directions ordered as the inputs [mu_b, s(sigma_b), u]
+        _zeros = lambda dM: np.zeros(dM.shape[:-1] + (_ns, ))
+        _dD = np.concatenate((_dD[..., :_nb], _dDs, _dD[..., _nb:]), axis=-1)
+        _dH = np.concatenate((_dH[..., :_nb], _zeros(_dH), _dH[..., _nb:]), axis=-1)
+        _dR = np.concatenate((_dR[..., :_nb], _zeros(_dR), _dR[..., _nb:]), axis=-1)
+        _dD = 0.5 * (_dD + np.swapaxes(_dD, 1, 2))
+
+        _D = np.einsum('tij,tjl,tml->tim', _A, sigma_b, _A) + _Q
+        _D = 0.5 * (_D + np.swapaxes(_D, 1, 2))
+
+        # W = M' S^-1 M with M = H D and S = H D H' + R
+        _M = _H @ _D
+        _S = _M @ np.swapaxes(_H, 1, 2) + _R
+        _G = np.linalg.solve(_S, _M)
+
+        _dM = np.einsum('tajk,tjl->talk', _dH, _D) + np.einsum('taj,tjlk->talk', _H, _dD)
+        _dS = np.einsum('tajk,tbj->tabk', _dM, _H) + np.einsum('taj,tbjk->tabk', _M, _dH) + _dR
+
+        _dGM = np.einsum('tajk,tal->tjlk', _dM, _G)
+        _dW = _dGM + np.swapaxes(_dGM, 1, 2) - np.einsum('taj,tabk,tbl->tjlk', _G, _dS, _G)
+        _dphi = _dD - _dW
+        _dphi = 0.5 * (_dphi + np.swapaxes(_dphi, 1, 2))
+
+        # (nb_bdim, nb_bdim, nb_steps, nb_in) -> (nb_steps, nb_sdim, nb_in)
+        _flat = lambda dM: np.transpose(self.cov.flatten(np.transpose(dM, (1, 2, 0, 3))), (1, 0, 2))
+
+        _df = np.concatenate((_AB[..., :_nb], np.zeros((_z.shape[0], _nb, _ns)), _AB[..., _nb:]), axis=-1)
+        return np.concatenate((_df, _flat(_dW), _flat(_dphi)), axis=1)
+
+    def ekf_flat(self, z):
+        _mu_b, _s, _u = self.unflatten(z)
+        _f, _W, _phi = self.ekf(_mu_b, self.cov.unflatten(_s, self.backend.numpy), _u)
+        if self.cov.vech:
+            _W, _phi = _W[self.cov.rows, self.cov.cols], _phi[self.cov.rows, self.cov.cols]
+        return self.backend.flatten((_f, _W, _phi))[0]
+
     def taylor_expansion(self, b, u):
-        for t in range(self.nb_steps):
-            _in = tuple([b.mu[..., t], b.sigma[..., t], u[..., t]])
+        _s = self.cov.flatten(b.sigma[..., :self.nb_steps]).T
 
-            _in_flat, _unflatten = flatten(_in)
+        if self.derivatives == 'analytic':
+            _sigma = np.transpose(b.sigma[..., :self.nb_steps], (2, 0, 1))
+            _jac = self.ekf_jacobian(b.mu[..., :self.nb_steps].T, _sigma, u.T)
+        else:
+            _z = np.hstack((b.mu[..., :self.nb_steps].T, _s, u.T))
+            _jac = self.dekf(_z)
 
-            def _ekf_flat(_in_flat):
-                return flatten(self.ekf(*_unflatten(_in_flat)))[0]
+        _grads = np.transpose(_jac, (1, 2, 0))
 
-            _ekf_jac = jacobian(_ekf_flat)
+        _b, _s = slice(None, self.nb_bdim), slice(self.nb_bdim, self.nb_bdim + self.nb_sdim)
+        _phi, _u = slice(self.nb_bdim + self.nb_sdim, None), slice(- self.nb_udim, None)
 
-            _grads = _ekf_jac(_in_flat)
-            self.F[..., t] = _grads[:self.nb_bdim, :self.nb_bdim]
-            self.G[..., t] = _grads[:self.nb_bdim, -self.nb_udim:]
+        self.F[...] = _grads[_b, _b]
+        self.G[...] = _grads[_b, _u]
 
-            self.X[..., t] = _grads[self.nb_bdim:self.nb_bdim + self.nb_bdim * self.nb_bdim, :self.nb_bdim]
-            self.Y[..., t] = _grads[self.nb_bdim:self.nb_bdim + self.nb_bdim * self.nb_bdim, self.nb_bdim:self.nb_bdim + self.nb_bdim * self.nb_bdim]
-            self.Z[..., t] = _grads[self.nb_bdim:self.nb_bdim + self.nb_bdim * self.nb_bdim, -self.nb_udim:]
+        self.X[...] = _grads[_s, _b]
+        self.Y[...] = _grads[_s, _s]
+        self.Z[...] = _grads[_s, _u]
 
-            self.T[..., t] = _grads[self.nb_bdim + self.nb_bdim * self.nb_bdim:, :self.nb_bdim]
-            self.U[..., t] = _grads[self.nb_bdim + self.nb_bdim * self.nb_bdim:, self.nb_bdim:self.nb_bdim + self.nb_bdim * self.nb_bdim]
-            self.V[..., t] = _grads[self.nb_bdim + self.nb_bdim * self.nb_bdim:, -self.nb_udim:]
+        self.T[...] = _grads[_phi, _b]
+        self.U[...] = _grads[_phi, _s]
+        self.V[...] = _grads[_phi, _u]
 
-            # # legacy
-            # self.F[..., t] = self.fF(_mu_b, _sigma_b, _u)
-            # self.G[..., t] = self.fG(_mu_b, _sigma_b, _u)
+        # # legacy
+        # self.F[..., t] = self.fF(_mu_b, _sigma_b, _u)
+        # self.G[..., t] = self.fG(_mu_b, _sigma_b, _u)
 
-            # self.X[..., t] = np.reshape(self.fX(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_bdim), order='F')
-            # self.Y[..., t] = np.reshape(self.fY(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_bdim * self.nb_bdim), order='F')
-            # self.Z[..., t] = np.reshape(self.fZ(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_udim), order='F')
+        # self.X[..., t] = np.reshape(self.fX(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_bdim), order='F')
+        # self.Y[..., t] = np.reshape(self.fY(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_bdim * self.nb_bdim), order='F')
+        # self.Z[..., t] = np.reshape(self.fZ(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_udim), order='F')
 
-            # self.T[..., t] = np.reshape(self.fT(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_bdim), order='F')
-            # self.U[..., t] = np.reshape(self.fU(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_bdim * self.nb_bdim), order='F')
-            # self.V[..., t] = np.reshape(self.fV(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_udim), order='F')
+        # self.T[..., t] = np.reshape(self.fT(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_bdim), order='F')
+        # self.U[..., t] = np.reshape(self.fU(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_bdim * self.nb_bdim), order='F')
+        # self.V[..., t] = np.reshape(self.fV(_mu_b, _sigma_b, _u), (self.nb_bdim * self.nb_bdim, self.nb_udim), order='F')
 
     def forward(self, b, u, t):
         _u = u[..., t]
 
         _mu_b, _sigma_b = b.mu[..., t], b.sigma[..., t]
-        _mu_bn, _, _sigma_bn = self.ekf(_mu_b, _sigma_b, _u)
+        _mu_bn, _, _sigma_bn = self.fekf(_mu_b, _sigma_b, _u)
+
+        return _mu_bn, _sigma_bn
+
+    def forward_batch(self, mu_b, sigma_b, u):
+        # mu_b: (nb_rows, nb_bdim), sigma_b: (nb_rows, nb_bdim, nb_bdim)
+        _mu_bn, _, _sigma_bn = self.fekfb(mu_b, sigma_b, u)
 
         return _mu_bn, _sigma_bn
 
@@ -258,8 +449,8 @@ class LinearControl:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.K = np.zeros((self.nb_udim, self.nb_bdim, self.nb_steps))
-        self.kff = np.zeros((self.nb_udim, self.nb_steps))
+        self.K = np.zeros((self.nb_udim, self.nb_bdim, self.nb_steps), order='F')
+        self.kff = np.zeros((self.nb_udim, self.nb_steps), order='F')
 
     @property
     def params(self):
@@ -272,3 +463,8 @@ class LinearControl:
     def action(self, b, alpha, bref, uref, t):
         dx = b.mu[..., t] - bref[:, t]
         return uref[:, t] + alpha * self.kff[..., t] + self.K[..., t] @ dx
+
+    def action_batch(self, mu_b, alphas, bref, uref, t):
+        # mu_b: (nb_alphas, nb_bdim), one row per step size
+        dx = mu_b - bref[:, t]
+        return uref[:, t] + alphas[:, None] * self.kff[..., t] + dx @ self.K[..., t].T
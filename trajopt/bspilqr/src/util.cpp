@@ -1,92 +1,31 @@
-#include <pybind11/pybind11.h>
-#include <pybind11/numpy.h>
-#include <armadillo>
-
-namespace py = pybind11;
-
-using namespace arma;
-
-
-typedef py::array_t<double, py::array::f_style | py::array::forcecast> array_tf;
-typedef py::array_t<double, py::array::c_style | py::array::forcecast> array_tc;
-
-
-cube array_to_cube(array_tf m) {
-
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-    int n_cols = _m_buff.shape[1];
-    int n_slices = _m_buff.shape[2];
-
-    cube _m_arma((double *)_m_buff.ptr, n_rows, n_cols, n_slices);
-
-    return _m_arma;
-}
-
-
-mat array_to_mat(array_tf m) {
-
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-    int n_cols = _m_buff.shape[1];
-
-    mat _m_arma((double *)_m_buff.ptr, n_rows, n_cols);
-
-    return _m_arma;
-}
-
-
-vec array_to_vec(array_tf m) {
-
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-
-    vec _m_vec((double *)_m_buff.ptr, n_rows);
-
-    return _m_vec;
-}
-
-
-array_tf cube_to_array(cube m) {
-
-    auto _m_array = array_tf({m.n_rows, m.n_cols, m.n_slices});
-
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows * m.n_cols * m.n_slices);
-
-    return _m_array;
+#include "util.h"
+
+
+// contraction of a symmetric S with nb_sdim covariance coordinates, vec(S)
+// in full form, D'vec(S) in vech form with D the duplication matrix,
+// i.e. the lower triangle by columns with off-diagonals counted twice
+vec sym_vec(const mat &S, int nb_sdim) {
+    if (nb_sdim == (int)S.n_elem)
+        return vectorise(S);
+
+    vec v(nb_sdim);
+    uword k = 0;
+    for (uword j = 0; j < S.n_cols; ++j) {
+        v(k++) = S(j, j);
+        for (uword i = j + 1; i < S.n_rows; ++i)
+            v(k++) = S(i, j) + S(j, i);
+    }
+    return v;
 }
 
 
-array_tf mat_to_array(mat m) {
-
-    auto _m_array = array_tf({m.n_rows, m.n_cols});
-
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows * m.n_cols);
-
-    return _m_array;
-}
-
-
-array_tf vec_to_array(vec m) {
-
-    auto _m_array = array_tf({m.n_rows});
-
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows);
-
-    return _m_array;
-}
-
-
-py::tuple backward_pass(array_tf _Q, array_tf _q,
-                        array_tf _R, array_tf _r,
-                        array_tf _P, array_tf _p,
-                        array_tf _F, array_tf _G,
-                        array_tf _T, array_tf _U,
-                        array_tf _V, array_tf _X,
-                        array_tf _Y, array_tf _Z,
+py::tuple backward_pass(py::array _Q, py::array _q,
+                        py::array _R, py::array _r,
+                        py::array _P, py::array _p,
+                        py::array _F, py::array _G,
+                        py::array _T, py::array _U,
+                        py::array _V, py::array _X,
+                        py::array _Y, py::array _Z,
                         double lmbda, int reg,
                         int nb_bdim, int nb_udim, int nb_steps) {
 
@@ -111,7 +50,30 @@ py::tuple backward_pass(array_tf _Q, array_tf _q,
     cube Y = array_to_cube(_Y);
     cube Z = array_to_cube(_Z);
 
+    // covariance coordinates, nb_bdim^2 in full or
+    // nb_bdim (nb_bdim + 1) / 2 in vech form
+    int nb_sdim = p.n_rows;
+
     // outputs
+    array_tf _S = zeros_array({nb_bdim, nb_bdim, nb_steps + 1});
+    array_tf _s = zeros_array({nb_bdim, nb_steps + 1});
+    array_tf _tau = zeros_array({nb_sdim, nb_steps + 1});
+
+    array_tf _dS = zeros_array({2});
+
+    array_tf _K = zeros_array({nb_udim, nb_bdim, nb_steps});
+    array_tf _kff = zeros_array({nb_udim, nb_steps});
+
+    cube S = array_to_cube(_S);
+    mat s = array_to_mat(_s);
+    mat tau = array_to_mat(_tau);
+
+    vec dS = array_to_vec(_dS);
+
+    cube K = array_to_cube(_K);
+    mat kff = array_to_mat(_kff);
+
+    // intermediates
     cube C(nb_bdim, nb_bdim, nb_steps);
     mat c(nb_bdim, nb_steps);
 
@@ -119,23 +81,16 @@ py::tuple backward_pass(array_tf _Q, array_tf _q,
     mat d(nb_udim, nb_steps);
 
     cube E(nb_udim, nb_bdim, nb_steps);
-    mat e(nb_bdim * nb_bdim, nb_steps);
+    mat e(nb_sdim, nb_steps);
+    vec vS(nb_sdim);
 
     cube Ereg(nb_udim, nb_bdim, nb_steps);
     cube Dreg(nb_udim, nb_udim, nb_steps);
-    cube Dinv(nb_udim, nb_udim, nb_steps);
-
-    cube S(nb_bdim, nb_bdim, nb_steps + 1);
-    mat s(nb_bdim, nb_steps + 1);
-    mat tau(nb_bdim * nb_bdim, nb_steps + 1);
-
-    vec dS(2);
+    mat L(nb_udim, nb_udim);
+    mat gains(nb_udim, nb_bdim + 1);
 
     cube Sreg(nb_bdim, nb_bdim, nb_steps + 1);
 
-    cube K(nb_udim, nb_bdim, nb_steps);
-    mat kff(nb_udim, nb_steps);
-
     int _diverge = 0;
 
     // init last time step
@@ -149,13 +104,15 @@ py::tuple backward_pass(array_tf _Q, array_tf _q,
         D.slice(i) = R.slice(i) + G.slice(i).t() * S.slice(i+1) * G.slice(i);
         E.slice(i) = (P.slice(i) + F.slice(i).t() * S.slice(i+1) * G.slice(i)).t();
 
+        vS = sym_vec(S.slice(i+1), nb_sdim);
+
         c.col(i) = q.col(i) + F.slice(i).t() * s.col(i+1) + T.slice(i).t() * tau.col(i+1)
-                   + 0.5 * X.slice(i).t() * vectorise(S.slice(i+1));
+                   + 0.5 * X.slice(i).t() * vS;
 
         d.col(i) = r.col(i) + G.slice(i).t() * s.col(i+1) + V.slice(i).t() * tau.col(i+1)
-                   + 0.5 * Z.slice(i).t() * vectorise(S.slice(i+1));
+                   + 0.5 * Z.slice(i).t() * vS;
 
-        e.col(i) = p.col(i) + U.slice(i).t() * tau.col(i) + 0.5 * Y.slice(i).t() * vectorise(S.slice(i+1));
+        e.col(i) = p.col(i) + U.slice(i).t() * tau.col(i) + 0.5 * Y.slice(i).t() * vS;
 
         Sreg.slice(i+1) = S.slice(i+1);
         if (reg==2)
@@ -167,14 +124,15 @@ py::tuple backward_pass(array_tf _Q, array_tf _q,
         if (reg==1)
             Dreg.slice(i) += lmbda * eye(nb_udim, nb_udim);
 
-        if (!(Dreg.slice(i)).is_sympd()) {
-            _diverge = i;
+        // the factorization doubles as the definiteness check
+        if (!chol_factor(L, Dreg.slice(i))) {
+            _diverge = 1;
             break;
         }
 
-        Dinv.slice(i) = inv(Dreg.slice(i));
-        K.slice(i) = - Dinv.slice(i) * Ereg.slice(i);
-        kff.col(i) = - Dinv.slice(i) * d.col(i);
+        gains = - chol_solve(L, join_horiz(Ereg.slice(i), d.col(i)));
+        K.slice(i) = gains.head_cols(nb_bdim);
+        kff.col(i) = gains.col(nb_bdim);
 
         dS += join_vert(kff.col(i).t() * d.col(i), 0.5 * kff.col(i).t() * D.slice(i) * kff.col(i));
 
@@ -188,16 +146,7 @@ py::tuple backward_pass(array_tf _Q, array_tf _q,
         S.slice(i) = 0.5 * (S.slice(i) + S.slice(i).t());
 	}
 
-    // transform outputs to numpy
-    array_tf _S = cube_to_array(S);
-    array_tf _s = mat_to_array(s);
-    array_tf _tau = mat_to_array(tau);
-
-    array_tf _dS = vec_to_array(dS);
-
-    array_tf _K = cube_to_array(K);
-    array_tf _kff = mat_to_array(kff);
-
+    // outputs already live in numpy
     py::tuple output =  py::make_tuple(_S, _s, _tau,
                                        _dS, _K, _kff, _diverge);
 	return output;
@@ -207,4 +156,6 @@ py::tuple backward_pass(array_tf _Q, array_tf _q,
 PYBIND11_MODULE(core, m)
 {
     m.def("backward_pass", &backward_pass);
+    m.def("copied_bytes", &copied_bytes);
+    m.def("reset_copied_bytes", &reset_copied_bytes);
 }
@@ -11,14 +11,28 @@ from trajopt.elqr.objects import AnalyticalLinearDynamics, AnalyticalQuadraticCo
 from trajopt.elqr.objects import QuadraticStateValue
 from trajopt.elqr.objects import LinearControl
 
+from trajopt.elqr.core import forward_sweep, backward_sweep
+
+from trajopt.autodiff import get_backend
+from trajopt.rollout import Rollout
+from trajopt.profiling import NullProfiler
+
 
 class eLQR:
 
     def __init__(self, env, nb_steps,
-                 activation=range(-1, 0)):
+                 activation=range(-1, 0),
+                 backend='autograd',
+                 profiler=None):
 
         self.env = env
 
+        # phase timings and event counts, nothing recorded by default
+        self.profiler = profiler if profiler is not None else NullProfiler()
+
+        # autodiff backend, autograd or jax
+        self.backend = get_backend(backend)
+
         # expose necessary functions
         self.env_dyn = self.env.unwrapped.dynamics
         self.env_inv_dyn = self.env.unwrapped.inverse_dynamics
@@ -44,8 +58,10 @@ class eLQR:
         self.gocost.V[..., 0] += np.eye(self.nb_xdim) * 1e-16
         self.comecost.V[..., 0] += np.eye(self.nb_xdim) * 1e-16
 
-        self.dyn = AnalyticalLinearDynamics(self.env_init, self.env_dyn, self.nb_xdim, self.nb_udim, self.nb_steps)
-        self.idyn = AnalyticalLinearDynamics(self.env_init, self.env_inv_dyn, self.nb_xdim, self.nb_udim, self.nb_steps)
+        self.dyn = AnalyticalLinearDynamics(self.env_init, self.env_dyn, self.nb_xdim, self.nb_udim, self.nb_steps,
+                                            backend=self.backend)
+        self.idyn = AnalyticalLinearDynamics(self.env_init, self.env_inv_dyn, self.nb_xdim, self.nb_udim, self.nb_steps,
+                                             backend=self.backend)
 
         self.ctl = LinearControl(self.nb_xdim, self.nb_udim, self.nb_steps)
         self.ctl.kff = np.random.randn(self.nb_udim, self.nb_steps)
@@ -58,67 +74,50 @@ class eLQR:
         self.activation[-1] = 1.  # last step always in
         self.activation[activation] = 1.
 
-        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps + 1)
+        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps + 1,
+                                            backend=self.backend)
+
+        # state propagation and batched cost of rollouts
+        self.rollout = Rollout(self.env_dyn, self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps,
+                               backend=self.backend)
 
         self.last_objective = - np.inf
 
     def forward_pass(self, ctl):
-        state = np.zeros((self.nb_xdim, self.nb_steps + 1))
-        action = np.zeros((self.nb_udim, self.nb_steps))
-        cost = np.zeros((self.nb_steps + 1,))
-
-        state[..., 0], _ = self.dyn.evali()
-        for t in range(self.nb_steps):
-            action[..., t] = ctl.action(state[..., t], t)
-            cost[..., t] = self.cost.evalf(state[..., t], action[..., t], self.activation[t])
-            state[..., t + 1] = self.dyn.evalf(state[..., t], action[..., t])
-
-        cost[..., -1] = self.cost.evalf(state[..., -1], np.zeros((self.nb_udim, )), self.activation[-1])
-        return state, action, cost
+        _x0, _ = self.dyn.evali()
+        return self.rollout(_x0, ctl.K, ctl.kff, self.activation)
 
-    def forward_lqr(self, state):
-        for t in range(self.nb_steps):
-            _action = self.ctl.action(state, t)
-
-            _state_n = self.dyn.evalf(state, _action)
-
-            # linearize inverse discrete dynamics
-            _A, _B, _c = self.idyn.taylor_expansion(_state_n, _action)
-
-            # quadratize cost
-            _Cxx, _Cuu, _Cxu, _cx, _cu, _c0 = self.cost.taylor_expansion(state, _action, self.activation[..., t])
+    def forward_expansion(self, state, t):
+        _action = self.ctl.action(state, t)
 
-            # forward value
-            _Qxx = _A.T @ (_Cxx + self.comecost.V[..., t]) @ _A
-            _Quu = _B.T @ (_Cxx + self.comecost.V[..., t]) @ _B + _B.T @ _Cxu + _Cxu.T  @ _B + _Cuu
-            _Qux = _B.T @ (_Cxx + self.comecost.V[..., t]) @ _A + _Cxu.T @ _A
+        _state_n = self.dyn.evalf(state, _action)
 
-            _qx = _A.T @ (_Cxx + self.comecost.V[..., t]) @ _c + _A.T @ (_cx + self.comecost.v[..., t])
-            _qu = _B.T @ (_Cxx + self.comecost.V[..., t]) @ _c + _Cxu.T @ _c + _B.T @ (_cx + self.comecost.v[..., t]) + _cu
+        # linearize inverse discrete dynamics
+        _A, _B, _c = self.idyn.taylor_expansion(_state_n, _action)
 
-            _q0 = 0.5 * _c.T @ (_Cxx + self.comecost.V[..., t]) @ _c +\
-                  _c.T @ (_cx + self.comecost.v[..., t]) + _c0 + self.comecost.v0[..., t]
+        # quadratize cost
+        return (_A, _B, _c) + self.cost.taylor_expansion(state, _action, self.activation[..., t])
 
-            # backward value
-            _Qxx = _A.T @ (_Cxx + self.comecost.V[..., t]) @ _A
-            _Quu = _B.T @ (_Cxx + self.comecost.V[..., t]) @ _B + _B.T @ _Cxu + _Cxu.T  @ _B + _Cuu
-            _Qux = _B.T @ (_Cxx + self.comecost.V[..., t]) @ _A + _Cxu.T @ _A
+    def backward_expansion(self, state, t):
+        _action = self.ictl.action(state, t)
 
-            self.ictl.K[..., t] = - np.linalg.inv(_Quu) @ _Qux
-            self.ictl.kff[..., t] = - np.linalg.inv(_Quu) @ _qu
+        _state_n = self.idyn.evalf(state, _action)
 
-            self.comecost.V[..., t + 1] = _Qxx - _Qux.T @ np.linalg.inv(_Quu) @ _Qux
-            self.comecost.v[..., t + 1] = _qx - _Qux.T @ np.linalg.inv(_Quu) @ _qu
-            self.comecost.v0[..., t + 1] = _q0 - 0.5 * _qu.T @ np.linalg.inv(_Quu) @ _qu
+        # linearize discrete dynamics
+        _A, _B, _c = self.dyn.taylor_expansion(_state_n, _action)
 
-            # store matrices
-            self.idyn.A[..., t] = _A
-            self.idyn.B[..., t] = _B
-            self.idyn.c[..., t] = _c
-
-            state = - np.linalg.inv(self.gocost.V[..., t + 1] + self.comecost.V[..., t + 1]) @\
-                    (self.gocost.v[..., t + 1] + self.comecost.v[..., t + 1])
+        # quadratize cost
+        return (_A, _B, _c) + self.cost.taylor_expansion(_state_n, _action, self.activation[..., t])
 
+    def forward_lqr(self, state):
+        # cost-to-come recursion, expansions are called back per step
+        self.comecost.V, self.comecost.v, self.comecost.v0,\
+        self.ictl.K, self.ictl.kff,\
+        self.idyn.A, self.idyn.B, self.idyn.c,\
+        state = forward_sweep(self.forward_expansion,
+                              self.gocost.V, self.gocost.v,
+                              self.comecost.V, self.comecost.v, self.comecost.v0,
+                              state, self.nb_xdim, self.nb_udim, self.nb_steps)
         return state
 
     def backward_lqr(self, state):
@@ -130,45 +129,17 @@ class eLQR:
         self.gocost.v[..., -1] = _cx
         self.gocost.v0[..., -1] = _c0
 
-        state = - np.linalg.inv(self.gocost.V[..., -1] + self.comecost.V[..., -1]) @\
-                (self.gocost.v[..., -1] + self.comecost.v[..., -1])
-
-        for t in range(self.nb_steps - 1, -1, -1):
-            _action = self.ictl.action(state, t)
-
-            _state_n = self.idyn.evalf(state, _action)
-            # linearize discrete dynamics
-            _A, _B, _c = self.dyn.taylor_expansion(_state_n, _action)
-
-            # quadratize cost
-            _Cxx, _Cuu, _Cxu, _cx, _cu, _c0 = self.cost.taylor_expansion(_state_n, _action, self.activation[..., t])
-
-            # backward value
-            _Qxx = _Cxx + _A.T @ self.gocost.V[..., t + 1] @ _A
-            _Quu = _Cuu + _B.T @ self.gocost.V[..., t + 1] @ _B
-            _Qux = _Cxu.T + _B.T @ self.gocost.V[..., t + 1] @ _A
-
-            _qx = _cx + _A.T @ self.gocost.V[..., t + 1] @ _c + _A.T @ self.gocost.v[..., t + 1]
-            _qu = _cu + _B.T @ self.gocost.V[..., t + 1] @ _c + _B.T @ self.gocost.v[..., t + 1]
-
-            _q0 = _c0 + self.gocost.v0[..., t + 1] + 0.5 * _c.T @ self.gocost.V[..., t + 1] @ _c +\
-                  _c.T @ self.gocost.v[..., t + 1]
-
-            self.ctl.K[..., t] = - np.linalg.inv(_Quu) @ _Qux
-            self.ctl.kff[..., t] = - np.linalg.inv(_Quu) @ _qu
-
-            self.gocost.V[..., t] = _Qxx - _Qux.T @ np.linalg.inv(_Quu) @ _Qux
-            self.gocost.v[..., t] = _qx - _Qux.T @ np.linalg.inv(_Quu) @ _qu
-            self.gocost.v0[..., t] = _q0 - 0.5 * _qu.T @ np.linalg.inv(_Quu) @ _qu
-
-            # store matrices
-            self.dyn.A[..., t] = _A
-            self.dyn.B[..., t] = _B
-            self.dyn.c[..., t] = _c
-
-            state = - np.linalg.inv(self.gocost.V[..., t] + self.comecost.V[..., t]) @\
-                     (self.gocost.v[..., t] + self.comecost.v[..., t])
-
+        state = - np.linalg.solve(self.gocost.V[..., -1] + self.comecost.V[..., -1],
+                                  self.gocost.v[..., -1] + self.comecost.v[..., -1])
+
+        # cost-to-go recursion, expansions are called back per step
+        self.gocost.V, self.gocost.v, self.gocost.v0,\
+        self.ctl.K, self.ctl.kff,\
+        self.dyn.A, self.dyn.B, self.dyn.c,\
+        state = backward_sweep(self.backward_expansion,
+                               self.gocost.V, self.gocost.v, self.gocost.v0,
+                               self.comecost.V, self.comecost.v,
+                               state, self.nb_xdim, self.nb_udim, self.nb_steps)
         return state
 
     def plot(self):
@@ -192,20 +163,26 @@ class eLQR:
         _trace = []
 
         # forward pass to get ref traj.
-        self.xref, self.uref, _cost = self.forward_pass(self.ctl)
+        with self.profiler.phase('forward_pass'):
+            self.xref, self.uref, _cost = self.forward_pass(self.ctl)
         # return around current traj.
         _trace.append(np.sum(_cost))
 
         _state, _ = self.dyn.evali()
         for _ in range(nb_iter):
+            self.profiler.step()
+
             # forward lqr
-            _state = self.forward_lqr(_state)
+            with self.profiler.phase('forward_lqr'):
+                _state = self.forward_lqr(_state)
 
             # backward lqr
-            _state = self.backward_lqr(_state)
+            with self.profiler.phase('backward_lqr'):
+                _state = self.backward_lqr(_state)
 
             # forward pass to get ref traj.
-            self.xref, self.uref, _cost = self.forward_pass(self.ctl)
+            with self.profiler.phase('forward_pass'):
+                self.xref, self.uref, _cost = self.forward_pass(self.ctl)
 
             # return around current traj.
             _trace.append(np.sum(_cost))
@@ -6,9 +6,10 @@
 # @Contact: hany@robot-learning.de
 
 import autograd.numpy as np
-from autograd import jacobian, hessian
 from copy import deepcopy
 
+from trajopt.autodiff import get_backend
+
 
 class QuadraticStateValue:
     def __init__(self, nb_xdim, nb_steps):
@@ -46,17 +47,19 @@ class QuadraticCost:
 
 
 class AnalyticalQuadraticCost(QuadraticCost):
-    def __init__(self, f, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, f, nb_xdim, nb_udim, nb_steps,
+                 backend='autograd'):
         super(AnalyticalQuadraticCost, self).__init__(nb_xdim, nb_udim, nb_steps)
 
-        self.f = f
+        self.backend = get_backend(backend)
+
+        self.f = self.backend.jit(f, static_argnums=(2, ))
 
-        self.dcdxx = hessian(self.f, 0)
-        self.dcduu = hessian(self.f, 1)
-        self.dcdxu = jacobian(jacobian(self.f, 0), 1)
+        # value, gradient and hessian w.r.t. z = [x, u] in one sweep
+        self.dcdz = self.backend.value_grad_hessian(self.fz, static_argnums=(1, ))
 
-        self.dcdx = jacobian(self.f, 0)
-        self.dcdu = jacobian(self.f, 1)
+    def fz(self, z, a, xref):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:], a, xref)
 
     def evalf(self, x, u, a):
         _xref = deepcopy(x)
@@ -64,16 +67,21 @@ class AnalyticalQuadraticCost(QuadraticCost):
 
     def taylor_expansion(self, x, u, a):
         _xref = deepcopy(x)
-        _in = tuple([x, u, a, _xref])
-        _Cxx = 0.5 * self.dcdxx(*_in)
-        _Cuu = 0.5 * self.dcduu(*_in)
-        _Cxu = self.dcdxu(*_in)
+        _c, _g, _H = self.dcdz(np.hstack((x, u)), a, _xref)
+
+        _dcdxx = _H[:self.nb_xdim, :self.nb_xdim]
+        _dcduu = _H[self.nb_xdim:, self.nb_xdim:]
+        _dcdxu = _H[:self.nb_xdim, self.nb_xdim:]
 
-        _cx = self.dcdx(*_in) - self.dcdxx(*_in) @ x - self.dcdxu(*_in) @ u
-        _cu = self.dcdu(*_in) - self.dcduu(*_in) @ u - x.T @ self.dcdxu(*_in)
+        _Cxx = 0.5 * _dcdxx
+        _Cuu = 0.5 * _dcduu
+        _Cxu = _dcdxu
+
+        _cx = _g[:self.nb_xdim] - _dcdxx @ x - _dcdxu @ u
+        _cu = _g[self.nb_xdim:] - _dcduu @ u - x.T @ _dcdxu
 
         # residual of taylor expansion
-        _c0 = self.f(*_in) - x.T @ _Cxx @ x -\
+        _c0 = _c - x.T @ _Cxx @ x -\
               u.T @ _Cuu @ u - x.T @ _Cxu @ u -\
               _cx.T @ x - _cu.T @ u
 
@@ -103,14 +111,20 @@ class LinearDynamics:
 
 
 class AnalyticalLinearDynamics(LinearDynamics):
-    def __init__(self, f_init, f_dyn, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, f_init, f_dyn, nb_xdim, nb_udim, nb_steps,
+                 backend='autograd'):
         super(AnalyticalLinearDynamics, self).__init__(nb_xdim, nb_udim, nb_steps)
 
+        self.backend = get_backend(backend)
+
         self.i = f_init
-        self.f = f_dyn
+        self.f = self.backend.jit(f_dyn)
+
+        # jacobian w.r.t. z = [x, u]
+        self.dfdz = self.backend.jacobian(self.fz)
 
-        self.dfdx = jacobian(self.f, 0)
-        self.dfdu = jacobian(self.f, 1)
+    def fz(self, z):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:])
 
     def evali(self):
         return self.i()
@@ -119,8 +133,9 @@ class AnalyticalLinearDynamics(LinearDynamics):
         return self.f(x, u)
 
     def taylor_expansion(self, x, u):
-        _A = self.dfdx(x, u)
-        _B = self.dfdu(x, u)
+        _grads = self.dfdz(np.hstack((x, u)))
+        _A = _grads[:, :self.nb_xdim]
+        _B = _grads[:, self.nb_xdim:]
         # residual of taylor expansion
         _c = self.evalf(x, u) - _A @ x - _B @ u
 
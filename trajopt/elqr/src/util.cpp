@@ -0,0 +1,240 @@
+#include "util.h"
+
+
+array_tf vec_to_array(const vec &x) {
+
+    // states are handed to the python callbacks as copies
+    array_tf _x_array({(ssize_t)x.n_elem});
+    std::copy(x.begin(), x.end(), _x_array.mutable_data());
+
+    return _x_array;
+}
+
+
+// local expansion of a step returned by a python callback,
+// (A, B, c, Cxx, Cuu, Cxu, cx, cu, c0), copied into armadillo
+struct Expansion {
+    mat A, B, Cxx, Cuu, Cxu;
+    vec c, cx, cu;
+    double c0;
+
+    explicit Expansion(py::tuple expansion) {
+        std::vector<py::array> _m;
+        for (int k = 0; k < 8; ++k)
+            _m.push_back(expansion[k].cast<py::array>());
+
+        A = array_to_mat(_m[0]);
+        B = array_to_mat(_m[1]);
+        c = array_to_vec(_m[2]);
+
+        Cxx = array_to_mat(_m[3]);
+        Cuu = array_to_mat(_m[4]);
+        Cxu = array_to_mat(_m[5]);
+
+        cx = array_to_vec(_m[6]);
+        cu = array_to_vec(_m[7]);
+        c0 = expansion[8].cast<double>();
+    }
+};
+
+
+// minimizes the quadratic q0 + qx'x + qu'u + 1/2 x'Qxx x + u'Qux x + 1/2 u'Quu u
+// over u, Quu is factorized once for the feedback and the feedforward gain
+void minimize_action(mat &K, vec &kff, mat &V, vec &v, double &v0,
+                     const mat &Qxx, const mat &Quu, const mat &Qux,
+                     const vec &qx, const vec &qu, double q0) {
+
+    mat gains = - solve(Quu, join_horiz(Qux, qu));
+    K = gains.head_cols(Qux.n_cols);
+    kff = gains.tail_cols(1);
+
+    V = Qxx + Qux.t() * K;
+    v = qx + Qux.t() * kff;
+    v0 = q0 + 0.5 * as_scalar(qu.t() * kff);
+}
+
+
+// state minimizing the sum of cost-to-go and cost-to-come
+vec minimize_state(const mat &Vgo, const vec &vgo, const mat &Vcome, const vec &vcome) {
+    return - solve(Vgo + Vcome, vgo + vcome);
+}
+
+
+py::tuple forward_sweep(py::function expansion,
+                        py::array _Vgo, py::array _vgo,
+                        py::array _Vcome, py::array _vcome, py::array _v0come,
+                        py::array _x, int nb_xdim, int nb_udim, int nb_steps) {
+
+    // inputs, cost-to-come is read at the first step only
+    cube Vgo = array_to_cube(_Vgo);
+    mat vgo = array_to_mat(_vgo);
+
+    cube Vcome_in = array_to_cube(_Vcome);
+    mat vcome_in = array_to_mat(_vcome);
+    vec v0come_in = array_to_vec(_v0come);
+
+    // a copy, the state is overwritten at every step
+    vec x;
+    x = array_to_vec(_x);
+
+    // outputs
+    array_tf _Vc = zeros_array({nb_xdim, nb_xdim, nb_steps + 1});
+    array_tf _vc = zeros_array({nb_xdim, nb_steps + 1});
+    array_tf _v0c = zeros_array({nb_steps + 1});
+
+    array_tf _K = zeros_array({nb_udim, nb_xdim, nb_steps});
+    array_tf _kff = zeros_array({nb_udim, nb_steps});
+
+    array_tf _A = zeros_array({nb_xdim, nb_xdim, nb_steps});
+    array_tf _B = zeros_array({nb_xdim, nb_udim, nb_steps});
+    array_tf _c = zeros_array({nb_xdim, nb_steps});
+
+    cube Vc = array_to_cube(_Vc);
+    mat vc = array_to_mat(_vc);
+    vec v0c = array_to_vec(_v0c);
+
+    cube K = array_to_cube(_K);
+    mat kff = array_to_mat(_kff);
+
+    cube A = array_to_cube(_A);
+    cube B = array_to_cube(_B);
+    mat c = array_to_mat(_c);
+
+    Vc.slice(0) = Vcome_in.slice(0);
+    vc.col(0) = vcome_in.col(0);
+    v0c(0) = v0come_in(0);
+
+    mat M, Qxx, Quu, Qux, Kt, V;
+    vec qx, qu, kt, v;
+    double q0, v0;
+
+    for (int t = 0; t < nb_steps; ++t) {
+        // inverse dynamics and cost around the current state
+        Expansion e(expansion(vec_to_array(x), t));
+
+        // cost-to-come of the previous state
+        M = e.Cxx + Vc.slice(t);
+
+        Qxx = e.A.t() * M * e.A;
+        Quu = e.B.t() * M * e.B + e.B.t() * e.Cxu + e.Cxu.t() * e.B + e.Cuu;
+        Qux = e.B.t() * M * e.A + e.Cxu.t() * e.A;
+
+        qx = e.A.t() * M * e.c + e.A.t() * (e.cx + vc.col(t));
+        qu = e.B.t() * M * e.c + e.Cxu.t() * e.c + e.B.t() * (e.cx + vc.col(t)) + e.cu;
+        q0 = 0.5 * as_scalar(e.c.t() * M * e.c) + as_scalar(e.c.t() * (e.cx + vc.col(t))) + e.c0 + v0c(t);
+
+        minimize_action(Kt, kt, V, v, v0, Qxx, Quu, Qux, qx, qu, q0);
+
+        K.slice(t) = Kt;
+        kff.col(t) = kt;
+
+        Vc.slice(t + 1) = V;
+        vc.col(t + 1) = v;
+        v0c(t + 1) = v0;
+
+        A.slice(t) = e.A;
+        B.slice(t) = e.B;
+        c.col(t) = e.c;
+
+        x = minimize_state(Vgo.slice(t + 1), vgo.col(t + 1), Vc.slice(t + 1), vc.col(t + 1));
+    }
+
+    // outputs already live in numpy
+    py::tuple output =  py::make_tuple(_Vc, _vc, _v0c, _K, _kff,
+                                       _A, _B, _c, vec_to_array(x));
+    return output;
+}
+
+
+py::tuple backward_sweep(py::function expansion,
+                         py::array _Vgo, py::array _vgo, py::array _v0go,
+                         py::array _Vcome, py::array _vcome,
+                         py::array _x, int nb_xdim, int nb_udim, int nb_steps) {
+
+    // inputs, cost-to-go is read at the last step only
+    cube Vgo_in = array_to_cube(_Vgo);
+    mat vgo_in = array_to_mat(_vgo);
+    vec v0go_in = array_to_vec(_v0go);
+
+    cube Vcome = array_to_cube(_Vcome);
+    mat vcome = array_to_mat(_vcome);
+
+    // a copy, the state is overwritten at every step
+    vec x;
+    x = array_to_vec(_x);
+
+    // outputs
+    array_tf _Vg = zeros_array({nb_xdim, nb_xdim, nb_steps + 1});
+    array_tf _vg = zeros_array({nb_xdim, nb_steps + 1});
+    array_tf _v0g = zeros_array({nb_steps + 1});
+
+    array_tf _K = zeros_array({nb_udim, nb_xdim, nb_steps});
+    array_tf _kff = zeros_array({nb_udim, nb_steps});
+
+    array_tf _A = zeros_array({nb_xdim, nb_xdim, nb_steps});
+    array_tf _B = zeros_array({nb_xdim, nb_udim, nb_steps});
+    array_tf _c = zeros_array({nb_xdim, nb_steps});
+
+    cube Vg = array_to_cube(_Vg);
+    mat vg = array_to_mat(_vg);
+    vec v0g = array_to_vec(_v0g);
+
+    cube K = array_to_cube(_K);
+    mat kff = array_to_mat(_kff);
+
+    cube A = array_to_cube(_A);
+    cube B = array_to_cube(_B);
+    mat c = array_to_mat(_c);
+
+    Vg.slice(nb_steps) = Vgo_in.slice(nb_steps);
+    vg.col(nb_steps) = vgo_in.col(nb_steps);
+    v0g(nb_steps) = v0go_in(nb_steps);
+
+    mat Qxx, Quu, Qux, Kt, V;
+    vec qx, qu, kt, v;
+    double q0, v0;
+
+    for (int t = nb_steps - 1; t >= 0; --t) {
+        // dynamics and cost around the previous state
+        Expansion e(expansion(vec_to_array(x), t));
+
+        const mat &Vn = Vg.slice(t + 1);
+
+        Qxx = e.Cxx + e.A.t() * Vn * e.A;
+        Quu = e.Cuu + e.B.t() * Vn * e.B;
+        Qux = e.Cxu.t() + e.B.t() * Vn * e.A;
+
+        qx = e.cx + e.A.t() * Vn * e.c + e.A.t() * vg.col(t + 1);
+        qu = e.cu + e.B.t() * Vn * e.c + e.B.t() * vg.col(t + 1);
+        q0 = e.c0 + v0g(t + 1) + 0.5 * as_scalar(e.c.t() * Vn * e.c) + as_scalar(e.c.t() * vg.col(t + 1));
+
+        minimize_action(Kt, kt, V, v, v0, Qxx, Quu, Qux, qx, qu, q0);
+
+        K.slice(t) = Kt;
+        kff.col(t) = kt;
+
+        Vg.slice(t) = V;
+        vg.col(t) = v;
+        v0g(t) = v0;
+
+        A.slice(t) = e.A;
+        B.slice(t) = e.B;
+        c.col(t) = e.c;
+
+        x = minimize_state(Vg.slice(t), vg.col(t), Vcome.slice(t), vcome.col(t));
+    }
+
+    // outputs already live in numpy
+    py::tuple output =  py::make_tuple(_Vg, _vg, _v0g, _K, _kff,
+                                       _A, _B, _c, vec_to_array(x));
+    return output;
+}
+
+
+PYBIND11_MODULE(core, m)
+{
+    m.def("forward_sweep", &forward_sweep);
+    m.def("backward_sweep", &backward_sweep);
+    m.def("copied_bytes", &copied_bytes);
+    m.def("reset_copied_bytes", &reset_copied_bytes);
+}
@@ -11,6 +11,8 @@ from gym.utils import seeding
 
 import autograd.numpy as np
 
+from trajopt.autodiff import backend_of
+
 
 class Car(gym.Env):
 
@@ -75,6 +77,7 @@ class Car(gym.Env):
         return _b0, _sigma_b0
 
     def dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         # x, y, th, v
         xn = x + self._dt * np.array([x[3] * np.cos(x[2]),
                                       x[3] * np.sin(x[2]),
@@ -82,20 +85,32 @@ class Car(gym.Env):
                                       u[0]])
         return xn
 
+    def dynamics_batch(self, x, u):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim)
+        xn = x + self._dt * np.stack((x[:, 3] * np.cos(x[:, 2]),
+                                      x[:, 3] * np.sin(x[:, 2]),
+                                      x[:, 3] * np.tan(u[:, 1]) / self._l,
+                                      u[:, 0]), axis=-1)
+        return xn
+
     def dyn_noise(self, x=None, u=None):
         return 1.e-4 * np.eye(self.nb_xdim)
 
     def observe(self, x):
+        np = backend_of(x).numpy
         return np.array([x[0], x[1]])
 
     def obs_noise(self, x=None):
+        np = backend_of(x).numpy
         _sigma = 1.e-4 * np.eye(self.nb_zdim)
-        _sigma += np.array([[0.5 * (5. - x[0])**2, 0.],
-                            [0., 0.]])
+        _sigma = _sigma + np.array([[0.5 * (5. - x[0])**2, 0.],
+                                   [0., 0.]])
         return _sigma
 
     # cost defined over belief
     def cost(self, mu_b, sigma_b, u, a):
+        np = backend_of(mu_b, sigma_b, u).numpy
         if a:
             return (mu_b - self._g).T @ np.diag(100. * self._bw) @ (mu_b - self._g) +\
                    np.trace(np.diag(100. * self._vw) @ sigma_b)
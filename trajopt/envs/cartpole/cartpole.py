@@ -3,11 +3,16 @@ from gym import spaces
 from gym.utils import seeding
 
 import autograd.numpy as np
-from autograd import jacobian
+
+from trajopt.autodiff import backend_of
 
 
 class Cartpole(gym.Env):
 
+    # reset and step sample init and dynamics with gaussian noise,
+    # samplers may replace them by init, dynamics_batch and noise_batch
+    gaussian_step = True
+
     def __init__(self):
         self.nb_xdim = 4
         self.nb_udim = 1
@@ -56,6 +61,7 @@ class Cartpole(gym.Env):
         return self._x0, self._sigma_0
 
     def dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         u = np.clip(u, -self._umax, self._umax)
 
         # import from: https://github.com/JoeMWatson/input-inference-for-control/
@@ -84,11 +90,44 @@ class Cartpole(gym.Env):
         xn = np.clip(xn, -self._xmax, self._xmax)
         return xn
 
+    def dynamics_batch(self, x, u):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim)
+        u = np.clip(u, -self._umax, self._umax)
+
+        g = 9.81
+        Mc = 0.37
+        Mp = 0.127
+        Mt = Mc + Mp
+        l = 0.3365
+
+        th = x[:, 1]
+        dth2 = np.power(x[:, 3], 2)
+        sth = np.sin(th)
+        cth = np.cos(th)
+
+        _num = - Mp * l * sth * dth2 + Mt * g * sth - u[:, 0] * cth
+        _denom = l * ((4. / 3.) * Mt - Mp * cth ** 2)
+        th_acc = _num / _denom
+        x_acc = (Mp * l * sth * dth2 - Mp * l * th_acc * cth + u[:, 0]) / Mt
+
+        xn = np.stack((x[:, 0] + self._dt * (x[:, 2] + self._dt * x_acc),
+                       x[:, 1] + self._dt * (x[:, 3] + self._dt * th_acc),
+                       x[:, 2] + self._dt * x_acc,
+                       x[:, 3] + self._dt * th_acc), axis=-1)
+
+        xn = np.clip(xn, -self._xmax, self._xmax)
+        return xn
+
     def features(self, x):
         return x
 
+    def features_batch(self, x):
+        # x: (N, xdim)
+        return x
+
     def features_jacobian(self, x):
-        _J = jacobian(self.features, 0)
+        _J = backend_of(x).jacobian(self.features, 0)
         _j = self.features(x) - _J(x) @ x
         return _J, _j
 
@@ -97,8 +136,13 @@ class Cartpole(gym.Env):
         x = np.clip(x, -self._xmax, self._xmax)
         return self._sigma
 
+    def noise_batch(self, x, u):
+        # x: (N, xdim), u: (N, udim), state-action independent noise
+        return np.broadcast_to(self._sigma, (x.shape[0], ) + self._sigma.shape)
+
     # xref is a hack to avoid autograd diffing through the jacobian
     def cost(self, x, u, a, xref):
+        np = backend_of(x, u, xref).numpy
         if a:
             _J, _j = self.features_jacobian(xref)
             _x = _J(xref) @ x + _j
@@ -106,6 +150,13 @@ class Cartpole(gym.Env):
         else:
             return u.T @ np.diag(self._uw) @ u
 
+    def cost_batch(self, x, u, a):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim), a: (N, ), features taken at x
+        _x = self.features_batch(x) - self._g
+        return np.where(a, np.einsum('nk,k,nk->n', _x, self._gw, _x), 0.) +\
+               np.einsum('nk,k,nk->n', u, self._uw, u)
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
@@ -135,6 +186,14 @@ class CartpoleWithCartesianCost(Cartpole):
         self._gw = np.array([1.e-1, 1.e1, 1.e-1, 1.e-1, 1.e-1])
 
     def features(self, x):
+        np = backend_of(x).numpy
         return np.array([x[0],
                         np.cos(x[1]), np.sin(x[1]),
                         x[2], x[3]])
+
+    def features_batch(self, x):
+        np = backend_of(x).numpy
+        # x: (N, xdim)
+        return np.stack((x[:, 0],
+                         np.cos(x[:, 1]), np.sin(x[:, 1]),
+                         x[:, 2], x[:, 3]), axis=-1)
@@ -3,11 +3,16 @@ from gym import spaces
 from gym.utils import seeding
 
 import autograd.numpy as np
-from autograd import jacobian
+
+from trajopt.autodiff import backend_of
 
 
 class DoubleCartpole(gym.Env):
 
+    # reset and step sample init and dynamics with gaussian noise,
+    # samplers may replace them by init, dynamics_batch and noise_batch
+    gaussian_step = True
+
     def __init__(self):
         self.nb_xdim = 6
         self.nb_udim = 1
@@ -57,6 +62,7 @@ class DoubleCartpole(gym.Env):
         return self._x0, self._sigma_0
 
     def dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         u = np.clip(u, -self._umax, self._umax)
 
         # import from: https://github.com/JoeMWatson/input-inference-for-control/
@@ -148,11 +154,98 @@ class DoubleCartpole(gym.Env):
         xn = np.clip(xn, -self._xmax, self._xmax)
         return xn
 
+    def dynamics_batch(self, x, u):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim)
+        u = np.clip(u, -self._umax, self._umax)
+
+        g = 9.81
+        Mc = 0.37
+        Mp1 = 0.127
+        Mp2 = 0.127
+        Mt = Mc + Mp1 + Mp2
+        L1 = 0.3365
+        L2 = 0.3365
+        l1 = L1 / 2
+        l2 = L2 / 2
+        J1 = Mp1 * L1 / 12
+        J2 = Mp2 * L2 / 12
+
+        th1 = x[:, 1]
+        th2 = x[:, 2]
+        th_dot1 = x[:, 4]
+        th_dot2 = x[:, 5]
+
+        sth1 = np.sin(th1)
+        cth1 = np.cos(th1)
+        sth2 = np.sin(th2)
+        cth2 = np.cos(th2)
+        sdth = np.sin(th1 - th2)
+        cdth = np.cos(th1 - th2)
+
+        # helpers
+        l1_mp1_mp2 = Mp1 * l1 + Mp2 * L2
+        l1_mp1_mp2_cth1 = l1_mp1_mp2 * cth1
+        Mp2_l2 = Mp2 * l2
+        Mp2_l2_cth2 = Mp2_l2 * cth2
+        l1_l2_Mp2 = L1 * l2 * Mp2
+        l1_l2_Mp2_cdth = l1_l2_Mp2 * cdth
+
+        _zeros = np.zeros_like(th1)
+
+        # inertia
+        M11 = Mt + _zeros
+        M12 = l1_mp1_mp2_cth1
+        M13 = Mp2_l2_cth2
+        M21 = l1_mp1_mp2_cth1
+        M22 = (l1 ** 2) * Mp1 + (L1 ** 2) * Mp2 + J1 + _zeros
+        M23 = l1_l2_Mp2_cdth
+        M31 = Mp2_l2_cth2
+        M32 = l1_l2_Mp2_cdth
+        M33 = (l2 ** 2) * Mp2 + J2 + _zeros
+
+        # coreolis
+        C12 = -l1_mp1_mp2 * th_dot1 * sth1
+        C13 = -Mp2_l2 * th_dot2 * sth2
+        C23 = l1_l2_Mp2 * th_dot2 * sdth
+        C32 = -l1_l2_Mp2 * th_dot1 * sdth
+
+        # gravity
+        G21 = - (Mp1 * l1 + Mp2 * L1) * g * sth1
+        G31 = - Mp2 * l2 * g * sth2
+
+        # stacked (N, 3, 3) mass matrices
+        M = np.stack((np.stack((M11, M12, M13), axis=-1),
+                      np.stack((M21, M22, M23), axis=-1),
+                      np.stack((M31, M32, M33), axis=-1)), axis=-2)
+
+        # C @ x_dot - G with C11 = C21 = C22 = C31 = C33 = G11 = 0
+        C_x_dot = np.stack((C12 * th_dot1 + C13 * th_dot2,
+                            C23 * th_dot2,
+                            C32 * th_dot1), axis=-1)
+        G = np.stack((_zeros, G21, G31), axis=-1)
+
+        action = np.stack((u[:, 0], _zeros, _zeros), axis=-1)
+
+        x_dot_dot = np.linalg.solve(M, (action - C_x_dot - G)[..., None])[..., 0]
+
+        x_dot = x[:, 3:] + x_dot_dot * self._dt
+        x_pos = x[:, :3] + x_dot * self._dt
+
+        xn = np.hstack((x_pos, x_dot))
+
+        xn = np.clip(xn, -self._xmax, self._xmax)
+        return xn
+
     def features(self, x):
         return x
 
+    def features_batch(self, x):
+        # x: (N, xdim)
+        return x
+
     def features_jacobian(self, x):
-        _J = jacobian(self.features, 0)
+        _J = backend_of(x).jacobian(self.features, 0)
         _j = self.features(x) - _J(x) @ x
         return _J, _j
 
@@ -161,7 +254,12 @@ class DoubleCartpole(gym.Env):
         x = np.clip(x, -self._xmax, self._xmax)
         return self._sigma
 
+    def noise_batch(self, x, u):
+        # x: (N, xdim), u: (N, udim), state-action independent noise
+        return np.broadcast_to(self._sigma, (x.shape[0], ) + self._sigma.shape)
+
     def cost(self, x, u, a, xref):
+        np = backend_of(x, u, xref).numpy
         if a:
             _J, _j = self.features_jacobian(xref)
             _x = _J(xref) @ x + _j
@@ -169,6 +267,13 @@ class DoubleCartpole(gym.Env):
         else:
             return u.T @ np.diag(self._uw) @ u
 
+    def cost_batch(self, x, u, a):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim), a: (N, ), features taken at x
+        _x = self.features_batch(x) - self._g
+        return np.where(a, np.einsum('nk,k,nk->n', _x, self._gw, _x), 0.) +\
+               np.einsum('nk,k,nk->n', u, self._uw, u)
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
@@ -205,7 +310,16 @@ class DoubleCartpoleWithCartesianCost(DoubleCartpole):
                              1.e-1, 1.e-1, 1.e-1])
 
     def features(self, x):
+        np = backend_of(x).numpy
         return np.array([x[0],
                          np.cos(x[0]), np.sin(x[0]),
                          np.cos(x[1]), np.sin(x[1]),
                          x[2], x[3], x[4]])
+
+    def features_batch(self, x):
+        np = backend_of(x).numpy
+        # x: (N, xdim)
+        return np.stack((x[:, 0],
+                         np.cos(x[:, 0]), np.sin(x[:, 0]),
+                         np.cos(x[:, 1]), np.sin(x[:, 1]),
+                         x[:, 2], x[:, 3], x[:, 4]), axis=-1)
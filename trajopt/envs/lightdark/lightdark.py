@@ -11,6 +11,8 @@ from gym.utils import seeding
 
 import autograd.numpy as np
 
+from trajopt.autodiff import backend_of
+
 
 class LightDark(gym.Env):
 
@@ -75,6 +77,10 @@ class LightDark(gym.Env):
     def dynamics(self, x, u):
         return x + self._dt * u
 
+    def dynamics_batch(self, x, u):
+        # x: (N, xdim), u: (N, udim)
+        return x + self._dt * u
+
     def dyn_noise(self, x=None, u=None):
         return 1.e-8 * np.eye(self.nb_xdim)
 
@@ -82,13 +88,15 @@ class LightDark(gym.Env):
         return x
 
     def obs_noise(self, x=None):
+        np = backend_of(x).numpy
         _sigma = 1e-4 * np.eye(self.nb_zdim)
-        _sigma += np.array([[0.5 * (5. - x[0])**2, 0.],
-                           [0., 0.]])
+        _sigma = _sigma + np.array([[0.5 * (5. - x[0])**2, 0.],
+                                   [0., 0.]])
         return _sigma
 
     # cost defined over belief
     def cost(self, mu_b, sigma_b, u, a):
+        np = backend_of(mu_b, sigma_b, u).numpy
         if a:
             return (mu_b - self._g).T @ np.diag(self._bw) @ (mu_b - self._g) +\
                    u.T @ np.diag(self._uw) @ u +\
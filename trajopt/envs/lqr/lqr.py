@@ -4,9 +4,15 @@ from gym.utils import seeding
 
 import autograd.numpy as np
 
+from trajopt.autodiff import backend_of
+
 
 class LQR(gym.Env):
 
+    # reset and step sample init and dynamics with gaussian noise,
+    # samplers may replace them by init, dynamics_batch and noise_batch
+    gaussian_step = True
+
     def __init__(self):
         self.nb_xdim = 2
         self.nb_udim = 1
@@ -57,6 +63,7 @@ class LQR(gym.Env):
         return np.array([5., 5.]), 1.e-4 * np.eye(2)
 
     def dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         u = np.clip(u, -self._umax, self._umax)
 
         def f(x, u):
@@ -72,7 +79,26 @@ class LQR(gym.Env):
 
         return xn
 
+    def dynamics_batch(self, x, u):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim)
+        u = np.clip(u, -self._umax, self._umax)
+
+        def f(x, u):
+            return x @ self._A.T + u @ self._B.T + self._c
+
+        k1 = f(x, u)
+        k2 = f(x + 0.5 * self.dt * k1, u)
+        k3 = f(x + 0.5 * self.dt * k2, u)
+        k4 = f(x + self.dt * k3, u)
+
+        xn = x + self.dt / 6. * (k1 + 2. * k2 + 2. * k3 + k4)
+        xn = np.clip(xn, -self._xmax, self._xmax)
+
+        return xn
+
     def inverse_dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         u = np.clip(u, -self._umax, self._umax)
 
         def f(x, u):
@@ -93,12 +119,24 @@ class LQR(gym.Env):
         x = np.clip(x, -self._xmax, self._xmax)
         return self._sigma
 
+    def noise_batch(self, x, u):
+        # x: (N, xdim), u: (N, udim), state-action independent noise
+        return np.broadcast_to(self._sigma, (x.shape[0], ) + self._sigma.shape)
+
     def cost(self, x, u, a, xref=None):
+        np = backend_of(x, u, xref).numpy
         if a:
             return (x - self._g).T @ np.diag(self._gw) @ (x - self._g) + u.T @ np.diag(self._uw) @ u
         else:
             return u.T @ np.diag(self._uw) @ u
 
+    def cost_batch(self, x, u, a):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim), a: (N, )
+        _x = x - self._g
+        return np.where(a, np.einsum('nk,k,nk->n', _x, self._gw, _x), 0.) +\
+               np.einsum('nk,k,nk->n', u, self._uw, u)
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
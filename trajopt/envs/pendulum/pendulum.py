@@ -3,11 +3,16 @@ from gym import spaces
 from gym.utils import seeding
 
 import autograd.numpy as np
-from autograd import jacobian
+
+from trajopt.autodiff import backend_of
 
 
 class Pendulum(gym.Env):
 
+    # reset and step sample init and dynamics with gaussian noise,
+    # samplers may replace them by init, dynamics_batch and noise_batch
+    gaussian_step = True
+
     def __init__(self):
         self.nb_xdim = 2
         self.nb_udim = 1
@@ -59,6 +64,7 @@ class Pendulum(gym.Env):
         return self._x0, self._sigma_0
 
     def dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         u = np.clip(u, -self._umax, self._umax)
 
         g, m, l = 9.80665, 1., 1.
@@ -79,7 +85,30 @@ class Pendulum(gym.Env):
 
         return xn
 
+    def dynamics_batch(self, x, u):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim)
+        u = np.clip(u, -self._umax, self._umax)
+
+        g, m, l = 9.80665, 1., 1.
+
+        def f(x, u):
+            th, dth = x[:, 0], x[:, 1]
+            return np.stack((dth, 3. * g / (2. * l) * np.sin(th) +
+                             3. / (m * l ** 2) * (u[:, 0] - self._k * dth)), axis=-1)
+
+        k1 = f(x, u)
+        k2 = f(x + 0.5 * self.dt * k1, u)
+        k3 = f(x + 0.5 * self.dt * k2, u)
+        k4 = f(x + self.dt * k3, u)
+
+        xn = x + self.dt / 6. * (k1 + 2. * k2 + 2. * k3 + k4)
+        xn = np.clip(xn, -self._xmax, self._xmax)
+
+        return xn
+
     def inverse_dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         u = np.clip(u, -self._umax, self._umax)
 
         g, m, l = 9.80665, 1., 1.
@@ -103,8 +132,12 @@ class Pendulum(gym.Env):
     def features(self, x):
         return x
 
+    def features_batch(self, x):
+        # x: (N, xdim)
+        return x
+
     def features_jacobian(self, x):
-        _J = jacobian(self.features, 0)
+        _J = backend_of(x).jacobian(self.features, 0)
         _j = self.features(x) - _J(x) @ x
         return _J, _j
 
@@ -113,8 +146,13 @@ class Pendulum(gym.Env):
         x = np.clip(x, -self._xmax, self._xmax)
         return self._sigma
 
+    def noise_batch(self, x, u):
+        # x: (N, xdim), u: (N, udim), state-action independent noise
+        return np.broadcast_to(self._sigma, (x.shape[0], ) + self._sigma.shape)
+
     # xref is a hack to avoid autograd diffing through the jacobian
     def cost(self, x, u, a, xref):
+        np = backend_of(x, u, xref).numpy
         if a:
             _J, _j = self.features_jacobian(xref)
             _x = _J(xref) @ x + _j
@@ -122,6 +160,13 @@ class Pendulum(gym.Env):
         else:
             return u.T @ np.diag(self._uw) @ u
 
+    def cost_batch(self, x, u, a):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim), a: (N, ), features taken at x
+        _x = self.features_batch(x) - self._g
+        return np.where(a, np.einsum('nk,k,nk->n', _x, self._gw, _x), 0.) +\
+               np.einsum('nk,k,nk->n', u, self._uw, u)
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
@@ -151,8 +196,14 @@ class PendulumWithCartesianCost(Pendulum):
         self._gw = np.array([1.e1, 1.e-1, 1.e-1])
 
     def features(self, x):
+        np = backend_of(x).numpy
         return np.array([np.cos(x[0]), np.sin(x[0]), x[1]])
 
+    def features_batch(self, x):
+        np = backend_of(x).numpy
+        # x: (N, xdim)
+        return np.stack((np.cos(x[:, 0]), np.sin(x[:, 0]), x[:, 1]), axis=-1)
+
 
 class PendulumWithCartesianObservation(Pendulum):
 
@@ -175,6 +226,7 @@ class PendulumWithCartesianObservation(Pendulum):
                                             high=self._xmax)
 
     def dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         u = np.clip(u, -self._umax, self._umax)
 
         g, m, l = 9.80665, 1., 1.
@@ -199,7 +251,34 @@ class PendulumWithCartesianObservation(Pendulum):
         xn = np.clip(xn, -self._xmax, self._xmax)
         return xn
 
+    def dynamics_batch(self, x, u):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim)
+        u = np.clip(u, -self._umax, self._umax)
+
+        g, m, l = 9.80665, 1., 1.
+
+        # transfer to th/thd space
+        _x = np.stack((np.arctan2(x[:, 1], x[:, 0]), x[:, 2]), axis=-1)
+
+        def f(x, u):
+            th, dth = x[:, 0], x[:, 1]
+            return np.stack((dth, 3. * g / (2. * l) * np.sin(th) +
+                             3. / (m * l ** 2) * (u[:, 0] - self._k * dth)), axis=-1)
+
+        k1 = f(_x, u)
+        k2 = f(_x + 0.5 * self.dt * k1, u)
+        k3 = f(_x + 0.5 * self.dt * k2, u)
+        k4 = f(_x + self.dt * k3, u)
+
+        _xn = _x + self.dt / 6. * (k1 + 2. * k2 + 2. * k3 + k4)
+        xn = np.stack((np.cos(_xn[:, 0]), np.sin(_xn[:, 0]), _xn[:, 1]), axis=-1)
+
+        xn = np.clip(xn, -self._xmax, self._xmax)
+        return xn
+
     def inverse_dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         u = np.clip(u, -self._umax, self._umax)
 
         g, m, l = 9.80665, 1., 1.
@@ -1,6 +1,7 @@
 import autograd.numpy as np
 import warnings
 
+from trajopt.autodiff import backend_of
 from trajopt.envs.quanser.common import Base, LabeledBox, Timing
 
 X_LIM = 0.814
@@ -102,6 +103,7 @@ class CartpoleDynamics:
         self.Jeq = self.mc + (self.eta_g * self.Kg ** 2 * self.Jm) / (self.r_mp ** 2)
 
     def __call__(self, s, v_m):
+        np = backend_of(s, v_m).numpy
         x, theta, x_dot, theta_dot = s
 
         # Compute force acting on the cart:
@@ -117,3 +119,24 @@ class CartpoleDynamics:
 
         s_ddot = np.linalg.solve(A, b)
         return s_ddot
+
+    def batch(self, s, v_m):
+        np = backend_of(s, v_m).numpy
+        # s: (N, 4), v_m: (N, 1)
+        x_dot, theta, theta_dot = s[:, 2], s[:, 1], s[:, 3]
+
+        F = (self.eta_g * self.Kg * self.eta_m * self.Kt) / (self.Rm * self.r_mp) *\
+            (-self.Kg * self.Km * x_dot / self.r_mp + self.eta_m * v_m[:, 0])
+
+        _ones = np.ones_like(theta)
+        _cth = self.mp * self.pl * np.cos(theta + np.pi)
+
+        # stacked (N, 2, 2) mass matrices
+        A = np.stack((np.stack(((self.mp + self.Jeq) * _ones, _cth), axis=-1),
+                      np.stack((_cth, (self.Jp + self.mp * self.pl ** 2) * _ones), axis=-1)), axis=-2)
+
+        b = np.stack((F - self.Beq * x_dot - self.mp * self.pl * np.sin(theta + np.pi) * theta_dot ** 2,
+                      0. - self.Bp * theta_dot - self.mp * self.pl * self.g * np.sin(theta + np.pi)), axis=-1)
+
+        s_ddot = np.linalg.solve(A, b[..., None])[..., 0]
+        return s_ddot
@@ -1,6 +1,6 @@
 import autograd.numpy as np
-from autograd import jacobian
 
+from trajopt.autodiff import backend_of
 from trajopt.envs.quanser.common import VelocityFilter
 from trajopt.envs.quanser.cartpole.base import QCartpoleBase, X_LIM, CartpoleDynamics
 
@@ -130,6 +130,7 @@ class QCartpoleTO(QCartpoleBase):
         return self._x0, self._sigma_0
 
     def dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         def f(x, u):
             _acc = self.dyn(x, u)
             return np.hstack((x[2], x[3], _acc))
@@ -142,11 +143,26 @@ class QCartpoleTO(QCartpoleBase):
         xn = x + self.timing.dt / 6. * (k1 + 2. * k2 + 2. * k3 + k4)
         return xn
 
+    def dynamics_batch(self, x, u):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim)
+        def f(x, u):
+            _acc = self.dyn.batch(x, u)
+            return np.hstack((x[:, 2:], _acc))
+
+        k1 = f(x, u)
+        k2 = f(x + 0.5 * self.timing.dt * k1, u)
+        k3 = f(x + 0.5 * self.timing.dt * k2, u)
+        k4 = f(x + self.timing.dt * k3, u)
+
+        xn = x + self.timing.dt / 6. * (k1 + 2. * k2 + 2. * k3 + k4)
+        return xn
+
     def features(self, x):
         return x
 
     def features_jacobian(self, x):
-        _J = jacobian(self.features, 0)
+        _J = backend_of(x).jacobian(self.features, 0)
         _j = self.features(x) - _J(x) @ x
         return _J, _j
 
@@ -155,6 +171,7 @@ class QCartpoleTO(QCartpoleBase):
 
     # xref is a hack to avoid autograd diffing through the jacobian
     def cost(self, x, u, a, xref):
+        np = backend_of(x, u, xref).numpy
         if a:
             _J, _j = self.features_jacobian(xref)
             _x = _J(xref) @ x + _j
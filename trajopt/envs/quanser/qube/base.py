@@ -1,6 +1,7 @@
 import autograd.numpy as np
 import warnings
 
+from trajopt.autodiff import backend_of
 from trajopt.envs.quanser.common import Base, LabeledBox, Timing
 
 
@@ -106,6 +107,7 @@ class QubeDynamics:
         self._init_const()
 
     def __call__(self, s, u):
+        np = backend_of(s, u).numpy
         th, al, thd, ald = s
         voltage = u[0]
 
@@ -1,6 +1,6 @@
 import autograd.numpy as np
-from autograd import jacobian
 
+from trajopt.autodiff import backend_of
 from trajopt.envs.quanser.common import VelocityFilter
 from trajopt.envs.quanser.qube.base import QubeBase, QubeDynamics
 
@@ -123,9 +123,27 @@ class QubeTO(QubeBase):
         return self._x0, self._sigma_0
 
     def dynamics(self, x, u):
+        np = backend_of(x, u).numpy
         def f(x, u):
             _acc = self.dyn(x, u)
-            return np.hstack((x[2], x[3], _acc))
+            # a nested tuple would hide the accelerations from autograd
+            return np.hstack((x[2], x[3]) + tuple(_acc))
+
+        k1 = f(x, u)
+        k2 = f(x + 0.5 * self.timing.dt * k1, u)
+        k3 = f(x + 0.5 * self.timing.dt * k2, u)
+        k4 = f(x + self.timing.dt * k3, u)
+
+        xn = x + self.timing.dt / 6. * (k1 + 2. * k2 + 2. * k3 + k4)
+        return xn
+
+    def dynamics_batch(self, x, u):
+        np = backend_of(x, u).numpy
+        # x: (N, xdim), u: (N, udim)
+        def f(x, u):
+            # the accelerations are elementwise in the transposed batch
+            _acc = self.dyn(x.T, u.T)
+            return np.stack((x[:, 2], x[:, 3]) + tuple(_acc), axis=-1)
 
         k1 = f(x, u)
         k2 = f(x + 0.5 * self.timing.dt * k1, u)
@@ -139,7 +157,7 @@ class QubeTO(QubeBase):
         return x
 
     def features_jacobian(self, x):
-        _J = jacobian(self.features, 0)
+        _J = backend_of(x).jacobian(self.features, 0)
         _j = self.features(x) - _J(x) @ x
         return _J, _j
 
@@ -148,6 +166,7 @@ class QubeTO(QubeBase):
 
     # xref is a hack to avoid autograd diffing through the jacobian
     def cost(self, x, u, a, xref):
+        np = backend_of(x, u, xref).numpy
         if a:
             _J, _j = self.features_jacobian(xref)
             _x = _J(xref) @ x + _j
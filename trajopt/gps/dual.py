@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: dual.py
+# @Date: 2019-07-18-10-30
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import autograd.numpy as np
+
+
+def bracketed_dual(dual, alpha, gtol, bounds=(-1e8, -1e-8),
+                   xtol=1e-8, maxiter=50):
+    """
+    Minimizes the convex 1-d dual of the gps temperature alpha < 0.
+    The gradient of the dual, kl(alpha) - kl_bound, is monotone, its
+    root is searched over eta = log(-alpha), starting from a warm alpha,
+    by secant steps on a bracket that is guaranteed to shrink (illinois).
+    An alpha outside the domain of the dual has an infinite gradient
+    :param dual: dual(alpha) -> (value, gradient), both as 1-d arrays
+    :param alpha: warm start, e.g. the alpha of the last iteration
+    :param gtol: tolerance on the gradient, i.e. on the kl
+    :param bounds: lower and upper bound on alpha
+    :param xtol: tolerance on the bracket in eta
+    :return: alpha as 1-d array and the number of dual evaluations
+    """
+    _nb_evals = 0
+
+    def _grad(eta):
+        nonlocal _nb_evals
+        _nb_evals += 1
+        return float(dual(np.array([- np.exp(eta)]))[1][0])
+
+    # the gradient decreases in eta
+    _lb, _ub = np.log(- bounds[1]), np.log(- bounds[0])
+    _eta = np.clip(np.log(- float(np.ravel(alpha)[0])), _lb, _ub)
+    _g = _grad(_eta)
+
+    # bracket the root, expanding steps from the warm start
+    _step = 1.
+    _a, _ga, _b, _gb = _eta, _g, _eta, _g
+    if _g > 0.:
+        while _g > 0. and _eta < _ub:
+            _a, _ga = _eta, _g
+            _eta = min(_eta + _step, _ub)
+            _g = _grad(_eta)
+            _b, _gb = _eta, _g
+            _step *= 2.
+    else:
+        while _g < 0. and _eta > _lb:
+            _b, _gb = _eta, _g
+            _eta = max(_eta - _step, _lb)
+            _g = _grad(_eta)
+            _a, _ga = _eta, _g
+            _step *= 2.
+
+    # constraint inactive or unreachable, solution on a bound
+    if _ga <= 0.:
+        return np.array([- np.exp(_a)]), _nb_evals
+    if _gb >= 0.:
+        return np.array([- np.exp(_b)]), _nb_evals
+
+    _eta, _g = (_a, _ga) if abs(_ga) < abs(_gb) else (_b, _gb)
+
+    _side = 0
+    for _ in range(maxiter):
+        if abs(_g) < gtol or _b - _a < xtol:
+            break
+
+        # secant on the bracket, bisection next to a diverged end
+        if np.isfinite(_ga):
+            _eta = _a - _ga * (_b - _a) / (_gb - _ga)
+        else:
+            _eta = 0.5 * (_a + _b)
+        _g = _grad(_eta)
+
+        # halve the kept end if it is kept twice in a row
+        if _g > 0.:
+            _a, _ga = _eta, _g
+            if _side == 1:
+                _gb *= 0.5
+            _side = 1
+        else:
+            _b, _gb = _eta, _g
+            if _side == -1:
+                _ga *= 0.5
+            _side = -1
+
+    # never end on a diverged alpha
+    if not np.isfinite(_g):
+        _eta = _b
+
+    return np.array([- np.exp(_eta)]), _nb_evals
+
+
+def finite_dual(dual, barrier=1.e20):
+    """
+    Wraps a dual for optimizers that need finite values, e.g. L-BFGS.
+    An alpha outside the domain of the dual gets a large value and
+    a gradient pushing alpha towards larger magnitudes
+    :param dual: dual(alpha) -> (value, gradient), both as 1-d arrays
+    :param barrier: value and gradient of a diverged alpha
+    """
+    def _dual(alpha):
+        _value, _grad = dual(alpha)
+        if not np.all(np.isfinite(_value)):
+            return np.full_like(_value, barrier), np.full_like(_grad, barrier)
+        return _value, _grad
+
+    return _dual
@@ -5,6 +5,8 @@
 # @Author: Hany Abdulsamad
 # @Contact: hany@robot-learning.de
 
+import warnings
+
 import autograd.numpy as np
 
 import scipy as sc
@@ -15,30 +17,92 @@ from trajopt.gps.objects import AnalyticalLinearGaussianDynamics, AnalyticalQuad
 from trajopt.gps.objects import QuadraticStateValue, QuadraticStateActionValue
 from trajopt.gps.objects import LinearGaussianControl
 
-from trajopt.gps.core import kl_divergence, quad_expectation, augment_cost
-from trajopt.gps.core import forward_pass, backward_pass
+from trajopt.gps.core import kl_divergence, augment_cost
+from trajopt.gps.core import forward_pass, backward_pass, parallel_backward_pass
+from trajopt.gps.core import dual_and_grad
+
+from trajopt.gps.dual import bracketed_dual, finite_dual
+
+from trajopt.autodiff import get_backend
+from trajopt.rollout import Rollout
+from trajopt.parallel import WorkerPool
+from trajopt.profiling import NullProfiler
 
 
 class MBGPS:
 
     def __init__(self, env, nb_steps, kl_bound,
                  init_ctl_sigma,
-                 activation=range(-1, 0)):
+                 activation=range(-1, 0),
+                 backend='autograd',
+                 sampler='serial',
+                 backward='sequential', nb_threads=0,
+                 dual_solver='bracketed', dual_tol=1.e-3,
+                 profiler=None):
 
         self.env = env
 
+        # phase timings and event counts, nothing recorded by default
+        self.profiler = profiler if profiler is not None else NullProfiler()
+
+        # autodiff backend, autograd or jax
+        self.backend = get_backend(backend)
+
         # expose necessary functions
         self.env_dyn = self.env.unwrapped.dynamics
         self.env_noise = self.env.unwrapped.noise
         self.env_cost = self.env.unwrapped.cost
         self.env_init = self.env.unwrapped.init
 
+        # batched dynamics, noise and cost take (nb_rows, nb_xdim) and (nb_rows, nb_udim)
+        self.env_dyn_batch = getattr(self.env.unwrapped, 'dynamics_batch', None)
+        if self.env_dyn_batch is None:
+            self.env_dyn_batch = self.backend.batch(self.env_dyn)
+
+        self.env_noise_batch = getattr(self.env.unwrapped, 'noise_batch', None)
+        if self.env_noise_batch is None:
+            self.env_noise_batch = self.backend.batch(self.env_noise)
+
+        self.env_cost_batch = getattr(self.env.unwrapped, 'cost_batch', None)
+
+        # episode sampling, serial, vectorized or pool
+        self.sampler = sampler
+        if self.sampler not in ('serial', 'vectorized', 'pool'):
+            raise ValueError("Unknown sampler '{}', choose from "
+                             "['serial', 'vectorized', 'pool']".format(self.sampler))
+
+        # the vectorized sampler replaces reset and step of the env,
+        # only valid if the env declares them as gaussian around its model
+        if self.sampler == 'vectorized' and not getattr(self.env.unwrapped, 'gaussian_step', False):
+            warnings.warn("{} does not declare a gaussian_step, "
+                          "sampling serially".format(type(self.env.unwrapped).__name__))
+            self.sampler = 'serial'
+
         self.ulim = self.env.action_space.high
 
         self.nb_xdim = self.env.observation_space.shape[0]
         self.nb_udim = self.env.action_space.shape[0]
         self.nb_steps = nb_steps
 
+        # backward pass, sequential or parallel-in-time scan,
+        # nb_threads=0 uses all available cores
+        self.backward = backward
+        if self.backward not in ('sequential', 'parallel'):
+            raise ValueError("Unknown backward pass '{}', choose from "
+                             "['sequential', 'parallel']".format(self.backward))
+        self.nb_threads = nb_threads
+
+        # dual over the temperature, bracketed root search or
+        # scipy's l-bfgs-b, dual_tol is relative to the kl bound
+        self.dual_solver = dual_solver
+        if self.dual_solver not in ('bracketed', 'lbfgs'):
+            raise ValueError("Unknown dual solver '{}', choose from "
+                             "['bracketed', 'lbfgs']".format(self.dual_solver))
+        self.dual_tol = dual_tol
+
+        # dual evaluations of every iteration
+        self.dual_evaluations = []
+
         # total kl over traj.
         self.kl_base = kl_bound
         self.kl_bound = kl_bound
@@ -61,42 +125,112 @@ class MBGPS:
         self.qfunc = QuadraticStateActionValue(self.nb_xdim, self.nb_udim, self.nb_steps)
 
         self.dyn = AnalyticalLinearGaussianDynamics(self.env_init, self.env_dyn, self.env_noise,
-                                                    self.nb_xdim, self.nb_udim, self.nb_steps)
+                                                    self.nb_xdim, self.nb_udim, self.nb_steps,
+                                                    backend=self.backend)
         self.ctl = LinearGaussianControl(self.nb_xdim, self.nb_udim, self.nb_steps, init_ctl_sigma)
-        self.ctl.kff = 1e-2 * np.random.randn(self.nb_udim, self.nb_steps)
+        self.ctl.kff[...] = 1e-2 * np.random.randn(self.nb_udim, self.nb_steps)
 
         # activation of cost function
         self.activation = np.zeros((self.nb_steps + 1,), dtype=np.int64)
         self.activation[-1] = 1.  # last step always in
         self.activation[activation] = 1.
 
-        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps + 1)
+        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps + 1,
+                                            f_batch=self.env_cost_batch, backend=self.backend)
+
+        # batched cost of the extended kalman rollouts
+        self.rollout = Rollout(self.env_dyn, self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps,
+                               backend=self.backend)
 
         self.last_return = - np.inf
 
     def sample(self, nb_episodes, stoch=True):
+        if self.sampler == 'vectorized':
+            return self.sample_batch(nb_episodes, stoch)
+
+        data = {'x': np.zeros((self.nb_xdim, self.nb_steps, nb_episodes)),
+                'u': np.zeros((self.nb_udim, self.nb_steps, nb_episodes)),
+                'xn': np.zeros((self.nb_xdim, self.nb_steps, nb_episodes)),
+                'c': np.zeros((self.nb_steps + 1, nb_episodes))}
+
+        if self.sampler == 'pool':
+            # independent seeds for env and controller noise in every worker
+            _seeds = np.random.randint(2**31, size=nb_episodes).tolist()
+            with WorkerPool(self) as pool:
+                _episodes = pool.starmap('episode', [(stoch, _seed) for _seed in _seeds])
+        else:
+            _episodes = (self.episode(stoch) for _ in range(nb_episodes))
+
+        for n, _episode in enumerate(_episodes):
+            data['x'][..., n], data['u'][..., n],\
+            data['xn'][..., n], data['c'][..., n] = _episode
+
+        return data
+
+    def episode(self, stoch=True, seed=None):
+        if seed is not None:
+            self.env.unwrapped.seed(seed)
+            np.random.seed(seed)
+
+        state = np.zeros((self.nb_xdim, self.nb_steps))
+        action = np.zeros((self.nb_udim, self.nb_steps))
+        nxt_state = np.zeros((self.nb_xdim, self.nb_steps))
+        cost = np.zeros((self.nb_steps + 1, ))
+
+        x = self.env.reset()
+
+        for t in range(self.nb_steps):
+            u = self.ctl.sample(x, t, stoch)
+            action[..., t] = u
+
+            # expose true reward function
+            cost[..., t] = self.cost.evalf(x, u, self.activation[t])
+
+            state[..., t] = x
+            x, _, _, _ = self.env.step(np.clip(u, - self.ulim, self.ulim))
+            nxt_state[..., t] = x
+
+        cost[..., -1] = self.cost.evalf(x, np.zeros((self.nb_udim, )), self.activation[-1])
+
+        return state, action, nxt_state, cost
+
+    def sample_batch(self, nb_episodes, stoch=True):
+        """
+        Advance all episodes at once, with the env's dynamics_batch,
+        noise_batch and cost_batch where available. Replaces reset and
+        step of envs with a gaussian_step, noise covariances have to
+        be positive definite
+        :param nb_episodes:
+        :param stoch:
+        :return:
+        """
         data = {'x': np.zeros((self.nb_xdim, self.nb_steps, nb_episodes)),
                 'u': np.zeros((self.nb_udim, self.nb_steps, nb_episodes)),
                 'xn': np.zeros((self.nb_xdim, self.nb_steps, nb_episodes)),
                 'c': np.zeros((self.nb_steps + 1, nb_episodes))}
 
-        for n in range(nb_episodes):
-            x = self.env.reset()
+        _np_random = self.env.unwrapped.np_random
 
-            for t in range(self.nb_steps):
-                u = self.ctl.sample(x, t, stoch)
-                data['u'][..., t, n] = u
+        _mu_0, _sigma_0 = self.env_init()
+        x = _mu_0 + _np_random.standard_normal((nb_episodes, self.nb_xdim)) @ np.linalg.cholesky(_sigma_0).T
 
-                # expose true reward function
-                c = self.cost.evalf(x, u, self.activation[t])
-                data['c'][t] = c
+        for t in range(self.nb_steps):
+            u = self.ctl.sample_batch(x, t, stoch)
+            data['u'][..., t, :] = u.T
+
+            # expose true reward function
+            data['c'][t, :] = self.cost.evalfb(x, u, self.activation[t])
+
+            data['x'][..., t, :] = x.T
+
+            u = np.clip(u, - self.ulim, self.ulim)
+            _L = np.linalg.cholesky(self.env_noise_batch(x, u))
+            x = self.env_dyn_batch(x, u)
+            x = x + np.einsum('nkh,nh->nk', _L, _np_random.standard_normal((nb_episodes, self.nb_xdim)))
 
-                data['x'][..., t, n] = x
-                x, _, _, _ = self.env.step(np.clip(u, - self.ulim, self.ulim))
-                data['xn'][..., t, n] = x
+            data['xn'][..., t, :] = x.T
 
-            c = self.cost.evalf(x, np.zeros((self.nb_udim, )), self.activation[-1])
-            data['c'][-1, n] = c
+        data['c'][-1, :] = self.cost.evalfb(x, np.zeros((nb_episodes, self.nb_udim)), self.activation[-1])
 
         return data
 
@@ -108,15 +242,14 @@ class MBGPS:
         """
         xdist = Gaussian(self.nb_xdim, self.nb_steps + 1)
         udist = Gaussian(self.nb_udim, self.nb_steps)
-        cost = np.zeros((self.nb_steps + 1, ))
 
         xdist.mu[..., 0], xdist.sigma[..., 0] = self.dyn.evali()
         for t in range(self.nb_steps):
             udist.mu[..., t], udist.sigma[..., t] = lgc.forward(xdist, t)
-            cost[..., t] = self.cost.evalf(xdist.mu[..., t], udist.mu[..., t], self.activation[t])
             xdist.mu[..., t + 1], xdist.sigma[..., t + 1] = self.dyn.forward(xdist, udist, lgc, t)
 
-        cost[..., -1] = self.cost.evalf(xdist.mu[..., -1], np.zeros((self.nb_udim, )), self.activation[-1])
+        # cost of the means, all steps at once
+        cost = self.rollout.evalc(xdist.mu, udist.mu, self.activation)
         return xdist, udist, cost
 
     def forward_pass(self, lgc):
@@ -137,6 +270,12 @@ class MBGPS:
                                                self.nb_xdim, self.nb_udim, self.nb_steps)
         return xdist, udist, xudist
 
+    def backward_kernel(self, *args):
+        if self.backward == 'parallel':
+            return parallel_backward_pass(*args, self.nb_threads)
+        else:
+            return backward_pass(*args)
+
     def backward_pass(self, alpha, agcost):
         lgc = LinearGaussianControl(self.nb_xdim, self.nb_udim, self.nb_steps)
         xvalue = QuadraticStateValue(self.nb_xdim, self.nb_steps + 1)
@@ -145,10 +284,10 @@ class MBGPS:
         xuvalue.Qxx, xuvalue.Qux, xuvalue.Quu,\
         xuvalue.qx, xuvalue.qu, xuvalue.q0, xuvalue.q0_softmax,\
         xvalue.V, xvalue.v, xvalue.v0, xvalue.v0_softmax,\
-        lgc.K, lgc.kff, lgc.sigma, diverge = backward_pass(agcost.Cxx, agcost.cx, agcost.Cuu,
-                                                           agcost.cu, agcost.Cxu, agcost.c0,
-                                                           self.dyn.A, self.dyn.B, self.dyn.c, self.dyn.sigma,
-                                                           alpha, self.nb_xdim, self.nb_udim, self.nb_steps)
+        lgc.K, lgc.kff, lgc.sigma, diverge = self.backward_kernel(agcost.Cxx, agcost.cx, agcost.Cuu,
+                                                                  agcost.cu, agcost.Cxu, agcost.c0,
+                                                                  self.dyn.A, self.dyn.B, self.dyn.c, self.dyn.sigma,
+                                                                  alpha, self.nb_xdim, self.nb_udim, self.nb_steps)
         return lgc, xvalue, xuvalue, diverge
 
     def augment_cost(self, alpha):
@@ -161,25 +300,41 @@ class MBGPS:
         return agcost
 
     def dual(self, alpha):
-        # augmented cost
-        agcost = self.augment_cost(alpha)
-
-        # backward pass
-        lgc, xvalue, xuvalue, diverge = self.backward_pass(alpha, agcost)
+        self.profiler.count('dual_evaluations')
+
+        # augmented cost, backward pass, forward pass
+        # and kl divergence in a single call
+        dual, grad, diverge = dual_and_grad(np.ravel(alpha)[0], self.kl_bound,
+                                            self.cost.Cxx, self.cost.cx, self.cost.Cuu,
+                                            self.cost.cu, self.cost.Cxu, self.cost.c0,
+                                            self.dyn.A, self.dyn.B, self.dyn.c, self.dyn.sigma,
+                                            self.xdist.mu[..., 0], self.xdist.sigma[..., 0],
+                                            self.ctl.K, self.ctl.kff, self.ctl.sigma,
+                                            self.nb_xdim, self.nb_udim, self.nb_steps,
+                                            False, self.backward == 'parallel', self.nb_threads)
+
+        # a diverged backward pass returns an infinite dual and kl
+        if diverge:
+            self.profiler.count('diverged_backward_passes')
 
-        # forward pass
-        xdist, udist, xudist = self.forward_pass(lgc)
-
-        # dual expectation
-        dual = quad_expectation(xdist.mu[..., 0], xdist.sigma[..., 0],
-                                xvalue.V[..., 0], xvalue.v[..., 0],
-                                xvalue.v0_softmax[..., 0])
-        dual += alpha * self.kl_bound
+        return -1. * np.array([dual]), -1. * np.array([grad])
 
-        # gradient
-        grad = self.kl_bound - self.kldiv(lgc, xdist)
+    def optimize_dual(self):
+        if self.dual_solver == 'bracketed':
+            # warm started from the last alpha
+            alpha, _nb = bracketed_dual(self.dual, self.alpha,
+                                        gtol=self.dual_tol * self.kl_bound)
+        else:
+            res = sc.optimize.minimize(finite_dual(self.dual), np.array([-1.e3]),
+                                       method='L-BFGS-B',
+                                       jac=True,
+                                       bounds=((-1e8, -1e-8), ),
+                                       options={'disp': False, 'maxiter': 1000,
+                                                'ftol': 1e-10})
+            alpha, _nb = res.x, res.nfev
 
-        return -1. * np.array([dual]), -1. * np.array([grad])
+        self.dual_evaluations.append(_nb)
+        return alpha
 
     def kldiv(self, lgc, xdist):
         return kl_divergence(lgc.K, lgc.kff, lgc.sigma,
@@ -214,32 +369,34 @@ class MBGPS:
         _trace = []
 
         # get mena traj. and linear system dynamics
-        self.xdist, self.udist, _cost = self.extended_kalman(self.ctl)
+        with self.profiler.phase('extended_kalman'):
+            self.xdist, self.udist, _cost = self.extended_kalman(self.ctl)
         # mean objective under current dists.
         self.last_return = np.sum(_cost)
         _trace.append(self.last_return)
 
         for _ in range(nb_iter):
+            self.profiler.step()
+
             # get quadratic cost around mean traj.
-            self.cost.taylor_expansion(self.xdist.mu, self.udist.mu, self.activation)
+            with self.profiler.phase('cost.taylor_expansion'):
+                self.cost.taylor_expansion(self.xdist.mu, self.udist.mu, self.activation)
 
-            # use scipy optimizer
-            res = sc.optimize.minimize(self.dual, np.array([-1.e3]),
-                                       method='L-BFGS-B',
-                                       jac=True,
-                                       bounds=((-1e8, -1e-8), ),
-                                       options={'disp': False, 'maxiter': 1000,
-                                                'ftol': 1e-10})
-            self.alpha = res.x
+            # optimize dual over alpha
+            with self.profiler.phase('optimize_dual', solver=self.dual_solver):
+                self.alpha = self.optimize_dual()
 
             # re-compute after opt.
             agcost = self.augment_cost(self.alpha)
-            lgc, xvalue, xuvalue, diverge = self.backward_pass(self.alpha, agcost)
-            xdist, udist, _cost = self.extended_kalman(lgc)
+            with self.profiler.phase('backward_pass'):
+                lgc, xvalue, xuvalue, diverge = self.backward_pass(self.alpha, agcost)
+            with self.profiler.phase('extended_kalman'):
+                xdist, udist, _cost = self.extended_kalman(lgc)
             _return = np.sum(_cost)
 
             # get expected improvment:
-            expected_xdist, expected_udist, _ = self.forward_pass(lgc)
+            with self.profiler.phase('forward_pass'):
+                expected_xdist, expected_udist, _ = self.forward_pass(lgc)
             _expected_return = self.cost.evaluate(expected_xdist.mu, expected_udist.mu)
 
             # expected vs actual improvement
@@ -265,6 +422,7 @@ class MBGPS:
                 # update last return to current
                 self.last_return = _return
             else:
+                self.profiler.count('rejected_steps')
                 print("Something is wrong, KL not satisfied")
 
             # update kl bound
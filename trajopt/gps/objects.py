@@ -6,17 +6,19 @@
 # @Contact: hany@robot-learning.de
 
 import autograd.numpy as np
-from autograd import jacobian, hessian
 from copy import deepcopy
 
+from trajopt.autodiff import get_backend
+from trajopt.gps.regression import MatrixNormalInverseWishart, RegressionStats, regression_stats
+
 
 class Gaussian:
     def __init__(self, nb_dim, nb_steps):
         self.nb_dim = nb_dim
         self.nb_steps = nb_steps
 
-        self.mu = np.zeros((self.nb_dim, self.nb_steps))
-        self.sigma = np.zeros((self.nb_dim, self.nb_dim, self.nb_steps))
+        self.mu = np.zeros((self.nb_dim, self.nb_steps), order='F')
+        self.sigma = np.zeros((self.nb_dim, self.nb_dim, self.nb_steps), order='F')
         for t in range(self.nb_steps):
             self.sigma[..., t] = np.eye(self.nb_dim)
 
@@ -37,8 +39,8 @@ class QuadraticStateValue:
         self.nb_xdim = nb_xdim
         self.nb_steps = nb_steps
 
-        self.V = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.v = np.zeros((self.nb_xdim, self.nb_steps, ))
+        self.V = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.v = np.zeros((self.nb_xdim, self.nb_steps, ), order='F')
         self.v0 = np.zeros((self.nb_steps, ))
         self.v0_softmax = np.zeros((self.nb_steps, ))
 
@@ -49,12 +51,12 @@ class QuadraticStateActionValue:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.Qxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.Quu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps))
-        self.Qux = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps))
+        self.Qxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.Quu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps), order='F')
+        self.Qux = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps), order='F')
 
-        self.qx = np.zeros((self.nb_xdim, self.nb_steps, ))
-        self.qu = np.zeros((self.nb_udim, self.nb_steps, ))
+        self.qx = np.zeros((self.nb_xdim, self.nb_steps, ), order='F')
+        self.qu = np.zeros((self.nb_udim, self.nb_steps, ), order='F')
 
         self.q0 = np.zeros((self.nb_steps, ))
         self.q0_common = np.zeros((self.nb_steps, ))
@@ -68,13 +70,13 @@ class QuadraticCost:
 
         self.nb_steps = nb_steps
 
-        self.Cxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.cx = np.zeros((self.nb_xdim, self.nb_steps))
+        self.Cxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.cx = np.zeros((self.nb_xdim, self.nb_steps), order='F')
 
-        self.Cuu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps))
-        self.cu = np.zeros((self.nb_udim, self.nb_steps))
+        self.Cuu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps), order='F')
+        self.cu = np.zeros((self.nb_udim, self.nb_steps), order='F')
 
-        self.Cxu = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps))
+        self.Cxu = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps), order='F')
         self.c0 = np.zeros((self.nb_steps, ))
 
     @property
@@ -97,42 +99,65 @@ class QuadraticCost:
         return _ret
 
 class AnalyticalQuadraticCost(QuadraticCost):
-    def __init__(self, f, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, f, nb_xdim, nb_udim, nb_steps,
+                 f_batch=None, backend='autograd'):
         super(AnalyticalQuadraticCost, self).__init__(nb_xdim, nb_udim, nb_steps)
 
-        self.f = f
+        self.backend = get_backend(backend)
+
+        self.f = self.backend.jit(f, static_argnums=(2, ))
+
+        # value, gradient and hessian w.r.t. z = [x, u] of all steps
+        self.dcdz = self.backend.batch_value_grad_hessian(self.fz, static_argnums=(1, ))
 
-        self.dcdxx = hessian(self.f, 0)
-        self.dcduu = hessian(self.f, 1)
-        self.dcdxu = jacobian(jacobian(self.f, 0), 1)
+        # cost of a batch of states and actions, evaluated on
+        # all rows at once by f_batch(x, u, a) where available
+        self.f_batch = f_batch
+        self.fb = self.backend.batch(self.f, static_argnums=(2, ))
 
-        self.dcdx = jacobian(self.f, 0)
-        self.dcdu = jacobian(self.f, 1)
+    def fz(self, z, a, xref):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:], a, xref)
 
     def evalf(self, x, u, a):
         _xref = deepcopy(x)
         return self.f(x, u, a, _xref)
 
+    def evalfb(self, x, u, a):
+        # x: (nb_rows, nb_xdim), u: (nb_rows, nb_udim)
+        _a = np.full((x.shape[0], ), a)
+        if self.f_batch is not None:
+            return self.f_batch(x, u, _a)
+
+        _xref = deepcopy(x)
+        return self.fb(x, u, _a, _xref)
+
     def taylor_expansion(self, x, u, a):
         # padd last time step of action traj.
         _u = np.hstack((u, np.zeros((self.nb_udim, 1))))
         _xref = deepcopy(x)
-        for t in range(self.nb_steps):
-            _in = tuple([x[..., t], _u[..., t], a[t], _xref[..., t]])
-            self.Cxx[..., t] = 0.5 * self.dcdxx(*_in)
-            self.Cuu[..., t] = 0.5 * self.dcduu(*_in)
-            self.Cxu[..., t] = self.dcdxu(*_in)
 
-            self.cx[..., t] = self.dcdx(*_in) - self.dcdxx(*_in) @ x[..., t] - self.dcdxu(*_in) @ _u[..., t]
-            self.cu[..., t] = self.dcdu(*_in) - self.dcduu(*_in) @ _u[..., t] - x[..., t].T @ self.dcdxu(*_in)
+        _z = np.vstack((x, _u)).T
+        _c, _g, _H = self.dcdz(_z, a, _xref.T)
+
+        _dcdxx = np.transpose(_H[:, :self.nb_xdim, :self.nb_xdim], (1, 2, 0))
+        _dcduu = np.transpose(_H[:, self.nb_xdim:, self.nb_xdim:], (1, 2, 0))
+        _dcdxu = np.transpose(_H[:, :self.nb_xdim, self.nb_xdim:], (1, 2, 0))
+
+        self.Cxx[...] = 0.5 * _dcdxx
+        self.Cuu[...] = 0.5 * _dcduu
+        self.Cxu[...] = _dcdxu
 
-            # residual of taylor expansion
-            self.c0[..., t] = self.f(*_in) -\
-                              x[..., t].T @ self.Cxx[..., t] @ x[..., t] -\
-                              _u[..., t].T @ self.Cuu[..., t] @ _u[..., t] -\
-                              x[..., t].T @ self.Cxu[..., t] @ _u[..., t] -\
-                              self.cx[..., t].T @ x[..., t] -\
-                              self.cu[..., t].T @ _u[..., t]
+        self.cx[...] = _g[:, :self.nb_xdim].T - np.einsum('iht,ht->it', _dcdxx, x)\
+                       - np.einsum('iht,ht->it', _dcdxu, _u)
+        self.cu[...] = _g[:, self.nb_xdim:].T - np.einsum('iht,ht->it', _dcduu, _u)\
+                       - np.einsum('ht,hit->it', x, _dcdxu)
+
+        # residual of taylor expansion
+        self.c0[...] = _c - np.einsum('it,iht,ht->t', x, self.Cxx, x)\
+                       - np.einsum('it,iht,ht->t', _u, self.Cuu, _u)\
+                       - np.einsum('it,iht,ht->t', x, self.Cxu, _u)\
+                       - np.einsum('it,it->t', self.cx, x)\
+                       - np.einsum('it,it->t', self.cu, _u)
 
 
 class LinearGaussianDynamics:
@@ -141,10 +166,10 @@ class LinearGaussianDynamics:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.A = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.B = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps))
-        self.c = np.zeros((self.nb_xdim, self.nb_steps))
-        self.sigma = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
+        self.A = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.B = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps), order='F')
+        self.c = np.zeros((self.nb_xdim, self.nb_steps), order='F')
+        self.sigma = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
         for t in range(self.nb_steps):
             self.sigma[..., t] = 1e-8 * np.eye(self.nb_xdim)
 
@@ -161,15 +186,21 @@ class LinearGaussianDynamics:
 
 
 class AnalyticalLinearGaussianDynamics(LinearGaussianDynamics):
-    def __init__(self, f_init, f_dyn, noise, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, f_init, f_dyn, noise, nb_xdim, nb_udim, nb_steps,
+                 backend='autograd'):
         super(AnalyticalLinearGaussianDynamics, self).__init__(nb_xdim, nb_udim, nb_steps)
 
+        self.backend = get_backend(backend)
+
         self.i = f_init
-        self.f = f_dyn
+        self.f = self.backend.jit(f_dyn)
         self.noise = noise
 
-        self.dfdx = jacobian(self.f, 0)
-        self.dfdu = jacobian(self.f, 1)
+        # jacobian w.r.t. z = [x, u]
+        self.dfdz = self.backend.jacobian(self.fz)
+
+    def fz(self, z):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:])
 
     def evali(self):
         return self.i()
@@ -178,8 +209,9 @@ class AnalyticalLinearGaussianDynamics(LinearGaussianDynamics):
         return self.f(x, u)
 
     def taylor_expansion(self, x, u):
-        _A = self.dfdx(x, u)
-        _B = self.dfdu(x, u)
+        _grads = self.dfdz(np.hstack((x, u)))
+        _A = _grads[:, :self.nb_xdim]
+        _B = _grads[:, self.nb_xdim:]
         # residual of taylor expansion
         _c = self.evalf(x, u) - _A @ x - _B @ u
         _sigma = self.noise(x, u)
@@ -208,45 +240,111 @@ class AnalyticalLinearGaussianDynamics(LinearGaussianDynamics):
 
 
 class LearnedLinearGaussianDynamics(LinearGaussianDynamics):
-    def __init__(self, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, nb_xdim, nb_udim, nb_steps, forget=1.,
+                 nb_states=5, nb_em_iter=50, nb_warm_iter=10, em_tol=1.e-4):
         super(LearnedLinearGaussianDynamics, self).__init__(nb_xdim, nb_udim, nb_steps)
 
+        self.prior = MatrixNormalInverseWishart(self.nb_xdim, self.nb_xdim + self.nb_udim + 1)
+
+        # statistics of all absorbed batches, weighted by forget per batch
+        self.forget = forget
+        self.stats = RegressionStats(self.nb_xdim, self.nb_xdim + self.nb_udim + 1, self.nb_steps)
+
+        # switching model of the non-pointwise fit, kept over calls,
+        # nb_em_iter sweeps on the first fit and nb_warm_iter after
+        self.rarhmm = None
+        self.nb_states = nb_states
+        self.nb_em_iter = nb_em_iter
+        self.nb_warm_iter = nb_warm_iter
+        self.em_tol = em_tol
+
+        # viterbi states of the mean trajectory and what they were decoded from
+        self.z = None
+        self._mean_obs, self._mean_input, self._params = None, None, None
+
+    def fit(self, zz, yz, yy, n):
+        # all time steps in one batched map fit
+        _A, _sigma = self.prior.map(zz, yz, yy, n)
+
+        self.A[...] = np.transpose(_A[..., :self.nb_xdim], (1, 2, 0))
+        self.B[...] = np.transpose(_A[..., self.nb_xdim:self.nb_xdim + self.nb_udim], (1, 2, 0))
+        self.c[...] = _A[..., -1].T
+        self.sigma[...] = np.transpose(_sigma, (1, 2, 0))
+
+    def update(self, data):
+        # absorb a new batch and refit from the accumulated statistics
+        self.stats.update(data['x'], data['u'], data['xn'], self.forget)
+        self.fit(*self.stats.params)
+
+    def learn_with_prior(self, data, prior):
+        # per-step joint gaussians of [x, u, xn] under the
+        # normal-inverse-wishart prior of the global model
+        _dxu = self.nb_xdim + self.nb_udim
+
+        _points = prior.points(data)
+        _nb = _points.shape[1]
+
+        _mu = np.mean(_points, axis=1)
+        _diff = _points - _mu[:, None, :]
+        _sigma = np.einsum('tni,tnj->tij', _diff, _diff) / _nb
+
+        mu0, Phi, m, n0 = prior.eval(data)
+
+        _dmu = _mu - mu0
+        _sigma = (_nb * _sigma + Phi + (_nb * m) / (_nb + m) * np.einsum('ti,tj->tij', _dmu, _dmu)) / (_nb + n0)
+        _sigma = 0.5 * (_sigma + np.swapaxes(_sigma, -1, -2))
+        _mu = (m * mu0 + _nb * _mu) / (m + _nb)
+
+        # conditionals xn | x, u of all steps
+        _Sxx = _sigma[:, :_dxu, :_dxu] + 1.e-6 * np.eye(_dxu)
+        _Syx = _sigma[:, _dxu:, :_dxu]
+        _A = np.swapaxes(np.linalg.solve(_Sxx, np.swapaxes(_Syx, -1, -2)), -1, -2)
+        _c = _mu[:, _dxu:] - np.einsum('tij,tj->ti', _A, _mu[:, :_dxu])
+
+        _dyn_sigma = _sigma[:, _dxu:, _dxu:] - _A @ _Sxx @ np.swapaxes(_A, -1, -2)
+        _dyn_sigma = 0.5 * (_dyn_sigma + np.swapaxes(_dyn_sigma, -1, -2))
+
+        self.A[...] = np.transpose(_A[..., :self.nb_xdim], (1, 2, 0))
+        self.B[...] = np.transpose(_A[..., self.nb_xdim:], (1, 2, 0))
+        self.c[...] = _c.T
+        self.sigma[...] = np.transpose(_dyn_sigma, (1, 2, 0))
+
     def learn(self, data, pointwise=False):
         if pointwise:
-            from mimo import distributions
-            _hypparams = dict(M=np.zeros((self.nb_xdim, self.nb_xdim + self.nb_udim + 1)),
-                              V=1.e6 * np.eye(self.nb_xdim + self.nb_udim + 1),
-                              affine=True,
-                              psi=np.eye(self.nb_xdim), nu=self.nb_xdim + 2)
-            _prior = distributions.MatrixNormalInverseWishart(**_hypparams)
-
-            for t in range(self.nb_steps):
-                _data = np.hstack((data['x'][:, t, :].T, data['u'][:, t, :].T, data['xn'][:, t, :].T))
-
-                _model = distributions.BayesianLinearGaussian(_prior)
-                _model = _model.MAP(_data)
-
-                self.A[..., t] = _model.A[:, :self.nb_xdim]
-                self.B[..., t] = _model.A[:, self.nb_xdim:self.nb_xdim + self.nb_udim]
-                self.c[..., t] = _model.A[:, -1]
-                self.sigma[..., t] = _model.sigma
+            self.fit(*regression_stats(data['x'], data['u'], data['xn']))
         else:
             _obs = [data['x'][..., n].T for n in range(data['x'].shape[-1])]
             _input = [data['u'][..., n].T for n in range(data['u'].shape[-1])]
 
-            from sds.rarhmm_ls import rARHMM
-            rarhmm = rARHMM(nb_states=5, dim_obs=self.nb_xdim, dim_act=self.nb_udim)
-            rarhmm.initialize(_obs, _input)
-            rarhmm.em(_obs, _input, nb_iter=50, prec=1e-12, verbose=False)
+            # cold fit on the first call, warm-started em after,
+            # em stops early once the likelihood improves by less than em_tol
+            if self.rarhmm is None:
+                from sds.rarhmm_ls import rARHMM
+                self.rarhmm = rARHMM(nb_states=self.nb_states, dim_obs=self.nb_xdim, dim_act=self.nb_udim)
+                self.rarhmm.initialize(_obs, _input)
+                _nb_iter = self.nb_em_iter
+            else:
+                _nb_iter = self.nb_warm_iter
+
+            self.rarhmm.em(_obs, _input, nb_iter=_nb_iter, prec=self.em_tol, verbose=False)
 
             _mean_obs = np.mean(data['x'], axis=-1).T
             _mean_input = np.mean(data['u'], axis=-1).T
-            _, _mean_z = rarhmm.viterbi([_mean_obs], [_mean_input])
+            _params = np.concatenate((self.rarhmm.observations.A,
+                                      self.rarhmm.observations.B,
+                                      self.rarhmm.observations.c[..., None]), axis=-1)
+
+            # decode again only if the mean trajectory or the model moved
+            if self.z is None or not np.allclose(_mean_obs, self._mean_obs, atol=self.em_tol)\
+                    or not np.allclose(_mean_input, self._mean_input, atol=self.em_tol)\
+                    or not np.allclose(_params, self._params, atol=self.em_tol):
+                _, _mean_z = self.rarhmm.viterbi([_mean_obs], [_mean_input])
+                self.z = np.asarray(_mean_z[0][:self.nb_steps])
+                self._mean_obs, self._mean_input, self._params = _mean_obs, _mean_input, _params
 
-            for t in range(self.nb_steps):
-                self.A[..., t] = rarhmm.observations.A[_mean_z[0][t], ...]
-                self.B[..., t] = rarhmm.observations.B[_mean_z[0][t], ...]
-                self.c[..., t] = rarhmm.observations.c[_mean_z[0][t], ...]
+            self.A[...] = np.transpose(self.rarhmm.observations.A[self.z, ...], (1, 2, 0))
+            self.B[...] = np.transpose(self.rarhmm.observations.B[self.z, ...], (1, 2, 0))
+            self.c[...] = self.rarhmm.observations.c[self.z, ...].T
 
 
 class LinearGaussianControl:
@@ -255,10 +353,10 @@ class LinearGaussianControl:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.K = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps))
-        self.kff = np.zeros((self.nb_udim, self.nb_steps))
+        self.K = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps), order='F')
+        self.kff = np.zeros((self.nb_udim, self.nb_steps), order='F')
 
-        self.sigma = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps))
+        self.sigma = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps), order='F')
         for t in range(self.nb_steps):
             self.sigma[..., t] = init_ctl_sigma * np.eye(self.nb_udim)
 
@@ -280,6 +378,15 @@ class LinearGaussianControl:
         else:
             return mu
 
+    def sample_batch(self, x, t, stoch=True):
+        # x: (nb_rows, nb_xdim), one row per episode
+        mu = x @ self.K[..., t].T + self.kff[..., t]
+        if stoch:
+            _L = np.linalg.cholesky(self.sigma[..., t])
+            return mu + np.random.randn(*mu.shape) @ _L.T
+        else:
+            return mu
+
     def forward(self, xdist, t):
         _x_mu, _x_sigma = xdist.mu[..., t], xdist.sigma[..., t]
         _K, _kff, _ctl_sigma = self.K[..., t], self.kff[..., t], self.sigma[..., t]
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: prior.py
+# @Date: 2019-07-20-10-10
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import autograd.numpy as np
+from scipy.special import logsumexp
+
+
+class GaussianMixture:
+    """
+    Gaussian mixture fitted by batched em, refits are warm
+    started from the components of the last fit
+    """
+
+    def __init__(self, nb_dim, nb_components, reg=1.e-6):
+        self.nb_dim = nb_dim
+        self.nb_components = nb_components
+        self.reg = reg
+
+        self.weights = None
+        self.mu = None
+        self.sigma = None
+
+    def log_likelihood(self, X):
+        """
+        :param X: (nb_points, nb_dim)
+        :return: log weight + log density of every point and component, (nb_points, nb_components)
+        """
+        _L = np.linalg.cholesky(self.sigma)
+        _diff = X[None, ...] - self.mu[:, None, :]
+
+        # whitened residuals of all components at once
+        _w = np.linalg.solve(_L, np.swapaxes(_diff, -1, -2))
+        _maha = np.sum(_w**2, axis=1)
+        _logdet = 2. * np.sum(np.log(np.diagonal(_L, axis1=-2, axis2=-1)), axis=-1)
+
+        _ll = - 0.5 * (_maha + _logdet[:, None] + self.nb_dim * np.log(2. * np.pi))
+        return (_ll + np.log(self.weights)[:, None]).T
+
+    def fit(self, X, nb_iter=100, tol=1.e-4):
+        _nb_points = X.shape[0]
+        _nb_components = max(1, min(self.nb_components, _nb_points // (self.nb_dim + 1)))
+
+        if self.mu is None or len(self.weights) != _nb_components:
+            # random points as means, all with the data covariance
+            _idx = np.random.choice(_nb_points, size=_nb_components, replace=False)
+            _sigma = np.cov(X.T) + self.reg * np.eye(self.nb_dim)
+            self.weights = np.full((_nb_components, ), 1. / _nb_components)
+            self.mu = X[_idx]
+            self.sigma = np.tile(_sigma, (_nb_components, 1, 1))
+
+        _last = - np.inf
+        for _ in range(nb_iter):
+            # e-step
+            _ll = self.log_likelihood(X)
+            _norm = logsumexp(_ll, axis=1)
+            _resp = np.exp(_ll - _norm[:, None])
+
+            _lik = np.mean(_norm)
+            if _lik - _last < tol * abs(_lik):
+                break
+            _last = _lik
+
+            # m-step, empty components keep a tiny weight
+            _nk = np.sum(_resp, axis=0) + 1.e-10
+            self.weights = _nk / np.sum(_nk)
+            self.mu = (_resp.T @ X) / _nk[:, None]
+
+            _diff = X[None, ...] - self.mu[:, None, :]
+            self.sigma = np.einsum('kn,kni,knj->kij', _resp.T, _diff, _diff) / _nk[:, None, None]
+            self.sigma = 0.5 * (self.sigma + np.swapaxes(self.sigma, -1, -2))\
+                         + self.reg * np.eye(self.nb_dim)
+
+        return self
+
+    def moments(self, X):
+        """
+        Moments of the mixture reweighted by the responsibilities
+        of a group of points
+        :param X: (nb_groups, nb_points, nb_dim)
+        :return: mu (nb_groups, nb_dim), sigma (nb_groups, nb_dim, nb_dim)
+        """
+        _nb_groups, _nb_points = X.shape[:2]
+
+        _ll = self.log_likelihood(X.reshape(-1, self.nb_dim)).reshape(_nb_groups, _nb_points, -1)
+        _ll = _ll - logsumexp(_ll, axis=2, keepdims=True)
+
+        # weights of the components within every group
+        _wts = logsumexp(_ll, axis=1)
+        _wts = np.exp(_wts - logsumexp(_wts, axis=1, keepdims=True))
+
+        mu = _wts @ self.mu
+        _diff = self.mu[None, ...] - mu[:, None, :]
+        sigma = np.einsum('gk,kij->gij', _wts, self.sigma)\
+                + np.einsum('gk,gki,gkj->gij', _wts, _diff, _diff)
+
+        return mu, sigma
+
+
+class GMMPrior:
+    """
+    Global prior of the dynamics, a mixture over [x, u, xn] of
+    the samples of all iterations. For every time step, the mixture
+    moments under the current samples form a normal-inverse-wishart
+    prior on the joint gaussian of [x, u, xn], with a strength in
+    units of samples
+    """
+
+    def __init__(self, nb_xdim, nb_udim, nb_components=20,
+                 max_samples=20000, strength=1., nb_iter=100):
+        self.nb_xdim = nb_xdim
+        self.nb_udim = nb_udim
+        self.nb_dim = 2 * nb_xdim + nb_udim
+
+        # samples kept over iterations, the oldest are dropped first
+        self.max_samples = max_samples
+        self.samples = np.zeros((0, self.nb_dim))
+
+        self.strength = strength
+        self.nb_iter = nb_iter
+
+        self.gmm = GaussianMixture(self.nb_dim, nb_components)
+
+    @staticmethod
+    def points(data):
+        # [x, u, xn] of all steps, (nb_steps, nb_episodes, nb_dim)
+        return np.transpose(np.concatenate((data['x'], data['u'], data['xn']), axis=0), (1, 2, 0))
+
+    def update(self, data):
+        _points = self.points(data).reshape(-1, self.nb_dim)
+        self.samples = np.vstack((self.samples, _points))[- self.max_samples:]
+        self.gmm.fit(self.samples, nb_iter=self.nb_iter)
+
+    def eval(self, data):
+        """
+        :return: mu0 (nb_steps, nb_dim), Phi (nb_steps, nb_dim, nb_dim), m, n0
+        """
+        mu0, _sigma = self.gmm.moments(self.points(data))
+        return mu0, self.strength * _sigma, self.strength, self.strength
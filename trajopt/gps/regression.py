@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: regression.py
+# @Date: 2019-07-19-11-00
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import autograd.numpy as np
+
+
+def regression_stats(x, u, xn):
+    """
+    Sufficient statistics of the affine regressions xn = A [x; u; 1]
+    of all time steps, summed over episodes
+    :param x: (nb_xdim, nb_steps, nb_episodes)
+    :param u: (nb_udim, nb_steps, nb_episodes)
+    :param xn: (nb_xdim, nb_steps, nb_episodes)
+    :return: zz (nb_steps, nb_zdim, nb_zdim), yz (nb_steps, nb_xdim, nb_zdim),
+             yy (nb_steps, nb_xdim, nb_xdim), n (nb_steps, )
+    """
+    # (nb_steps, dim, nb_episodes), batched products over time steps
+    _z = np.transpose(np.concatenate((x, u, np.ones((1, ) + x.shape[1:])), axis=0), (1, 0, 2))
+    _y = np.transpose(xn, (1, 0, 2))
+
+    zz = _z @ np.swapaxes(_z, -1, -2)
+    yz = _y @ np.swapaxes(_z, -1, -2)
+    yy = _y @ np.swapaxes(_y, -1, -2)
+    n = np.full((x.shape[1], ), float(x.shape[2]))
+
+    return zz, yz, yy, n
+
+
+class RegressionStats:
+    """
+    Sufficient statistics of all time steps accumulated over batches
+    of episodes. Absorbing a batch costs O(nb_episodes), older batches
+    are exponentially down-weighted by forget
+    """
+
+    def __init__(self, nb_xdim, nb_zdim, nb_steps):
+        self.nb_xdim = nb_xdim
+        self.nb_zdim = nb_zdim
+        self.nb_steps = nb_steps
+
+        self.reset()
+
+    @property
+    def params(self):
+        return self.zz, self.yz, self.yy, self.n
+
+    def reset(self):
+        self.zz = np.zeros((self.nb_steps, self.nb_zdim, self.nb_zdim))
+        self.yz = np.zeros((self.nb_steps, self.nb_xdim, self.nb_zdim))
+        self.yy = np.zeros((self.nb_steps, self.nb_xdim, self.nb_xdim))
+        self.n = np.zeros((self.nb_steps, ))
+
+    def update(self, x, u, xn, forget=1.):
+        zz, yz, yy, n = regression_stats(x, u, xn)
+
+        self.zz = forget * self.zz + zz
+        self.yz = forget * self.yz + yz
+        self.yy = forget * self.yy + yy
+        self.n = forget * self.n + n
+
+
+class MatrixNormalInverseWishart:
+    """
+    Conjugate prior of all time steps, A ~ MN(M, sigma, V) and
+    sigma ~ IW(psi, nu), with V the column covariance of the
+    coefficients. A broad V is a weak ridge penalty 1/V on A
+    """
+
+    def __init__(self, nb_xdim, nb_zdim, M=None, V=1.e6, psi=1., nu=None):
+        self.nb_xdim = nb_xdim
+        self.nb_zdim = nb_zdim
+
+        self.M = np.zeros((nb_xdim, nb_zdim)) if M is None else M
+        self.V = V * np.eye(nb_zdim) if np.isscalar(V) else V
+        self.psi = psi * np.eye(nb_xdim) if np.isscalar(psi) else psi
+        self.nu = nb_xdim + 2 if nu is None else nu
+
+    def map(self, zz, yz, yy, n):
+        """
+        Posterior modes of all time steps in one batched solve
+        :return: A (nb_steps, nb_xdim, nb_zdim), sigma (nb_steps, nb_xdim, nb_xdim)
+        """
+        _V_inv = np.linalg.inv(self.V)
+
+        # posterior precision of the coefficients and mean
+        _K = zz + _V_inv
+        _Y = yz + self.M @ _V_inv
+        A = np.swapaxes(np.linalg.solve(_K, np.swapaxes(_Y, -1, -2)), -1, -2)
+
+        # posterior scale, psi + yy + M V^-1 M' - A K A'
+        _psi = self.psi + yy + self.M @ _V_inv @ self.M.T - A @ np.swapaxes(_Y, -1, -2)
+        _psi = 0.5 * (_psi + np.swapaxes(_psi, -1, -2))
+
+        _nu = self.nu + n
+        sigma = _psi / (_nu + self.nb_xdim + 1)[:, None, None]
+
+        return A, sigma
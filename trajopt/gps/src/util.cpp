@@ -1,88 +1,64 @@
-#include <pybind11/pybind11.h>
-#include <pybind11/numpy.h>
-#include <armadillo>
+#include "util.h"
 
-namespace py = pybind11;
 
-using namespace arma;
+// precisions and log-determinants of the control covariances.
+// False if a covariance is not positive definite
+bool ctl_precision(const cube &sigma_ctl, int nb_steps,
+                   cube &prec_ctl, vec &logdet) {
 
+    prec_ctl.set_size(sigma_ctl.n_rows, sigma_ctl.n_cols, nb_steps);
+    logdet.set_size(nb_steps);
 
-typedef py::array_t<double, py::array::f_style | py::array::forcecast> array_tf;
-typedef py::array_t<double, py::array::c_style | py::array::forcecast> array_tc;
-
-
-cube array_to_cube(array_tf m) {
-
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-    int n_cols = _m_buff.shape[1];
-    int n_slices = _m_buff.shape[2];
-
-    cube _m_arma((double *)_m_buff.ptr, n_rows, n_cols, n_slices);
-
-    return _m_arma;
-}
-
-
-mat array_to_mat(array_tf m) {
-
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-    int n_cols = _m_buff.shape[1];
-
-    mat _m_arma((double *)_m_buff.ptr, n_rows, n_cols);
-
-    return _m_arma;
-}
-
-
-vec array_to_vec(array_tf m) {
-
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-
-    vec _m_vec((double *)_m_buff.ptr, n_rows);
-
-    return _m_vec;
-}
-
-
-array_tf cube_to_array(cube m) {
-
-    auto _m_array = array_tf({m.n_rows, m.n_cols, m.n_slices});
-
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows * m.n_cols * m.n_slices);
+    mat L;
+    for (int i = 0; i < nb_steps; i++) {
+        if (!chol_factor(L, sigma_ctl.slice(i)))
+            return false;
 
-    return _m_array;
+        prec_ctl.slice(i) = chol_inv(L);
+        logdet(i) = chol_logdet(L);
+    }
+    return true;
 }
 
 
-array_tf mat_to_array(mat m) {
+// kl divergence of the controller K, kff, sigma_ctl from the last
+// controller lK, lkff, given by its precision and log-determinant
+double kl_sweep(const cube &K, const mat &kff, const cube &sigma_ctl,
+                const cube &lK, const mat &lkff,
+                const cube &lprec_ctl, const vec &llogdet,
+                const mat &mu_x, const cube &sigma_x,
+                int nb_udim, int nb_steps) {
 
-    auto _m_array = array_tf({m.n_rows, m.n_cols});
-
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows * m.n_cols);
+    double kl = 0.0;
 
-    return _m_array;
-}
+    mat L;
 
+    for(int i = 0; i < nb_steps; i++) {
+        if (!chol_factor(L, sigma_ctl.slice(i)))
+            throw std::runtime_error("kl_sweep(): control covariance is not positive definite");
 
-array_tf vec_to_array(vec m) {
+        const mat &lprec = lprec_ctl.slice(i);
 
-    auto _m_array = array_tf({m.n_rows});
+        mat diff_K = (lK.slice(i) - K.slice(i)).t() * lprec * (lK.slice(i) - K.slice(i));
+        mat diff_crs = (lK.slice(i) - K.slice(i)).t() * lprec * (- lkff.col(i) + kff.col(i));
+        mat diff_kff = (- lkff.col(i) + kff.col(i)).t() * lprec * (- lkff.col(i) + kff.col(i));
 
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows);
+        kl += as_scalar(0.5 * (llogdet(i) - chol_logdet(L))
+		                + 0.5 * trace(lprec * sigma_ctl.slice(i))
+		                - 0.5 * nb_udim
+		                + 0.5 * trace(diff_K * sigma_x.slice(i))
+		                + 0.5 * mu_x.col(i).t() * diff_K * mu_x.col(i)
+		                - mu_x.col(i).t() * diff_crs
+		                + 0.5 * diff_kff);
+    }
 
-    return _m_array;
+    return kl;
 }
 
 
-double kl_divergence(array_tf _K, array_tf _kff, array_tf _sigma_ctl,
-                       array_tf _lK, array_tf _lkff, array_tf _lsigma_ctl,
-                       array_tf _mu_x, array_tf _sigma_x,
+double kl_divergence(py::array _K, py::array _kff, py::array _sigma_ctl,
+                       py::array _lK, py::array _lkff, py::array _lsigma_ctl,
+                       py::array _mu_x, py::array _sigma_x,
                        int nb_xdim, int nb_udim, int nb_steps) {
 
     cube K = array_to_cube(_K);
@@ -96,29 +72,27 @@ double kl_divergence(array_tf _K, array_tf _kff, array_tf _sigma_ctl,
     mat mu_x  = array_to_mat(_mu_x);
     cube sigma_x = array_to_cube(_sigma_x);
 
-    double kl = 0.0;
+    cube lprec_ctl;
+    vec llogdet;
+    if (!ctl_precision(lsigma_ctl, nb_steps, lprec_ctl, llogdet))
+        throw std::runtime_error("kl_divergence(): control covariance is not positive definite");
 
-    for(int i = 0; i < nb_steps; i++) {
-        mat lprec_ctl = inv_sympd(lsigma_ctl.slice(i));
+    return kl_sweep(K, kff, sigma_ctl, lK, lkff, lprec_ctl, llogdet,
+                    mu_x, sigma_x, nb_udim, nb_steps);
+}
 
-        mat diff_K = (lK.slice(i) - K.slice(i)).t() * lprec_ctl * (lK.slice(i) - K.slice(i));
-        mat diff_crs = (lK.slice(i) - K.slice(i)).t() * lprec_ctl * (- lkff.col(i) + kff.col(i));
-        mat diff_kff = (- lkff.col(i) + kff.col(i)).t() * lprec_ctl * (- lkff.col(i) + kff.col(i));
 
-        kl += as_scalar(0.5 * log( det(lsigma_ctl.slice(i)) / det(sigma_ctl.slice(i)) )
-		                + 0.5 * trace(lprec_ctl * sigma_ctl.slice(i))
-		                - 0.5 * nb_udim
-		                + 0.5 * trace(diff_K * sigma_x.slice(i))
-		                + 0.5 * mu_x.col(i).t() * diff_K * mu_x.col(i)
-		                - mu_x.col(i).t() * diff_crs
-		                + 0.5 * diff_kff);
-    }
+// expectation of x'Qx + q'x + q0 under a gaussian
+double expected_value(const vec &mu, const mat &sigma_s,
+                      const mat &Q, const vec &q, double q0) {
 
-    return kl;
+	double result = as_scalar(mu.t() * Q * mu) + as_scalar(mu.t() * q) + q0 + trace(Q * sigma_s);
+	return result;
 }
 
-double quad_expectation(array_tf _mu, array_tf _sigma_s,
-                        array_tf _Q, array_tf _q, double _q0) {
+
+double quad_expectation(py::array _mu, py::array _sigma_s,
+                        py::array _Q, py::array _q, double _q0) {
 
     vec mu  = array_to_vec(_mu);
     mat sigma_s = array_to_mat(_sigma_s);
@@ -126,45 +100,30 @@ double quad_expectation(array_tf _mu, array_tf _sigma_s,
     mat Q = array_to_mat(_Q);
     vec q = array_to_vec(_q);
 
-	double result = as_scalar(mu.t() * Q * mu) + as_scalar(mu.t() * q) + _q0 + trace(Q * sigma_s);
-	return result;
+	return expected_value(mu, sigma_s, Q, q, _q0);
 }
 
-py::tuple augment_cost(array_tf _Cxx, array_tf _cx, array_tf _Cuu,
-                       array_tf _cu, array_tf _Cxu, array_tf _c0,
-                       array_tf _K, array_tf _kff, array_tf _sigma_ctl,
-                       double alpha, int nb_xdim, int nb_udim, int nb_steps) {
-
-    // inputs
-    cube Cxx = array_to_cube(_Cxx);
-    mat cx = array_to_mat(_cx);
-    cube Cuu = array_to_cube(_Cuu);
-    mat cu = array_to_mat(_cu);
-    cube Cxu = array_to_cube(_Cxu);
-    vec c0 = array_to_vec(_c0);
-
-    cube K = array_to_cube(_K);
-    mat kff = array_to_mat(_kff);
-    cube sigma_ctl = array_to_cube(_sigma_ctl);
 
-    // outputs
-    cube agCxx(nb_xdim, nb_xdim, nb_steps + 1);
-    mat agcx(nb_xdim, nb_steps + 1);
-    cube agCuu(nb_udim, nb_udim, nb_steps + 1);
-    mat agcu(nb_udim, nb_steps + 1);
-    cube agCxu(nb_xdim, nb_udim, nb_steps + 1);
-    vec agc0(nb_steps + 1);
+// cost augmented with the log-likelihood of the last controller,
+// given by its precision and log-determinant
+void augment_sweep(const cube &Cxx, const mat &cx, const cube &Cuu,
+                   const mat &cu, const cube &Cxu, const vec &c0,
+                   const cube &K, const mat &kff,
+                   const cube &prec_ctl, const vec &logdet,
+                   double alpha, int nb_udim, int nb_steps,
+                   cube &agCxx, mat &agcx, cube &agCuu,
+                   mat &agcu, cube &agCxu, vec &agc0) {
 
     for (int i = 0; i < nb_steps; i++) {
-        mat prec_ctl = inv_sympd(sigma_ctl.slice(i));
-
-        agCxx.slice(i) = Cxx.slice(i) - 0.5 * alpha * K.slice(i).t() * prec_ctl * K.slice(i);
-        agCuu.slice(i) = Cuu.slice(i) - 0.5 * alpha * prec_ctl;
-        agCxu.slice(i) = Cxu.slice(i) + 0.5 * alpha * K.slice(i).t() * prec_ctl;
-        agcx.col(i) = cx.col(i) - alpha * K.slice(i).t() * prec_ctl * kff.col(i);
-        agcu.col(i) = cu.col(i) + alpha * prec_ctl * kff.col(i);
-        agc0(i) = as_scalar(c0(i) - 0.5 * alpha * log( det(2. * datum::pi * sigma_ctl.slice(i)) )
-                   - 0.5 * alpha * kff.col(i).t() * prec_ctl * kff.col(i));
+        const mat &prec = prec_ctl.slice(i);
+
+        agCxx.slice(i) = Cxx.slice(i) - 0.5 * alpha * K.slice(i).t() * prec * K.slice(i);
+        agCuu.slice(i) = Cuu.slice(i) - 0.5 * alpha * prec;
+        agCxu.slice(i) = Cxu.slice(i) + 0.5 * alpha * K.slice(i).t() * prec;
+        agcx.col(i) = cx.col(i) - alpha * K.slice(i).t() * prec * kff.col(i);
+        agcu.col(i) = cu.col(i) + alpha * prec * kff.col(i);
+        agc0(i) = as_scalar(c0(i) - 0.5 * alpha * (nb_udim * log(2. * datum::pi) + logdet(i))
+                   - 0.5 * alpha * kff.col(i).t() * prec * kff.col(i));
     }
 
     // last time step
@@ -174,46 +133,63 @@ py::tuple augment_cost(array_tf _Cxx, array_tf _cx, array_tf _Cuu,
     agcu.col(nb_steps) = cu.col(nb_steps);
     agCxu.slice(nb_steps) = Cxu.slice(nb_steps);
     agc0(nb_steps) = c0(nb_steps);
-
-    // transform outputs to numpy
-    array_tf _agCxx = cube_to_array(agCxx);
-    array_tf _agcx = mat_to_array(agcx);
-    array_tf _agCuu =  cube_to_array(agCuu);
-    array_tf _agcu = mat_to_array(agcu);
-    array_tf _agCxu =  cube_to_array(agCxu);
-    array_tf _agc0 = vec_to_array(agc0);
-
-    py::tuple output =  py::make_tuple(_agCxx, _agcx, _agCuu, _agcu, _agCxu, _agc0);
-    return output;
 }
 
-py::tuple forward_pass(array_tf _mu_x0, array_tf _sigma_x0,
-                       array_tf _A, array_tf _B, array_tf _c, array_tf _sigma_dyn,
-                       array_tf _K, array_tf _kff, array_tf _sigma_ctl,
-                       int nb_xdim, int nb_udim, int nb_steps) {
 
-    // inputs
-    vec mu_x0 = array_to_vec(_mu_x0);
-    mat sigma_x0 = array_to_mat(_sigma_x0);
+py::tuple augment_cost(py::array _Cxx, py::array _cx, py::array _Cuu,
+                       py::array _cu, py::array _Cxu, py::array _c0,
+                       py::array _K, py::array _kff, py::array _sigma_ctl,
+                       double alpha, int nb_xdim, int nb_udim, int nb_steps) {
 
-    cube A = array_to_cube(_A);
-    cube B = array_to_cube(_B);
-    mat c = array_to_mat(_c);
-    cube sigma_dyn = array_to_cube(_sigma_dyn);
+    // inputs
+    cube Cxx = array_to_cube(_Cxx);
+    mat cx = array_to_mat(_cx);
+    cube Cuu = array_to_cube(_Cuu);
+    mat cu = array_to_mat(_cu);
+    cube Cxu = array_to_cube(_Cxu);
+    vec c0 = array_to_vec(_c0);
 
     cube K = array_to_cube(_K);
     mat kff = array_to_mat(_kff);
     cube sigma_ctl = array_to_cube(_sigma_ctl);
 
     // outputs
-    mat mu_x(nb_xdim, nb_steps + 1);
-    cube sigma_x(nb_xdim, nb_xdim, nb_steps + 1);
+    array_tf _agCxx = zeros_array({nb_xdim, nb_xdim, nb_steps + 1});
+    array_tf _agcx = zeros_array({nb_xdim, nb_steps + 1});
+    array_tf _agCuu = zeros_array({nb_udim, nb_udim, nb_steps + 1});
+    array_tf _agcu = zeros_array({nb_udim, nb_steps + 1});
+    array_tf _agCxu = zeros_array({nb_xdim, nb_udim, nb_steps + 1});
+    array_tf _agc0 = zeros_array({nb_steps + 1});
+
+    cube agCxx = array_to_cube(_agCxx);
+    mat agcx = array_to_mat(_agcx);
+    cube agCuu = array_to_cube(_agCuu);
+    mat agcu = array_to_mat(_agcu);
+    cube agCxu = array_to_cube(_agCxu);
+    vec agc0 = array_to_vec(_agc0);
+
+    cube prec_ctl;
+    vec logdet;
+    if (!ctl_precision(sigma_ctl, nb_steps, prec_ctl, logdet))
+        throw std::runtime_error("augment_cost(): control covariance is not positive definite");
+
+    augment_sweep(Cxx, cx, Cuu, cu, Cxu, c0, K, kff, prec_ctl, logdet,
+                  alpha, nb_udim, nb_steps, agCxx, agcx, agCuu, agcu, agCxu, agc0);
+
+    // outputs already live in numpy
+    py::tuple output =  py::make_tuple(_agCxx, _agcx, _agCuu, _agcu, _agCxu, _agc0);
+    return output;
+}
 
-    mat mu_u(nb_udim, nb_steps);
-    cube sigma_u(nb_udim, nb_udim, nb_steps);
 
-    mat mu_xu(nb_xdim + nb_udim, nb_steps + 1);
-    cube sigma_xu(nb_xdim + nb_udim, nb_xdim + nb_udim, nb_steps + 1);
+// propagation of the state-action distribution,
+// outputs are expected to be zero-initialized
+void forward_sweep(const vec &mu_x0, const mat &sigma_x0,
+                   const cube &A, const cube &B, const mat &c, const cube &sigma_dyn,
+                   const cube &K, const mat &kff, const cube &sigma_ctl,
+                   int nb_xdim, int nb_udim, int nb_steps,
+                   mat &mu_x, cube &sigma_x, mat &mu_u, cube &sigma_u,
+                   mat &mu_xu, cube &sigma_xu) {
 
     mu_x.col(0) = mu_x0;
     sigma_x.slice(0) = sigma_x0;
@@ -250,59 +226,72 @@ py::tuple forward_pass(array_tf _mu_x0, array_tf _sigma_x0,
             sigma_xu.slice(i+1).submat(0, 0, nb_xdim - 1, nb_xdim - 1) = sigma_x.slice(i+1);
         }
     }
-
-    // transform outputs to numpy
-    array_tf _mu_x = mat_to_array(mu_x);
-    array_tf _sigma_x = cube_to_array(sigma_x);
-    array_tf _mu_u =  mat_to_array(mu_u);
-    array_tf _sigma_u = cube_to_array(sigma_u);
-    array_tf _mu_xu =  mat_to_array(mu_xu);
-    array_tf _sigma_xu = cube_to_array(sigma_xu);
-
-    py::tuple output =  py::make_tuple(_mu_x, _sigma_x, _mu_u, _sigma_u, _mu_xu, _sigma_xu);
-    return output;
 }
 
 
-py::tuple backward_pass(array_tf _Cxx, array_tf _cx, array_tf _Cuu,
-                        array_tf _cu, array_tf _Cxu, array_tf _c0,
-                        array_tf _A, array_tf _B, array_tf _c, array_tf _sigma_dyn,
-                        double alpha, int nb_xdim, int nb_udim, int nb_steps) {
+py::tuple forward_pass(py::array _mu_x0, py::array _sigma_x0,
+                       py::array _A, py::array _B, py::array _c, py::array _sigma_dyn,
+                       py::array _K, py::array _kff, py::array _sigma_ctl,
+                       int nb_xdim, int nb_udim, int nb_steps) {
 
     // inputs
-    cube Cxx = array_to_cube(_Cxx);
-    mat cx = array_to_mat(_cx);
-    cube Cuu = array_to_cube(_Cuu);
-    mat cu = array_to_mat(_cu);
-    cube Cxu = array_to_cube(_Cxu);
-    vec c0 = array_to_vec(_c0);
+    vec mu_x0 = array_to_vec(_mu_x0);
+    mat sigma_x0 = array_to_mat(_sigma_x0);
 
     cube A = array_to_cube(_A);
     cube B = array_to_cube(_B);
     mat c = array_to_mat(_c);
     cube sigma_dyn = array_to_cube(_sigma_dyn);
 
+    cube K = array_to_cube(_K);
+    mat kff = array_to_mat(_kff);
+    cube sigma_ctl = array_to_cube(_sigma_ctl);
+
     // outputs
-    cube Q(nb_xdim + nb_udim, nb_xdim + nb_udim, nb_steps);
-    cube Qxx(nb_xdim, nb_xdim, nb_steps);
-    cube Qux(nb_udim, nb_xdim, nb_steps);
-    cube Quu(nb_udim, nb_udim, nb_steps);
-    cube Quu_inv(nb_udim, nb_udim, nb_steps);
-    mat qx(nb_xdim, nb_steps);
-    mat qu(nb_udim, nb_steps);
-    vec q0(nb_steps);
-    vec q0_common(nb_steps);
-    vec q0_softmax(nb_steps);
+    array_tf _mu_x = zeros_array({nb_xdim, nb_steps + 1});
+    array_tf _sigma_x = zeros_array({nb_xdim, nb_xdim, nb_steps + 1});
+
+    array_tf _mu_u = zeros_array({nb_udim, nb_steps});
+    array_tf _sigma_u = zeros_array({nb_udim, nb_udim, nb_steps});
+
+    array_tf _mu_xu = zeros_array({nb_xdim + nb_udim, nb_steps + 1});
+    array_tf _sigma_xu = zeros_array({nb_xdim + nb_udim, nb_xdim + nb_udim, nb_steps + 1});
+
+    mat mu_x = array_to_mat(_mu_x);
+    cube sigma_x = array_to_cube(_sigma_x);
 
-    cube V(nb_xdim, nb_xdim, nb_steps + 1);
-    mat v(nb_xdim, nb_steps + 1);
-    vec v0(nb_steps + 1);
-    vec v0_softmax(nb_steps + 1);
+    mat mu_u = array_to_mat(_mu_u);
+    cube sigma_u = array_to_cube(_sigma_u);
 
-    cube K(nb_udim, nb_xdim, nb_steps);
-    mat kff(nb_udim, nb_steps);
-    cube sigma_ctl(nb_udim, nb_udim, nb_steps);
-    cube prec_ctl(nb_udim, nb_udim, nb_steps);
+    mat mu_xu = array_to_mat(_mu_xu);
+    cube sigma_xu = array_to_cube(_sigma_xu);
+
+    forward_sweep(mu_x0, sigma_x0, A, B, c, sigma_dyn, K, kff, sigma_ctl,
+                  nb_xdim, nb_udim, nb_steps,
+                  mu_x, sigma_x, mu_u, sigma_u, mu_xu, sigma_xu);
+
+    // outputs already live in numpy
+    py::tuple output =  py::make_tuple(_mu_x, _sigma_x, _mu_u, _sigma_u, _mu_xu, _sigma_xu);
+    return output;
+}
+
+
+// sequential backward recursion of the soft value functions,
+// outputs are expected to be zero-initialized. Returns 1 if
+// Quu is not negative definite at any step, 0 otherwise
+int backward_sweep(const cube &Cxx, const mat &cx, const cube &Cuu,
+                   const mat &cu, const cube &Cxu, const vec &c0,
+                   const cube &A, const cube &B, const mat &c, const cube &sigma_dyn,
+                   double alpha, int nb_udim, int nb_steps,
+                   cube &Qxx, cube &Qux, cube &Quu, mat &qx, mat &qu,
+                   vec &q0, vec &q0_softmax,
+                   cube &V, mat &v, vec &v0, vec &v0_softmax,
+                   cube &K, mat &kff, cube &sigma_ctl) {
+
+    // intermediates
+    mat L(nb_udim, nb_udim);
+    mat Quu_inv(nb_udim, nb_udim);
+    vec q0_common(nb_steps);
 
     int _diverge = 0;
 
@@ -326,49 +315,196 @@ py::tuple backward_pass(array_tf _Cxx, array_tf _cx, array_tf _Cuu,
         q0(i) = (q0_common(i) + v0(i+1)) / alpha;
         q0_softmax(i) = (q0_common(i) + v0_softmax(i+1)) / alpha;
 
-        if ((Quu.slice(i)).is_sympd()) {
-            _diverge = i;
+        // Quu has to be negative definite, factorize - Quu = LL'
+        if (!chol_factor(L, - Quu.slice(i))) {
+            _diverge = 1;
             break;
         }
 
-        Quu_inv.slice(i) = inv(Quu.slice(i));
-        K.slice(i) = - Quu_inv.slice(i) * Qux.slice(i);
-        kff.col(i) = - 0.5 * Quu_inv.slice(i) * qu.col(i);
+        Quu_inv = - chol_inv(L);
+        K.slice(i) = - Quu_inv * Qux.slice(i);
+        kff.col(i) = - 0.5 * Quu_inv * qu.col(i);
 
-        sigma_ctl.slice(i) = - 0.5 * Quu_inv.slice(i);
+        sigma_ctl.slice(i) = - 0.5 * Quu_inv;
         sigma_ctl.slice(i) = 0.5 * (sigma_ctl.slice(i).t() + sigma_ctl.slice(i));
 
-        prec_ctl.slice(i) = - (Quu.slice(i).t() + Quu.slice(i));
-        prec_ctl.slice(i) = 0.5 * (prec_ctl.slice(i).t() + prec_ctl.slice(i));
-
         V.slice(i) = (Qxx.slice(i) + Qux.slice(i).t() * K.slice(i)) * alpha;
         V.slice(i) = 0.5 * (V.slice(i) + V.slice(i).t());
 
         v.col(i) = (qx.col(i) + 2. * Qux.slice(i).t() * kff.col(i)) * alpha;
         v0(i) = alpha * (as_scalar(0.5 * qu.col(i).t() * kff.col(i)) + q0(i) - (0.5 * nb_udim));
         v0_softmax(i) = alpha * (as_scalar(0.5 * qu.col(i).t() * kff.col(i)) + q0_softmax(i)
-                         + 0.5 * (nb_udim * log (2. * datum::pi) - log(det(- 2. * Quu.slice(i)))));
+                         + 0.5 * (nb_udim * log (datum::pi) - chol_logdet(L)));
 	}
 
-    // transform outputs to numpy
-    array_tf _Qxx = cube_to_array(Qxx);
-    array_tf _Qux = cube_to_array(Qux);
-    array_tf _Quu = cube_to_array(Quu);
+    return _diverge;
+}
+
+
+// parallel-in-time counterpart of backward_sweep
+int parallel_sweep(const cube &Cxx, const mat &cx, const cube &Cuu,
+                   const mat &cu, const cube &Cxu, const vec &c0,
+                   const cube &A, const cube &B, const mat &c, const cube &sigma_dyn,
+                   double alpha, int nb_udim, int nb_steps,
+                   cube &Qxx, cube &Qux, cube &Quu, mat &qx, mat &qu,
+                   vec &q0, vec &q0_softmax,
+                   cube &V, mat &v, vec &v0, vec &v0_softmax,
+                   cube &K, mat &kff, cube &sigma_ctl,
+                   int nb_threads) {
+
+    int _diverge = 0;
+
+    // value functions x'Vx + v'x are scanned in the 1/2 x'Sx - eta'x
+    // form of the elements, i.e. S = 2V with doubled quadratic costs
+    std::vector<Element> elems(nb_steps + 1);
+    std::vector<int> _failed(nb_steps, 0);
+
+    parallel_blocks(nb_steps, nb_threads, [&](int begin, int end, int p) {
+        for (int i = begin; i < end; ++i)
+            _failed[i] = !lqr_element(2. * Cxx.slice(i), cx.col(i), 2. * Cuu.slice(i), cu.col(i), 2. * Cxu.slice(i),
+                                      A.slice(i), B.slice(i), c.col(i), elems[i]);
+    });
+    elems[nb_steps] = terminal_element(2. * Cxx.slice(nb_steps), cx.col(nb_steps));
+
+    for(int i = nb_steps - 1; i>= 0; --i)
+        if (_failed[i])
+            return 1;
+
+    suffix_scan(elems, nb_threads);
+
+    parallel_blocks(nb_steps + 1, nb_threads, [&](int begin, int end, int p) {
+        for (int i = begin; i < end; ++i) {
+            V.slice(i) = 0.5 * elems[i].J;
+            v.col(i) = - elems[i].eta;
+        }
+    });
+
+    // per-step terms of the constants, summed up afterwards
+    vec q0_common(nb_steps);
+    vec v0_step(nb_steps);
+    vec v0_softmax_step(nb_steps);
+
+    parallel_blocks(nb_steps, nb_threads, [&](int begin, int end, int p) {
+        for (int i = begin; i < end; ++i) {
+            Qxx.slice(i) = (Cxx.slice(i) + A.slice(i).t() * V.slice(i+1) * A.slice(i)) / alpha;
+            Quu.slice(i) = (Cuu.slice(i) + B.slice(i).t() * V.slice(i+1) * B.slice(i)) / alpha;
+            Qux.slice(i) = (Cxu.slice(i) + A.slice(i).t() * V.slice(i+1) * B.slice(i)).t() / alpha;
+
+            qu.col(i) = (cu.col(i) + 2.0 * B.slice(i).t() * V.slice(i+1) * c.col(i) + B.slice(i).t() * v.col(i+1)) / alpha;
+            qx.col(i) = (cx.col(i) + 2.0 * A.slice(i).t() * V.slice(i+1) * c.col(i) + A.slice(i).t() * v.col(i+1)) / alpha;
+            q0_common(i) = as_scalar(c0(i) +  c.col(i).t() * V.slice(i+1) * c.col(i)
+                            + trace(V.slice(i+1) * sigma_dyn.slice(i)) + v.col(i+1).t() * c.col(i));
+
+            mat L;
+            if (!chol_factor(L, - Quu.slice(i))) {
+                _failed[i] = 1;
+                continue;
+            }
+
+            mat Quu_inv = - chol_inv(L);
+
+            K.slice(i) = - Quu_inv * Qux.slice(i);
+            kff.col(i) = - 0.5 * Quu_inv * qu.col(i);
 
-    array_tf _qx = mat_to_array(qx);
-    array_tf _qu = mat_to_array(qu);
-    array_tf _q0 = mat_to_array(q0);
-    array_tf _q0_softmax = mat_to_array(q0_softmax);
+            sigma_ctl.slice(i) = - 0.5 * Quu_inv;
+            sigma_ctl.slice(i) = 0.5 * (sigma_ctl.slice(i).t() + sigma_ctl.slice(i));
+
+            v0_step(i) = alpha * (as_scalar(0.5 * qu.col(i).t() * kff.col(i)) - (0.5 * nb_udim)) + q0_common(i);
+            v0_softmax_step(i) = alpha * (as_scalar(0.5 * qu.col(i).t() * kff.col(i))
+                                  + 0.5 * (nb_udim * log (datum::pi) - chol_logdet(L))) + q0_common(i);
+        }
+    });
+
+    for(int i = nb_steps - 1; i>= 0; --i)
+        if (_failed[i]) {
+            _diverge = 1;
+            break;
+        }
+
+    // constants are suffix sums of the per-step terms
+    v0(nb_steps) = c0(nb_steps);
+    v0_softmax(nb_steps) = c0(nb_steps);
+
+    for(int i = nb_steps - 1; i>= 0; --i) {
+        q0(i) = (q0_common(i) + v0(i+1)) / alpha;
+        q0_softmax(i) = (q0_common(i) + v0_softmax(i+1)) / alpha;
+
+        v0(i) = v0_step(i) + v0(i+1);
+        v0_softmax(i) = v0_softmax_step(i) + v0_softmax(i+1);
+    }
+
+    return _diverge;
+}
+
+
+// numpy outputs of the sequential or parallel backward pass
+py::tuple backward_arrays(py::array _Cxx, py::array _cx, py::array _Cuu,
+                          py::array _cu, py::array _Cxu, py::array _c0,
+                          py::array _A, py::array _B, py::array _c, py::array _sigma_dyn,
+                          double alpha, int nb_xdim, int nb_udim, int nb_steps,
+                          bool parallel, int nb_threads) {
+
+    // inputs
+    cube Cxx = array_to_cube(_Cxx);
+    mat cx = array_to_mat(_cx);
+    cube Cuu = array_to_cube(_Cuu);
+    mat cu = array_to_mat(_cu);
+    cube Cxu = array_to_cube(_Cxu);
+    vec c0 = array_to_vec(_c0);
+
+    cube A = array_to_cube(_A);
+    cube B = array_to_cube(_B);
+    mat c = array_to_mat(_c);
+    cube sigma_dyn = array_to_cube(_sigma_dyn);
 
-    array_tf _V = cube_to_array(V);
-    array_tf _v = mat_to_array(v);
-    array_tf _v0 = vec_to_array(v0);
-    array_tf _v0_softmax = vec_to_array(v0_softmax);
+    // outputs
+    array_tf _Qxx = zeros_array({nb_xdim, nb_xdim, nb_steps});
+    array_tf _Qux = zeros_array({nb_udim, nb_xdim, nb_steps});
+    array_tf _Quu = zeros_array({nb_udim, nb_udim, nb_steps});
+    array_tf _qx = zeros_array({nb_xdim, nb_steps});
+    array_tf _qu = zeros_array({nb_udim, nb_steps});
+    array_tf _q0 = zeros_array({nb_steps, 1});
+    array_tf _q0_softmax = zeros_array({nb_steps, 1});
+
+    array_tf _V = zeros_array({nb_xdim, nb_xdim, nb_steps + 1});
+    array_tf _v = zeros_array({nb_xdim, nb_steps + 1});
+    array_tf _v0 = zeros_array({nb_steps + 1});
+    array_tf _v0_softmax = zeros_array({nb_steps + 1});
+
+    array_tf _K = zeros_array({nb_udim, nb_xdim, nb_steps});
+    array_tf _kff = zeros_array({nb_udim, nb_steps});
+    array_tf _sigma_ctl = zeros_array({nb_udim, nb_udim, nb_steps});
+
+    cube Qxx = array_to_cube(_Qxx);
+    cube Qux = array_to_cube(_Qux);
+    cube Quu = array_to_cube(_Quu);
+    mat qx = array_to_mat(_qx);
+    mat qu = array_to_mat(_qu);
+    vec q0 = array_to_vec(_q0);
+    vec q0_softmax = array_to_vec(_q0_softmax);
+
+    cube V = array_to_cube(_V);
+    mat v = array_to_mat(_v);
+    vec v0 = array_to_vec(_v0);
+    vec v0_softmax = array_to_vec(_v0_softmax);
 
-    array_tf _K = cube_to_array(K);
-    array_tf _kff = mat_to_array(kff);
-    array_tf _sigma_ctl = cube_to_array(sigma_ctl);
+    cube K = array_to_cube(_K);
+    mat kff = array_to_mat(_kff);
+    cube sigma_ctl = array_to_cube(_sigma_ctl);
 
+    int _diverge;
+    if (parallel)
+        _diverge = parallel_sweep(Cxx, cx, Cuu, cu, Cxu, c0, A, B, c, sigma_dyn,
+                                  alpha, nb_udim, nb_steps,
+                                  Qxx, Qux, Quu, qx, qu, q0, q0_softmax,
+                                  V, v, v0, v0_softmax, K, kff, sigma_ctl, nb_threads);
+    else
+        _diverge = backward_sweep(Cxx, cx, Cuu, cu, Cxu, c0, A, B, c, sigma_dyn,
+                                  alpha, nb_udim, nb_steps,
+                                  Qxx, Qux, Quu, qx, qu, q0, q0_softmax,
+                                  V, v, v0, v0_softmax, K, kff, sigma_ctl);
+
+    // outputs already live in numpy
     py::tuple output =  py::make_tuple(_Qxx, _Qux, _Quu, _qx, _qu, _q0, _q0_softmax,
                                         _V, _v, _v0, _v0_softmax,
                                         _K, _kff, _sigma_ctl, _diverge);
@@ -377,6 +513,147 @@ py::tuple backward_pass(array_tf _Cxx, array_tf _cx, array_tf _Cuu,
 }
 
 
+py::tuple backward_pass(py::array _Cxx, py::array _cx, py::array _Cuu,
+                        py::array _cu, py::array _Cxu, py::array _c0,
+                        py::array _A, py::array _B, py::array _c, py::array _sigma_dyn,
+                        double alpha, int nb_xdim, int nb_udim, int nb_steps) {
+
+    return backward_arrays(_Cxx, _cx, _Cuu, _cu, _Cxu, _c0, _A, _B, _c, _sigma_dyn,
+                           alpha, nb_xdim, nb_udim, nb_steps, false, 0);
+}
+
+
+py::tuple parallel_backward_pass(py::array _Cxx, py::array _cx, py::array _Cuu,
+                                 py::array _cu, py::array _Cxu, py::array _c0,
+                                 py::array _A, py::array _B, py::array _c, py::array _sigma_dyn,
+                                 double alpha, int nb_xdim, int nb_udim, int nb_steps,
+                                 int nb_threads) {
+
+    return backward_arrays(_Cxx, _cx, _Cuu, _cu, _Cxu, _c0, _A, _B, _c, _sigma_dyn,
+                           alpha, nb_xdim, nb_udim, nb_steps, true, nb_threads);
+}
+
+
+// dual of the kl-constrained step and its gradient w.r.t. alpha in one call,
+// the augmented cost, backward pass, forward pass and kl divergence share
+// native memory and only the results are returned. With return_ctl the
+// new controller K, kff, sigma_ctl is returned as well
+py::tuple dual_and_grad(double alpha, double kl_bound,
+                        py::array _Cxx, py::array _cx, py::array _Cuu,
+                        py::array _cu, py::array _Cxu, py::array _c0,
+                        py::array _A, py::array _B, py::array _c, py::array _sigma_dyn,
+                        py::array _mu_x0, py::array _sigma_x0,
+                        py::array _lK, py::array _lkff, py::array _lsigma_ctl,
+                        int nb_xdim, int nb_udim, int nb_steps,
+                        bool return_ctl, bool parallel, int nb_threads) {
+
+    // inputs
+    cube Cxx = array_to_cube(_Cxx);
+    mat cx = array_to_mat(_cx);
+    cube Cuu = array_to_cube(_Cuu);
+    mat cu = array_to_mat(_cu);
+    cube Cxu = array_to_cube(_Cxu);
+    vec c0 = array_to_vec(_c0);
+
+    cube A = array_to_cube(_A);
+    cube B = array_to_cube(_B);
+    mat c = array_to_mat(_c);
+    cube sigma_dyn = array_to_cube(_sigma_dyn);
+
+    vec mu_x0 = array_to_vec(_mu_x0);
+    mat sigma_x0 = array_to_mat(_sigma_x0);
+
+    cube lK = array_to_cube(_lK);
+    mat lkff = array_to_mat(_lkff);
+    cube lsigma_ctl = array_to_cube(_lsigma_ctl);
+
+    // last controller, factorized once for the cost and the kl
+    cube lprec_ctl;
+    vec llogdet;
+    if (!ctl_precision(lsigma_ctl, nb_steps, lprec_ctl, llogdet))
+        throw std::runtime_error("dual_and_grad(): control covariance is not positive definite");
+
+    // augmented cost
+    cube agCxx(nb_xdim, nb_xdim, nb_steps + 1, fill::zeros);
+    mat agcx(nb_xdim, nb_steps + 1, fill::zeros);
+    cube agCuu(nb_udim, nb_udim, nb_steps + 1, fill::zeros);
+    mat agcu(nb_udim, nb_steps + 1, fill::zeros);
+    cube agCxu(nb_xdim, nb_udim, nb_steps + 1, fill::zeros);
+    vec agc0(nb_steps + 1, fill::zeros);
+
+    augment_sweep(Cxx, cx, Cuu, cu, Cxu, c0, lK, lkff, lprec_ctl, llogdet,
+                  alpha, nb_udim, nb_steps, agCxx, agcx, agCuu, agcu, agCxu, agc0);
+
+    // backward pass, controller outputs live in numpy if requested
+    array_tf _K = zeros_array({nb_udim, nb_xdim, nb_steps});
+    array_tf _kff = zeros_array({nb_udim, nb_steps});
+    array_tf _sigma_ctl = zeros_array({nb_udim, nb_udim, nb_steps});
+
+    cube K = array_to_cube(_K);
+    mat kff = array_to_mat(_kff);
+    cube sigma_ctl = array_to_cube(_sigma_ctl);
+
+    cube Qxx(nb_xdim, nb_xdim, nb_steps, fill::zeros);
+    cube Qux(nb_udim, nb_xdim, nb_steps, fill::zeros);
+    cube Quu(nb_udim, nb_udim, nb_steps, fill::zeros);
+    mat qx(nb_xdim, nb_steps, fill::zeros);
+    mat qu(nb_udim, nb_steps, fill::zeros);
+    vec q0(nb_steps, fill::zeros);
+    vec q0_softmax(nb_steps, fill::zeros);
+
+    cube V(nb_xdim, nb_xdim, nb_steps + 1, fill::zeros);
+    mat v(nb_xdim, nb_steps + 1, fill::zeros);
+    vec v0(nb_steps + 1, fill::zeros);
+    vec v0_softmax(nb_steps + 1, fill::zeros);
+
+    int _diverge;
+    if (parallel)
+        _diverge = parallel_sweep(agCxx, agcx, agCuu, agcu, agCxu, agc0, A, B, c, sigma_dyn,
+                                  alpha, nb_udim, nb_steps,
+                                  Qxx, Qux, Quu, qx, qu, q0, q0_softmax,
+                                  V, v, v0, v0_softmax, K, kff, sigma_ctl, nb_threads);
+    else
+        _diverge = backward_sweep(agCxx, agcx, agCuu, agcu, agCxu, agc0, A, B, c, sigma_dyn,
+                                  alpha, nb_udim, nb_steps,
+                                  Qxx, Qux, Quu, qx, qu, q0, q0_softmax,
+                                  V, v, v0, v0_softmax, K, kff, sigma_ctl);
+
+    // alpha out of the domain of the dual, the controller is undefined.
+    // an infinite kl pushes alpha towards larger magnitudes
+    if (_diverge) {
+        double dual = - datum::inf;
+        double grad = - datum::inf;
+
+        if (return_ctl)
+            return py::make_tuple(dual, grad, _diverge, _K, _kff, _sigma_ctl);
+        return py::make_tuple(dual, grad, _diverge);
+    }
+
+    // forward pass
+    mat mu_x(nb_xdim, nb_steps + 1, fill::zeros);
+    cube sigma_x(nb_xdim, nb_xdim, nb_steps + 1, fill::zeros);
+    mat mu_u(nb_udim, nb_steps, fill::zeros);
+    cube sigma_u(nb_udim, nb_udim, nb_steps, fill::zeros);
+    mat mu_xu(nb_xdim + nb_udim, nb_steps + 1, fill::zeros);
+    cube sigma_xu(nb_xdim + nb_udim, nb_xdim + nb_udim, nb_steps + 1, fill::zeros);
+
+    forward_sweep(mu_x0, sigma_x0, A, B, c, sigma_dyn, K, kff, sigma_ctl,
+                  nb_xdim, nb_udim, nb_steps,
+                  mu_x, sigma_x, mu_u, sigma_u, mu_xu, sigma_xu);
+
+    // dual expectation and gradient
+    double dual = expected_value(mu_x.col(0), sigma_x.slice(0), V.slice(0), v.col(0), v0_softmax(0));
+    dual += alpha * kl_bound;
+
+    double grad = kl_bound - kl_sweep(K, kff, sigma_ctl, lK, lkff, lprec_ctl, llogdet,
+                                      mu_x, sigma_x, nb_udim, nb_steps);
+
+    if (return_ctl)
+        return py::make_tuple(dual, grad, _diverge, _K, _kff, _sigma_ctl);
+    return py::make_tuple(dual, grad, _diverge);
+}
+
+
 PYBIND11_MODULE(core, m)
 {
     m.def("kl_divergence", &kl_divergence);
@@ -384,4 +661,8 @@ PYBIND11_MODULE(core, m)
     m.def("augment_cost", &augment_cost);
     m.def("forward_pass", &forward_pass);
     m.def("backward_pass", &backward_pass);
+    m.def("parallel_backward_pass", &parallel_backward_pass);
+    m.def("dual_and_grad", &dual_and_grad);
+    m.def("copied_bytes", &copied_bytes);
+    m.def("reset_copied_bytes", &reset_copied_bytes);
 }
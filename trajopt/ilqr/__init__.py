@@ -1 +1,3 @@
 from .ilqr import iLQR
+from .batch import BatchiLQR
+from .mpc import MPC
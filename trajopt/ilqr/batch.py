@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: batch.py
+# @Date: 2019-07-16-10-15
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import autograd.numpy as np
+
+from trajopt.ilqr.objects import AnalyticalBatchLinearDynamics, AnalyticalBatchQuadraticCost
+from trajopt.ilqr.objects import BatchLinearControl, BatchWorkspace
+from trajopt.ilqr.objects import batch_params
+
+from trajopt.ilqr.core import batch_backward_pass
+
+from trajopt.autodiff import get_backend
+from trajopt.profiling import NullProfiler
+
+
+class BatchiLQR:
+    """
+    iLQR on nb_batch problems of the same environment, one per
+    initial state. Every problem keeps its own regularization and
+    convergence state, the problems are linearized and rolled out
+    together and their backward passes run on nb_threads threads
+
+        alg = BatchiLQR(env, nb_steps=100, x0=np.stack([...]))
+        trace = alg.run(nb_iter=25)  # (nb_iter + 1, nb_batch)
+    """
+
+    def __init__(self, env, nb_steps, x0,
+                 alphas=np.power(10., np.linspace(0, -3, 11)),
+                 lmbda=1., dlmbda=1.,
+                 min_lmbda=1.e-6, max_lmbda=1.e6, mult_lmbda=1.6,
+                 tolfun=1.e-8, tolgrad=1.e-6, min_imp=0., reg=1,
+                 activation=range(-1, 0),
+                 backend='autograd',
+                 nb_threads=0,
+                 profiler=None):
+
+        self.env = env
+
+        # phase timings and event counts, nothing recorded by default
+        self.profiler = profiler if profiler is not None else NullProfiler()
+
+        # autodiff backend, autograd or jax
+        self.backend = get_backend(backend)
+
+        # expose necessary functions
+        self.env_dyn = self.env.unwrapped.dynamics
+        self.env_dyn_batch = getattr(self.env.unwrapped, 'dynamics_batch', None)
+        self.env_cost = self.env.unwrapped.cost
+
+        self.ulim = self.env.action_space.high
+
+        self.nb_xdim = self.env.observation_space.shape[0]
+        self.nb_udim = self.env.action_space.shape[0]
+        self.nb_steps = nb_steps
+
+        # initial states, one problem per row
+        self.x0 = np.atleast_2d(x0)
+        self.nb_batch = self.x0.shape[0]
+
+        # backtracking, per problem
+        self.alphas = alphas
+        self.lmbda = np.full((self.nb_batch, ), lmbda, dtype=np.float64)
+        self.dlmbda = np.full((self.nb_batch, ), dlmbda, dtype=np.float64)
+        self.min_lmbda = min_lmbda
+        self.max_lmbda = max_lmbda
+        self.mult_lmbda = mult_lmbda
+
+        # regularization type
+        self.reg = reg
+
+        # threads over problems, nb_threads=0 uses all available cores
+        self.nb_threads = nb_threads
+
+        # minimum relative improvement
+        self.min_imp = min_imp
+
+        # stopping criterion
+        self.tolfun = tolfun
+        self.tolgrad = tolgrad
+
+        # problems still being optimized
+        self.active = np.ones((self.nb_batch, ), dtype=bool)
+
+        # reference trajectories
+        self.xref = np.zeros((self.nb_batch, self.nb_xdim, self.nb_steps + 1))
+        self.xref[..., 0] = self.x0
+
+        self.uref = np.zeros((self.nb_batch, self.nb_udim, self.nb_steps))
+
+        self.dyn = AnalyticalBatchLinearDynamics(self.env_dyn, self.nb_xdim, self.nb_udim,
+                                                 self.nb_steps, self.nb_batch,
+                                                 f_dyn_batch=self.env_dyn_batch, backend=self.backend)
+        self.ctl = BatchLinearControl(self.nb_xdim, self.nb_udim, self.nb_steps, self.nb_batch)
+        self.ctl.kff[...] = 1e-2 * np.random.randn(self.nb_batch, self.nb_udim, self.nb_steps)
+
+        # backward pass outputs, reused over iterations
+        self.work = BatchWorkspace(self.nb_xdim, self.nb_udim, self.nb_steps, self.nb_batch)
+
+        # activation of cost function
+        self.activation = np.zeros((self.nb_steps + 1,), dtype=np.int64)
+        self.activation[-1] = 1.  # last step always in
+        self.activation[activation] = 1.
+
+        self.cost = AnalyticalBatchQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim,
+                                                 self.nb_steps + 1, self.nb_batch, backend=self.backend)
+
+        self.last_return = np.full((self.nb_batch, ), - np.inf)
+
+    def forward_pass(self, ctl, alpha, idx):
+        # rollouts of the problems in idx, one step size per problem
+        _nb = len(idx)
+
+        state = np.zeros((_nb, self.nb_xdim, self.nb_steps + 1))
+        action = np.zeros((_nb, self.nb_udim, self.nb_steps))
+        cost = np.zeros((_nb, self.nb_steps + 1))
+
+        state[..., 0] = self.x0[idx]
+        for t in range(self.nb_steps):
+            action[..., t] = ctl.action(state[..., t], alpha, self.xref, self.uref, t, idx)
+            cost[..., t] = self.cost.evalfb(state[..., t], action[..., t], self.activation[t])
+            state[..., t + 1] = self.dyn.evalfb(state[..., t], action[..., t])
+
+        cost[..., -1] = self.cost.evalfb(state[..., -1], np.zeros((_nb, self.nb_udim)), self.activation[-1])
+        return state, action, cost
+
+    def backward_pass(self, active):
+        _args = batch_params(self.cost.Cxx, self.cost.cx, self.cost.Cuu,
+                             self.cost.cu, self.cost.Cxu,
+                             self.dyn.A, self.dyn.B)
+
+        # outputs are written in place into the workspace,
+        # problems that are not active are left untouched
+        return batch_backward_pass(*_args, self.lmbda, self.reg, active.astype(np.float64),
+                                   self.nb_xdim, self.nb_udim, self.nb_steps, self.nb_batch,
+                                   *self.work.params, self.nb_threads)
+
+    def increase_lmbda(self, idx):
+        self.dlmbda[idx] = np.maximum(self.dlmbda[idx] * self.mult_lmbda, self.mult_lmbda)
+        self.lmbda[idx] = np.maximum(self.lmbda[idx] * self.dlmbda[idx], self.min_lmbda)
+
+    def decrease_lmbda(self, idx):
+        self.dlmbda[idx] = np.minimum(self.dlmbda[idx] / self.mult_lmbda, 1. / self.mult_lmbda)
+        self.lmbda[idx] = self.lmbda[idx] * self.dlmbda[idx] * (self.lmbda[idx] > self.min_lmbda)
+
+    def run(self, nb_iter=25):
+        _trace = []
+        # init trajectories
+        _pending = np.arange(self.nb_batch)
+        for alpha in self.alphas:
+            with self.profiler.phase('forward_pass', alpha=alpha, nb_problems=len(_pending)):
+                _state, _action, _cost = self.forward_pass(self.ctl, np.full((len(_pending), ), alpha), _pending)
+
+            _ok = np.all(_state < 1.e8, axis=(1, 2))
+            self.xref[_pending[_ok]] = _state[_ok]
+            self.uref[_pending[_ok]] = _action[_ok]
+            self.last_return[_pending[_ok]] = np.sum(_cost[_ok], axis=1)
+
+            _pending = _pending[~_ok]
+            if len(_pending) == 0:
+                break
+            else:
+                print("Initial trajectory diverges")
+
+        _trace.append(np.copy(self.last_return))
+
+        for _ in range(nb_iter):
+            _idx = np.flatnonzero(self.active)
+            if len(_idx) == 0:
+                break
+
+            self.profiler.step()
+
+            # get linear system dynamics around ref trajs.
+            with self.profiler.phase('dyn.taylor_expansion', nb_problems=len(_idx)):
+                self.dyn.taylor_expansion(self.xref, self.uref, _idx)
+
+            # get quadratic cost around ref trajs.
+            with self.profiler.phase('cost.taylor_expansion', nb_problems=len(_idx)):
+                self.cost.taylor_expansion(self.xref, self.uref, self.activation, _idx)
+
+            # execute backward passes, repeated on diverged problems
+            _backward = np.copy(self.active)
+            while np.any(_backward):
+                with self.profiler.phase('backward_pass', nb_problems=int(np.sum(_backward))):
+                    diverge = self.backward_pass(_backward)
+
+                _diverged = _backward & diverge.astype(bool)
+                self.profiler.count('diverged_backward_passes', int(np.sum(_diverged)))
+
+                # increase lmbda, give up beyond max lmbda
+                self.increase_lmbda(_diverged)
+                _failed = _diverged & (self.lmbda > self.max_lmbda)
+                self.active[_failed] = False
+
+                _backward = _diverged & ~_failed
+
+            _idx = np.flatnonzero(self.active)
+
+            # terminate problems with too small a gradient
+            _g_norm = np.mean(np.max(np.abs(self.work.ctl.kff[_idx]) /
+                                     (np.abs(self.uref[_idx]) + 1.), axis=2), axis=1)
+            _converged = _idx[(_g_norm < self.tolgrad) & (self.lmbda[_idx] < 1.e-5)]
+            self.decrease_lmbda(_converged)
+            self.active[_converged] = False
+
+            # line search in lockstep over all searching problems
+            _search = np.flatnonzero(self.active)
+            for alpha in self.alphas:
+                if len(_search) == 0:
+                    break
+
+                with self.profiler.phase('forward_pass', alpha=alpha, nb_problems=len(_search)):
+                    _state, _action, _cost = self.forward_pass(self.work.ctl, np.full((len(_search), ), alpha), _search)
+
+                # summed mean return
+                _return = np.sum(_cost, axis=1)
+
+                # check return improvement
+                _dreturn = self.last_return[_search] - _return
+                _expected = - 1. * alpha * (self.work.dV[_search, 0] + alpha * self.work.dV[_search, 1])
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    _imp = _dreturn / _expected
+
+                _accept = _imp > self.min_imp
+                _done = _search[_accept]
+
+                # accept and decrease lmbda
+                self.decrease_lmbda(_done)
+
+                self.xref[_done] = _state[_accept]
+                self.uref[_done] = _action[_accept]
+                self.last_return[_done] = _return[_accept]
+
+                self.ctl.K[_done] = self.work.ctl.K[_done]
+                self.ctl.kff[_done] = self.work.ctl.kff[_done]
+
+                # terminate problems that reached objective tolerance
+                self.active[_done[_dreturn[_accept] < self.tolfun]] = False
+
+                self.profiler.count('rejected_steps', int(np.sum(~_accept)))
+                _search = _search[~_accept]
+
+            # reject and increase lmbda, give up beyond max lmbda
+            self.profiler.count('rejected_iterations', len(_search))
+            self.increase_lmbda(_search)
+            self.active[_search[self.lmbda[_search] > self.max_lmbda]] = False
+
+            _trace.append(np.copy(self.last_return))
+
+        return np.stack(_trace)
@@ -9,9 +9,14 @@ import autograd.numpy as np
 
 from trajopt.ilqr.objects import AnalyticalLinearDynamics, AnalyticalQuadraticCost
 from trajopt.ilqr.objects import QuadraticStateValue, QuadraticStateActionValue
-from trajopt.ilqr.objects import LinearControl
+from trajopt.ilqr.objects import LinearControl, Workspace
 
-from trajopt.ilqr.core import backward_pass
+from trajopt.ilqr.core import backward_pass, parallel_backward_pass
+
+from trajopt.autodiff import get_backend
+from trajopt.rollout import Rollout
+from trajopt.parallel import WorkerPool
+from trajopt.profiling import NullProfiler
 
 
 class iLQR:
@@ -21,12 +26,23 @@ class iLQR:
                  lmbda=1., dlmbda=1.,
                  min_lmbda=1.e-6, max_lmbda=1.e6, mult_lmbda=1.6,
                  tolfun=1.e-8, tolgrad=1.e-6, min_imp=0., reg=1,
-                 activation=range(-1, 0)):
+                 activation=range(-1, 0),
+                 backend='autograd',
+                 linesearch='serial',
+                 backward='sequential', nb_threads=0,
+                 profiler=None):
 
         self.env = env
 
+        # phase timings and event counts, nothing recorded by default
+        self.profiler = profiler if profiler is not None else NullProfiler()
+
+        # autodiff backend, autograd or jax
+        self.backend = get_backend(backend)
+
         # expose necessary functions
         self.env_dyn = self.env.unwrapped.dynamics
+        self.env_dyn_batch = getattr(self.env.unwrapped, 'dynamics_batch', None)
         self.env_cost = self.env.unwrapped.cost
         self.env_init = self.env.unwrapped.init
 
@@ -44,9 +60,29 @@ class iLQR:
         self.max_lmbda = max_lmbda
         self.mult_lmbda = mult_lmbda
 
+        # line search over alphas, serial, vectorized or pool
+        self.linesearch = linesearch
+        if self.linesearch not in ('serial', 'vectorized', 'pool'):
+            raise ValueError("Unknown line search '{}', choose from "
+                             "['serial', 'vectorized', 'pool']".format(self.linesearch))
+        self.pool = None
+
         # regularization type
         self.reg = reg
 
+        # backward pass, sequential or parallel-in-time scan,
+        # nb_threads=0 uses all available cores
+        self.backward = backward
+        if self.backward not in ('sequential', 'parallel'):
+            raise ValueError("Unknown backward pass '{}', choose from "
+                             "['sequential', 'parallel']".format(self.backward))
+
+        # the scan solves the unregularized problem only
+        if self.backward == 'parallel' and lmbda != 0.:
+            raise ValueError("The parallel backward pass requires lmbda=0, "
+                             "got lmbda={}".format(lmbda))
+        self.nb_threads = nb_threads
+
         # minimum relative improvement
         self.min_imp = min_imp
 
@@ -54,56 +90,93 @@ class iLQR:
         self.tolfun = tolfun
         self.tolgrad = tolgrad
 
+        # initial state of all rollouts
+        self.x0 = self.env_init()[0]
+
         # reference trajectory
         self.xref = np.zeros((self.nb_xdim, self.nb_steps + 1))
-        self.xref[..., 0] = self.env_init()[0]
+        self.xref[..., 0] = self.x0
 
         self.uref = np.zeros((self.nb_udim, self.nb_steps))
 
         self.vfunc = QuadraticStateValue(self.nb_xdim, self.nb_steps + 1)
         self.qfunc = QuadraticStateActionValue(self.nb_xdim, self.nb_udim, self.nb_steps)
 
-        self.dyn = AnalyticalLinearDynamics(self.env_init, self.env_dyn, self.nb_xdim, self.nb_udim, self.nb_steps)
+        self.dyn = AnalyticalLinearDynamics(self.env_init, self.env_dyn, self.nb_xdim, self.nb_udim, self.nb_steps,
+                                            f_dyn_batch=self.env_dyn_batch, backend=self.backend)
         self.ctl = LinearControl(self.nb_xdim, self.nb_udim, self.nb_steps)
-        self.ctl.kff = 1e-2 * np.random.randn(self.nb_udim, self.nb_steps)
+        self.ctl.kff[...] = 1e-2 * np.random.randn(self.nb_udim, self.nb_steps)
+
+        # backward pass outputs, reused over iterations
+        self.work = Workspace(self.nb_xdim, self.nb_udim, self.nb_steps)
 
         # activation of cost function
         self.activation = np.zeros((self.nb_steps + 1,), dtype=np.int64)
         self.activation[-1] = 1.  # last step always in
         self.activation[activation] = 1.
 
-        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps + 1)
+        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps + 1,
+                                            backend=self.backend)
+
+        # state propagation and batched cost of rollouts
+        self.rollout = Rollout(self.env_dyn, self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps,
+                               backend=self.backend)
 
         self.last_return = - np.inf
 
     def forward_pass(self, ctl, alpha):
-        state = np.zeros((self.nb_xdim, self.nb_steps + 1))
-        action = np.zeros((self.nb_udim, self.nb_steps))
-        cost = np.zeros((self.nb_steps + 1, ))
+        # feedforward of all steps, the feedback acts on x - xref
+        _k = self.uref + alpha * ctl.kff
+        return self.rollout(self.x0, ctl.K, _k, self.activation, self.xref)
 
-        state[..., 0], _ = self.dyn.evali()
-        for t in range(self.nb_steps):
-            action[..., t] = ctl.action(state, alpha, self.xref, self.uref, t)
-            cost[..., t] = self.cost.evalf(state[..., t], action[..., t], self.activation[t])
-            state[..., t + 1] = self.dyn.evalf(state[..., t], action[..., t])
+    def forward_pass_batch(self, ctl, alphas):
+        alphas = np.asarray(alphas)
+        _nb_alphas = len(alphas)
+
+        state = np.zeros((_nb_alphas, self.nb_xdim, self.nb_steps + 1))
+        action = np.zeros((_nb_alphas, self.nb_udim, self.nb_steps))
+        cost = np.zeros((_nb_alphas, self.nb_steps + 1))
 
-        cost[..., -1] = self.cost.evalf(state[..., -1], np.zeros((self.nb_udim, )), self.activation[-1])
-        return state, action, cost
+        state[..., 0] = self.x0
+        for t in range(self.nb_steps):
+            action[..., t] = ctl.action_batch(state[..., t], alphas, self.xref, self.uref, t)
+            cost[..., t] = self.cost.evalfb(state[..., t], action[..., t], self.activation[t])
+            state[..., t + 1] = self.dyn.evalfb(state[..., t], action[..., t])
+
+        cost[..., -1] = self.cost.evalfb(state[..., -1], np.zeros((_nb_alphas, self.nb_udim)), self.activation[-1])
+        return [(state[k], action[k], cost[k]) for k in range(_nb_alphas)]
+
+    def line_search(self, ctl):
+        # rollouts for all step sizes, the serial search stays lazy
+        if self.linesearch == 'vectorized':
+            with self.profiler.phase('forward_pass', nb_alphas=len(self.alphas)):
+                return self.forward_pass_batch(ctl, self.alphas)
+        elif self.linesearch == 'pool':
+            with self.profiler.phase('forward_pass', nb_alphas=len(self.alphas)):
+                return self.pool.starmap('forward_pass', [(ctl, alpha) for alpha in self.alphas],
+                                         x0=self.x0, xref=self.xref, uref=self.uref)
+        else:
+            return self.serial_search(ctl)
+
+    def serial_search(self, ctl):
+        for alpha in self.alphas:
+            with self.profiler.phase('forward_pass', alpha=alpha):
+                _rollout = self.forward_pass(ctl, alpha)
+            yield _rollout
 
     def backward_pass(self):
-        lc = LinearControl(self.nb_xdim, self.nb_udim, self.nb_steps)
-        xvalue = QuadraticStateValue(self.nb_xdim, self.nb_steps + 1)
-        xuvalue = QuadraticStateActionValue(self.nb_xdim, self.nb_udim, self.nb_steps)
-
-        xuvalue.Qxx, xuvalue.Qux, xuvalue.Quu,\
-        xuvalue.qx, xuvalue.qu,\
-        xvalue.V, xvalue.v, dV,\
-        lc.K, lc.kff, diverge = backward_pass(self.cost.Cxx, self.cost.cx, self.cost.Cuu,
-                                              self.cost.cu, self.cost.Cxu,
-                                              self.dyn.A, self.dyn.B,
-                                              self.lmbda, self.reg,
-                                              self.nb_xdim, self.nb_udim, self.nb_steps)
-        return lc, xvalue, xuvalue, dV, diverge
+        _args = (self.cost.Cxx, self.cost.cx, self.cost.Cuu,
+                 self.cost.cu, self.cost.Cxu,
+                 self.dyn.A, self.dyn.B)
+        _dims = (self.nb_xdim, self.nb_udim, self.nb_steps)
+
+        # outputs are written in place into the workspace, the
+        # sequential pass takes over while lmbda regularizes
+        if self.backward == 'parallel' and self.lmbda == 0.:
+            diverge = parallel_backward_pass(*_args, *_dims, *self.work.params, self.nb_threads)
+        else:
+            diverge = backward_pass(*_args, self.lmbda, self.reg, *_dims, *self.work.params)
+        return self.work.ctl, self.work.vfunc, self.work.qfunc, self.work.dV, diverge
 
     def plot(self):
         import matplotlib.pyplot as plt
@@ -122,11 +195,10 @@ class iLQR:
 
         plt.show()
 
-    def run(self, nb_iter=25):
-        _trace = []
-        # init trajectory
+    def init_trajectory(self):
         for alpha in self.alphas:
-            _state, _action, _cost = self.forward_pass(self.ctl, alpha)
+            with self.profiler.phase('forward_pass', alpha=alpha):
+                _state, _action, _cost = self.forward_pass(self.ctl, alpha)
             if np.all(_state < 1.e8):
                 self.xref = _state
                 self.uref = _action
@@ -135,86 +207,113 @@ class iLQR:
             else:
                 print("Initial trajectory diverges")
 
-        _trace.append(self.last_return)
+    def iteration(self, trace):
+        """
+        One iteration around the current reference, accepted
+        returns are appended to trace
+        :return: True if the solver terminates
+        """
+        self.profiler.step()
 
-        for _ in range(nb_iter):
-            # get linear system dynamics around ref traj.
+        # get linear system dynamics around ref traj.
+        with self.profiler.phase('dyn.taylor_expansion'):
             self.dyn.taylor_expansion(self.xref, self.uref)
 
-            # get quadratic cost around ref traj.
+        # get quadratic cost around ref traj.
+        with self.profiler.phase('cost.taylor_expansion'):
             self.cost.taylor_expansion(self.xref, self.uref, self.activation)
 
-            xvalue, xuvalue = None, None
-            lc, dvalue = None, None
-            # execute a backward pass
-            backpass_done = False
-            while not backpass_done:
+        xvalue, xuvalue = None, None
+        lc, dvalue = None, None
+        # execute a backward pass
+        backpass_done = False
+        while not backpass_done:
+            with self.profiler.phase('backward_pass', lmbda=self.lmbda):
                 lc, xvalue, xuvalue, dvalue, diverge = self.backward_pass()
-                if np.any(diverge):
-                    # increase lmbda
-                    self.dlmbda = np.maximum(self.dlmbda * self.mult_lmbda, self.mult_lmbda)
-                    self.lmbda = np.maximum(self.lmbda * self.dlmbda, self.min_lmbda)
-                    if self.lmbda > self.max_lmbda:
-                        break
-                    else:
-                        continue
+            if diverge:
+                self.profiler.count('diverged_backward_passes')
+                # increase lmbda
+                self.dlmbda = np.maximum(self.dlmbda * self.mult_lmbda, self.mult_lmbda)
+                self.lmbda = np.maximum(self.lmbda * self.dlmbda, self.min_lmbda)
+                if self.lmbda > self.max_lmbda:
+                    break
                 else:
-                    backpass_done = True
+                    continue
+            else:
+                backpass_done = True
+
+        # terminate if gradient too small
+        _g_norm = np.mean(np.max(np.abs(lc.kff) / (np.abs(self.uref) + 1.), axis=1))
+        if _g_norm < self.tolgrad and self.lmbda < 1.e-5:
+            self.dlmbda = np.minimum(self.dlmbda / self.mult_lmbda, 1. / self.mult_lmbda)
+            self.lmbda = self.lmbda * self.dlmbda * (self.lmbda > self.min_lmbda)
+            return True
+
+        _state, _action = None, None
+        _return, _dreturn = None, None
+        # execute a forward pass
+        fwdpass_done = False
+        if backpass_done:
+            # apply on actual system
+            for alpha, (_state, _action, _cost) in zip(self.alphas, self.line_search(lc)):
+                # summed mean return
+                _return = np.sum(_cost)
+
+                # check return improvement
+                _dreturn = self.last_return - _return
+                _expected = - 1. * alpha * (dvalue[0] + alpha * dvalue[1])
+                _imp = _dreturn / _expected
+                if _imp > self.min_imp:
+                    fwdpass_done = True
+                    break
+                else:
+                    self.profiler.count('rejected_steps')
 
-            # terminate if gradient too small
-            _g_norm = np.mean(np.max(np.abs(lc.kff) / (np.abs(self.uref) + 1.), axis=1))
-            if _g_norm < self.tolgrad and self.lmbda < 1.e-5:
-                self.dlmbda = np.minimum(self.dlmbda / self.mult_lmbda, 1. / self.mult_lmbda)
-                self.lmbda = self.lmbda * self.dlmbda * (self.lmbda > self.min_lmbda)
-                break
+        # accept or reject
+        if fwdpass_done:
+            # decrease lmbda
+            self.dlmbda = np.minimum(self.dlmbda / self.mult_lmbda, 1. / self.mult_lmbda)
+            self.lmbda = self.lmbda * self.dlmbda * (self.lmbda > self.min_lmbda)
 
-            _state, _action = None, None
-            _return, _dreturn = None, None
-            # execute a forward pass
-            fwdpass_done = False
-            if backpass_done:
-                for alpha in self.alphas:
-                    # apply on actual system
-                    _state, _action, _cost = self.forward_pass(ctl=lc, alpha=alpha)
-
-                    # summed mean return
-                    _return = np.sum(_cost)
-
-                    # check return improvement
-                    _dreturn = self.last_return - _return
-                    _expected = - 1. * alpha * (dvalue[0] + alpha * dvalue[1])
-                    _imp = _dreturn / _expected
-                    if _imp > self.min_imp:
-                        fwdpass_done = True
-                        break
-
-            # accept or reject
-            if fwdpass_done:
-                # decrease lmbda
-                self.dlmbda = np.minimum(self.dlmbda / self.mult_lmbda, 1. / self.mult_lmbda)
-                self.lmbda = self.lmbda * self.dlmbda * (self.lmbda > self.min_lmbda)
+            self.xref = _state
+            self.uref = _action
+            self.last_return = _return
 
-                self.xref = _state
-                self.uref = _action
-                self.last_return = _return
+            # swap accepted solution with the workspace buffers
+            self.vfunc, self.work.vfunc = xvalue, self.vfunc
+            self.qfunc, self.work.qfunc = xuvalue, self.qfunc
 
-                self.vfunc = xvalue
-                self.qfunc = xuvalue
+            self.ctl, self.work.ctl = lc, self.ctl
 
-                self.ctl = lc
+            trace.append(self.last_return)
 
-                _trace.append(self.last_return)
+            # terminate if reached objective tolerance
+            return _dreturn < self.tolfun
+        else:
+            self.profiler.count('rejected_iterations')
 
-                # terminate if reached objective tolerance
-                if _dreturn < self.tolfun:
-                    break
-            else:
-                # increase lmbda
-                self.dlmbda = np.maximum(self.dlmbda * self.mult_lmbda, self.mult_lmbda)
-                self.lmbda = np.maximum(self.lmbda * self.dlmbda, self.min_lmbda)
-                if self.lmbda > self.max_lmbda:
+            # increase lmbda
+            self.dlmbda = np.maximum(self.dlmbda * self.mult_lmbda, self.mult_lmbda)
+            self.lmbda = np.maximum(self.lmbda * self.dlmbda, self.min_lmbda)
+            return self.lmbda > self.max_lmbda
+
+    def run(self, nb_iter=25):
+        _trace = []
+        # init trajectory
+        self.init_trajectory()
+        _trace.append(self.last_return)
+
+        if self.linesearch == 'pool':
+            self.pool = WorkerPool(self)
+
+        try:
+            for _ in range(nb_iter):
+                if self.iteration(_trace):
                     break
-                else:
-                    continue
+        finally:
+            # workers are closed even if an iteration raises
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
 
         return _trace
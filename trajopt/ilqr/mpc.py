@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: mpc.py
+# @Date: 2019-07-17-09-45
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import time
+
+import autograd.numpy as np
+
+from trajopt.ilqr.ilqr import iLQR
+from trajopt.parallel import WorkerPool
+
+
+class MPC:
+    """
+    Receding-horizon control with a warm-started iLQR. At every tick
+    the previous solution is shifted by one step, rolled out from the
+    measured state and improved for at most nb_iter iterations or until
+    the wall-clock budget is spent. One iteration is always done,
+    further ones only if they are expected to fit into the budget.
+    The first action is applied
+
+        mpc = MPC(env, nb_steps=50, nb_iter=2, budget=4.e-3)
+        x = env.reset()
+        for _ in range(500):
+            x, _, _, _ = env.step(mpc.action(x))
+        mpc.latency()
+    """
+
+    def __init__(self, env, nb_steps, nb_iter=1,
+                 budget=None, deadline=None, **kwargs):
+
+        self.alg = iLQR(env, nb_steps, **kwargs)
+
+        # iterations and wall-clock budget in seconds of every tick
+        self.nb_iter = nb_iter
+        self.budget = budget
+
+        # control period, from the timing of the quanser envs by default
+        _timing = getattr(env.unwrapped, 'timing', None)
+        self.deadline = deadline if deadline is not None else \
+            (_timing.dt_ctrl if _timing is not None else budget)
+
+        # regularization restored after a failed tick
+        self.lmbda, self.dlmbda = self.alg.lmbda, self.alg.dlmbda
+
+        # latency and iterations of every tick
+        self.times, self.iterations = [], []
+
+        # duration of the last iteration, predicts the next one
+        self.iteration_time = 0.
+
+        self.initialized = False
+
+        if self.alg.linesearch == 'pool':
+            self.alg.pool = WorkerPool(self.alg)
+
+    def reset(self):
+        self.initialized = False
+        self.alg.lmbda, self.alg.dlmbda = self.lmbda, self.dlmbda
+        self.times, self.iterations = [], []
+        self.iteration_time = 0.
+
+    def close(self):
+        if self.alg.pool is not None:
+            self.alg.pool.close()
+            self.alg.pool = None
+
+    def shift(self):
+        # drop the applied step, the last step is held
+        self.alg.xref[:, :-1] = self.alg.xref[:, 1:]
+        self.alg.uref[:, :-1] = self.alg.uref[:, 1:]
+        self.alg.ctl.K[..., :-1] = self.alg.ctl.K[..., 1:]
+        self.alg.ctl.kff[..., :-1] = self.alg.ctl.kff[..., 1:]
+
+    def warm_start(self):
+        # closed-loop rollout of the shifted solution
+        with self.alg.profiler.phase('forward_pass', alpha=0.):
+            _state, _action, _cost = self.alg.forward_pass(self.alg.ctl, 0.)
+
+        if np.all(_state < 1.e8):
+            self.alg.xref = _state
+            self.alg.uref = _action
+            self.alg.last_return = np.sum(_cost)
+        else:
+            self.alg.init_trajectory()
+
+    def action(self, x):
+        _start = time.perf_counter()
+
+        self.alg.x0 = np.copy(x)
+        if self.initialized:
+            self.shift()
+            self.warm_start()
+        else:
+            self.alg.init_trajectory()
+            self.initialized = True
+
+        # regularization blew up at the last tick
+        if self.alg.lmbda > self.alg.max_lmbda:
+            self.alg.lmbda, self.alg.dlmbda = self.lmbda, self.dlmbda
+
+        _trace = []
+        _nb_iter = 0
+        while _nb_iter < self.nb_iter:
+            # at least one iteration, more while the budget allows
+            if _nb_iter > 0 and self.budget is not None and\
+                    time.perf_counter() - _start + self.iteration_time > self.budget:
+                break
+
+            _iter_start = time.perf_counter()
+            _done = self.alg.iteration(_trace)
+            self.iteration_time = time.perf_counter() - _iter_start
+
+            _nb_iter += 1
+            if _done:
+                break
+
+        self.times.append(time.perf_counter() - _start)
+        self.iterations.append(_nb_iter)
+
+        return np.copy(self.alg.uref[:, 0])
+
+    def latency(self):
+        """
+        :return: statistics of the solve latency per tick in seconds,
+                 misses counts the ticks exceeding the deadline
+        """
+        _times = np.array(self.times)
+        if len(_times) == 0:
+            return {'ticks': 0}
+
+        _stats = {'ticks': len(_times),
+                  'mean': np.mean(_times), 'std': np.std(_times),
+                  'min': np.min(_times), 'max': np.max(_times),
+                  'p50': np.percentile(_times, 50),
+                  'p95': np.percentile(_times, 95),
+                  'p99': np.percentile(_times, 99),
+                  'iterations': np.mean(self.iterations),
+                  'deadline': self.deadline}
+
+        if self.deadline is not None:
+            _stats['misses'] = int(np.sum(_times > self.deadline))
+        return _stats
@@ -6,17 +6,18 @@
 # @Contact: hany@robot-learning.de
 
 import autograd.numpy as np
-from autograd import jacobian, hessian
 from copy import deepcopy
 
+from trajopt.autodiff import get_backend
+
 
 class QuadraticStateValue:
     def __init__(self, nb_xdim, nb_steps):
         self.nb_xdim = nb_xdim
         self.nb_steps = nb_steps
 
-        self.V = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.v = np.zeros((self.nb_xdim, self.nb_steps, ))
+        self.V = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.v = np.zeros((self.nb_xdim, self.nb_steps, ), order='F')
 
 
 class QuadraticStateActionValue:
@@ -25,12 +26,12 @@ class QuadraticStateActionValue:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.Qxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.Quu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps))
-        self.Qux = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps))
+        self.Qxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.Quu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps), order='F')
+        self.Qux = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps), order='F')
 
-        self.qx = np.zeros((self.nb_xdim, self.nb_steps, ))
-        self.qu = np.zeros((self.nb_udim, self.nb_steps, ))
+        self.qx = np.zeros((self.nb_xdim, self.nb_steps, ), order='F')
+        self.qu = np.zeros((self.nb_udim, self.nb_steps, ), order='F')
 
 
 class QuadraticCost:
@@ -40,13 +41,13 @@ class QuadraticCost:
 
         self.nb_steps = nb_steps
 
-        self.Cxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.cx = np.zeros((self.nb_xdim, self.nb_steps))
+        self.Cxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.cx = np.zeros((self.nb_xdim, self.nb_steps), order='F')
 
-        self.Cuu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps))
-        self.cu = np.zeros((self.nb_udim, self.nb_steps))
+        self.Cuu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps), order='F')
+        self.cu = np.zeros((self.nb_udim, self.nb_steps), order='F')
 
-        self.Cxu = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps))
+        self.Cxu = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps), order='F')
 
     @property
     def params(self):
@@ -58,33 +59,46 @@ class QuadraticCost:
 
 
 class AnalyticalQuadraticCost(QuadraticCost):
-    def __init__(self, f, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, f, nb_xdim, nb_udim, nb_steps,
+                 backend='autograd'):
         super(AnalyticalQuadraticCost, self).__init__(nb_xdim, nb_udim, nb_steps)
 
-        self.f = f
+        self.backend = get_backend(backend)
+
+        self.f = self.backend.jit(f, static_argnums=(2, ))
+
+        # value, gradient and hessian w.r.t. z = [x, u] of all steps
+        self.dcdz = self.backend.batch_value_grad_hessian(self.fz, static_argnums=(1, ))
 
-        self.dcdxx = hessian(self.f, 0)
-        self.dcduu = hessian(self.f, 1)
-        self.dcdxu = jacobian(jacobian(self.f, 0), 1)
+        # cost of a batch of states and actions
+        self.fb = self.backend.batch(self.f, static_argnums=(2, ))
 
-        self.dcdx = jacobian(self.f, 0)
-        self.dcdu = jacobian(self.f, 1)
+    def fz(self, z, a, xref):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:], a, xref)
 
     def evalf(self, x, u, a):
         _xref = deepcopy(x)
         return self.f(x, u, a, _xref)
 
+    def evalfb(self, x, u, a):
+        # x: (nb_rows, nb_xdim), u: (nb_rows, nb_udim)
+        _xref = deepcopy(x)
+        _a = np.full((x.shape[0], ), a)
+        return self.fb(x, u, _a, _xref)
+
     def taylor_expansion(self, x, u, a):
         # padd last time step of action traj.
         _u = np.hstack((u, np.zeros((self.nb_udim, 1))))
         _xref = deepcopy(x)
-        for t in range(self.nb_steps):
-            _in = tuple([x[..., t], _u[..., t], a[t], _xref[..., t]])
-            self.Cxx[..., t] = self.dcdxx(*_in)
-            self.Cuu[..., t] = self.dcduu(*_in)
-            self.Cxu[..., t] = self.dcdxu(*_in)
-            self.cx[..., t] = self.dcdx(*_in)
-            self.cu[..., t] = self.dcdu(*_in)
+
+        _z = np.vstack((x, _u)).T
+        _, _g, _H = self.dcdz(_z, a, _xref.T)
+
+        self.Cxx[...] = np.transpose(_H[:, :self.nb_xdim, :self.nb_xdim], (1, 2, 0))
+        self.Cuu[...] = np.transpose(_H[:, self.nb_xdim:, self.nb_xdim:], (1, 2, 0))
+        self.Cxu[...] = np.transpose(_H[:, :self.nb_xdim, self.nb_xdim:], (1, 2, 0))
+        self.cx[...] = _g[:, :self.nb_xdim].T
+        self.cu[...] = _g[:, self.nb_xdim:].T
 
 
 class LinearDynamics:
@@ -93,8 +107,8 @@ class LinearDynamics:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.A = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.B = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps))
+        self.A = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.B = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps), order='F')
 
     @property
     def params(self):
@@ -109,14 +123,29 @@ class LinearDynamics:
 
 
 class AnalyticalLinearDynamics(LinearDynamics):
-    def __init__(self, f_init, f_dyn, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, f_init, f_dyn, nb_xdim, nb_udim, nb_steps,
+                 f_dyn_batch=None, backend='autograd'):
         super(AnalyticalLinearDynamics, self).__init__(nb_xdim, nb_udim, nb_steps)
 
+        self.backend = get_backend(backend)
+
         self.i = f_init
-        self.f = f_dyn
+        self.f = self.backend.jit(f_dyn)
+
+        # batched dynamics take (nb_steps, nb_xdim) and (nb_steps, nb_udim)
+        self.fb = f_dyn_batch
+
+        # jacobians w.r.t. z = [x, u] of all steps
+        self.dfdz = self.backend.batch_jacobian(self.fz, self.fzb if self.fb is not None else None)
+
+        # dynamics of a batch of states and actions
+        self.fbatch = self.fb if self.fb is not None else self.backend.batch(self.f)
+
+    def fz(self, z):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:])
 
-        self.dfdx = jacobian(self.f, 0)
-        self.dfdu = jacobian(self.f, 1)
+    def fzb(self, z):
+        return self.fb(z[:, :self.nb_xdim], z[:, self.nb_xdim:])
 
     def evali(self):
         return self.i()
@@ -124,10 +153,16 @@ class AnalyticalLinearDynamics(LinearDynamics):
     def evalf(self, x, u):
         return self.f(x, u)
 
+    def evalfb(self, x, u):
+        # x: (nb_rows, nb_xdim), u: (nb_rows, nb_udim)
+        return self.fbatch(x, u)
+
     def taylor_expansion(self, x, u):
-        for t in range(self.nb_steps):
-            self.A[..., t] = self.dfdx(x[..., t], u[..., t])
-            self.B[..., t] = self.dfdu(x[..., t], u[..., t])
+        _z = np.vstack((x[:, :self.nb_steps], u)).T
+        _grads = self.dfdz(_z)
+
+        self.A[...] = np.transpose(_grads[..., :self.nb_xdim], (1, 2, 0))
+        self.B[...] = np.transpose(_grads[..., self.nb_xdim:], (1, 2, 0))
 
 
 class LinearControl:
@@ -136,8 +171,8 @@ class LinearControl:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.K = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps))
-        self.kff = np.zeros((self.nb_udim, self.nb_steps))
+        self.K = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps), order='F')
+        self.kff = np.zeros((self.nb_udim, self.nb_steps), order='F')
 
     @property
     def params(self):
@@ -150,3 +185,220 @@ class LinearControl:
     def action(self, x, alpha, xref, uref, t):
         dx = x[..., t] - xref[:, t]
         return uref[:, t] + alpha * self.kff[..., t] + self.K[..., t] @ dx
+
+    def action_batch(self, x, alphas, xref, uref, t):
+        # x: (nb_alphas, nb_xdim), one row per step size
+        dx = x - xref[:, t]
+        return uref[:, t] + alphas[:, None] * self.kff[..., t] + dx @ self.K[..., t].T
+
+
+class Workspace:
+    """
+    Preallocated outputs of the backward pass, sized once and
+    written in place by the core at every call
+    """
+    def __init__(self, nb_xdim, nb_udim, nb_steps):
+        self.nb_xdim = nb_xdim
+        self.nb_udim = nb_udim
+        self.nb_steps = nb_steps
+
+        self.ctl = LinearControl(self.nb_xdim, self.nb_udim, self.nb_steps)
+        self.vfunc = QuadraticStateValue(self.nb_xdim, self.nb_steps + 1)
+        self.qfunc = QuadraticStateActionValue(self.nb_xdim, self.nb_udim, self.nb_steps)
+
+        # expected cost change, linear and quadratic in alpha
+        self.dV = np.zeros((2, ))
+
+    @property
+    def params(self):
+        return self.qfunc.Qxx, self.qfunc.Qux, self.qfunc.Quu,\
+               self.qfunc.qx, self.qfunc.qu,\
+               self.vfunc.V, self.vfunc.v, self.dV,\
+               self.ctl.K, self.ctl.kff
+
+
+def batch_zeros(nb_batch, *shape):
+    # f-ordered with the batch axis last, every problem is contiguous
+    # for the core, and viewed with a leading batch axis
+    return np.moveaxis(np.zeros(shape + (nb_batch, ), order='F'), -1, 0)
+
+
+def batch_params(*arrays):
+    # views with the batch axis last, as passed to the core
+    return tuple(np.moveaxis(_array, 0, -1) for _array in arrays)
+
+
+class AnalyticalBatchQuadraticCost:
+    """
+    Quadratic expansions of the cost of nb_batch problems,
+    all arrays carry a leading batch axis
+    """
+    def __init__(self, f, nb_xdim, nb_udim, nb_steps, nb_batch,
+                 backend='autograd'):
+        self.nb_xdim = nb_xdim
+        self.nb_udim = nb_udim
+        self.nb_steps = nb_steps
+        self.nb_batch = nb_batch
+
+        self.Cxx = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_xdim, self.nb_steps)
+        self.cx = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_steps)
+
+        self.Cuu = batch_zeros(self.nb_batch, self.nb_udim, self.nb_udim, self.nb_steps)
+        self.cu = batch_zeros(self.nb_batch, self.nb_udim, self.nb_steps)
+
+        self.Cxu = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_udim, self.nb_steps)
+
+        self.backend = get_backend(backend)
+
+        self.f = self.backend.jit(f, static_argnums=(2, ))
+
+        # value, gradient and hessian w.r.t. z = [x, u] of all steps
+        self.dcdz = self.backend.batch_value_grad_hessian(self.fz, static_argnums=(1, ))
+
+        # cost of a batch of states and actions
+        self.fb = self.backend.batch(self.f, static_argnums=(2, ))
+
+    @property
+    def params(self):
+        return self.Cxx, self.cx, self.Cuu, self.cu, self.Cxu
+
+    def fz(self, z, a, xref):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:], a, xref)
+
+    def evalfb(self, x, u, a):
+        # x: (nb_rows, nb_xdim), u: (nb_rows, nb_udim)
+        _xref = deepcopy(x)
+        _a = np.full((x.shape[0], ), a)
+        return self.fb(x, u, _a, _xref)
+
+    def taylor_expansion(self, x, u, a, idx=None):
+        # x: (nb_batch, nb_xdim, nb_steps), u: (nb_batch, nb_udim, nb_steps - 1),
+        # only problems in idx are expanded, all steps in one call
+        idx = np.arange(self.nb_batch) if idx is None else idx
+        _nb = len(idx)
+
+        # padd last time step of action traj.
+        _u = np.concatenate((u[idx], np.zeros((_nb, self.nb_udim, 1))), axis=2)
+        _x = x[idx]
+
+        _z = np.concatenate((_x, _u), axis=1).transpose(0, 2, 1).reshape(-1, self.nb_xdim + self.nb_udim)
+        _xref = np.copy(_z[:, :self.nb_xdim])
+        _, _g, _H = self.dcdz(_z, np.tile(a, _nb), _xref)
+
+        _g = _g.reshape(_nb, self.nb_steps, -1)
+        _H = _H.reshape(_nb, self.nb_steps, self.nb_xdim + self.nb_udim, -1)
+
+        self.Cxx[idx] = np.transpose(_H[..., :self.nb_xdim, :self.nb_xdim], (0, 2, 3, 1))
+        self.Cuu[idx] = np.transpose(_H[..., self.nb_xdim:, self.nb_xdim:], (0, 2, 3, 1))
+        self.Cxu[idx] = np.transpose(_H[..., :self.nb_xdim, self.nb_xdim:], (0, 2, 3, 1))
+        self.cx[idx] = np.transpose(_g[..., :self.nb_xdim], (0, 2, 1))
+        self.cu[idx] = np.transpose(_g[..., self.nb_xdim:], (0, 2, 1))
+
+
+class AnalyticalBatchLinearDynamics:
+    """
+    Linearizations of the dynamics of nb_batch problems,
+    all arrays carry a leading batch axis
+    """
+    def __init__(self, f_dyn, nb_xdim, nb_udim, nb_steps, nb_batch,
+                 f_dyn_batch=None, backend='autograd'):
+        self.nb_xdim = nb_xdim
+        self.nb_udim = nb_udim
+        self.nb_steps = nb_steps
+        self.nb_batch = nb_batch
+
+        self.A = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_xdim, self.nb_steps)
+        self.B = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_udim, self.nb_steps)
+
+        self.backend = get_backend(backend)
+
+        self.f = self.backend.jit(f_dyn)
+
+        # batched dynamics take (nb_rows, nb_xdim) and (nb_rows, nb_udim)
+        self.fb = f_dyn_batch
+
+        # jacobians w.r.t. z = [x, u] of all steps
+        self.dfdz = self.backend.batch_jacobian(self.fz, self.fzb if self.fb is not None else None)
+
+        # dynamics of a batch of states and actions
+        self.fbatch = self.fb if self.fb is not None else self.backend.batch(self.f)
+
+    @property
+    def params(self):
+        return self.A, self.B
+
+    def fz(self, z):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:])
+
+    def fzb(self, z):
+        return self.fb(z[:, :self.nb_xdim], z[:, self.nb_xdim:])
+
+    def evalfb(self, x, u):
+        # x: (nb_rows, nb_xdim), u: (nb_rows, nb_udim)
+        return self.fbatch(x, u)
+
+    def taylor_expansion(self, x, u, idx=None):
+        # x: (nb_batch, nb_xdim, nb_steps + 1), u: (nb_batch, nb_udim, nb_steps),
+        # only problems in idx are linearized, all steps in one call
+        idx = np.arange(self.nb_batch) if idx is None else idx
+        _nb = len(idx)
+
+        _z = np.concatenate((x[idx, :, :self.nb_steps], u[idx]), axis=1)
+        _z = _z.transpose(0, 2, 1).reshape(-1, self.nb_xdim + self.nb_udim)
+
+        _grads = self.dfdz(_z).reshape(_nb, self.nb_steps, self.nb_xdim, -1)
+
+        self.A[idx] = np.transpose(_grads[..., :self.nb_xdim], (0, 2, 3, 1))
+        self.B[idx] = np.transpose(_grads[..., self.nb_xdim:], (0, 2, 3, 1))
+
+
+class BatchLinearControl:
+    def __init__(self, nb_xdim, nb_udim, nb_steps, nb_batch):
+        self.nb_xdim = nb_xdim
+        self.nb_udim = nb_udim
+        self.nb_steps = nb_steps
+        self.nb_batch = nb_batch
+
+        self.K = batch_zeros(self.nb_batch, self.nb_udim, self.nb_xdim, self.nb_steps)
+        self.kff = batch_zeros(self.nb_batch, self.nb_udim, self.nb_steps)
+
+    @property
+    def params(self):
+        return self.K, self.kff
+
+    def action(self, x, alpha, xref, uref, t, idx):
+        # x: (nb_rows, nb_xdim) and alpha: (nb_rows, ) of the problems in idx
+        dx = x - xref[idx, :, t]
+        return uref[idx, :, t] + alpha[:, None] * self.kff[idx, :, t]\
+               + np.einsum('nkl,nl->nk', self.K[idx, ..., t], dx)
+
+
+class BatchWorkspace:
+    """
+    Preallocated outputs of the batched backward pass, with a
+    leading batch axis and written in place by the core
+    """
+    def __init__(self, nb_xdim, nb_udim, nb_steps, nb_batch):
+        self.nb_xdim = nb_xdim
+        self.nb_udim = nb_udim
+        self.nb_steps = nb_steps
+        self.nb_batch = nb_batch
+
+        self.ctl = BatchLinearControl(self.nb_xdim, self.nb_udim, self.nb_steps, self.nb_batch)
+
+        self.Qxx = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_xdim, self.nb_steps)
+        self.Qux = batch_zeros(self.nb_batch, self.nb_udim, self.nb_xdim, self.nb_steps)
+        self.Quu = batch_zeros(self.nb_batch, self.nb_udim, self.nb_udim, self.nb_steps)
+        self.qx = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_steps)
+        self.qu = batch_zeros(self.nb_batch, self.nb_udim, self.nb_steps)
+
+        self.V = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_xdim, self.nb_steps + 1)
+        self.v = batch_zeros(self.nb_batch, self.nb_xdim, self.nb_steps + 1)
+
+        # expected cost change, linear and quadratic in alpha
+        self.dV = batch_zeros(self.nb_batch, 2)
+
+    @property
+    def params(self):
+        return batch_params(self.Qxx, self.Qux, self.Quu, self.qx, self.qu,
+                            self.V, self.v, self.dV, self.ctl.K, self.ctl.kff)
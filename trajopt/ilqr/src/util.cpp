@@ -1,90 +1,222 @@
-#include <pybind11/pybind11.h>
-#include <pybind11/numpy.h>
-#include <armadillo>
+#include "util.h"
+
+
+// sequential riccati sweep of a single problem, outputs are written
+// into the given armadillo views. Returns 1 if the regularized Quu
+// was not positive definite at any step, 0 otherwise
+int backward_sweep(const cube &Cxx, const mat &cx, const cube &Cuu,
+                   const mat &cu, const cube &Cxu,
+                   const cube &A, const cube &B,
+                   double lmbda, int reg,
+                   int nb_xdim, int nb_udim, int nb_steps,
+                   cube &Qxx, cube &Qux, cube &Quu,
+                   mat &qx, mat &qu,
+                   cube &V, mat &v, vec &dV,
+                   cube &K, mat &kff) {
+
+    Qxx.zeros(); Qux.zeros(); Quu.zeros();
+    qx.zeros(); qu.zeros();
+    V.zeros(); v.zeros(); dV.zeros();
+    K.zeros(); kff.zeros();
+
+    // per-step intermediates
+    mat Qux_reg(nb_udim, nb_xdim);
+    mat Quu_reg(nb_udim, nb_udim);
+    mat L(nb_udim, nb_udim);
+    mat gains(nb_udim, nb_xdim + 1);
+
+    mat V_reg(nb_xdim, nb_xdim);
 
-namespace py = pybind11;
-
-using namespace arma;
+    int _diverge = 0;
 
+    // last time step
+    V.slice(nb_steps) = Cxx.slice(nb_steps);
+    v.col(nb_steps) = cx.col(nb_steps);
 
-typedef py::array_t<double, py::array::f_style | py::array::forcecast> array_tf;
-typedef py::array_t<double, py::array::c_style | py::array::forcecast> array_tc;
+	for(int i = nb_steps - 1; i>= 0; --i)
+	{
+        Qxx.slice(i) = Cxx.slice(i) + A.slice(i).t() * V.slice(i+1) * A.slice(i);
+        Quu.slice(i) = Cuu.slice(i) + B.slice(i).t() * V.slice(i+1) * B.slice(i);
+        Qux.slice(i) = (Cxu.slice(i) + A.slice(i).t() * V.slice(i+1) * B.slice(i)).t();
 
+        qu.col(i) = cu.col(i) + B.slice(i).t() * v.col(i+1);
+        qx.col(i) = cx.col(i) + A.slice(i).t() * v.col(i+1);
 
-cube array_to_cube(array_tf m) {
+        V_reg = V.slice(i+1);
+        if (reg==2)
+            V_reg += lmbda * eye(nb_xdim, nb_xdim);
 
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-    int n_cols = _m_buff.shape[1];
-    int n_slices = _m_buff.shape[2];
+        Qux_reg = (Cxu.slice(i) + A.slice(i).t() * V_reg * B.slice(i)).t();
 
-    cube _m_arma((double *)_m_buff.ptr, n_rows, n_cols, n_slices);
+        Quu_reg = Cuu.slice(i) + B.slice(i).t() * V_reg * B.slice(i);
+        if (reg==1)
+            Quu_reg += lmbda * eye(nb_udim, nb_udim);
 
-    return _m_arma;
-}
+        // the factorization doubles as the definiteness check
+        if (!chol_factor(L, Quu_reg)) {
+            _diverge = 1;
+            break;
+        }
 
+        gains = - chol_solve(L, join_horiz(Qux_reg, qu.col(i)));
+        K.slice(i) = gains.head_cols(nb_xdim);
+        kff.col(i) = gains.col(nb_xdim);
 
-mat array_to_mat(array_tf m) {
+        dV += join_vert(kff.col(i).t() * qu.col(i), 0.5 * kff.col(i).t() * Quu.slice(i) * kff.col(i));
 
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-    int n_cols = _m_buff.shape[1];
+        v.col(i) = qx.col(i) + K.slice(i).t() * Quu.slice(i) * kff.col(i) +
+                   K.slice(i).t() * qu.col(i) + Qux.slice(i).t() * kff.col(i);
 
-    mat _m_arma((double *)_m_buff.ptr, n_rows, n_cols);
+        V.slice(i) = Qxx.slice(i) + K.slice(i).t() * Quu.slice(i) * K.slice(i) +
+                     K.slice(i).t() * Qux.slice(i) + Qux.slice(i).t() * K.slice(i);
+        V.slice(i) = 0.5 * (V.slice(i) + V.slice(i).t());
+	}
 
-    return _m_arma;
+	return _diverge;
 }
 
 
-vec array_to_vec(array_tf m) {
+int backward_pass(py::array _Cxx, py::array _cx, py::array _Cuu,
+                  py::array _cu, py::array _Cxu,
+                  py::array _A, py::array _B,
+                  double lmbda, int reg,
+                  int nb_xdim, int nb_udim, int nb_steps,
+                  py::array _Qxx, py::array _Qux, py::array _Quu,
+                  py::array _qx, py::array _qu,
+                  py::array _V, py::array _v, py::array _dV,
+                  py::array _K, py::array _kff) {
 
-    py::buffer_info _m_buff = m.request();
-    int n_rows = _m_buff.shape[0];
-
-    vec _m_vec((double *)_m_buff.ptr, n_rows);
-
-    return _m_vec;
-}
+    // inputs
+    cube Cxx = array_to_cube(_Cxx);
+    mat cx = array_to_mat(_cx);
+    cube Cuu = array_to_cube(_Cuu);
+    mat cu = array_to_mat(_cu);
+    cube Cxu = array_to_cube(_Cxu);
 
+    cube A = array_to_cube(_A);
+    cube B = array_to_cube(_B);
 
-array_tf cube_to_array(cube m) {
+    // outputs, preallocated by the caller and written in place
+    cube Qxx = array_to_cube(_Qxx, true);
+    cube Qux = array_to_cube(_Qux, true);
+    cube Quu = array_to_cube(_Quu, true);
+    mat qx = array_to_mat(_qx, true);
+    mat qu = array_to_mat(_qu, true);
 
-    auto _m_array = array_tf({m.n_rows, m.n_cols, m.n_slices});
+    cube V = array_to_cube(_V, true);
+    mat v = array_to_mat(_v, true);
+    vec dV = array_to_vec(_dV, true);
 
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows * m.n_cols * m.n_slices);
+    cube K = array_to_cube(_K, true);
+    mat kff = array_to_mat(_kff, true);
 
-    return _m_array;
+    return backward_sweep(Cxx, cx, Cuu, cu, Cxu, A, B,
+                          lmbda, reg, nb_xdim, nb_udim, nb_steps,
+                          Qxx, Qux, Quu, qx, qu, V, v, dV, K, kff);
 }
 
 
-array_tf mat_to_array(mat m) {
-
-    auto _m_array = array_tf({m.n_rows, m.n_cols});
+// problem n of an f-contiguous batch, the batch axis is last
+cube batch_cube(double *ptr, py::array &m, int n) {
+    int n_rows = m.shape(0);
+    int n_cols = m.shape(1);
+    int n_slices = m.shape(2);
+    return cube(ptr + n * n_rows * n_cols * n_slices, n_rows, n_cols, n_slices, false, true);
+}
 
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows * m.n_cols);
 
-    return _m_array;
+mat batch_mat(double *ptr, py::array &m, int n) {
+    int n_rows = m.shape(0);
+    int n_cols = m.shape(1);
+    return mat(ptr + n * n_rows * n_cols, n_rows, n_cols, false, true);
 }
 
 
-array_tf vec_to_array(vec m) {
+vec batch_vec(double *ptr, py::array &m, int n) {
+    int n_rows = m.shape(0);
+    return vec(ptr + n * n_rows, n_rows, false, true);
+}
 
-    auto _m_array = array_tf({m.n_rows});
 
-    py::buffer_info _m_buff = _m_array.request();
-    std::memcpy(_m_buff.ptr, m.memptr(), sizeof(double) * m.n_rows);
+// sequential backward passes of nb_batch independent problems, inputs and
+// outputs carry the batch as last axis. Every problem has its own lmbda,
+// problems that are not active are skipped and keep their outputs.
+// Problems are spread over nb_threads, 0 uses all available cores
+py::array_t<int> batch_backward_pass(py::array _Cxx, py::array _cx, py::array _Cuu,
+                                     py::array _cu, py::array _Cxu,
+                                     py::array _A, py::array _B,
+                                     py::array _lmbda, int reg, py::array _active,
+                                     int nb_xdim, int nb_udim, int nb_steps, int nb_batch,
+                                     py::array _Qxx, py::array _Qux, py::array _Quu,
+                                     py::array _qx, py::array _qu,
+                                     py::array _V, py::array _v, py::array _dV,
+                                     py::array _K, py::array _kff,
+                                     int nb_threads) {
+
+    // inputs and outputs are resolved before spawning any thread
+    std::vector<py::array *> _inputs = {&_Cxx, &_cx, &_Cuu, &_cu, &_Cxu, &_A, &_B};
+    std::vector<py::array *> _outputs = {&_Qxx, &_Qux, &_Quu, &_qx, &_qu,
+                                         &_V, &_v, &_dV, &_K, &_kff};
+
+    std::vector<double *> _in, _out;
+    for (auto _m : _inputs)
+        _in.push_back(array_to_ptr(*_m));
+    for (auto _m : _outputs)
+        _out.push_back(array_to_ptr(*_m, true));
+
+    vec lmbda = array_to_vec(_lmbda);
+    vec active = array_to_vec(_active);
+
+    py::array_t<int> _diverge(nb_batch);
+    int *diverge = _diverge.mutable_data();
+    std::fill_n(diverge, nb_batch, 0);
+
+    parallel_blocks(nb_batch, nb_threads, [&](int begin, int end, int p) {
+        for (int n = begin; n < end; ++n) {
+            if (active(n) == 0.)
+                continue;
+
+            cube Cxx = batch_cube(_in[0], _Cxx, n);
+            mat cx = batch_mat(_in[1], _cx, n);
+            cube Cuu = batch_cube(_in[2], _Cuu, n);
+            mat cu = batch_mat(_in[3], _cu, n);
+            cube Cxu = batch_cube(_in[4], _Cxu, n);
+            cube A = batch_cube(_in[5], _A, n);
+            cube B = batch_cube(_in[6], _B, n);
+
+            cube Qxx = batch_cube(_out[0], _Qxx, n);
+            cube Qux = batch_cube(_out[1], _Qux, n);
+            cube Quu = batch_cube(_out[2], _Quu, n);
+            mat qx = batch_mat(_out[3], _qx, n);
+            mat qu = batch_mat(_out[4], _qu, n);
+            cube V = batch_cube(_out[5], _V, n);
+            mat v = batch_mat(_out[6], _v, n);
+            vec dV = batch_vec(_out[7], _dV, n);
+            cube K = batch_cube(_out[8], _K, n);
+            mat kff = batch_mat(_out[9], _kff, n);
+
+            diverge[n] = backward_sweep(Cxx, cx, Cuu, cu, Cxu, A, B,
+                                        lmbda(n), reg, nb_xdim, nb_udim, nb_steps,
+                                        Qxx, Qux, Quu, qx, qu, V, v, dV, K, kff);
+        }
+    });
 
-    return _m_array;
+    return _diverge;
 }
 
 
-py::tuple backward_pass(array_tf _Cxx, array_tf _cx, array_tf _Cuu,
-                        array_tf _cu, array_tf _Cxu,
-                        array_tf _A, array_tf _B,
-                        double lmbda, int reg,
-                        int nb_xdim, int nb_udim, int nb_steps) {
+// unregularized backward pass as a parallel-in-time scan, agrees with
+// backward_pass for lmbda=0. Returns 1 if a control cost or Quu is not
+// positive definite at any step, 0 otherwise
+int parallel_backward_pass(py::array _Cxx, py::array _cx, py::array _Cuu,
+                           py::array _cu, py::array _Cxu,
+                           py::array _A, py::array _B,
+                           int nb_xdim, int nb_udim, int nb_steps,
+                           py::array _Qxx, py::array _Qux, py::array _Quu,
+                           py::array _qx, py::array _qu,
+                           py::array _V, py::array _v, py::array _dV,
+                           py::array _K, py::array _kff,
+                           int nb_threads) {
 
     // inputs
     cube Cxx = array_to_cube(_Cxx);
@@ -96,93 +228,95 @@ py::tuple backward_pass(array_tf _Cxx, array_tf _cx, array_tf _Cuu,
     cube A = array_to_cube(_A);
     cube B = array_to_cube(_B);
 
-    // outputs
-    cube Q(nb_xdim + nb_udim, nb_xdim + nb_udim, nb_steps);
-    cube Qxx(nb_xdim, nb_xdim, nb_steps);
-    cube Qux(nb_udim, nb_xdim, nb_steps);
-    cube Quu(nb_udim, nb_udim, nb_steps);
-    mat qx(nb_xdim, nb_steps);
-    mat qu(nb_udim, nb_steps);
-
-    cube Qux_reg(nb_udim, nb_xdim, nb_steps);
-    cube Quu_reg(nb_udim, nb_udim, nb_steps);
-    cube Quu_inv(nb_udim, nb_udim, nb_steps);
+    // outputs, preallocated by the caller and written in place
+    cube Qxx = array_to_cube(_Qxx, true);
+    cube Qux = array_to_cube(_Qux, true);
+    cube Quu = array_to_cube(_Quu, true);
+    mat qx = array_to_mat(_qx, true);
+    mat qu = array_to_mat(_qu, true);
 
-    cube V(nb_xdim, nb_xdim, nb_steps + 1);
-    mat v(nb_xdim, nb_steps + 1);
-    vec dV(2);
+    cube V = array_to_cube(_V, true);
+    mat v = array_to_mat(_v, true);
+    vec dV = array_to_vec(_dV, true);
 
-    cube V_reg(nb_xdim, nb_xdim, nb_steps + 1);
+    cube K = array_to_cube(_K, true);
+    mat kff = array_to_mat(_kff, true);
 
-    cube K(nb_udim, nb_xdim, nb_steps);
-    mat kff(nb_udim, nb_steps);
+    Qxx.zeros(); Qux.zeros(); Quu.zeros();
+    qx.zeros(); qu.zeros();
+    V.zeros(); v.zeros(); dV.zeros();
+    K.zeros(); kff.zeros();
 
-    int _diverge = 0;
+    std::vector<Element> elems(nb_steps + 1);
+    std::vector<int> _failed(nb_steps, 0);
 
-    // last time step
-    V.slice(nb_steps) = Cxx.slice(nb_steps);
-    v.col(nb_steps) = cx.col(nb_steps);
+    parallel_blocks(nb_steps, nb_threads, [&](int begin, int end, int p) {
+        for (int i = begin; i < end; ++i)
+            _failed[i] = !lqr_element(Cxx.slice(i), cx.col(i), Cuu.slice(i), cu.col(i), Cxu.slice(i),
+                                      A.slice(i), B.slice(i), zeros<vec>(nb_xdim), elems[i]);
+    });
+    elems[nb_steps] = terminal_element(Cxx.slice(nb_steps), cx.col(nb_steps));
 
-	for(int i = nb_steps - 1; i>= 0; --i)
-	{
-        Qxx.slice(i) = Cxx.slice(i) + A.slice(i).t() * V.slice(i+1) * A.slice(i);
-        Quu.slice(i) = Cuu.slice(i) + B.slice(i).t() * V.slice(i+1) * B.slice(i);
-        Qux.slice(i) = (Cxu.slice(i) + A.slice(i).t() * V.slice(i+1) * B.slice(i)).t();
+    for(int i = nb_steps - 1; i>= 0; --i)
+        if (_failed[i])
+            return 1;
 
-        qu.col(i) = cu.col(i) + B.slice(i).t() * v.col(i+1);
-        qx.col(i) = cx.col(i) + A.slice(i).t() * v.col(i+1);
+    suffix_scan(elems, nb_threads);
 
-        V_reg.slice(i+1) = V.slice(i+1);
-        if (reg==2)
-            V_reg.slice(i+1) += lmbda * eye(nb_xdim, nb_xdim);
+    // gains from the value functions, independent over time
+    mat dV_steps = zeros<mat>(2, nb_steps);
 
-        Qux_reg.slice(i) = (Cxu.slice(i) + A.slice(i).t() * V_reg.slice(i+1) * B.slice(i)).t();
+    parallel_blocks(nb_steps + 1, nb_threads, [&](int begin, int end, int p) {
+        for (int i = begin; i < end; ++i) {
+            V.slice(i) = elems[i].J;
+            v.col(i) = - elems[i].eta;
+        }
+    });
 
-        Quu_reg.slice(i) = Cuu.slice(i) + B.slice(i).t() * V_reg.slice(i+1) * B.slice(i);
-        if (reg==1)
-            Quu_reg.slice(i) += lmbda * eye(nb_udim, nb_udim);
+    parallel_blocks(nb_steps, nb_threads, [&](int begin, int end, int p) {
 
-        if (!(Quu_reg.slice(i)).is_sympd()) {
-            _diverge = i;
-            break;
-        }
+        mat L(nb_udim, nb_udim);
+        mat gains(nb_udim, nb_xdim + 1);
 
-        Quu_inv.slice(i) = inv(Quu_reg.slice(i));
-        K.slice(i) = - Quu_inv.slice(i) * Qux_reg.slice(i);
-        kff.col(i) = - Quu_inv.slice(i) * qu.col(i);
+        for (int i = begin; i < end; ++i) {
+            mat Vn = elems[i+1].J;
+            vec vn = - elems[i+1].eta;
 
-        dV += join_vert(kff.col(i).t() * qu.col(i), 0.5 * kff.col(i).t() * Quu.slice(i) * kff.col(i));
+            Qxx.slice(i) = Cxx.slice(i) + A.slice(i).t() * Vn * A.slice(i);
+            Quu.slice(i) = Cuu.slice(i) + B.slice(i).t() * Vn * B.slice(i);
+            Qux.slice(i) = (Cxu.slice(i) + A.slice(i).t() * Vn * B.slice(i)).t();
 
-        v.col(i) = qx.col(i) + K.slice(i).t() * Quu.slice(i) * kff.col(i) +
-                   K.slice(i).t() * qu.col(i) + Qux.slice(i).t() * kff.col(i);
+            qu.col(i) = cu.col(i) + B.slice(i).t() * vn;
+            qx.col(i) = cx.col(i) + A.slice(i).t() * vn;
 
-        V.slice(i) = Qxx.slice(i) + K.slice(i).t() * Quu.slice(i) * K.slice(i) +
-                     K.slice(i).t() * Qux.slice(i) + Qux.slice(i).t() * K.slice(i);
-        V.slice(i) = 0.5 * (V.slice(i) + V.slice(i).t());
-	}
+            if (!chol_factor(L, Quu.slice(i))) {
+                _failed[i] = 1;
+                continue;
+            }
 
-    // transform outputs to numpy
-    array_tf _Qxx = cube_to_array(Qxx);
-    array_tf _Qux = cube_to_array(Qux);
-    array_tf _Quu = cube_to_array(Quu);
+            gains = - chol_solve(L, join_horiz(Qux.slice(i), qu.col(i)));
+            K.slice(i) = gains.head_cols(nb_xdim);
+            kff.col(i) = gains.col(nb_xdim);
 
-    array_tf _qx = mat_to_array(qx);
-    array_tf _qu = mat_to_array(qu);
+            dV_steps.col(i) = join_vert(kff.col(i).t() * qu.col(i), 0.5 * kff.col(i).t() * Quu.slice(i) * kff.col(i));
+        }
+    });
 
-    array_tf _V = cube_to_array(V);
-    array_tf _v = mat_to_array(v);
-    array_tf _dV = vec_to_array(dV);
+    for(int i = nb_steps - 1; i>= 0; --i)
+        if (_failed[i])
+            return 1;
 
-    array_tf _K = cube_to_array(K);
-    array_tf _kff = mat_to_array(kff);
+    dV = sum(dV_steps, 1);
 
-    py::tuple output =  py::make_tuple(_Qxx, _Qux, _Quu, _qx, _qu,
-                                       _V, _v, _dV, _K, _kff, _diverge);
-	return output;
+	return 0;
 }
 
 
 PYBIND11_MODULE(core, m)
 {
     m.def("backward_pass", &backward_pass);
+    m.def("parallel_backward_pass", &parallel_backward_pass);
+    m.def("batch_backward_pass", &batch_backward_pass);
+    m.def("copied_bytes", &copied_bytes);
+    m.def("reset_copied_bytes", &reset_copied_bytes);
 }
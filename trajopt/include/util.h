@@ -0,0 +1,323 @@
+// numpy to armadillo bridge, cholesky helpers and the parallel-in-time
+// scan, shared by the c++ cores of all solvers
+
+#pragma once
+
+#include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+
+// a failed factorization is reported as divergence, keep stderr quiet
+#define ARMA_WARN_LEVEL 1
+#define ARMA_DONT_PRINT_ERRORS
+#include <armadillo>
+
+#include <thread>
+#include <vector>
+#include <algorithm>
+
+namespace py = pybind11;
+
+using namespace arma;
+
+
+typedef py::array_t<double, py::array::f_style | py::array::forcecast> array_tf;
+typedef py::array_t<double, py::array::c_style | py::array::forcecast> array_tc;
+
+
+// bytes copied while passing arrays from numpy to armadillo
+static size_t _copied_bytes = 0;
+
+
+size_t copied_bytes() {
+    return _copied_bytes;
+}
+
+
+void reset_copied_bytes() {
+    _copied_bytes = 0;
+}
+
+
+double * array_to_ptr(py::array &m, bool inplace = false) {
+
+    // outputs written in place would be lost in a converted copy
+    if (inplace && !(py::isinstance<array_tf>(m) && m.writeable()))
+        throw std::invalid_argument("in-place outputs have to be writeable f-contiguous float64 arrays");
+
+    // f-contiguous double arrays are aliased as they are, anything
+    // else is converted once and replaces m to outlive the alias
+    if (!py::isinstance<array_tf>(m)) {
+        _copied_bytes += sizeof(double) * m.size();
+        m = array_tf(m);
+    }
+
+    py::buffer_info _m_buff = m.request();
+    return (double *)_m_buff.ptr;
+}
+
+
+cube array_to_cube(py::array &m, bool inplace = false) {
+
+    double *_m_ptr = array_to_ptr(m, inplace);
+    int n_rows = m.shape(0);
+    int n_cols = m.shape(1);
+    int n_slices = m.shape(2);
+
+    // strict alias without copy, armadillo writes to numpy memory
+    return cube(_m_ptr, n_rows, n_cols, n_slices, false, true);
+}
+
+
+mat array_to_mat(py::array &m, bool inplace = false) {
+
+    double *_m_ptr = array_to_ptr(m, inplace);
+    int n_rows = m.shape(0);
+    int n_cols = m.shape(1);
+
+    return mat(_m_ptr, n_rows, n_cols, false, true);
+}
+
+
+vec array_to_vec(py::array &m, bool inplace = false) {
+
+    double *_m_ptr = array_to_ptr(m, inplace);
+    int n_rows = m.shape(0);
+
+    return vec(_m_ptr, n_rows, false, true);
+}
+
+
+array_tf zeros_array(std::vector<ssize_t> shape) {
+
+    // outputs are allocated by numpy and filled in by armadillo
+    array_tf _m_array(shape);
+    std::fill_n(_m_array.mutable_data(), _m_array.size(), 0.);
+
+    return _m_array;
+}
+
+
+// cholesky factor M = LL' of a symmetric matrix, a single factorization
+// serves the definiteness check, solves, inverses and log-determinants.
+// False if M is not positive definite
+bool chol_factor(mat &L, const mat &M) {
+    return chol(L, mat(0.5 * (M + M.t())), "lower");
+}
+
+
+// solution X of LL'X = Y by forward and backward substitution,
+// written out as the factors are small and lapack calls dominate
+mat chol_solve(const mat &L, const mat &Y) {
+    mat X = Y;
+    const uword n = L.n_rows;
+
+    for (uword j = 0; j < X.n_cols; ++j) {
+        double *x = X.colptr(j);
+
+        for (uword i = 0; i < n; ++i) {
+            for (uword k = 0; k < i; ++k)
+                x[i] -= L(i, k) * x[k];
+            x[i] /= L(i, i);
+        }
+
+        for (uword i = n; i-- > 0;) {
+            for (uword k = i + 1; k < n; ++k)
+                x[i] -= L(k, i) * x[k];
+            x[i] /= L(i, i);
+        }
+    }
+
+    return X;
+}
+
+
+// inverse of LL' from the inverse of the triangular factor
+mat chol_inv(const mat &L) {
+    mat L_inv = inv(trimatl(L));
+    return L_inv.t() * L_inv;
+}
+
+
+// log-determinant of LL', stays finite where det() over- or underflows
+double chol_logdet(const mat &L) {
+    return 2. * accu(log(L.diag()));
+}
+
+
+// element of the parallel-in-time scan, a conditional value function
+// V(x, z) = max_l 1/2 x'Jx - x'eta + l'(z - Ax - b) - 1/2 l'Cl
+struct Element {
+    mat A;
+    vec b;
+    mat C;
+    vec eta;
+    mat J;
+};
+
+
+// associative operator, combines steps i->j and j->k into i->k
+Element combine(const Element &ij, const Element &jk) {
+
+    int _nb_xdim = ij.A.n_rows;
+    mat M = eye(_nb_xdim, _nb_xdim) + ij.C * jk.J;
+
+    // exceptions cannot leave a worker thread
+    mat W;
+    if (!inv(W, M))
+        W = pinv(M);
+
+    mat T = jk.A * W;
+    mat U = (W * ij.A).t();
+
+    Element ik;
+    ik.A = T * ij.A;
+    ik.b = T * (ij.b + ij.C * jk.eta) + jk.b;
+    ik.C = T * ij.C * jk.A.t() + jk.C;
+    ik.C = 0.5 * (ik.C + ik.C.t());
+
+    ik.eta = U * (jk.eta - jk.J * ij.b) + ij.eta;
+    ik.J = U * jk.J * ij.A + ij.J;
+    ik.J = 0.5 * (ik.J + ik.J.t());
+
+    return ik;
+}
+
+
+// combination with a suffix that contains the terminal element, its A, b
+// and C vanish, only the value function of the result is computed
+Element combine_value(const Element &ij, const Element &jk) {
+
+    int _nb_xdim = ij.A.n_rows;
+    mat M = eye(_nb_xdim, _nb_xdim) + ij.C * jk.J;
+
+    // exceptions cannot leave a worker thread
+    mat W;
+    if (!inv(W, M))
+        W = pinv(M);
+
+    mat U = (W * ij.A).t();
+
+    Element ik;
+    ik.A = zeros<mat>(_nb_xdim, _nb_xdim);
+    ik.b = zeros<vec>(_nb_xdim);
+    ik.C = zeros<mat>(_nb_xdim, _nb_xdim);
+
+    ik.eta = U * (jk.eta - jk.J * ij.b) + ij.eta;
+    ik.J = U * jk.J * ij.A + ij.J;
+    ik.J = 0.5 * (ik.J + ik.J.t());
+
+    return ik;
+}
+
+
+// run func(begin, end, block) on contiguous blocks, one thread each
+template <typename Func>
+void parallel_blocks(int nb_items, int nb_threads, Func func) {
+
+    if (nb_threads <= 0)
+        nb_threads = std::max(1, (int) std::thread::hardware_concurrency());
+    int _nb_blocks = std::max(1, std::min(nb_threads, nb_items));
+
+    std::vector<std::thread> _threads;
+    for (int p = 0; p < _nb_blocks; ++p) {
+        int _begin = (p * nb_items) / _nb_blocks;
+        int _end = ((p + 1) * nb_items) / _nb_blocks;
+        _threads.emplace_back(func, _begin, _end, p);
+    }
+
+    for (auto &_thread : _threads)
+        _thread.join();
+}
+
+
+// in-place suffix scan, elems[k] <- elems[k] x elems[k+1] x ... x elems[N-1],
+// local scans per block, a sequential pass over the block totals
+// and a final parallel fix-up, O(N/P + P) depth on P threads.
+// The last element is terminal, only value functions are kept
+void suffix_scan(std::vector<Element> &elems, int nb_threads) {
+
+    int _nb_items = elems.size();
+    if (nb_threads <= 0)
+        nb_threads = std::max(1, (int) std::thread::hardware_concurrency());
+    int _nb_blocks = std::max(1, std::min(nb_threads, _nb_items));
+
+    std::vector<int> _begin(_nb_blocks), _end(_nb_blocks);
+    for (int p = 0; p < _nb_blocks; ++p) {
+        _begin[p] = (p * _nb_items) / _nb_blocks;
+        _end[p] = ((p + 1) * _nb_items) / _nb_blocks;
+    }
+
+    // local scans, the last block ends with the terminal element
+    parallel_blocks(_nb_items, _nb_blocks, [&](int begin, int end, int p) {
+        for (int k = end - 2; k >= begin; --k)
+            if (p == _nb_blocks - 1)
+                elems[k] = combine_value(elems[k], elems[k+1]);
+            else
+                elems[k] = combine(elems[k], elems[k+1]);
+    });
+
+    // totals of all following blocks
+    std::vector<Element> _carry(_nb_blocks);
+    for (int p = _nb_blocks - 2; p >= 0; --p) {
+        if (p == _nb_blocks - 2)
+            _carry[p] = elems[_begin[p+1]];
+        else
+            _carry[p] = combine_value(elems[_begin[p+1]], _carry[p+1]);
+    }
+
+    // fix-up
+    parallel_blocks(_nb_items, _nb_blocks, [&](int begin, int end, int p) {
+        if (p < _nb_blocks - 1)
+            for (int k = begin; k < end; ++k)
+                elems[k] = combine_value(elems[k], _carry[p]);
+    });
+}
+
+
+// scan elements of the lqr problem with stage cost
+// 1/2 x'Cxx x + 1/2 u'Cuu u + x'Cxu u + cx'x + cu'u and
+// dynamics x' = Ax + Bu + c, the cross terms are removed
+// by substituting u = w - Cuu^-1 (Cxu'x + cu). False if
+// Cuu is not positive definite
+bool lqr_element(const mat &Cxx, const vec &cx, const mat &Cuu,
+                 const vec &cu, const mat &Cxu,
+                 const mat &A, const mat &B, const vec &c,
+                 Element &elem) {
+
+    mat L;
+    if (!chol_factor(L, Cuu))
+        return false;
+
+    // whitened cross terms, Cuu^-1 = L^-T L^-1
+    mat W = solve(trimatl(L), join_horiz(Cxu.t(), cu, B.t()), solve_opts::fast);
+    mat Wxu = W.cols(0, Cxu.n_rows - 1);
+    vec wu = W.col(Cxu.n_rows);
+    mat Wb = W.cols(Cxu.n_rows + 1, W.n_cols - 1);
+
+    elem.A = A - Wb.t() * Wxu;
+    elem.b = c - Wb.t() * wu;
+    elem.C = Wb.t() * Wb;
+    elem.C = 0.5 * (elem.C + elem.C.t());
+
+    elem.eta = - (cx - Wxu.t() * wu);
+    elem.J = Cxx - Wxu.t() * Wxu;
+    elem.J = 0.5 * (elem.J + elem.J.t());
+
+    return true;
+}
+
+
+// terminal element, the value function does not depend on a next state
+Element terminal_element(const mat &Cxx, const vec &cx) {
+
+    int _nb_xdim = Cxx.n_rows;
+
+    Element elem;
+    elem.A = zeros<mat>(_nb_xdim, _nb_xdim);
+    elem.b = zeros<vec>(_nb_xdim);
+    elem.C = zeros<mat>(_nb_xdim, _nb_xdim);
+    elem.eta = - cx;
+    elem.J = Cxx;
+
+    return elem;
+}
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: parallel.py
+# @Date: 2019-07-11-10-15
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import multiprocessing
+
+
+# solver inherited by the forked workers
+_solver = None
+
+
+def _init_worker(solver):
+    global _solver
+    _solver = solver
+
+
+def _call(args):
+    method, _args, refs = args
+
+    # references change over iterations, the rest of the solver does not
+    for _key, _value in refs.items():
+        setattr(_solver, _key, _value)
+
+    return getattr(_solver, method)(*_args)
+
+
+class WorkerPool:
+    """
+    Pool of forked workers calling methods of a solver concurrently,
+    e.g. forward_pass for several step sizes or independent episodes.
+    Workers get a copy of the solver when the pool is created, so the
+    solver itself is never pickled. Forking is not safe once jax has
+    started its threads, the pool is meant for the default autograd backend
+    """
+
+    def __init__(self, solver, nb_workers=None):
+        _ctx = multiprocessing.get_context('fork')
+        self.pool = _ctx.Pool(nb_workers, initializer=_init_worker,
+                              initargs=(solver, ))
+
+    def starmap(self, method, args, **refs):
+        """
+        :param method: name of the solver method
+        :param args: list of argument tuples, one call each
+        :param refs: solver attributes to update in the workers
+        :return: list of outputs in order of args
+        """
+        return self.pool.map(_call, [(method, _args, refs) for _args in args])
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: profiling.py
+# @Date: 2019-07-15-09-30
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import json
+import time
+
+
+class _NullPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class NullProfiler:
+    """
+    Default profiler of the solvers, records nothing.
+    Phases share a single no-op context manager
+    """
+
+    def phase(self, name, **info):
+        return _null_phase
+
+    def count(self, name, nb=1):
+        pass
+
+    def step(self):
+        pass
+
+
+class _Phase:
+
+    def __init__(self, profiler, name, info):
+        self.profiler = profiler
+        self.name = name
+        self.info = info
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start, self.info)
+        return False
+
+
+class Profiler(NullProfiler):
+    """
+    Records the wall time of every phase of a solver run and counts
+    of events, e.g. dual evaluations or rejected steps. Records are
+    tagged with the solver iteration and can be exported as json lines
+
+        profiler = Profiler()
+        alg = iLQR(env, nb_steps=100, profiler=profiler)
+        alg.run(nb_iter=10)
+        profiler.summary()
+        profiler.dump('ilqr.jsonl')
+    """
+
+    def __init__(self):
+        self.records = []
+        self.counts = {}
+        self.iteration = 0
+
+    def phase(self, name, **info):
+        return _Phase(self, name, info)
+
+    def record(self, name, elapsed, info=None):
+        _record = {'phase': name, 'iteration': self.iteration, 'time': elapsed}
+        if info:
+            _record.update(info)
+        self.records.append(_record)
+
+    def count(self, name, nb=1):
+        self.counts[name] = self.counts.get(name, 0) + nb
+
+    def step(self):
+        self.iteration += 1
+
+    def reset(self):
+        self.records, self.counts = [], {}
+        self.iteration = 0
+
+    def summary(self):
+        """
+        :return: total time and number of calls of every phase,
+                 and the event counts
+        """
+        _phases = {}
+        for _record in self.records:
+            _phase = _phases.setdefault(_record['phase'], {'time': 0., 'calls': 0})
+            _phase['time'] += _record['time']
+            _phase['calls'] += 1
+        return {'phases': _phases, 'counts': dict(self.counts)}
+
+    def dump(self, path):
+        # one json record per line, counts last
+        with open(path, 'w') as f:
+            for _record in self.records:
+                f.write(json.dumps(_record, default=float) + '\n')
+            f.write(json.dumps({'counts': self.counts}) + '\n')
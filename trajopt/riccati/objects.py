@@ -6,17 +6,18 @@
 # @Contact: hany@robot-learning.de
 
 import autograd.numpy as np
-from autograd import jacobian, hessian
 from copy import deepcopy
 
+from trajopt.autodiff import get_backend
+
 
 class QuadraticStateValue:
     def __init__(self, nb_xdim, nb_steps):
         self.nb_xdim = nb_xdim
         self.nb_steps = nb_steps
 
-        self.V = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.v = np.zeros((self.nb_xdim, self.nb_steps, ))
+        self.V = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.v = np.zeros((self.nb_xdim, self.nb_steps, ), order='F')
 
 
 class QuadraticCost:
@@ -26,13 +27,13 @@ class QuadraticCost:
 
         self.nb_steps = nb_steps
 
-        self.Cxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.cx = np.zeros((self.nb_xdim, self.nb_steps))
+        self.Cxx = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.cx = np.zeros((self.nb_xdim, self.nb_steps), order='F')
 
-        self.Cuu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps))
-        self.cu = np.zeros((self.nb_udim, self.nb_steps))
+        self.Cuu = np.zeros((self.nb_udim, self.nb_udim, self.nb_steps), order='F')
+        self.cu = np.zeros((self.nb_udim, self.nb_steps), order='F')
 
-        self.Cxu = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps))
+        self.Cxu = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps), order='F')
 
     @property
     def params(self):
@@ -44,17 +45,19 @@ class QuadraticCost:
 
 
 class AnalyticalQuadraticCost(QuadraticCost):
-    def __init__(self, f, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, f, nb_xdim, nb_udim, nb_steps,
+                 backend='autograd'):
         super(AnalyticalQuadraticCost, self).__init__(nb_xdim, nb_udim, nb_steps)
 
-        self.f = f
+        self.backend = get_backend(backend)
+
+        self.f = self.backend.jit(f, static_argnums=(2, ))
 
-        self.dcdxx = hessian(self.f, 0)
-        self.dcduu = hessian(self.f, 1)
-        self.dcdxu = jacobian(jacobian(self.f, 0), 1)
+        # value, gradient and hessian w.r.t. z = [x, u] of all steps
+        self.dcdz = self.backend.batch_value_grad_hessian(self.fz, static_argnums=(1, ))
 
-        self.dcdx = jacobian(self.f, 0)
-        self.dcdu = jacobian(self.f, 1)
+    def fz(self, z, a, xref):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:], a, xref)
 
     def evalf(self, x, u, a):
         _xref = deepcopy(x)
@@ -64,13 +67,15 @@ class AnalyticalQuadraticCost(QuadraticCost):
         # padd last time step of action traj.
         _u = np.hstack((u, np.zeros((self.nb_udim, 1))))
         _xref = deepcopy(x)
-        for t in range(self.nb_steps):
-            _in = tuple([x[..., t], _u[..., t], a[t], _xref[..., t]])
-            self.Cxx[..., t] = self.dcdxx(*_in)
-            self.Cuu[..., t] = self.dcduu(*_in)
-            self.Cxu[..., t] = self.dcdxu(*_in)
-            self.cx[..., t] = self.dcdx(*_in)
-            self.cu[..., t] = self.dcdu(*_in)
+
+        _z = np.vstack((x, _u)).T
+        _, _g, _H = self.dcdz(_z, a, _xref.T)
+
+        self.Cxx[...] = np.transpose(_H[:, :self.nb_xdim, :self.nb_xdim], (1, 2, 0))
+        self.Cuu[...] = np.transpose(_H[:, self.nb_xdim:, self.nb_xdim:], (1, 2, 0))
+        self.Cxu[...] = np.transpose(_H[:, :self.nb_xdim, self.nb_xdim:], (1, 2, 0))
+        self.cx[...] = _g[:, :self.nb_xdim].T
+        self.cu[...] = _g[:, self.nb_xdim:].T
 
 
 class LinearDynamics:
@@ -79,9 +84,9 @@ class LinearDynamics:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.A = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps))
-        self.B = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps))
-        self.c = np.zeros((self.nb_xdim, self.nb_steps))
+        self.A = np.zeros((self.nb_xdim, self.nb_xdim, self.nb_steps), order='F')
+        self.B = np.zeros((self.nb_xdim, self.nb_udim, self.nb_steps), order='F')
+        self.c = np.zeros((self.nb_xdim, self.nb_steps), order='F')
 
     @property
     def params(self):
@@ -96,14 +101,20 @@ class LinearDynamics:
 
 
 class AnalyticalLinearDynamics(LinearDynamics):
-    def __init__(self, f_init, f_dyn, nb_xdim, nb_udim, nb_steps):
+    def __init__(self, f_init, f_dyn, nb_xdim, nb_udim, nb_steps,
+                 backend='autograd'):
         super(AnalyticalLinearDynamics, self).__init__(nb_xdim, nb_udim, nb_steps)
 
+        self.backend = get_backend(backend)
+
         self.i = f_init
-        self.f = f_dyn
+        self.f = self.backend.jit(f_dyn)
+
+        # jacobians w.r.t. z = [x, u] of all steps
+        self.dfdz = self.backend.batch_jacobian(self.fz)
 
-        self.dfdx = jacobian(self.f, 0)
-        self.dfdu = jacobian(self.f, 1)
+    def fz(self, z):
+        return self.f(z[:self.nb_xdim], z[self.nb_xdim:])
 
     def evali(self):
         return self.i()
@@ -112,9 +123,13 @@ class AnalyticalLinearDynamics(LinearDynamics):
         return self.f(x, u)
 
     def taylor_expansion(self, x, u):
+        _z = np.vstack((x[:, :self.nb_steps], u)).T
+        _grads = self.dfdz(_z)
+
+        self.A[...] = np.transpose(_grads[..., :self.nb_xdim], (1, 2, 0))
+        self.B[...] = np.transpose(_grads[..., self.nb_xdim:], (1, 2, 0))
+
         for t in range(self.nb_steps):
-            self.A[..., t] = self.dfdx(x[..., t], u[..., t])
-            self.B[..., t] = self.dfdu(x[..., t], u[..., t])
             # residual of taylor expansion
             self.c[..., t] = self.evalf(x[..., t], u[..., t]) -\
                              self.A[..., t] @ x[..., t] - self.B[..., t] @ u[..., t]
@@ -126,8 +141,8 @@ class LinearControl:
         self.nb_udim = nb_udim
         self.nb_steps = nb_steps
 
-        self.K = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps))
-        self.kff = np.zeros((self.nb_udim, self.nb_steps))
+        self.K = np.zeros((self.nb_udim, self.nb_xdim, self.nb_steps), order='F')
+        self.kff = np.zeros((self.nb_udim, self.nb_steps), order='F')
 
     @property
     def params(self):
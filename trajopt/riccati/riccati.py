@@ -11,14 +11,31 @@ from trajopt.riccati.objects import AnalyticalLinearDynamics, AnalyticalQuadrati
 from trajopt.riccati.objects import QuadraticStateValue
 from trajopt.riccati.objects import LinearControl
 
+from trajopt.riccati.core import backward_pass, parallel_backward_pass
+from trajopt.riccati.core import infinite_horizon
+
+from trajopt.autodiff import get_backend
+from trajopt.rollout import Rollout
+from trajopt.profiling import NullProfiler
+
 
 class Riccati:
 
     def __init__(self, env, nb_steps,
-                 activation=range(-1, 0)):
+                 activation=range(-1, 0),
+                 backend='autograd',
+                 backward='sequential', nb_threads=0,
+                 tol=1.e-10, maxiter=100,
+                 profiler=None):
 
         self.env = env
 
+        # phase timings and event counts, nothing recorded by default
+        self.profiler = profiler if profiler is not None else NullProfiler()
+
+        # autodiff backend, autograd or jax
+        self.backend = get_backend(backend)
+
         # expose necessary functions
         self.env_dyn = self.env.unwrapped.dynamics
         self.env_cost = self.env.unwrapped.cost
@@ -30,6 +47,22 @@ class Riccati:
         self.nb_udim = self.env.action_space.shape[0]
         self.nb_steps = nb_steps
 
+        # backward pass, sequential or parallel-in-time scan,
+        # nb_threads=0 uses all available cores
+        self.backward = backward
+        if self.backward not in ('sequential', 'parallel'):
+            raise ValueError("Unknown backward pass '{}', choose from "
+                             "['sequential', 'parallel']".format(self.backward))
+        self.nb_threads = nb_threads
+
+        # the sequential pass stops on runs of equal stages once the value
+        # reaches the steady state of the stage, tol=0 sweeps all steps
+        self.tol = tol
+        self.maxiter = maxiter
+
+        # steps solved by the last sequential pass
+        self.nb_sweep = None
+
         # reference trajectory
         self.xref = np.zeros((self.nb_xdim, self.nb_steps + 1))
         self.xref[..., 0] = self.env_init()[0]
@@ -37,7 +70,8 @@ class Riccati:
         self.uref = np.zeros((self.nb_udim, self.nb_steps))
 
         self.vfunc = QuadraticStateValue(self.nb_xdim, self.nb_steps + 1)
-        self.dyn = AnalyticalLinearDynamics(self.env_init, self.env_dyn, self.nb_xdim, self.nb_udim, self.nb_steps)
+        self.dyn = AnalyticalLinearDynamics(self.env_init, self.env_dyn, self.nb_xdim, self.nb_udim, self.nb_steps,
+                                            backend=self.backend)
         self.ctl = LinearControl(self.nb_xdim, self.nb_udim, self.nb_steps)
 
         # activation of cost function
@@ -45,49 +79,58 @@ class Riccati:
         self.activation[-1] = 1.  # last step always in
         self.activation[activation] = 1.
 
-        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps + 1)
+        self.cost = AnalyticalQuadraticCost(self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps + 1,
+                                            backend=self.backend)
 
-    def forward_pass(self, ctl):
-        state = np.zeros((self.nb_xdim, self.nb_steps + 1))
-        action = np.zeros((self.nb_udim, self.nb_steps))
-        cost = np.zeros((self.nb_steps + 1, ))
+        # state propagation and batched cost of rollouts
+        self.rollout = Rollout(self.env_dyn, self.env_cost, self.nb_xdim, self.nb_udim, self.nb_steps,
+                               backend=self.backend)
 
-        state[..., 0], _ = self.dyn.evali()
-        for t in range(self.nb_steps):
-            action[..., t] = ctl.action(state[..., t], t)
-            cost[..., t] = self.cost.evalf(state[..., t], action[..., t], self.activation[t])
-            state[..., t + 1] = self.dyn.evalf(state[..., t], action[..., t])
-
-        cost[..., -1] = self.cost.evalf(state[..., -1], np.zeros((self.nb_udim, )), self.activation[-1])
-        return state, action, cost
+    def forward_pass(self, ctl):
+        _x0, _ = self.dyn.evali()
+        return self.rollout(_x0, ctl.K, ctl.kff, self.activation)
 
     def backward_pass(self):
+        if self.backward == 'parallel':
+            return self.parallel_backward_pass()
+
         lc = LinearControl(self.nb_xdim, self.nb_udim, self.nb_steps)
         xvalue = QuadraticStateValue(self.nb_xdim, self.nb_steps + 1)
 
-        xvalue.V[..., -1] = self.cost.Cxx[..., -1]
-        xvalue.v[..., -1] = self.cost.cx[..., -1]
-        for t in range(self.nb_steps - 2, -1, -1):
-            _Qxx = self.cost.Cxx[..., t] + self.dyn.A[..., t].T @ xvalue.V[..., t + 1] @ self.dyn.A[..., t]
-            _Quu = self.cost.Cuu[..., t] + self.dyn.B[..., t].T @ xvalue.V[..., t + 1] @ self.dyn.B[..., t]
-            _Qux = self.cost.Cxu[..., t].T + self.dyn.B[..., t].T @ xvalue.V[..., t + 1] @ self.dyn.A[..., t]
-
-            _qx = self.cost.cx[..., t] + self.dyn.A[..., t].T @ xvalue.V[..., t + 1] @ self.dyn.c[..., t] +\
-                  self.dyn.A[..., t].T @ xvalue.v[..., t + 1]
-
-            _qu = self.cost.cu[..., t] + self.dyn.B[..., t].T @ xvalue.V[..., t + 1] @ self.dyn.c[..., t] +\
-                  self.dyn.B[..., t].T @ xvalue.v[..., t + 1]
-
-            _Quu_inv = np.linalg.inv(_Quu)
-
-            lc.K[...,t] = - _Quu_inv @ _Qux
-            lc.kff[..., t] = - _Quu_inv @ _qu
+        xvalue.V, xvalue.v,\
+        lc.K, lc.kff, _, self.nb_sweep = backward_pass(self.cost.Cxx, self.cost.cx, self.cost.Cuu,
+                                                       self.cost.cu, self.cost.Cxu,
+                                                       self.dyn.A, self.dyn.B, self.dyn.c,
+                                                       self.nb_xdim, self.nb_udim, self.nb_steps,
+                                                       self.tol, self.maxiter)
+        self.profiler.count('backward_steps', self.nb_sweep)
+        return lc, xvalue
 
-            xvalue.V[..., t] = _Qxx + _Qux.T * lc.K[..., t]
-            xvalue.v[..., t] = _qx + lc.kff[..., t].T @ _Qux
+    def parallel_backward_pass(self):
+        lc = LinearControl(self.nb_xdim, self.nb_udim, self.nb_steps)
+        xvalue = QuadraticStateValue(self.nb_xdim, self.nb_steps + 1)
 
+        xvalue.V, xvalue.v,\
+        lc.K, lc.kff, _ = parallel_backward_pass(self.cost.Cxx, self.cost.cx, self.cost.Cuu,
+                                                 self.cost.cu, self.cost.Cxu,
+                                                 self.dyn.A, self.dyn.B, self.dyn.c,
+                                                 self.nb_xdim, self.nb_udim, self.nb_steps,
+                                                 self.nb_threads)
         return lc, xvalue
 
+    def steady_state(self, t=0):
+        """
+        Infinite-horizon solution for the dynamics and cost of step t,
+        the stabilizing solution of the discrete algebraic riccati equation
+        :return: gains K, kff and value V, v, None if there is none
+        """
+        V, v, K, kff, converged, _ = infinite_horizon(self.cost.Cxx[..., t], self.cost.cx[..., t],
+                                                      self.cost.Cuu[..., t], self.cost.cu[..., t],
+                                                      self.cost.Cxu[..., t],
+                                                      self.dyn.A[..., t], self.dyn.B[..., t], self.dyn.c[..., t],
+                                                      self.tol, self.maxiter)
+        return (K, kff, V, v) if converged else None
+
     def plot(self):
         import matplotlib.pyplot as plt
 
@@ -107,16 +150,20 @@ class Riccati:
 
     def run(self):
         # get linear system dynamics around ref traj.
-        self.dyn.taylor_expansion(self.xref, self.uref)
+        with self.profiler.phase('dyn.taylor_expansion'):
+            self.dyn.taylor_expansion(self.xref, self.uref)
 
         # get quadratic cost around ref traj.
-        self.cost.taylor_expansion(self.xref, self.uref, self.activation)
+        with self.profiler.phase('cost.taylor_expansion'):
+            self.cost.taylor_expansion(self.xref, self.uref, self.activation)
 
         # backward pass to get ctrl.
-        self.ctl, self.vfunc = self.backward_pass()
+        with self.profiler.phase('backward_pass'):
+            self.ctl, self.vfunc = self.backward_pass()
 
         # forward pass to get cost and traj.
-        self.xref, self.uref, _cost = self.forward_pass(self.ctl)
+        with self.profiler.phase('forward_pass'):
+            self.xref, self.uref, _cost = self.forward_pass(self.ctl)
 
         return np.sum(_cost)
 
@@ -0,0 +1,361 @@
+#include "util.h"
+
+
+py::tuple parallel_backward_pass(py::array _Cxx, py::array _cx, py::array _Cuu,
+                                 py::array _cu, py::array _Cxu,
+                                 py::array _A, py::array _B, py::array _c,
+                                 int nb_xdim, int nb_udim, int nb_steps,
+                                 int nb_threads) {
+
+    // inputs
+    cube Cxx = array_to_cube(_Cxx);
+    mat cx = array_to_mat(_cx);
+    cube Cuu = array_to_cube(_Cuu);
+    mat cu = array_to_mat(_cu);
+    cube Cxu = array_to_cube(_Cxu);
+
+    cube A = array_to_cube(_A);
+    cube B = array_to_cube(_B);
+    mat c = array_to_mat(_c);
+
+    // outputs
+    array_tf _V = zeros_array({nb_xdim, nb_xdim, nb_steps + 1});
+    array_tf _v = zeros_array({nb_xdim, nb_steps + 1});
+
+    array_tf _K = zeros_array({nb_udim, nb_xdim, nb_steps});
+    array_tf _kff = zeros_array({nb_udim, nb_steps});
+
+    cube V = array_to_cube(_V);
+    mat v = array_to_mat(_v);
+
+    cube K = array_to_cube(_K);
+    mat kff = array_to_mat(_kff);
+
+    int _diverge = 0;
+
+    std::vector<Element> elems(nb_steps + 1);
+    std::vector<int> _failed(nb_steps, 0);
+
+    parallel_blocks(nb_steps, nb_threads, [&](int begin, int end, int p) {
+        for (int i = begin; i < end; ++i)
+            _failed[i] = !lqr_element(Cxx.slice(i), cx.col(i), Cuu.slice(i), cu.col(i), Cxu.slice(i),
+                                      A.slice(i), B.slice(i), c.col(i), elems[i]);
+    });
+    elems[nb_steps] = terminal_element(Cxx.slice(nb_steps), cx.col(nb_steps));
+
+    for(int i = nb_steps - 1; i>= 0; --i)
+        if (_failed[i]) {
+            _diverge = 1;
+            return py::make_tuple(_V, _v, _K, _kff, _diverge);
+        }
+
+    suffix_scan(elems, nb_threads);
+
+    // value functions and gains, independent over time
+    parallel_blocks(nb_steps + 1, nb_threads, [&](int begin, int end, int p) {
+        for (int i = begin; i < end; ++i) {
+            V.slice(i) = elems[i].J;
+            v.col(i) = - elems[i].eta;
+        }
+    });
+
+    parallel_blocks(nb_steps, nb_threads, [&](int begin, int end, int p) {
+        for (int i = begin; i < end; ++i) {
+            mat Vn = elems[i+1].J;
+            vec vn = - elems[i+1].eta;
+
+            mat Quu = Cuu.slice(i) + B.slice(i).t() * Vn * B.slice(i);
+            mat Qux = (Cxu.slice(i) + A.slice(i).t() * Vn * B.slice(i)).t();
+            vec qu = cu.col(i) + B.slice(i).t() * (Vn * c.col(i) + vn);
+
+            mat L;
+            if (!chol_factor(L, Quu)) {
+                _failed[i] = 1;
+                continue;
+            }
+
+            mat gains = - chol_solve(L, join_horiz(Qux, qu));
+            K.slice(i) = gains.head_cols(nb_xdim);
+            kff.col(i) = gains.col(nb_xdim);
+        }
+    });
+
+    for(int i = nb_steps - 1; i>= 0; --i)
+        if (_failed[i]) {
+            _diverge = 1;
+            break;
+        }
+
+    // outputs already live in numpy
+    py::tuple output =  py::make_tuple(_V, _v, _K, _kff, _diverge);
+
+    return output;
+}
+
+
+// steady state of a time-invariant stage, the stabilizing solution V of
+// the discrete algebraic riccati equation by structure-preserving doubling,
+// the gains and the fixed point v of the affine part of the recursion.
+// False if Cuu is not positive definite, the doubling does not converge
+// or the closed loop is not stable
+struct SteadyState {
+    mat V;
+    vec v;
+    mat K;
+    vec kff;
+    int nb_iter = 0;
+};
+
+
+bool steady_state(const mat &Cxx, const vec &cx, const mat &Cuu,
+                  const vec &cu, const mat &Cxu,
+                  const mat &A, const mat &B, const vec &c,
+                  double tol, int maxiter, SteadyState &ss) {
+
+    int _nb_xdim = A.n_rows;
+    mat I = eye(_nb_xdim, _nb_xdim);
+
+    mat L;
+    if (!chol_factor(L, Cuu))
+        return false;
+
+    // cross terms removed, Ak = A - B Cuu^-1 Cxu', G = B Cuu^-1 B', H = Cxx - Cxu Cuu^-1 Cxu'
+    mat W = solve(trimatl(L), join_horiz(Cxu.t(), B.t()), solve_opts::fast);
+    mat Wxu = W.head_cols(_nb_xdim);
+    mat Wb = W.tail_cols(_nb_xdim);
+
+    mat Ak = A - Wb.t() * Wxu;
+    mat Gk = Wb.t() * Wb;
+    mat Hk = Cxx - Wxu.t() * Wxu;
+
+    mat Z1, Z2, Hn;
+    bool _converged = false;
+    for (ss.nb_iter = 1; ss.nb_iter <= maxiter; ++ss.nb_iter) {
+        mat M = I + Gk * Hk;
+        if (!solve(Z1, M, Ak) || !solve(Z2, M, Gk))
+            return false;
+
+        Hn = Hk + Ak.t() * Hk * Z1;
+        Hn = 0.5 * (Hn + Hn.t());
+
+        Gk = Gk + Ak * Z2 * Ak.t();
+        Gk = 0.5 * (Gk + Gk.t());
+
+        Ak = Ak * Z1;
+
+        if (!Hn.is_finite())
+            return false;
+
+        _converged = norm(Hn - Hk, "inf") <= tol * std::max(1., norm(Hn, "inf"));
+        Hk = Hn;
+        if (_converged)
+            break;
+    }
+
+    if (!_converged)
+        return false;
+
+    ss.V = Hk;
+
+    mat Quu = Cuu + B.t() * ss.V * B;
+    mat Qux = (Cxu + A.t() * ss.V * B).t();
+    if (!chol_factor(L, Quu))
+        return false;
+    ss.K = - chol_solve(L, Qux);
+
+    // only a stabilizing solution is a steady state of the finite recursion
+    mat Acl = A + B * ss.K;
+    cx_vec _eig;
+    if (!eig_gen(_eig, Acl) || max(abs(_eig)) >= 1.)
+        return false;
+
+    // v = cx + K'cu + (A + BK)'(Vc + v)
+    if (!solve(ss.v, I - Acl.t(), cx + ss.K.t() * cu + Acl.t() * ss.V * c))
+        return false;
+
+    vec qu = cu + B.t() * (ss.V * c + ss.v);
+    ss.kff = - chol_solve(L, qu);
+
+    return true;
+}
+
+
+// stages i and j share dynamics and cost
+bool same_stage(const cube &Cxx, const mat &cx, const cube &Cuu,
+                const mat &cu, const cube &Cxu,
+                const cube &A, const cube &B, const mat &c,
+                int i, int j) {
+
+    return approx_equal(A.slice(i), A.slice(j), "absdiff", 0.)
+           && approx_equal(B.slice(i), B.slice(j), "absdiff", 0.)
+           && approx_equal(c.col(i), c.col(j), "absdiff", 0.)
+           && approx_equal(Cxx.slice(i), Cxx.slice(j), "absdiff", 0.)
+           && approx_equal(cx.col(i), cx.col(j), "absdiff", 0.)
+           && approx_equal(Cuu.slice(i), Cuu.slice(j), "absdiff", 0.)
+           && approx_equal(cu.col(i), cu.col(j), "absdiff", 0.)
+           && approx_equal(Cxu.slice(i), Cxu.slice(j), "absdiff", 0.);
+}
+
+
+bool close(const mat &X, const mat &Y, double tol) {
+    return norm(X - Y, "inf") <= tol * std::max(1., norm(Y, "inf"));
+}
+
+
+py::tuple backward_pass(py::array _Cxx, py::array _cx, py::array _Cuu,
+                        py::array _cu, py::array _Cxu,
+                        py::array _A, py::array _B, py::array _c,
+                        int nb_xdim, int nb_udim, int nb_steps,
+                        double tol, int maxiter) {
+
+    // inputs
+    cube Cxx = array_to_cube(_Cxx);
+    mat cx = array_to_mat(_cx);
+    cube Cuu = array_to_cube(_Cuu);
+    mat cu = array_to_mat(_cu);
+    cube Cxu = array_to_cube(_Cxu);
+
+    cube A = array_to_cube(_A);
+    cube B = array_to_cube(_B);
+    mat c = array_to_mat(_c);
+
+    // outputs
+    array_tf _V = zeros_array({nb_xdim, nb_xdim, nb_steps + 1});
+    array_tf _v = zeros_array({nb_xdim, nb_steps + 1});
+
+    array_tf _K = zeros_array({nb_udim, nb_xdim, nb_steps});
+    array_tf _kff = zeros_array({nb_udim, nb_steps});
+
+    cube V = array_to_cube(_V);
+    mat v = array_to_mat(_v);
+
+    cube K = array_to_cube(_K);
+    mat kff = array_to_mat(_kff);
+
+    int _diverge = 0;
+
+    // steps solved by the recursion, the rest is filled by a steady state
+    int _nb_sweep = 0;
+
+    mat L, Quu, Qux, gains;
+    vec qu;
+
+    // steady state of the stage model of step _ss_stage
+    SteadyState ss;
+    int _ss_stage = -1;
+    bool _ss_valid = false;
+
+    V.slice(nb_steps) = Cxx.slice(nb_steps);
+    v.col(nb_steps) = cx.col(nb_steps);
+
+    for (int i = nb_steps - 1; i >= 0; --i) {
+        const mat &Vn = V.slice(i+1);
+        const vec &vn = v.col(i+1);
+
+        Quu = Cuu.slice(i) + B.slice(i).t() * Vn * B.slice(i);
+        Qux = (Cxu.slice(i) + A.slice(i).t() * Vn * B.slice(i)).t();
+        qu = cu.col(i) + B.slice(i).t() * (Vn * c.col(i) + vn);
+
+        // the factorization doubles as the definiteness check
+        if (!chol_factor(L, Quu)) {
+            _diverge = 1;
+            break;
+        }
+
+        gains = - chol_solve(L, join_horiz(Qux, qu));
+        K.slice(i) = gains.head_cols(nb_xdim);
+        kff.col(i) = gains.col(nb_xdim);
+
+        V.slice(i) = Cxx.slice(i) + A.slice(i).t() * Vn * A.slice(i) + Qux.t() * K.slice(i);
+        V.slice(i) = 0.5 * (V.slice(i) + V.slice(i).t());
+        v.col(i) = cx.col(i) + A.slice(i).t() * (Vn * c.col(i) + vn) + Qux.t() * kff.col(i);
+
+        _nb_sweep++;
+
+        // time-invariant stages ahead, stop once the value is stationary,
+        // the steady state is only solved for when the sweep slows down
+        if (tol <= 0. || i == 0 || !close(V.slice(i), V.slice(i+1), std::sqrt(tol)) ||
+            !same_stage(Cxx, cx, Cuu, cu, Cxu, A, B, c, i - 1, i))
+            continue;
+
+        // solved once per run of equal stages
+        if (_ss_stage < 0 || !same_stage(Cxx, cx, Cuu, cu, Cxu, A, B, c, _ss_stage, i)) {
+            _ss_valid = steady_state(Cxx.slice(i), cx.col(i), Cuu.slice(i),
+                                     cu.col(i), Cxu.slice(i),
+                                     A.slice(i), B.slice(i), c.col(i),
+                                     tol, maxiter, ss);
+            _ss_stage = i;
+        }
+
+        if (!_ss_valid || !close(V.slice(i), ss.V, tol) || !close(v.col(i), ss.v, tol))
+            continue;
+
+        // earlier steps of the same stage model hold the steady state
+        while (i > 0 && same_stage(Cxx, cx, Cuu, cu, Cxu, A, B, c, i - 1, i)) {
+            --i;
+            V.slice(i) = ss.V;
+            v.col(i) = ss.v;
+            K.slice(i) = ss.K;
+            kff.col(i) = ss.kff;
+        }
+    }
+
+    // outputs already live in numpy
+    py::tuple output =  py::make_tuple(_V, _v, _K, _kff, _diverge, _nb_sweep);
+
+    return output;
+}
+
+
+py::tuple infinite_horizon(py::array _Cxx, py::array _cx, py::array _Cuu,
+                           py::array _cu, py::array _Cxu,
+                           py::array _A, py::array _B, py::array _c,
+                           double tol, int maxiter) {
+
+    mat Cxx = array_to_mat(_Cxx);
+    vec cx = array_to_vec(_cx);
+    mat Cuu = array_to_mat(_Cuu);
+    vec cu = array_to_vec(_cu);
+    mat Cxu = array_to_mat(_Cxu);
+
+    mat A = array_to_mat(_A);
+    mat B = array_to_mat(_B);
+    vec c = array_to_vec(_c);
+
+    int nb_xdim = A.n_rows;
+    int nb_udim = B.n_cols;
+
+    array_tf _V = zeros_array({nb_xdim, nb_xdim});
+    array_tf _v = zeros_array({nb_xdim});
+    array_tf _K = zeros_array({nb_udim, nb_xdim});
+    array_tf _kff = zeros_array({nb_udim});
+
+    SteadyState ss;
+    bool _converged = steady_state(Cxx, cx, Cuu, cu, Cxu, A, B, c, tol, maxiter, ss);
+
+    if (_converged) {
+        mat V = array_to_mat(_V);
+        vec v = array_to_vec(_v);
+        mat K = array_to_mat(_K);
+        vec kff = array_to_vec(_kff);
+
+        V = ss.V;
+        v = ss.v;
+        K = ss.K;
+        kff = ss.kff;
+    }
+
+    py::tuple output =  py::make_tuple(_V, _v, _K, _kff, _converged, ss.nb_iter);
+
+    return output;
+}
+
+
+PYBIND11_MODULE(core, m)
+{
+    m.def("backward_pass", &backward_pass);
+    m.def("infinite_horizon", &infinite_horizon);
+    m.def("parallel_backward_pass", &parallel_backward_pass);
+    m.def("copied_bytes", &copied_bytes);
+    m.def("reset_copied_bytes", &reset_copied_bytes);
+}
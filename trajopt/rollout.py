@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# @Filename: rollout.py
+# @Date: 2019-07-21-09-30
+# @Author: Hany Abdulsamad
+# @Contact: hany@robot-learning.de
+
+import autograd.numpy as np
+
+from trajopt.autodiff import get_backend
+
+
+class Rollout:
+    """
+    Rollouts of an affine feedback u = k + K (x - xref) on the
+    dynamics of an environment. The propagation of the states and
+    the evaluation of the cost are separated, the states are propagated
+    by a scan of the backend, i.e. a loop with autograd and a single
+    compiled lax.scan with jax, and the cost of the whole trajectory
+    is evaluated afterwards in one batched call
+
+        rollout = Rollout(env.unwrapped.dynamics, env.unwrapped.cost,
+                          nb_xdim, nb_udim, nb_steps)
+        state, action, cost = rollout(x0, K, k, activation, xref)
+    """
+
+    def __init__(self, f_dyn, f_cost, nb_xdim, nb_udim, nb_steps,
+                 backend='autograd'):
+        self.nb_xdim = nb_xdim
+        self.nb_udim = nb_udim
+        self.nb_steps = nb_steps
+
+        self.backend = get_backend(backend)
+
+        self.f = f_dyn
+        self.scan = self.backend.scan(self.step)
+
+        # cost of a batch of states and actions
+        self.fb = self.backend.batch(f_cost, static_argnums=(2, ))
+
+    def step(self, x, args):
+        _K, _k, _xref = args
+        u = _k + _K @ (x - _xref)
+        return self.f(x, u), (x, u)
+
+    def propagate(self, x0, K, k, xref=None):
+        """
+        :param x0: (nb_xdim, )
+        :param K: (nb_udim, nb_xdim, nb_steps)
+        :param k: (nb_udim, nb_steps)
+        :param xref: (nb_xdim, nb_steps + 1), zero by default
+        :return: state (nb_xdim, nb_steps + 1), action (nb_udim, nb_steps)
+        """
+        _xref = np.zeros((self.nb_xdim, self.nb_steps)) if xref is None else xref[:, :self.nb_steps]
+
+        _xn, (_x, _u) = self.scan(x0, (np.transpose(K, (2, 0, 1)), k.T, _xref.T))
+
+        state = np.hstack((_x.T, np.reshape(_xn, (self.nb_xdim, 1))))
+        action = _u.T
+        return state, action
+
+    def evalc(self, x, u, a):
+        """
+        :param x: (nb_xdim, nb_steps + 1)
+        :param u: (nb_udim, nb_steps), padded with zeros at the last step
+        :param a: activation of every step, (nb_steps + 1, )
+        :return: cost (nb_steps + 1, )
+        """
+        # nothing is differentiated, the states are their own reference
+        _u = np.hstack((u, np.zeros((self.nb_udim, 1))))
+        return np.reshape(self.fb(x.T, _u.T, a, x.T), (-1, ))
+
+    def __call__(self, x0, K, k, a, xref=None):
+        state, action = self.propagate(x0, K, k, xref)
+        return state, action, self.evalc(state, action, a)